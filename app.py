@@ -7,6 +7,7 @@ Flask + gunicorn + openpyxl
 import os
 import sys
 import json
+import math
 import random
 import re
 import threading
@@ -22,15 +23,32 @@ import base64
 import zipfile
 import io
 import hashlib
+import heapq
+import itertools
 import gzip
+import queue as _queue
+import sqlite3
+import uuid
+from array import array
 from copy import copy, deepcopy
-from collections import defaultdict
+from collections import Counter, defaultdict
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from functools import wraps
+from urllib.parse import parse_qsl
 from urllib.request import Request, urlopen
 from urllib.error import URLError, HTTPError
-from flask import Flask, render_template, request, jsonify, send_file, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, send_file, send_from_directory, session, redirect, url_for
 import openpyxl
 from openpyxl.styles import Font, Alignment, PatternFill
+try:
+    import brotli  # 任意: 導入されていれば Accept-Encoding: br に対応
+except ImportError:
+    brotli = None
+try:
+    from ortools.sat.python import cp_model  # 任意: 導入されていれば厳密解法（CP-SAT）で生成結果を詰め直せる
+except ImportError:
+    cp_model = None
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10MB上限
@@ -58,6 +76,76 @@ def add_security_headers(response):
     response.headers['Permissions-Policy'] = 'camera=(), microphone=(), geolocation=()'
     return response
 
+# ========== レスポンス圧縮 / ETag ==========
+# 大きなJSON/HTML応答は Accept-Encoding に応じて brotli(導入時) / gzip で圧縮する。
+# /api/state・/api/check はセッション結果のバージョンから強いETagを作り、
+# If-None-Match が一致すれば再計算せず 304 を返す。
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+_BOOT_ID = secrets.token_hex(4)  # 再起動をまたいだETagの衝突防止
+_result_versions = {}  # {sid: 結果・ファイル更新ごとに増える番号}
+
+def bump_result_version(sid):
+    _result_versions[sid] = _result_versions.get(sid, 0) + 1
+
+def _result_etag(sid, kind):
+    fmt = '-c' if wire_compact_requested() else ''
+    lazy = request.headers.get(LAZY_HEADER)
+    if lazy is not None:
+        fmt += f'-l{lazy[:4]}'
+    return f'{_BOOT_ID}-{sid[:12]}-{_result_versions.get(sid, 0)}-{kind}{fmt}'
+
+def etag_cached(kind):
+    """セッション結果が前回応答時から変わっていなければ 304 を返すデコレーター"""
+    def deco(f):
+        @wraps(f)
+        def wrapped(*args, **kwargs):
+            sid = session.get('sid')
+            if sid and request.if_none_match:
+                tag = _result_etag(sid, kind)
+                if any(request.if_none_match.contains(tag + sfx) for sfx in ('', '-br', '-gzip')):
+                    sd = get_session_data()  # last_access の更新
+                    if sd['_sid'] == sid:
+                        resp = app.response_class(status=304)
+                        resp.vary.add(WIRE_HEADER)
+                        resp.vary.add(LAZY_HEADER)
+                        resp.set_etag(tag)
+                        resp.headers['Cache-Control'] = 'private, no-cache'
+                        return resp
+            resp = app.make_response(f(*args, **kwargs))
+            resp.vary.add(WIRE_HEADER)
+            resp.vary.add(LAZY_HEADER)
+            sid = session.get('sid')
+            if sid and resp.status_code == 200:
+                resp.set_etag(_result_etag(sid, kind))
+                resp.headers['Cache-Control'] = 'private, no-cache'
+            return resp
+        return wrapped
+    return deco
+
+@app.after_request
+def compress_response(response):
+    if (response.status_code != 200 or response.direct_passthrough
+            or response.mimetype not in ('application/json', 'text/html')
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    accept = request.accept_encodings
+    if brotli is not None and accept['br']:
+        data, encoding = brotli.compress(data, quality=5), 'br'
+    elif accept['gzip']:
+        data, encoding = gzip.compress(data, compresslevel=6), 'gzip'
+    else:
+        return response
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f'{etag}-{encoding}', weak=weak)
+    return response
+
 # 一時ファイル管理（ディスクベース: gunicornマルチワーカー対応）
 UPLOAD_BASE = os.path.join(tempfile.gettempdir(), 'booth_sessions')
 os.makedirs(UPLOAD_BASE, exist_ok=True)
@@ -97,6 +185,9 @@ def cleanup_old_sessions():
         meta = _load_meta(name)
         if meta and now - meta.get('last_access', 0) > SESSION_TIMEOUT:
             shutil.rmtree(sdir, ignore_errors=True)
+            _result_versions.pop(name, None)
+            with _journals_lock:
+                _journals.pop(name, None)
     # Supabase: 7日以上古いセッションを削除
     cutoff = (_dt.datetime.utcnow() - _dt.timedelta(days=7)).isoformat() + 'Z'
     _supabase_request('DELETE', 'schedule_sessions', f'updated_at=lt.{cutoff}')
@@ -134,62 +225,75 @@ def save_session_files(sd):
         meta['survey_name_map'] = sd['survey_name_map']
     meta['last_access'] = time.time()
     _save_meta(sid, meta)
+    bump_result_version(sid)
 
-def save_session_result(sd):
-    """resultをインメモリキャッシュ + ディスクに保存"""
+def save_session_result(sd, keep_history=False):
+    """resultをインメモリキャッシュ + ディスクに保存（チェックポイント）
+
+    keep_history=False ならアンドゥ/リドゥ履歴も破棄する（生成・読込など全体置換時）。
+    """
     sid = sd['_sid']
     if not hasattr(get_session_data, '_cache'):
         get_session_data._cache = {}
     get_session_data._cache[sid] = {'result': sd['result']}
+    bump_result_version(sid)
     # ディスクにもJSON保存（サーバー再起動後の復元用）
-    _save_result_to_disk(sid, sd['result'])
+    _write_checkpoint(sid, sd['result'], keep_history=keep_history)
 
 def _result_json_path(sid):
     return os.path.join(_session_dir(sid), '_result.json')
 
+def _result_saveable(result):
+    """result をJSON保存可能な dict に変換（set/tuple→list）"""
+    # schedule内のtupleをlistに変換して保存
+    saveable = {}
+    if 'schedule_json' in result:
+        saveable['schedule_json'] = result['schedule_json']
+    if 'original_schedule_json' in result:
+        saveable['original_schedule_json'] = _as_schedule_json(result['original_schedule_json'])
+    if 'original_unplaced' in result:
+        saveable['original_unplaced'] = result['original_unplaced']
+    if 'unplaced' in result:
+        saveable['unplaced'] = result['unplaced']
+    if 'office_teachers' in result:
+        saveable['office_teachers'] = result['office_teachers']
+    if 'booth_pref' in result:
+        saveable['booth_pref'] = result['booth_pref']
+    if 'students' in result:
+        # studentsのsetをlistに変換
+        stu_save = []
+        for s in result['students']:
+            sc = dict(s)
+            if isinstance(sc.get('avail'), set):
+                sc['avail'] = sorted([list(a) for a in sc['avail']])
+            if isinstance(sc.get('backup_avail'), set):
+                sc['backup_avail'] = sorted([list(a) for a in sc['backup_avail']])
+            if isinstance(sc.get('ng_dates'), set):
+                sc['ng_dates'] = [list(d) for d in sc['ng_dates']]
+            if 'fixed' in sc:
+                sc['fixed'] = [list(f) for f in sc['fixed']]
+            stu_save.append(sc)
+        saveable['students'] = stu_save
+    if 'week_dates' in result:
+        saveable['week_dates'] = result['week_dates']
+    if 'weekly_teachers' in result:
+        saveable['weekly_teachers'] = result['weekly_teachers']
+    if 'skills' in result:
+        # set→list変換（JSON保存用）
+        saveable['skills'] = {t: list(v) if isinstance(v, set) else v
+                              for t, v in result['skills'].items()}
+    return saveable
+
 def _save_result_to_disk(sid, result):
     """スケジュール結果をディスクにJSON保存"""
     rp = _result_json_path(sid)
     try:
-        # schedule内のtupleをlistに変換して保存
-        saveable = {}
-        if 'schedule_json' in result:
-            saveable['schedule_json'] = result['schedule_json']
-        if 'original_schedule_json' in result:
-            saveable['original_schedule_json'] = result['original_schedule_json']
-        if 'original_unplaced' in result:
-            saveable['original_unplaced'] = result['original_unplaced']
-        if 'unplaced' in result:
-            saveable['unplaced'] = result['unplaced']
-        if 'office_teachers' in result:
-            saveable['office_teachers'] = result['office_teachers']
-        if 'booth_pref' in result:
-            saveable['booth_pref'] = result['booth_pref']
-        if 'students' in result:
-            # studentsのsetをlistに変換
-            stu_save = []
-            for s in result['students']:
-                sc = dict(s)
-                if isinstance(sc.get('avail'), set):
-                    sc['avail'] = sorted([list(a) for a in sc['avail']])
-                if isinstance(sc.get('backup_avail'), set):
-                    sc['backup_avail'] = sorted([list(a) for a in sc['backup_avail']])
-                if isinstance(sc.get('ng_dates'), set):
-                    sc['ng_dates'] = [list(d) for d in sc['ng_dates']]
-                if 'fixed' in sc:
-                    sc['fixed'] = [list(f) for f in sc['fixed']]
-                stu_save.append(sc)
-            saveable['students'] = stu_save
-        if 'week_dates' in result:
-            saveable['week_dates'] = result['week_dates']
-        if 'weekly_teachers' in result:
-            saveable['weekly_teachers'] = result['weekly_teachers']
-        if 'skills' in result:
-            # set→list変換（JSON保存用）
-            saveable['skills'] = {t: list(v) if isinstance(v, set) else v
-                                  for t, v in result['skills'].items()}
-        with open(rp, 'w', encoding='utf-8') as f:
+        saveable = _result_saveable(result)
+        # 一時ファイル経由で置き換え（書き込み途中のクラッシュで壊さない）
+        tmp = rp + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
             json.dump(saveable, f, ensure_ascii=False)
+        os.replace(tmp, rp)
         # Supabaseにも永続保存
         _save_result_to_supabase(sid, saveable)
     except Exception as e:
@@ -214,9 +318,11 @@ def _load_result_from_disk(sid):
         return None
     try:
         with open(rp, 'r', encoding='utf-8') as f:
-            return json.load(f)
+            result = json.load(f)
     except Exception:
         return None
+    # チェックポイント以降の編集をジャーナルから再生
+    return _replay_journal(sid, result)
 
 def _load_result_from_supabase(sid):
     """Supabaseからスケジュール結果を読み込む"""
@@ -229,6 +335,215 @@ def _load_result_from_supabase(sid):
         print(f"[load_result] WARNING: Supabase読み込み失敗: {e}", flush=True)
     return None
 
+# ========== 編集ジャーナル ==========
+# update_schedule の変更をセル(週/曜日/時限/ブース)単位の操作として _journal.jsonl に
+# 追記し、_result.json 全体の書き直しを JOURNAL_COMPACT_EVERY 件に1回へ減らす。
+# 操作は「変更前/変更後のブース内容」を絶対値で持つため、チェックポイント後に
+# 古いジャーナルを再生しても結果は変わらない（コンパクション途中のクラッシュに強い）。
+JOURNAL_COMPACT_EVERY = int(os.environ.get('JOURNAL_COMPACT_EVERY', '50'))
+JOURNAL_UNDO_LIMIT = int(os.environ.get('JOURNAL_UNDO_LIMIT', '50'))
+_journals = {}  # {sid: {'undo': [edit, ...], 'redo': [edit, ...], 'pending': 追記件数}}
+_journals_lock = threading.Lock()
+_pending_supabase_sync = {}  # {sid: 保存用スナップショット} バックグラウンド同期待ち
+
+def _journal_path(sid):
+    return os.path.join(_session_dir(sid), '_journal.jsonl')
+
+def _booth_json(b):
+    return {'teacher': b.get('teacher', ''), 'slots': [list(s) for s in b.get('slots', [])]}
+
+def _diff_schedule_cells(old, new):
+    """schedule_json 同士をブース単位で比較し [wi, day, ts, bi, before, after] のリストを返す。
+    週・曜日・時限・ブース数の構成が違う場合は None（差分にできない）"""
+    if not isinstance(old, list) or not isinstance(new, list) or len(old) != len(new):
+        return None
+    cells = []
+    for wi, (ow, nw) in enumerate(zip(old, new)):
+        if ow.keys() != nw.keys():
+            return None
+        for day, nd in nw.items():
+            od = ow[day]
+            if od.keys() != nd.keys():
+                return None
+            for ts, nbs in nd.items():
+                obs = od[ts]
+                if len(obs) != len(nbs):
+                    return None
+                for bi, (ob, nb) in enumerate(zip(obs, nbs)):
+                    before, after = _booth_json(ob), _booth_json(nb)
+                    if before != after:
+                        cells.append([wi, day, ts, bi, before, after])
+    return cells
+
+def _apply_journal_edit(result, entry, forward=True):
+    """編集操作を result に適用（forward=False なら取り消し）"""
+    sj = result['schedule_json']
+    sched = result.get('schedule')
+    cs = result.get('_compact')
+    if cs is not None and cs.source is not sj:
+        cs = None
+    pidx = result.get('_pindex')
+    if pidx is not None and pidx.source is not sj:
+        pidx = None
+    score = result.get('_score')
+    if score is not None and (pidx is None or score.idx is not pidx):
+        score = None
+    k = 5 if forward else 4
+    for c in entry.get('cells', []):
+        wi, day, ts, bi, b = c[0], c[1], c[2], c[3], c[k]
+        if pidx is not None:
+            pidx.update_booth((wi, day, ts, bi), sj[wi][day][ts][bi], b)
+        if score is not None:
+            score.update_booth((wi, day, ts, bi), sj[wi][day][ts][bi], b)
+        sj[wi][day][ts][bi] = {'teacher': b['teacher'], 'slots': [list(s) for s in b['slots']]}
+        if sched is not None and sched is not sj:
+            sched[wi][day][ts][bi] = {'teacher': b['teacher'], 'slots': [tuple(s) for s in b['slots']]}
+        if cs is not None:
+            cs.set_booth(wi, day, ts, bi, b)
+    if 'unplaced' in entry:
+        result['unplaced'] = entry['unplaced'][1 if forward else 0]
+
+def _journal_apply_record(state, result, rec):
+    """ジャーナル1行分を state(アンドゥ/リドゥスタック) と result に反映。適用できたらTrue"""
+    op = rec.get('op')
+    if op == 'stacks':
+        state['undo'] = rec.get('undo', [])
+        state['redo'] = rec.get('redo', [])
+        return True
+    if op == 'edit':
+        _apply_journal_edit(result, rec, True)
+        state['undo'].append(rec)
+        del state['undo'][:-JOURNAL_UNDO_LIMIT]
+        state['redo'] = []
+        return True
+    src, dst, forward = ('undo', 'redo', False) if op == 'undo' else ('redo', 'undo', True)
+    if op not in ('undo', 'redo') or not state[src]:
+        return False
+    entry = state[src].pop()
+    _apply_journal_edit(result, entry, forward)
+    state[dst].append(entry)
+    return True
+
+def _get_journal_state(sid):
+    with _journals_lock:
+        return _journals.setdefault(sid, {'undo': [], 'redo': [], 'pending': 0})
+
+def _replay_journal(sid, result):
+    """チェックポイントにジャーナルを再生し、アンドゥ/リドゥスタックを復元する"""
+    state = {'undo': [], 'redo': [], 'pending': 0}
+    jp = _journal_path(sid)
+    if 'schedule_json' in result and os.path.exists(jp):
+        with open(jp, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    break  # クラッシュで書きかけになった末尾行は捨てる
+                try:
+                    _journal_apply_record(state, result, rec)
+                except (KeyError, IndexError, TypeError):
+                    print(f"[journal] WARNING: 再生できない操作をスキップ: {rec.get('op')}", flush=True)
+                state['pending'] += 1
+    with _journals_lock:
+        _journals[sid] = state
+    return result
+
+def _write_checkpoint(sid, result, keep_history=False):
+    """result 全体を _result.json に書き、ジャーナルをスタックだけに切り詰める"""
+    state = _get_journal_state(sid)
+    if not keep_history:
+        state['undo'], state['redo'] = [], []
+    state['pending'] = 0
+    with _journals_lock:
+        _pending_supabase_sync.pop(sid, None)
+    _save_result_to_disk(sid, result)
+    jp = _journal_path(sid)
+    try:
+        if state['undo'] or state['redo']:
+            tmp = jp + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(json.dumps({'op': 'stacks', 'undo': state['undo'], 'redo': state['redo']},
+                                   ensure_ascii=False) + '\n')
+            os.replace(tmp, jp)
+        elif os.path.exists(jp):
+            os.remove(jp)
+    except OSError as e:
+        print(f"[journal] WARNING: コンパクション失敗: {e}", flush=True)
+
+def _sync_result_to_supabase_later(sid, result):
+    """Supabaseへの全体保存をバックグラウンドに回す（連続編集は最新1回にまとめる）。
+    result は他のリクエストが書き換え続けるので、編集の適用と同じロックの中で切り離したコピーを積む"""
+    with _journals_lock:
+        snapshot = json.loads(json.dumps(_result_saveable(result), ensure_ascii=False))
+        queued = sid in _pending_supabase_sync
+        _pending_supabase_sync[sid] = snapshot
+    if not queued:
+        run_in_background(_flush_supabase_sync, sid)
+
+def _flush_supabase_sync(sid):
+    with _journals_lock:
+        saveable = _pending_supabase_sync.pop(sid, None)
+    if saveable is not None:
+        _save_result_to_supabase(sid, saveable)
+
+def _journal_append(sd, rec):
+    """操作を result に適用してジャーナルに追記。一定件数ごとにコンパクション"""
+    sid = sd['_sid']
+    res = sd['result']
+    state = _get_journal_state(sid)
+    with _journals_lock:
+        applied = _journal_apply_record(state, res, rec)
+    if not applied:
+        return False
+    bump_result_version(sid)
+    state['pending'] += 1
+    if state['pending'] >= JOURNAL_COMPACT_EVERY:
+        save_session_result(sd, keep_history=True)
+        return True
+    try:
+        with open(_journal_path(sid), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(rec, ensure_ascii=False) + '\n')
+    except OSError as e:
+        print(f"[journal] WARNING: 追記失敗、全体保存に切り替え: {e}", flush=True)
+        save_session_result(sd, keep_history=True)
+        return True
+    _sync_result_to_supabase_later(sid, res)
+    return True
+
+def record_schedule_edit(sd, schedule_json, unplaced):
+    """update_schedule の変更をジャーナルに記録する。
+    差分にできない（未保存・構成変更）場合は False を返し、呼び出し側が全体保存する"""
+    sid = sd['_sid']
+    res = sd.get('result') or {}
+    if 'schedule_json' not in res or not os.path.exists(_result_json_path(sid)):
+        return False
+    cells = _diff_schedule_cells(res['schedule_json'], schedule_json)
+    if cells is None:
+        return False
+    rec = {'op': 'edit', 'cells': cells}
+    old_unplaced = res.get('unplaced', [])
+    if old_unplaced != unplaced:
+        rec['unplaced'] = [old_unplaced, unplaced]
+    if not cells and 'unplaced' not in rec:
+        return True  # 変更なし
+    return _journal_append(sd, rec)
+
+def undo_redo_session(sd, op):
+    """直前の編集を取り消す(op='undo') / やり直す(op='redo')。できなければFalse"""
+    if 'schedule_json' not in (sd.get('result') or {}):
+        # 再起動後: チェックポイント + ジャーナルから復元
+        disk_result = _load_result_from_disk(sd['_sid'])
+        if not disk_result or 'schedule_json' not in disk_result:
+            return False
+        disk_result['schedule'] = disk_result['schedule_json']
+        sd['result'] = disk_result
+        get_session_data._cache[sd['_sid']] = {'result': disk_result}
+    return _journal_append(sd, {'op': op})
+
+def journal_status(sid):
+    state = _get_journal_state(sid)
+    return {'can_undo': bool(state['undo']), 'can_redo': bool(state['redo'])}
+
 # ========== 認証 ==========
 def login_required(f):
     @wraps(f)
@@ -369,6 +684,460 @@ DAY_COLS = {
 }
 TUTOR_ROWS = [19,32,45,58,71,84]
 
+# ========== コンパクトスケジュール表現 ==========
+# schedule[wi][day][ts] = [{'teacher', 'slots'}] * ブース数 の入れ子dictを、
+# 週ごとの平坦な配列（講師ID / CSR形式の生徒スロットID）と名前テーブルで保持する。
+# エンドポイントや write_excel は従来どおり to_json() の入れ子dictを使う。
+_LAYOUTS = {}  # layout → (layout, {(day, ts): (先頭ブース番号, ブース数)}, 総ブース数)
+
+def _intern_layout(layout):
+    got = _LAYOUTS.get(layout)
+    if got is None:
+        if len(_LAYOUTS) > 1024:
+            _LAYOUTS.clear()
+        index = {}
+        base = 0
+        for day, row in layout:
+            for ts, nb in row:
+                index[(day, ts)] = (base, nb)
+                base += nb
+        got = _LAYOUTS.setdefault(layout, (layout, index, base))
+    return got
+
+
+class _NameTable:
+    """文字列/スロットタプル ↔ 整数ID（追記のみ。コピー間で共有してもIDは不変）"""
+    __slots__ = ('names', 'ids', '_lock')
+
+    def __init__(self, names=()):
+        self.names = list(names)
+        self.ids = {n: i for i, n in enumerate(self.names)}
+        self._lock = threading.Lock()
+
+    def intern(self, key):
+        i = self.ids.get(key)
+        if i is None:
+            with self._lock:
+                i = self.ids.get(key)
+                if i is None:
+                    i = len(self.names)
+                    self.names.append(key)
+                    self.ids[key] = i
+        return i
+
+
+class BoothRecord:
+    """ブース1つ分（講師名 + (学年, 名前, 科目) スロット）"""
+    __slots__ = ('teacher', 'slots')
+
+    def __init__(self, teacher='', slots=()):
+        self.teacher = teacher
+        self.slots = tuple(tuple(s) for s in slots)
+
+    def __eq__(self, other):
+        return (isinstance(other, BoothRecord)
+                and self.teacher == other.teacher and self.slots == other.slots)
+
+    def __repr__(self):
+        return f'BoothRecord({self.teacher!r}, {list(self.slots)!r})'
+
+    def to_json(self):
+        return {'teacher': self.teacher, 'slots': [list(s) for s in self.slots]}
+
+
+class _WeekBlock:
+    """1週分のブース。layout順に平坦化し、ブースkのスロットは slot_ids[slot_start[k]:slot_start[k+1]]"""
+    __slots__ = ('layout', 'teacher', 'slot_start', 'slot_ids')
+
+    def __init__(self, layout, teacher, slot_start, slot_ids):
+        self.layout = layout
+        self.teacher = teacher
+        self.slot_start = slot_start
+        self.slot_ids = slot_ids
+
+    def copy(self):
+        return _WeekBlock(self.layout, self.teacher[:], self.slot_start[:], self.slot_ids[:])
+
+
+class CompactSchedule:
+    """配列ベースのスケジュール。コピー・ハッシュ・差分がブース配列単位で済む
+
+    copy() は週ブロックを共有するコピーオンライト複製で、書き込んだ側だけが
+    その週を複製する（未編集の週は何世代のスナップショットでも1つ）。
+    """
+    __slots__ = ('teachers', 'entries', 'weeks', 'source', '_shared', '_digest', '_json')
+
+    def __init__(self, teachers=None, entries=None, weeks=None, shared=False):
+        self.teachers = teachers if teachers is not None else _NameTable([''])
+        self.entries = entries if entries is not None else _NameTable()
+        self.weeks = weeks if weeks is not None else []
+        self.source = None   # 変換元の schedule_json（session_compact のキャッシュ判定用）
+        self._shared = set(range(len(self.weeks))) if shared else set()  # 他と共有中の週
+        self._digest = None
+        self._json = None
+
+    @classmethod
+    def from_json(cls, schedule, teachers=None, entries=None):
+        """入れ子dict形式（slots は list / tuple どちらでも可）から構築"""
+        cs = cls(teachers, entries)
+        t_intern, e_intern = cs.teachers.intern, cs.entries.intern
+        for w in schedule or []:
+            layout = []
+            teacher, slot_start, slot_ids = array('H'), array('I', [0]), array('I')
+            for day, dd in w.items():
+                row = []
+                for ts, booths in dd.items():
+                    row.append((ts, len(booths)))
+                    for b in booths:
+                        teacher.append(t_intern(b.get('teacher') or ''))
+                        for s in b.get('slots', ()):
+                            slot_ids.append(e_intern(tuple(s)))
+                        slot_start.append(len(slot_ids))
+                layout.append((day, tuple(row)))
+            cs.weeks.append(_WeekBlock(_intern_layout(tuple(layout)), teacher, slot_start, slot_ids))
+        return cs
+
+    @classmethod
+    def of(cls, schedule):
+        return schedule if isinstance(schedule, cls) else cls.from_json(schedule)
+
+    def __len__(self):
+        return len(self.weeks)
+
+    def copy(self):
+        """コピーオンライト複製（名前テーブルと週ブロックを共有）"""
+        self._shared = set(range(len(self.weeks)))
+        cp = CompactSchedule(self.teachers, self.entries, list(self.weeks), shared=True)
+        cp._digest = self._digest
+        return cp
+
+    def week_json(self, wi):
+        wb = self.weeks[wi]
+        tn, en = self.teachers.names, self.entries.names
+        teacher, st, ids = wb.teacher, wb.slot_start, wb.slot_ids
+        out = {}
+        k = 0
+        for day, row in wb.layout[0]:
+            dj = {}
+            for ts, nb in row:
+                dj[ts] = [{'teacher': tn[teacher[i]], 'slots': [list(en[j]) for j in ids[st[i]:st[i + 1]]]}
+                          for i in range(k, k + nb)]
+                k += nb
+            out[day] = dj
+        return out
+
+    def to_json(self):
+        """従来の入れ子dict形式に展開（アダプター）。書き換えるまで同じ展開結果を返す（読み取り専用）"""
+        if self._json is None:
+            self._json = [self.week_json(wi) for wi in range(len(self.weeks))]
+        return self._json
+
+    def _booth_index(self, wi, day, ts, bi):
+        wb = self.weeks[wi]
+        base, nb = wb.layout[1][(day, ts)]
+        if not 0 <= bi < nb:
+            raise IndexError(bi)
+        return wb, base + bi
+
+    def booth(self, wi, day, ts, bi):
+        wb, k = self._booth_index(wi, day, ts, bi)
+        en = self.entries.names
+        return BoothRecord(self.teachers.names[wb.teacher[k]],
+                           [en[j] for j in wb.slot_ids[wb.slot_start[k]:wb.slot_start[k + 1]]])
+
+    def set_booth(self, wi, day, ts, bi, booth):
+        """ブース1つを書き換える（booth は dict / BoothRecord）"""
+        if isinstance(booth, BoothRecord):
+            teacher, slots = booth.teacher, booth.slots
+        else:
+            teacher, slots = booth.get('teacher') or '', booth.get('slots', ())
+        wb, k = self._booth_index(wi, day, ts, bi)
+        if wi in self._shared:
+            wb = self.weeks[wi] = wb.copy()
+            self._shared.discard(wi)
+        wb.teacher[k] = self.teachers.intern(teacher)
+        new = array('I', [self.entries.intern(tuple(s)) for s in slots])
+        s0, s1 = wb.slot_start[k], wb.slot_start[k + 1]
+        wb.slot_ids[s0:s1] = new
+        delta = len(new) - (s1 - s0)
+        if delta:
+            st = wb.slot_start
+            for j in range(k + 1, len(st)):
+                st[j] += delta
+        self._digest = None
+        self._json = None
+
+    def placed(self):
+        return sum(len(wb.slot_ids) for wb in self.weeks)
+
+    def digest(self):
+        """内容のsha256（JSONダンプ不要。未変更なら前回値を返す）"""
+        if self._digest is None:
+            h = hashlib.sha256()
+            n_t = max((max(wb.teacher) for wb in self.weeks if wb.teacher), default=0) + 1
+            n_e = max((max(wb.slot_ids) for wb in self.weeks if wb.slot_ids), default=-1) + 1
+            h.update(repr((self.teachers.names[:n_t], self.entries.names[:n_e])).encode('utf-8'))
+            for wb in self.weeks:
+                h.update(repr(wb.layout[0]).encode('utf-8'))
+                h.update(wb.teacher.tobytes())
+                h.update(wb.slot_start.tobytes())
+                h.update(wb.slot_ids.tobytes())
+            self._digest = h.hexdigest()
+        return self._digest
+
+    def diff(self, other):
+        """内容が異なるブース位置 [(wi, day, ts, bi)]。週・曜日・時限・ブース数の構成が違えば None"""
+        if len(self.weeks) != len(other.weeks):
+            return None
+        shared = self.teachers is other.teachers and self.entries is other.entries
+        tn_a, tn_b = self.teachers.names, other.teachers.names
+        en_a, en_b = self.entries.names, other.entries.names
+        out = []
+        for wi, (a, b) in enumerate(zip(self.weeks, other.weeks)):
+            if a is b:
+                continue
+            if a.layout[0] != b.layout[0]:
+                return None
+            if shared and a.teacher == b.teacher and a.slot_start == b.slot_start and a.slot_ids == b.slot_ids:
+                continue
+            sa, sb = a.slot_start, b.slot_start
+            k = 0
+            for day, row in a.layout[0]:
+                for ts, nb in row:
+                    for bi in range(nb):
+                        i = k + bi
+                        ids_a = a.slot_ids[sa[i]:sa[i + 1]]
+                        ids_b = b.slot_ids[sb[i]:sb[i + 1]]
+                        if shared:
+                            same = a.teacher[i] == b.teacher[i] and ids_a == ids_b
+                        else:
+                            same = (tn_a[a.teacher[i]] == tn_b[b.teacher[i]]
+                                    and [en_a[j] for j in ids_a] == [en_b[j] for j in ids_b])
+                        if not same:
+                            out.append((wi, day, ts, bi))
+                    k += nb
+        return out
+
+    def index_placements(self, positions):
+        """指定ブース位置だけの _index_placements 相当"""
+        idx = defaultdict(list)
+        for wi, day, ts, bi in positions:
+            b = self.booth(wi, day, ts, bi)
+            for slot in b.slots:
+                if len(slot) >= 3:
+                    idx[(slot[1], slot[2])].append({
+                        'wi': wi, 'day': day, 'ts': ts, 'bi': bi, 'teacher': b.teacher
+                    })
+        return idx
+
+
+BASELINE_HISTORY_LIMIT = int(os.environ.get('BASELINE_HISTORY_LIMIT', '5'))
+
+def _make_baseline(label, compact, unplaced):
+    """学習diff用ベースライン。schedule はCOW複製、unplaced は要素を共有したタプル
+    （セッションの unplaced は丸ごと置き換えられ、要素が書き換えられることはない）"""
+    return {'label': label, 'at': _utc_now_iso(), 'schedule': compact.copy(),
+            'unplaced': tuple(unplaced or ())}
+
+def push_baseline(res, label):
+    """現在のスケジュールをベースライン履歴に追加（先頭の生成時ベースラインは常に残す）"""
+    history = res.setdefault('baselines', [])
+    history.append(_make_baseline(label, session_compact(res), res.get('unplaced')))
+    if len(history) > BASELINE_HISTORY_LIMIT:
+        del history[1:len(history) - BASELINE_HISTORY_LIMIT + 1]
+
+def session_compact(res):
+    """セッション結果の schedule_json に対応する CompactSchedule（変換結果をキャッシュ）"""
+    sj = res.get('schedule_json') or res.get('schedule') or []
+    cs = res.get('_compact')
+    if cs is None or cs.source is not sj:
+        cs = CompactSchedule.from_json(sj)
+        cs.source = sj
+        res['_compact'] = cs
+    return cs
+
+def _as_schedule_json(schedule):
+    """CompactSchedule / 入れ子dict のどちらでも入れ子dictで返す"""
+    return schedule.to_json() if isinstance(schedule, CompactSchedule) else schedule
+
+# ========== 配置インデックス ==========
+# 生徒・講師ごとの配置位置と (週, 曜日) ごとのブース占有数の逆引き。
+# セッション結果ごとに1つ持ち（session_index）、ジャーナル編集ではブース単位で差分更新する。
+_DAY_ORDER = {d: i for i, d in enumerate(DAYS)}
+
+def _pos_order(pos):
+    wi, day, ts, bi = pos
+    return (wi, _DAY_ORDER.get(day, len(DAYS)), ts, bi)
+
+class PlacementIndex:
+    """schedule_json の逆引き索引（位置 pos は (wi, day, ts, bi)）"""
+
+    def __init__(self):
+        self.students = {}   # 生徒名 -> {pos: [(si, grade, subj, teacher)]}
+        self.teachers = {}   # 講師名 -> {pos}
+        self.occupancy = {}  # (wi, day) -> {ts: [ブースごとのスロット数]}
+        self.num_weeks = 0
+        self.source = None
+
+    @classmethod
+    def from_json(cls, schedule):
+        idx = cls()
+        idx.num_weeks = len(schedule or [])
+        for wi, w in enumerate(schedule or []):
+            for day, dd in w.items():
+                occ = idx.occupancy[(wi, day)] = {}
+                for ts, booths in dd.items():
+                    occ[ts] = [0] * len(booths)
+                    for bi, b in enumerate(booths):
+                        idx._add((wi, day, ts, bi), b)
+        return idx
+
+    def _add(self, pos, booth):
+        teacher = booth.get('teacher') or ''
+        slots = booth.get('slots') or []
+        if teacher:
+            self.teachers.setdefault(teacher, set()).add(pos)
+        for si, s in enumerate(slots):
+            if len(s) >= 3:
+                self.students.setdefault(s[1], {}).setdefault(pos, []).append((si, s[0], s[2], teacher))
+        self.occupancy[pos[:2]][pos[2]][pos[3]] = len(slots)
+
+    def _remove(self, pos, booth):
+        teacher = booth.get('teacher') or ''
+        if teacher in self.teachers:
+            self.teachers[teacher].discard(pos)
+            if not self.teachers[teacher]:
+                del self.teachers[teacher]
+        for s in booth.get('slots') or []:
+            placements = self.students.get(s[1]) if len(s) >= 3 else None
+            if placements is not None:
+                placements.pop(pos, None)
+                if not placements:
+                    del self.students[s[1]]
+        self.occupancy[pos[:2]][pos[2]][pos[3]] = 0
+
+    def update_booth(self, pos, old, new):
+        """1ブースの内容が old → new に変わったことを反映"""
+        self._remove(pos, old)
+        self._add(pos, new)
+
+    def student_placements(self, name):
+        """[{'wi','day','ts','bi','si','grade','subj','teacher'}]（週・曜日・時限順）"""
+        out = []
+        placements = self.students.get(name, {})
+        for pos in sorted(placements, key=_pos_order):
+            wi, day, ts, bi = pos
+            for si, grade, subj, teacher in placements[pos]:
+                out.append({'wi': wi, 'day': day, 'ts': ts, 'bi': bi, 'si': si,
+                            'grade': grade, 'subj': subj, 'teacher': teacher})
+        return out
+
+    def teacher_positions(self, name):
+        return sorted(self.teachers.get(name, ()), key=_pos_order)
+
+def session_index(res):
+    """セッション結果の schedule_json に対応する PlacementIndex（編集で差分更新される）"""
+    sj = res.get('schedule_json') or res.get('schedule') or []
+    idx = res.get('_pindex')
+    if idx is None or idx.source is not sj:
+        idx = PlacementIndex.from_json(sj)
+        idx.source = sj
+        res['_pindex'] = idx
+    return idx
+
+# ========== コンパクト転送形式 ==========
+# リクエストヘッダー X-Schedule-Format: compact のとき、応答の schedule / weeklyTeachers を
+# 文字列テーブル + 整数参照の形で返す（空ブースは省略）。デコードは index.html の decodeWire。
+#   schedule:       {'v': 1, 's': [文字列], 'e': [学年, 名前, 科目, ...](sの添字を3つずつ),
+#                    'w': [{day: {ts: [ブース数, bi, 講師, スロット数k, e1..ek, bi, ...]}}]}
+#   weeklyTeachers: {'v': 1, 's': [文字列], 'w': [{day: {ts: [講師, ...]}}]}
+WIRE_HEADER = 'X-Schedule-Format'
+LAZY_HEADER = 'X-Schedule-Lazy'
+
+def wire_compact_requested():
+    return request.headers.get(WIRE_HEADER, '').lower() == 'compact'
+
+def encode_schedule_wire(schedule):
+    """schedule_json をコンパクト転送形式に変換。3要素でないスロットがあれば None"""
+    strings = _NameTable()
+    entries = {}
+    flat = []
+    weeks = []
+    for w in schedule or []:
+        if w is None:  # X-Schedule-Lazy で省いた週
+            weeks.append(None)
+            continue
+        wk = {}
+        for day, dd in w.items():
+            dk = {}
+            for ts, booths in dd.items():
+                cell = [len(booths)]
+                for bi, b in enumerate(booths):
+                    teacher = b.get('teacher') or ''
+                    slots = b.get('slots') or []
+                    if not teacher and not slots:
+                        continue
+                    cell += (bi, strings.intern(teacher), len(slots))
+                    for s in slots:
+                        key = tuple(s)
+                        eid = entries.get(key)
+                        if eid is None:
+                            if len(key) != 3:
+                                return None
+                            eid = entries[key] = len(entries)
+                            flat.extend(strings.intern(x) for x in key)
+                        cell.append(eid)
+                dk[ts] = cell
+            wk[day] = dk
+        weeks.append(wk)
+    return {'v': 1, 's': strings.names, 'e': flat, 'w': weeks}
+
+def encode_weekly_teachers_wire(wt):
+    strings = _NameTable()
+    weeks = [{day: {ts: [strings.intern(t) for t in (ts_list or [])] for ts, ts_list in dd.items()}
+              for day, dd in w.items()} for w in wt or []]
+    return {'v': 1, 's': strings.names, 'w': weeks}
+
+def schedule_manifest(schedule, week_dates=None):
+    """週ごとの配置数・ブース数・日付の目録（週の中身は含めない）"""
+    dates = (week_dates or {}).get('weeks') or []
+    weeks = []
+    for wi, w in enumerate(schedule or []):
+        booths = [b for dd in w.values() for bs in dd.values() for b in bs]
+        weeks.append({
+            'wi': wi,
+            'placed': sum(len(b.get('slots', [])) for b in booths),
+            'booths': len(booths),
+            'staffed': sum(1 for b in booths if b.get('teacher')),
+            'dates': dates[wi] if wi < len(dates) else None,
+        })
+    return {'weeks': weeks, 'placed': sum(w['placed'] for w in weeks), 'weekDates': week_dates}
+
+def wire_payload(payload):
+    """要求ヘッダーに合わせて応答の schedule / weeklyTeachers を変換する
+
+    X-Schedule-Lazy: <wi>      … schedule はその週だけ（他は null）にして manifest を付ける
+    X-Schedule-Format: compact … 文字列テーブル形式に変換
+    """
+    lazy = request.headers.get(LAZY_HEADER)
+    if lazy is not None and isinstance(payload.get('schedule'), list):
+        try:
+            keep = int(lazy)
+        except ValueError:
+            keep = 0
+        sched = payload['schedule']
+        payload['manifest'] = schedule_manifest(sched, payload.get('weekDates'))
+        payload['schedule'] = [w if wi == keep else None for wi, w in enumerate(sched)]
+    if not wire_compact_requested():
+        return payload
+    if payload.get('schedule'):
+        enc = encode_schedule_wire(payload['schedule'])
+        if enc is not None:
+            payload['schedule'] = enc
+    if payload.get('weeklyTeachers'):
+        payload['weeklyTeachers'] = encode_weekly_teachers_wire(payload['weeklyTeachers'])
+    return payload
+
 # ========== 学習システム ==========
 SUPABASE_URL = os.environ.get('SUPABASE_URL', '')
 SUPABASE_SERVICE_KEY = os.environ.get('SUPABASE_SERVICE_KEY', '')
@@ -432,29 +1201,425 @@ def _sanitize_postgrest_value(value, expected_type='string'):
     return s
 
 
-def _supabase_request(method, table, params='', body=None, headers_extra=None):
-    """Supabase REST API へのリクエストヘルパー"""
-    if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
-        return None
-    url = f"{SUPABASE_URL}/rest/v1/{table}"
-    if params:
-        url += f"?{params}"
-    hdrs = {
-        'apikey': SUPABASE_SERVICE_KEY,
-        'Authorization': f'Bearer {SUPABASE_SERVICE_KEY}',
-        'Content-Type': 'application/json',
-    }
-    if headers_extra:
-        hdrs.update(headers_extra)
-    data = json.dumps(body, ensure_ascii=False).encode('utf-8') if body else None
-    req = Request(url, data=data, headers=hdrs, method=method)
-    try:
-        with urlopen(req, timeout=10) as resp:
-            raw = resp.read().decode('utf-8')
-            return json.loads(raw) if raw.strip() else None
-    except (URLError, HTTPError) as e:
-        print(f"[learning] Supabase {method} {table} error: {e}", flush=True)
-        return None
+# ========== ストレージ層 ==========
+# STORAGE_BACKEND:
+#   'supabase' (既定) — Supabase REST API を直接利用（未設定時は全操作が None）
+#   'sqlite'          — ローカルSQLiteのみで動作（Supabase不要のローカル運用）
+#   'cached'          — SQLiteをSupabaseの前段に置く read-through / write-through キャッシュ
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'supabase').strip().lower()
+STORAGE_SQLITE_PATH = (os.environ.get('STORAGE_SQLITE_PATH', '')
+                       or os.path.join(tempfile.gettempdir(), 'booth_storage.sqlite3'))
+STORAGE_CACHE_TTL = float(os.environ.get('STORAGE_CACHE_TTL', '300'))  # 秒
+
+# PostgREST互換サブセットをSQLiteで再現するためのテーブル定義
+# 型: TEXT / INTEGER / JSON(TEXTにJSON保存) / UUID(未指定時uuid4) / SERIAL(自動採番) / NOW(未指定時UTC現在時刻)
+STORAGE_TABLES = {
+    'schedule_sessions': {
+        'columns': {'sid': 'TEXT', 'result_data': 'JSON', 'updated_at': 'NOW'},
+        'primary_key': ('sid',),
+    },
+    'schedule_snapshots': {
+        'columns': {'id': 'UUID', 'year': 'INTEGER', 'month': 'INTEGER', 'label': 'TEXT',
+                    'schedule_data': 'JSON', 'settings_data': 'JSON', 'metadata': 'JSON',
+                    'booth_template': 'TEXT', 'created_at': 'NOW', 'updated_at': 'NOW'},
+        'primary_key': ('id',),
+        'unique': [('year', 'month', 'label')],
+    },
+    'schedule_learning_data': {
+        'columns': {'key': 'TEXT', 'data': 'JSON', 'updated_at': 'NOW'},
+        'primary_key': ('key',),
+    },
+    'schedule_edit_history': {
+        'columns': {'id': 'SERIAL', 'total_changes': 'INTEGER', 'placed_before': 'INTEGER',
+                    'placed_after': 'INTEGER', 'changes': 'JSON', 'created_at': 'NOW'},
+        'primary_key': ('id',),
+    },
+}
+
+_POSTGREST_RESERVED = {'select', 'order', 'limit', 'offset', 'on_conflict'}
+_POSTGREST_OPS = {'eq': '=', 'neq': '!=', 'lt': '<', 'lte': '<=', 'gt': '>', 'gte': '>='}
+
+def _utc_now_iso():
+    return _dt.datetime.utcnow().isoformat() + 'Z'
+
+def _parse_postgrest_params(params):
+    """PostgRESTクエリ文字列を (filters, options) に分解する。
+    filters: [(column, op, value)]、options: select/order/limit/offset/on_conflict
+    否定（not.is.null など）は op を 'not.is' のように 'not.' 付きで返す
+    """
+    filters = []
+    options = {}
+    for k, v in parse_qsl(params or '', keep_blank_values=True):
+        if k in _POSTGREST_RESERVED:
+            options[k] = v
+            continue
+        op, _, val = v.partition('.')
+        negate = op == 'not'
+        if negate:
+            op, _, val = val.partition('.')
+        if op == 'in':
+            inner = val.strip()
+            if inner.startswith('(') and inner.endswith(')'):
+                inner = inner[1:-1]
+            val = [x.strip().strip('"') for x in inner.split(',') if x.strip()]
+        elif op == 'is':
+            val = {'null': None, 'true': True, 'false': False}.get(val.lower(), val)
+        elif op not in _POSTGREST_OPS:
+            raise ValueError(f'未対応のフィルタ演算子です: {op}')
+        filters.append((k, 'not.' + op if negate else op, val))
+    return filters, options
+
+
+class _SupabaseBackend:
+    """Supabase REST API (PostgREST) への直接アクセス"""
+    name = 'supabase'
+
+    def enabled(self):
+        return bool(SUPABASE_URL and SUPABASE_SERVICE_KEY)
+
+    def request(self, method, table, params='', body=None, headers_extra=None,
+                timeout=10, raise_errors=False):
+        if not self.enabled():
+            return None
+        url = f"{SUPABASE_URL}/rest/v1/{table}"
+        if params:
+            url += f"?{params}"
+        hdrs = {
+            'apikey': SUPABASE_SERVICE_KEY,
+            'Authorization': f'Bearer {SUPABASE_SERVICE_KEY}',
+            'Content-Type': 'application/json',
+        }
+        if headers_extra:
+            hdrs.update(headers_extra)
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8') if body else None
+        req = Request(url, data=data, headers=hdrs, method=method)
+        try:
+            with urlopen(req, timeout=timeout) as resp:
+                raw = resp.read().decode('utf-8')
+                return json.loads(raw) if raw.strip() else None
+        except (URLError, HTTPError) as e:
+            print(f"[learning] Supabase {method} {table} error: {e}", flush=True)
+            if raise_errors:
+                raise
+            return None
+
+
+class _SQLiteBackend:
+    """STORAGE_TABLES をローカルSQLiteで実装するバックエンド。
+    アプリが使うPostgRESTサブセット（eq/neq/lt/lte/gt/gte/in/is フィルタ、select、
+    order/limit/offset、on_conflict + Prefer: resolution=merge-duplicates / return=representation）を解釈する。
+    """
+    name = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def enabled(self):
+        return True
+
+    def _connection(self):
+        if self._conn is None:
+            if self.path != ':memory:':
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            for table, spec in STORAGE_TABLES.items():
+                conn.execute(self._create_table_sql(table, spec))
+            conn.execute('CREATE TABLE IF NOT EXISTS _query_cache ('
+                         'tbl TEXT NOT NULL, query TEXT NOT NULL, payload TEXT NOT NULL, '
+                         'stored_at REAL NOT NULL, PRIMARY KEY (tbl, query))')
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _create_table_sql(table, spec):
+        cols = []
+        pk = spec['primary_key']
+        for col, typ in spec['columns'].items():
+            if typ == 'SERIAL':
+                cols.append(f'"{col}" INTEGER PRIMARY KEY AUTOINCREMENT')
+            else:
+                sql_type = 'INTEGER' if typ == 'INTEGER' else 'TEXT'
+                cols.append(f'"{col}" {sql_type}')
+        if not any(spec['columns'][c] == 'SERIAL' for c in pk):
+            cols.append('PRIMARY KEY (' + ', '.join(f'"{c}"' for c in pk) + ')')
+        for uq in spec.get('unique', []):
+            cols.append('UNIQUE (' + ', '.join(f'"{c}"' for c in uq) + ')')
+        return f'CREATE TABLE IF NOT EXISTS "{table}" (' + ', '.join(cols) + ')'
+
+    @staticmethod
+    def _spec(table):
+        spec = STORAGE_TABLES.get(table)
+        if spec is None:
+            raise ValueError(f'未知のテーブルです: {table}')
+        return spec
+
+    @staticmethod
+    def _check_column(spec, col):
+        if col not in spec['columns']:
+            raise ValueError(f'未知のカラムです: {col}')
+        return col
+
+    def _where(self, spec, filters):
+        clauses, args = [], []
+        for col, op, val in filters:
+            self._check_column(spec, col)
+            negate = op.startswith('not.')
+            if negate:
+                op = op[len('not.'):]
+            if op == 'in':
+                if not val:
+                    clause = '0'
+                else:
+                    clause = f'"{col}" IN (' + ', '.join('?' * len(val)) + ')'
+                    args.extend(val)
+            elif op == 'is':
+                clause = f'"{col}" IS ?'
+                args.append(val)
+            else:
+                clause = f'"{col}" {_POSTGREST_OPS[op]} ?'
+                args.append(val)
+            clauses.append(f'NOT ({clause})' if negate else clause)
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', args
+
+    def _tail(self, spec, options):
+        sql, args = '', []
+        order = options.get('order')
+        if order:
+            terms = []
+            for term in order.split(','):
+                parts = term.strip().split('.')
+                self._check_column(spec, parts[0])
+                direction = 'DESC' if 'desc' in parts[1:] else 'ASC'
+                terms.append(f'"{parts[0]}" {direction}')
+            sql += ' ORDER BY ' + ', '.join(terms)
+        if options.get('limit') or options.get('offset'):
+            sql += ' LIMIT ? OFFSET ?'
+            args += [int(options.get('limit') or -1), int(options.get('offset') or 0)]
+        return sql, args
+
+    def _select_cols(self, spec, options):
+        sel = options.get('select', '*').strip() or '*'
+        if sel == '*':
+            return list(spec['columns'])
+        return [self._check_column(spec, c.strip()) for c in sel.split(',') if c.strip()]
+
+    @staticmethod
+    def _decode_row(spec, row, cols):
+        out = {}
+        for c in cols:
+            v = row[c]
+            if spec['columns'][c] == 'JSON' and v is not None:
+                v = json.loads(v)
+            out[c] = v
+        return out
+
+    @staticmethod
+    def _encode_value(spec, col, val):
+        if spec['columns'][col] == 'JSON' and val is not None:
+            return json.dumps(val, ensure_ascii=False)
+        return val
+
+    def _insert(self, conn, table, spec, rows, options, prefer):
+        returned = []
+        merge = 'resolution=merge-duplicates' in prefer
+        ignore = 'resolution=ignore-duplicates' in prefer
+        if options.get('on_conflict'):
+            target = tuple(c.strip() for c in options['on_conflict'].split(','))
+        else:
+            target = spec['primary_key']
+        for row in rows:
+            given = [self._check_column(spec, c) for c in row]
+            values = dict(row)
+            for col, typ in spec['columns'].items():
+                if col in values:
+                    continue
+                if typ == 'UUID':
+                    values[col] = str(uuid.uuid4())
+                elif typ == 'NOW':
+                    values[col] = _utc_now_iso()
+            cols = list(values)
+            sql = (f'INSERT INTO "{table}" (' + ', '.join(f'"{c}"' for c in cols) + ') VALUES ('
+                   + ', '.join('?' * len(cols)) + ')')
+            if merge or ignore:
+                updates = [c for c in given if c not in target]
+                sql += ' ON CONFLICT (' + ', '.join(f'"{c}"' for c in target) + ')'
+                if merge and updates:
+                    sql += ' DO UPDATE SET ' + ', '.join(f'"{c}" = excluded."{c}"' for c in updates)
+                else:
+                    sql += ' DO NOTHING'
+            sql += ' RETURNING *'
+            cur = conn.execute(sql, [self._encode_value(spec, c, values[c]) for c in cols])
+            returned.extend(self._decode_row(spec, r, list(spec['columns'])) for r in cur.fetchall())
+        return returned
+
+    def request(self, method, table, params='', body=None, headers_extra=None,
+                timeout=10, raise_errors=False):
+        spec = self._spec(table)
+        filters, options = _parse_postgrest_params(params)
+        prefer = (headers_extra or {}).get('Prefer', '')
+        method = method.upper()
+        with self._lock:
+            conn = self._connection()
+            where, wargs = self._where(spec, filters)
+            if method == 'GET':
+                cols = self._select_cols(spec, options)
+                tail, targs = self._tail(spec, options)
+                cols_sql = ', '.join(f'"{c}"' for c in cols)
+                sql = f'SELECT {cols_sql} FROM "{table}"{where}{tail}'
+                return [self._decode_row(spec, r, cols) for r in conn.execute(sql, wargs + targs)]
+            if method == 'POST':
+                rows = body if isinstance(body, list) else [body or {}]
+                conn.execute('BEGIN')
+                try:
+                    returned = self._insert(conn, table, spec, rows, options, prefer)
+                    conn.execute('COMMIT')
+                except Exception:
+                    conn.execute('ROLLBACK')
+                    raise
+            elif method == 'PATCH':
+                sets = [self._check_column(spec, c) for c in (body or {})]
+                if not sets:
+                    return None
+                sql = (f'UPDATE "{table}" SET ' + ', '.join(f'"{c}" = ?' for c in sets)
+                       + where + ' RETURNING *')
+                args = [self._encode_value(spec, c, body[c]) for c in sets] + wargs
+                returned = [self._decode_row(spec, r, list(spec['columns']))
+                            for r in conn.execute(sql, args).fetchall()]
+            elif method == 'DELETE':
+                pk = spec['primary_key']
+                tail, targs = self._tail(spec, options)
+                if tail:
+                    # order/limit/offset 付き削除: 対象行を部分問い合わせで特定する
+                    pk_cols = ', '.join(f'"{c}"' for c in pk)
+                    sql = (f'DELETE FROM "{table}" WHERE ({pk_cols}) IN '
+                           f'(SELECT {pk_cols} FROM "{table}"{where}{tail}) RETURNING *')
+                    args = wargs + targs
+                else:
+                    sql = f'DELETE FROM "{table}"{where} RETURNING *'
+                    args = wargs
+                returned = [self._decode_row(spec, r, list(spec['columns']))
+                            for r in conn.execute(sql, args).fetchall()]
+            else:
+                raise ValueError(f'未対応のメソッドです: {method}')
+        return returned if 'return=representation' in prefer else None
+
+    # ---- read-through キャッシュ用 (cachedモードから利用) ----
+    def cache_get(self, table, params, ttl):
+        with self._lock:
+            row = self._connection().execute(
+                'SELECT payload, stored_at FROM _query_cache WHERE tbl = ? AND query = ?',
+                (table, params or '')).fetchone()
+        if row is None or time.time() - row['stored_at'] > ttl:
+            return None
+        return json.loads(row['payload'])
+
+    def cache_put(self, table, params, payload):
+        with self._lock:
+            self._connection().execute(
+                'INSERT OR REPLACE INTO _query_cache (tbl, query, payload, stored_at) VALUES (?, ?, ?, ?)',
+                (table, params or '', json.dumps(payload, ensure_ascii=False), time.time()))
+
+    def cache_invalidate(self, table):
+        with self._lock:
+            self._connection().execute('DELETE FROM _query_cache WHERE tbl = ?', (table,))
+
+
+class _CachedBackend:
+    """SQLiteをSupabaseの前段キャッシュとして使うバックエンド。
+    - GET: クエリ単位でSQLiteにキャッシュ（TTL付き）。ミス時はSupabaseから取得しローカルにもミラー
+    - 書き込み: Supabaseに書いた後、ローカルSQLiteにも同じ操作を適用し、該当テーブルのキャッシュを破棄
+    - Supabase障害時: ローカルSQLiteのミラーから応答（オフライン継続）
+    """
+    name = 'cached'
+
+    def __init__(self, remote, local, ttl=STORAGE_CACHE_TTL):
+        self.remote = remote
+        self.local = local
+        self.ttl = ttl
+
+    def enabled(self):
+        return True
+
+    def _mirror(self, table, rows):
+        pk = STORAGE_TABLES[table]['primary_key']
+        rows = [r for r in rows or [] if isinstance(r, dict) and all(c in r for c in pk)]
+        if rows:
+            try:
+                self.local.request('POST', table, '', body=rows,
+                                   headers_extra={'Prefer': 'resolution=merge-duplicates'})
+            except Exception as e:
+                print(f"[storage] local mirror {table} failed: {e}", flush=True)
+
+    def request(self, method, table, params='', body=None, headers_extra=None,
+                timeout=10, raise_errors=False):
+        method = method.upper()
+        if method == 'GET':
+            hit = self.local.cache_get(table, params, self.ttl)
+            if hit is not None:
+                return hit
+            try:
+                rows = self.remote.request(method, table, params, body, headers_extra,
+                                           timeout=timeout, raise_errors=True)
+            except (URLError, HTTPError, OSError) as e:
+                print(f"[storage] remote GET {table} failed, serving local mirror: {e}", flush=True)
+                rows = None
+            if rows is None:
+                return self.local.request(method, table, params)
+            self.local.cache_put(table, params, rows)
+            self._mirror(table, rows)
+            return rows
+        result = None
+        remote_error = None
+        try:
+            result = self.remote.request(method, table, params, body, headers_extra,
+                                         timeout=timeout, raise_errors=True)
+        except (URLError, HTTPError, OSError) as e:
+            remote_error = e
+            print(f"[storage] remote {method} {table} failed, applied locally only: {e}", flush=True)
+        try:
+            local_result = self.local.request(method, table, params, body, headers_extra)
+        except Exception as e:
+            print(f"[storage] local {method} {table} failed: {e}", flush=True)
+            local_result = None
+        self.local.cache_invalidate(table)
+        if remote_error is not None and raise_errors:
+            raise remote_error
+        return result if self.remote.enabled() else local_result
+
+
+_storage_backend = None
+_storage_lock = threading.Lock()
+
+def _get_storage():
+    """STORAGE_BACKEND に応じたストレージバックエンドを返す（初回呼び出し時に生成）"""
+    global _storage_backend
+    if _storage_backend is None:
+        with _storage_lock:
+            if _storage_backend is None:
+                if STORAGE_BACKEND == 'sqlite':
+                    _storage_backend = _SQLiteBackend(STORAGE_SQLITE_PATH)
+                elif STORAGE_BACKEND == 'cached':
+                    _storage_backend = _CachedBackend(_SupabaseBackend(), _SQLiteBackend(STORAGE_SQLITE_PATH))
+                else:
+                    _storage_backend = _SupabaseBackend()
+                print(f"[storage] backend={_storage_backend.name}", flush=True)
+    return _storage_backend
+
+def _storage_enabled():
+    """永続ストレージが利用可能か（supabaseモードで未設定の場合のみFalse）"""
+    return _get_storage().enabled()
+
+def _supabase_request(method, table, params='', body=None, headers_extra=None, timeout=10, raise_errors=False):
+    """永続ストレージへのPostgREST形式リクエストヘルパー（STORAGE_BACKENDで振り分け）。
+    raise_errors=True の場合、通信エラー(URLError/HTTPError)を呼び出し元に送出する。
+    """
+    return _get_storage().request(method, table, params, body, headers_extra,
+                                  timeout=timeout, raise_errors=raise_errors)
 
 def _encode_booth_files(sd):
     """セッションのブース表ファイル群(meta+week_files)をZIP→base64エンコード。b64_str or None"""
@@ -512,23 +1677,50 @@ def _restore_booth_files(b64_str, session_dir):
         print(f"[cloud_load] booth restore failed: {e}", flush=True)
         return None
 
+# 学習データ（weights/stats）のインプロセスキャッシュ
+# generate() のたびにSupabaseへ往復しないよう、TTL内は1回の取得結果を使い回す。
+# 書き込み（save_learning_weights / save_learning_stats）時に明示的に破棄する。
+LEARNING_CACHE_TTL = float(os.environ.get('LEARNING_CACHE_TTL', '60'))  # 秒
+_learning_cache = {'data': None, 'fetched_at': 0.0}
+_learning_cache_lock = threading.Lock()
+
+def invalidate_learning_cache():
+    """学習データキャッシュを破棄する"""
+    with _learning_cache_lock:
+        _learning_cache['data'] = None
+        _learning_cache['fetched_at'] = 0.0
+
+def _load_learning_rows():
+    """weights/stats を1回のリクエストでまとめて取得する（TTLキャッシュ付き）。
+    Returns: {key: data} — 存在しないキーは含まれない
+    """
+    now = time.time()
+    with _learning_cache_lock:
+        cached = _learning_cache['data']
+        if cached is not None and now - _learning_cache['fetched_at'] < LEARNING_CACHE_TTL:
+            return cached
+    rows = _supabase_request('GET', 'schedule_learning_data', 'key=in.(weights,stats)&select=key,data')
+    data = {r.get('key'): r.get('data') or {} for r in (rows or []) if isinstance(r, dict)}
+    # 取得失敗(None)はキャッシュしない（次回リトライ）
+    if rows is not None or not _storage_enabled():
+        with _learning_cache_lock:
+            _learning_cache['data'] = data
+            _learning_cache['fetched_at'] = now
+    return data
+
 def load_learning_weights():
-    """Supabaseから学習済み重みを読み込む。なければデフォルト値を返す"""
-    rows = _supabase_request('GET', 'schedule_learning_data', 'key=eq.weights&select=data')
-    if rows and len(rows) > 0:
-        saved = rows[0].get('data', {})
-        weights = dict(DEFAULT_WEIGHTS)
+    """学習済み重みを読み込む。なければデフォルト値を返す"""
+    data = _load_learning_rows()
+    weights = dict(DEFAULT_WEIGHTS)
+    if 'weights' in data:
+        saved = data['weights']
         # statsのsession_countを確認（3未満なら学習適用しない）
-        stats_rows = _supabase_request('GET', 'schedule_learning_data', 'key=eq.stats&select=data')
-        session_count = 0
-        if stats_rows and len(stats_rows) > 0:
-            session_count = stats_rows[0].get('data', {}).get('session_count', 0)
+        session_count = data.get('stats', {}).get('session_count', 0)
         if session_count >= 3:
             for k in DEFAULT_WEIGHTS:
                 if k in saved:
                     weights[k] = int(round(saved[k]))
-        return weights
-    return dict(DEFAULT_WEIGHTS)
+    return weights
 
 def save_learning_weights(weights):
     """学習済み重みをSupabaseに保存 (upsert)"""
@@ -537,12 +1729,13 @@ def save_learning_weights(weights):
         'data': weights,
         'updated_at': _dt.datetime.utcnow().isoformat() + 'Z',
     }, headers_extra={'Prefer': 'resolution=merge-duplicates'})
+    invalidate_learning_cache()
 
 def load_learning_stats():
     """学習統計を読み込む"""
-    rows = _supabase_request('GET', 'schedule_learning_data', 'key=eq.stats&select=data')
-    if rows and len(rows) > 0:
-        return rows[0].get('data', {})
+    data = _load_learning_rows()
+    if 'stats' in data:
+        return dict(data['stats'])
     return {'session_count': 0}
 
 def save_learning_stats(stats):
@@ -552,17 +1745,62 @@ def save_learning_stats(stats):
         'data': stats,
         'updated_at': _dt.datetime.utcnow().isoformat() + 'Z',
     }, headers_extra={'Prefer': 'resolution=merge-duplicates'})
+    invalidate_learning_cache()
 
-def save_edit_history(entry):
-    """編集履歴を保存し、20件超を削除"""
+EDIT_HISTORY_KEEP = 20
+
+# ========== バックグラウンドジョブ ==========
+# レスポンスに影響しないストレージ後処理（編集履歴の保存・剪定など）を
+# 1本のワーカースレッドで順番に実行する（リクエスト処理をブロックしない）
+_bg_queue = _queue.Queue()
+_bg_worker = None
+_bg_worker_lock = threading.Lock()
+
+def _bg_loop():
+    while True:
+        fn, args = _bg_queue.get()
+        try:
+            fn(*args)
+        except Exception as e:
+            print(f"[background] {getattr(fn, '__name__', fn)} failed: {e}", flush=True)
+        finally:
+            _bg_queue.task_done()
+
+def run_in_background(fn, *args):
+    """fn(*args) をバックグラウンドワーカーに投入する"""
+    global _bg_worker
+    with _bg_worker_lock:
+        if _bg_worker is None or not _bg_worker.is_alive():
+            _bg_worker = threading.Thread(target=_bg_loop, daemon=True, name='storage-background')
+            _bg_worker.start()
+    _bg_queue.put((fn, args))
+
+def wait_background_jobs():
+    """投入済みのバックグラウンドジョブが全て終わるまで待つ"""
+    _bg_queue.join()
+
+def _save_edit_history_sync(entry):
     _supabase_request('POST', 'schedule_edit_history', '', body=entry,
                       headers_extra={'Prefer': 'return=minimal'})
-    # 古いレコードを削除（最新20件以外）
+    prune_edit_history()
+
+def prune_edit_history(keep=EDIT_HISTORY_KEEP):
+    """最新keep件以外の編集履歴を1回のDELETE (id=in.(...)) でまとめて削除"""
     rows = _supabase_request('GET', 'schedule_edit_history',
-                             'select=id&order=created_at.desc&offset=20')
-    if rows:
-        for r in rows:
-            _supabase_request('DELETE', 'schedule_edit_history', f"id=eq.{r['id']}")
+                             f'select=id&order=created_at.desc&offset={int(keep)}')
+    ids = [str(r['id']) for r in rows or [] if r.get('id') is not None]
+    if ids:
+        _supabase_request('DELETE', 'schedule_edit_history', f"id=in.({','.join(ids)})")
+
+def clear_edit_history():
+    """編集履歴を1回のDELETEで全削除"""
+    # PostgREST は条件なしの DELETE を拒否するので、全行に当てはまる条件を付ける
+    # （created_at を時刻で絞るとアプリサーバーとDBの時計のずれで新しい行が残る）
+    _supabase_request('DELETE', 'schedule_edit_history', 'id=not.is.null')
+
+def save_edit_history(entry):
+    """編集履歴を保存し、20件超を削除（バックグラウンド実行）"""
+    run_in_background(_save_edit_history_sync, entry)
 
 def _index_placements(schedule_json):
     """スケジュールから (name, subject) → [(wi, day, ts, bi, teacher), ...] のインデックスを構築"""
@@ -580,11 +1818,21 @@ def _index_placements(schedule_json):
                             })
     return idx
 
+def _diff_indexes(original, edited):
+    """差分計算用の配置インデックス。CompactSchedule なら内容の変わったブースだけを索引する
+    （変わっていないブースの配置は両側で打ち消し合うので結果は同じ）"""
+    if isinstance(original, CompactSchedule) or isinstance(edited, CompactSchedule):
+        a, b = CompactSchedule.of(original), CompactSchedule.of(edited)
+        changed = a.diff(b)
+        if changed is not None:
+            return a.index_placements(changed), b.index_placements(changed)
+        original, edited = a.to_json(), b.to_json()
+    return _index_placements(original), _index_placements(edited)
+
 def compute_schedule_diff(original, edited, orig_unplaced, edit_unplaced):
     """自動生成スケジュールと手動編集後スケジュールの差分を計算"""
     changes = []
-    orig_idx = _index_placements(original)
-    edit_idx = _index_placements(edited)
+    orig_idx, edit_idx = _diff_indexes(original, edited)
     all_keys = set(orig_idx.keys()) | set(edit_idx.keys())
 
     for key in all_keys:
@@ -1596,12 +2844,1518 @@ def extract_week_dates_from_files(week_file_paths):
         weeks.append(by_week.get(wi + 1, {}))
     return {'year': year, 'month': month, 'weeks': weeks}
 
+# ========== 配置スコア ==========
+def slot_score_terms(s, wi, day, ts, teacher, bi, n_slots, existing, booth_pref):
+    """find_slot の評価項目を加点順に列挙する（連続コマ・飛び石は既存コマごとに繰り返し現れる）。
+    existing はその週の生徒の配置済み {(day, ts)}。スコアは weights[項] の合計"""
+    terms = []
+    # NG日程は大きくペナルティ（配置は可能）
+    if (wi, day) in s.get('ng_dates', ()):
+        terms.append('ng_date')
+    # 予備時間はペナルティ（希望時間を優先）
+    if not (s['avail'] is None or (day, ts) in s['avail']):
+        terms.append('backup_time')
+    # 同曜日に既に別科目が配置されている場合: 連続コマを強く推奨、飛び石は回避
+    existing_on_day = [t_ for d_, t_ in existing if d_ == day]
+    if existing_on_day:
+        times = SATURDAY_TIMES if day == '土' else WEEKDAY_TIMES
+        tl = TIME_SHORT_REV.get(ts)
+        if tl in times:
+            curr_idx = times.index(tl)
+            for et_short in existing_on_day:
+                et_long = TIME_SHORT_REV.get(et_short)
+                if et_long in times:
+                    diff = abs(curr_idx - times.index(et_long))
+                    if diff == 1:
+                        terms.append('continuous_block')
+                    elif diff > 1:
+                        terms.append('skip_interval')
+        terms.append('same_day_2nd' if len(existing_on_day) < 2 else 'same_day_3plus')
+    if teacher in s['wish_teachers']:
+        terms.append('wish_teacher')
+    if teacher in booth_pref and booth_pref[teacher] == bi + 1:
+        terms.append('booth_pref')
+    if n_slots == 0:
+        terms.append('empty_booth')
+    return terms
+
+def lesson_terms(s, wi, lessons, booth_pref):
+    """配置済みの授業の評価項目。lessons は生徒のその週の授業 [(day, ts, bi, 講師, 同ブースの他の生徒数)]。
+    各授業を「他の授業が既にある状態で置いた」とみなして slot_score_terms を合計する"""
+    terms = []
+    occupied = [(l[0], l[1]) for l in lessons]
+    for i, (day, ts, bi, teacher, others) in enumerate(lessons):
+        existing = set(occupied[:i] + occupied[i + 1:])
+        terms += slot_score_terms(s, wi, day, ts, teacher, bi, others, existing, booth_pref)
+    return terms
+
+def unplaced_reason(checked_avail, reject_skill, reject_ng, reject_other, reject_full):
+    """候補が1つもなかったときの未配置理由（find_slot の却下件数から判定）"""
+    if not checked_avail:
+        return '希望時間帯なし'
+    if reject_skill:
+        return '指導可能な講師不在'
+    if reject_ng:
+        return 'NG講師'
+    if reject_other:
+        return 'NG生徒/ブース制約'
+    if reject_full:
+        return 'ブース満席'
+    return '空きコマなし'
+
+def score_breakdown(terms, weights):
+    """slot_score_terms の結果を {項: 点数} と合計点にまとめる"""
+    breakdown = {}
+    score = 0
+    for term in terms:
+        score += weights[term]
+        breakdown[term] = breakdown.get(term, 0) + weights[term]
+    return score, breakdown
+
+# ========== 配置候補の提案 ==========
+# セッションのスケジュールから組み立てた Scheduler で、未配置コマを置ける (wi, day, ts, bi) を
+# 生成時の find_slot と同じ candidates で列挙する（/api/suggest）。
+SUGGEST_MAX_K = 50
+
+def _pair_set(v):
+    return {(p[0], p[1]) for p in v or ()}
+
+def normalize_student(s):
+    """セッションの生徒dict（生成直後は set、保存・復元後は list）を配置判定用にそろえる"""
+    avail = s.get('avail')
+    if not isinstance(avail, set):
+        avail = _pair_set(avail) if avail else None  # JSON往復で None が [] になるため空は制限なし
+    return {
+        'name': s['name'], 'grade': s.get('grade', ''), 'needs': dict(s.get('needs') or {}),
+        'avail': avail,
+        'backup_avail': _pair_set(s.get('backup_avail')),
+        'ng_dates': _pair_set(s.get('ng_dates')),
+        'ng_teachers': set(s.get('ng_teachers') or ()),
+        'ng_students': set(s.get('ng_students') or ()),
+        'wish_teachers': list(s.get('wish_teachers') or ()),
+        'fixed': [tuple(f) for f in s.get('fixed') or ()],
+    }
+
+def session_students(res):
+    """{生徒名: normalize_student 済み}（res['students'] が差し替わるまでキャッシュ）"""
+    students = res.get('students') or []
+    cached = res.get('_students')
+    if cached is None or cached[0] is not students:
+        cached = (students, {s['name']: normalize_student(s) for s in students if s.get('name')})
+        res['_students'] = cached
+    return cached[1]
+
+def session_scheduler(res, weights, weeks=None):
+    """セッション結果の Scheduler（生成と同じ配置判定・評価を提案で使う）。
+    weeks を渡すとその週だけを索引する（他の週は空として扱う）"""
+    sched = res.get('schedule_json') or res.get('schedule') or []
+    if weeks is not None:
+        sched = [w if wi in weeks else {} for wi, w in enumerate(sched)]
+    return Scheduler(sched, list(session_students(res).values()), res.get('skills') or {},
+                     res.get('booth_pref') or {}, weights)
+
+def suggest_slots(sch, name, subj, weeks=None, k=5):
+    """生徒 name の subj を置ける候補を点数順に最大k件。候補がなければ (空リスト, 未配置理由)"""
+    s = sch.smap[name]
+    found = []
+    tally = [False, 0, 0, 0, 0]
+    for wi in (range(sch.num_weeks) if weeks is None else weeks):
+        cands, t = sch.scan(wi, s, subj)
+        found += [(sc, (wi, day, ts, bi)) for sc, day, ts, bi in cands]
+        tally = [tally[0] or t[0]] + [x + y for x, y in zip(tally[1:], t[1:])]
+    if not found:
+        return [], unplaced_reason(*tally)
+    found.sort(key=lambda c: (-c[0], _pos_order(c[1])))
+    out = []
+    for _sc, (wi, day, ts, bi) in found[:k]:
+        score, breakdown = score_breakdown(sch.score_terms(wi, s, day, ts, bi), sch.weights)
+        out.append({'wi': wi, 'day': day, 'ts': ts, 'bi': bi, 'teacher': sch.schedule[wi][day][ts][bi]['teacher'],
+                    'score': score, 'breakdown': breakdown})
+    return out, None
+
+# ========== 移動の評価 ==========
+# 手動の移動・交換を確定せずに評価する（/api/evaluate_move）。変わるブースだけを changes
+# {pos: 変更後のブース} として持ち、影響する週の Scheduler に当てて生徒・週の評価項目を、
+# 影響する曜日だけの check_all で指摘を変更前後で比べる。
+def _booth_names(b):
+    return {sl[1] for sl in (b.get('slots') or []) if len(sl) > 1}
+
+def move_changes(schedule, smap, data):
+    """移動・交換の指定を {pos: 変更後のブース} と配置数の増減に変換する。不正なら ValueError
+
+    {'from': {wi, day, ts, bi, si} | {'unplaced': {name, subject}}, 'to': {wi, day, ts, bi} | null}
+    {'swap': [{wi, day, ts, bi, si}, {wi, day, ts, bi, si}]}
+    """
+    def pos_of(p):
+        try:
+            pos = (int(p['wi']), p['day'], str(p['ts']), int(p['bi']))
+            schedule[pos[0]][pos[1]][pos[2]][pos[3]]
+        except (KeyError, IndexError, TypeError, ValueError):
+            raise ValueError('位置の指定が不正です')
+        if pos[0] < 0 or pos[3] < 0:
+            raise ValueError('位置の指定が不正です')
+        return pos
+
+    changes = {}
+    def booth(pos):
+        if pos not in changes:
+            b = schedule[pos[0]][pos[1]][pos[2]][pos[3]]
+            changes[pos] = {'teacher': b.get('teacher') or '', 'slots': [list(s) for s in b.get('slots') or []]}
+        return changes[pos]
+
+    def take(p):
+        pos = pos_of(p)
+        slots = booth(pos)['slots']
+        try:
+            si = int(p.get('si', 0))
+        except (TypeError, ValueError):
+            raise ValueError('移動元のコマがありません')
+        if not 0 <= si < len(slots):
+            raise ValueError('移動元のコマがありません')
+        return pos, si, slots[si]
+
+    if not isinstance(data, dict):
+        raise ValueError('from を指定してください')
+    if 'swap' in data:
+        pair = data['swap']
+        if not (isinstance(pair, list) and len(pair) == 2 and all(isinstance(p, dict) for p in pair)):
+            raise ValueError('swap には2つの位置を指定してください')
+        a, b = pair
+        pos_a, si_a, slot_a = take(a)
+        pos_b, si_b, slot_b = take(b)
+        if pos_a == pos_b:
+            raise ValueError('同じブース内の交換はできません')
+        booth(pos_a)['slots'][si_a], booth(pos_b)['slots'][si_b] = slot_b, slot_a
+        return changes, 0
+    src, dst = data.get('from'), data.get('to')
+    if not src or not isinstance(src, dict):
+        raise ValueError('from を指定してください')
+    if dst is not None and not isinstance(dst, dict):
+        raise ValueError('位置の指定が不正です')
+    placed_delta = 0
+    if 'unplaced' in src:
+        if not isinstance(src['unplaced'], dict):
+            raise ValueError('未配置コマの生徒・科目が不正です')
+        name, subj = src['unplaced'].get('name'), src['unplaced'].get('subject')
+        if name not in smap or not subj:
+            raise ValueError('未配置コマの生徒・科目が不正です')
+        slot = [smap[name]['grade'], name, subj]
+        placed_delta += 1
+    else:
+        pos, si, slot = take(src)
+        booth(pos)['slots'].pop(si)
+    if dst:
+        target = booth(pos_of(dst))
+        if len(target['slots']) >= 2:
+            raise ValueError('移動先のブースは満席です')
+        target['slots'].append(slot)
+    else:
+        placed_delta -= 1
+    return changes, placed_delta
+
+def _issue_key(i):
+    return (i['code'], i.get('wi'), i.get('day'), i.get('ts'), i.get('bi'), i['message'])
+
+def evaluate_move(schedule, smap, changes, booth_pref, weights, check_args):
+    """changes を適用した場合の目的関数と check_all 指摘の差分（schedule は変更しない）。
+    check_args は (weekly_teachers, students, skills, manual_teachers)"""
+    # 影響する週だけの Scheduler（変わる曜日は複製）に changes を適用し、生成時と同じ
+    # student_week_terms で前後を比べる
+    days = {(pos[0], pos[1]) for pos in changes}
+    work = [{} for _ in schedule]
+    for wi, day in days:
+        if not work[wi]:
+            work[wi] = dict(schedule[wi])
+        work[wi][day] = {ts: [{'teacher': b.get('teacher') or '', 'slots': [list(sl) for sl in b.get('slots') or []]}
+                              for b in booths] for ts, booths in schedule[wi][day].items()}
+    sch = Scheduler(work, list(smap.values()), check_args[2], booth_pref, weights)
+    weeks = {pos[0] for pos in changes}
+    names = set()
+    for pos, b in changes.items():
+        names |= _booth_names(schedule[pos[0]][pos[1]][pos[2]][pos[3]]) | _booth_names(b)
+    keys = [(name, wi) for name in sorted(names) for wi in sorted(weeks)]
+    before, bd_before = score_breakdown([t for name, wi in keys for t in sch.student_week_terms(wi, name)], weights)
+    for (wi, day, ts, bi), b in changes.items():
+        sch.set_slots(wi, day, ts, bi, b.get('slots') or [])
+    after, bd_after = score_breakdown([t for name, wi in keys for t in sch.student_week_terms(wi, name)], weights)
+    breakdown = {t: bd_after.get(t, 0) - bd_before.get(t, 0) for t in set(bd_before) | set(bd_after)}
+
+    # 影響する曜日だけを持つ疎なスケジュールで check_all を前後2回
+    sub_before = [{} for _ in schedule]
+    sub_after = [{} for _ in schedule]
+    for wi, day in days:
+        sub_before[wi][day] = schedule[wi][day]
+        sub_after[wi][day] = sch.schedule[wi][day]
+    weekly_teachers, students, skills, manual_teachers = check_args
+    issues_before = {_issue_key(i): i for i in check_all(sub_before, weekly_teachers, [], students, skills, manual_teachers)}
+    issues_after = {_issue_key(i): i for i in check_all(sub_after, weekly_teachers, [], students, skills, manual_teachers)}
+    added = [i for k, i in issues_after.items() if k not in issues_before]
+    removed = [i for k, i in issues_before.items() if k not in issues_after]
+    return {
+        'delta': after - before, 'before': before, 'after': after,
+        'breakdown': {t: v for t, v in breakdown.items() if v},
+        'issues': {'added': added, 'removed': removed},
+        'feasible': not any(i['level'] == 'error' for i in added),
+    }
+
+# ========== 目的関数 ==========
+# スケジュール全体の評価（/api/score・生成結果の score）。(生徒名, wi) ごとに lesson_terms の
+# 件数を持ち、ブースが変わったら載っている生徒のその週だけを数え直す。点数は件数 × 重みで、
+# 重みを変えても数え直しは不要。
+def week_lessons(idx, name, wi):
+    """生徒のその週の授業 [(day, ts, bi, 講師, 同ブースの他の生徒数)]"""
+    out = []
+    for pos, entries in idx.students.get(name, {}).items():
+        if pos[0] != wi:
+            continue
+        others = idx.occupancy[pos[:2]][pos[2]][pos[3]] - 1
+        out.extend((pos[1], pos[2], pos[3], e[3], others) for e in entries)
+    out.sort(key=lambda l: (_DAY_ORDER.get(l[0], len(DAYS)), l[1], l[2]))
+    return out
+
+class ScheduleScore:
+    def __init__(self, idx, smap, booth_pref):
+        self.idx = idx
+        self.smap = smap
+        self.booth_pref = booth_pref
+        self.terms = {}         # (生徒名, wi) → Counter({項: 件数})
+        self.counts = Counter()
+        self.source = None
+        self.students = None
+        for name, positions in idx.students.items():
+            for wi in {pos[0] for pos in positions}:
+                self._add(name, wi)
+
+    def _add(self, name, wi):
+        s = self.smap.get(name)
+        if s is None:
+            return
+        c = Counter(lesson_terms(s, wi, week_lessons(self.idx, name, wi), self.booth_pref))
+        if c:
+            self.terms[(name, wi)] = c
+            self.counts.update(c)
+
+    def _remove(self, name, wi):
+        c = self.terms.pop((name, wi), None)
+        if c:
+            self.counts.subtract(c)
+
+    def update_booth(self, pos, old, new):
+        """ブース pos が old → new に変わった後（idx は更新済み）に呼ぶ"""
+        for name in _booth_names(old) | _booth_names(new):
+            self._remove(name, pos[0])
+            self._add(name, pos[0])
+
+    def total(self, weights):
+        """(点数, {項: 点数}, {項: 件数})"""
+        counts = {t: n for t, n in self.counts.items() if n}
+        breakdown = {t: weights[t] * n for t, n in counts.items()}
+        return sum(breakdown.values()), breakdown, counts
+
+def session_score(res):
+    """セッション結果の ScheduleScore（session_index と同じく編集で差分更新される）"""
+    sj = res.get('schedule_json') or res.get('schedule') or []
+    idx = session_index(res)
+    smap = session_students(res)
+    sc = res.get('_score')
+    booth_pref = res.get('booth_pref') or {}
+    if sc is None or sc.source is not sj or sc.idx is not idx or sc.smap is not smap or sc.booth_pref != booth_pref:
+        sc = ScheduleScore(idx, smap, booth_pref)
+        sc.source = sj
+        res['_score'] = sc
+    return sc
+
+def score_summary(sc, weights, placed, unplaced):
+    score, breakdown, counts = sc.total(weights)
+    return {'score': score, 'breakdown': breakdown, 'counts': counts,
+            'placed': placed, 'unplaced': sum(u.get('count', 1) for u in unplaced or ())}
+
 # ========== スケジューラー ==========
-def build_schedule(students, weekly_teachers, skills, office_rule, booth_pref, holidays=None, weights=None, week_dates=None, manual_teachers=None):
+IMPROVE_MAX_SECONDS = 20   # 焼きなまし改善の上限秒数（gunicorn の timeout 120秒に収まる範囲）
+EJECT_DEPTH = 3            # 押し出し連鎖の最大段数
+EJECT_MAX_NODES = 400      # 未配置1コマあたりに試す押し出しの上限（結果が実行時間に左右されないよう回数で制限）
+EJECT_SECONDS = 5          # Phase3 の押し出し修復全体の上限秒数（安全弁）
+# 1回の生成リクエストで押し出し修復・厳密解法・焼きなましに使える秒数の合計
+# （gunicorn の timeout 120秒から、読み込み・貪欲法・チェック・応答の分を残す）
+GENERATE_MAX_SECONDS = 90
+# 2以上なら Phase2/4 を週ごとに別プロセスで並列に行う（プロセス数。既定は従来どおり1プロセス）
+SCHEDULE_WORKERS = int(os.environ.get('SCHEDULE_WORKERS', '0') or 0)
+# Phase2 の配置方式: greedy=生徒順に各自の最良枠 / heap=週内の全候補から全体で最良のものを順に確定
+# matching=greedy のあと時限ごとに席を最小費用割当で詰め直す
+PLACEMENT_MODES = ('greedy', 'heap', 'matching')
+MATCH_PLACE_BONUS = 10 ** 7  # 割当でコマを置く価値（どの点数の差よりも大きく、置ける限り置かせる）
+MATCH_FORBIDDEN = 10 ** 9    # 置けない席の費用
+
+def min_cost_assignment(cost):
+    """n×m（n <= m）の費用行列で、各行に別々の列を1つずつ割り当てる最小費用の割当（ハンガリー法, O(n²m)）。
+    → 行ごとの列番号のリスト"""
+    n = len(cost)
+    m = len(cost[0]) if n else 0
+    if n > m:
+        raise ValueError('列より行が多い')
+    inf = float('inf')
+    u = [0] * (n + 1)
+    v = [0] * (m + 1)
+    p = [0] * (m + 1)      # 列 j に割り当てた行（1始まり, 0=なし）
+    way = [0] * (m + 1)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = [inf] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            row = cost[i0 - 1]
+            ui0 = u[i0]
+            delta = inf
+            j1 = 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    cur = row[j - 1] - ui0 - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+    out = [-1] * n
+    for j in range(1, m + 1):
+        if p[j]:
+            out[p[j] - 1] = j - 1
+    return out
+
+class Scheduler:
+    """スケジュールと配置インデックスを持つ配置エンジン。
+    配置・取り外し・移動でインデックスを差分更新し、ブース判定と候補の評価は find_slot と同じ条件で行う。
+    build_schedule の各フェーズはこの操作だけでスケジュールを組み立てる"""
+
+    def __init__(self, schedule, students, skills, booth_pref, weights=None, valid_days=None):
+        self.schedule = schedule
+        self.smap = {s['name']: s for s in students}
+        self.skills = skills
+        self.booth_pref = booth_pref
+        self.weights = weights if weights is not None else dict(DEFAULT_WEIGHTS)
+        self.num_weeks = len(schedule)
+        self.valid_days = valid_days or [set(DAYS)] * self.num_weeks
+        # placed_days[wi][name][subj] = set of days
+        # student_slots[wi][name] = set of (day, ts)
+        # any_days[wi][name] = set of days
+        # teacher_booths[wi][(day, teacher)] = set of (ts, bi)（生徒のいるブースのみ）
+        self.placed_days = [{} for _ in range(self.num_weeks)]
+        self.student_slots = [{} for _ in range(self.num_weeks)]
+        self.any_days = [{} for _ in range(self.num_weeks)]
+        self.teacher_booths = [{} for _ in range(self.num_weeks)]
+        self._teach = {}   # (講師, 学年, 科目) → can_teach の結果
+        # 操作ログ（anneal 中のみ）: ('P'|'U', wi, (day, ts, bi), si, slot) を積み、逆順に戻せる
+        self._log = None
+        for wi, ws in enumerate(schedule):
+            for day, ds in ws.items():
+                for ts, booths in ds.items():
+                    for bi, b in enumerate(booths):
+                        if b['slots']:
+                            self._booth_changed(wi, day, ts, bi)
+                        for slot in b['slots']:
+                            self._index_add(wi, slot[1], slot[2], day, ts)
+
+    # ---- インデックス ----
+    def _index_add(self, wi, name, subj, day, ts):
+        self.placed_days[wi].setdefault(name, {}).setdefault(subj, set()).add(day)
+        self.student_slots[wi].setdefault(name, set()).add((day, ts))
+        self.any_days[wi].setdefault(name, set()).add(day)
+
+    def _index_remove(self, wi, name, subj, day, ts):
+        self.placed_days[wi].setdefault(name, {}).setdefault(subj, set()).discard(day)
+        self.student_slots[wi].setdefault(name, set()).discard((day, ts))
+        if not any(d == day for d, _ in self.student_slots[wi].get(name, set())):
+            self.any_days[wi].setdefault(name, set()).discard(day)
+
+    def _booth_changed(self, wi, day, ts, bi):
+        b = self.schedule[wi][day][ts][bi]
+        if not b['teacher']:
+            return
+        tb = self.teacher_booths[wi].setdefault((day, b['teacher']), set())
+        if b['slots']:
+            tb.add((ts, bi))
+        else:
+            tb.discard((ts, bi))
+
+    def _attach(self, wi, day, ts, bi, slot, si=None):
+        slots = self.schedule[wi][day][ts][bi]['slots']
+        slots.append(slot) if si is None else slots.insert(si, slot)
+        self._booth_changed(wi, day, ts, bi)
+
+    def _detach(self, wi, day, ts, bi, si):
+        slot = self.schedule[wi][day][ts][bi]['slots'].pop(si)
+        self._booth_changed(wi, day, ts, bi)
+        return slot
+
+    def can_teach(self, teacher, grade, subj):
+        key = (teacher, grade, subj)
+        ok = self._teach.get(key)
+        if ok is None:
+            ok = self._teach[key] = can_teach(teacher, grade, subj, self.skills)
+        return ok
+
+    def placed_days_of(self, wi, name, subj):
+        return self.placed_days[wi].get(name, {}).get(subj, set())
+
+    def slots_of(self, wi, name):
+        return self.student_slots[wi].get(name, set())
+
+    def teacher_booth(self, wi, day, teacher):
+        """講師がその日に授業を持つブース（最も早い時限のもの）"""
+        tb = self.teacher_booths[wi].get((day, teacher))
+        return min(tb)[1] if tb else None
+
+    # ---- 配置操作 ----
+    def _put(self, wi, day, ts, bi, slot, si=None):
+        self._attach(wi, day, ts, bi, slot, si)
+        self._index_add(wi, slot[1], slot[2], day, ts)
+        if self._log is not None:
+            slots = self.schedule[wi][day][ts][bi]['slots']
+            self._log.append(('P', wi, (day, ts, bi), len(slots) - 1 if si is None else si, slot))
+
+    def place(self, wi, day, ts, bi, s, subj, si=None):
+        self._put(wi, day, ts, bi, (s['grade'], s['name'], subj), si)
+
+    def unplace(self, wi, day, ts, bi, si):
+        slot = self._detach(wi, day, ts, bi, si)
+        self._index_remove(wi, slot[1], slot[2], day, ts)
+        if self._log is not None:
+            self._log.append(('U', wi, (day, ts, bi), si, slot))
+        return slot
+
+    def move(self, wi, src, dst):
+        """src=(day, ts, bi, si) のコマを dst=(day, ts, bi) に移す（同じ週の中）"""
+        slot = self.unplace(wi, *src)
+        self._put(wi, *dst, slot)
+        return slot
+
+    def set_slots(self, wi, day, ts, bi, slots):
+        """ブース (day, ts, bi) の生徒を slots にそろえる（手動編集の反映用）"""
+        for si in range(len(self.schedule[wi][day][ts][bi]['slots']) - 1, -1, -1):
+            self.unplace(wi, day, ts, bi, si)
+        for slot in slots:
+            self._put(wi, day, ts, bi, list(slot))
+
+    def _rollback(self, mark):
+        """操作ログを mark の位置まで逆順に取り消す"""
+        log, self._log = self._log, None
+        while len(log) > mark:
+            op, wi, pos, si, slot = log.pop()
+            if op == 'P':
+                self.unplace(wi, *pos, si)
+            else:
+                self._put(wi, *pos, slot, si)
+        self._log = log
+
+    def place_first(self, wi, s, day, ts, subj):
+        """(day, ts) の置けるブースに置く（希望講師のブースを先に試す）。固定授業用"""
+        ws = self.schedule[wi]
+        if day not in ws or ts not in ws[day]: return False
+        booths = list(enumerate(ws[day][ts]))
+        wish = s.get('wish_teachers', [])
+        if wish:
+            booths = sorted(booths, key=lambda x: (0 if x[1]['teacher'] in wish else 1))
+        for bi, b in booths:
+            if self.check_booth(wi, day, bi, b, s, subj):
+                self.place(wi, day, ts, bi, s, subj)
+                return True
+        return False
+
+    # ---- 判定・評価 ----
+    def check_booth(self, wi, day, bi, booth, s, subj):
+        t = booth['teacher']
+        if not t or len(booth['slots'])>=2: return False
+        if t in s['ng_teachers']: return False
+        if not self.can_teach(t, s['grade'], subj): return False
+        # 同一ブース内のNG生徒チェック
+        for g2,sn2,sb2 in booth['slots']:
+            if sn2 in s['ng_students']: return False
+            other = self.smap.get(sn2)
+            if other and s['name'] in other.get('ng_students',[]): return False
+        # 隣接ブースチェックは廃止（同一ブースのみNGとする要望により）
+
+        eb = self.teacher_booth(wi, day, t)
+        if eb is not None and eb != bi: return False
+        return True
+
+    def score_terms(self, wi, s, day, ts, bi):
+        """(day, ts, bi) に s を置いたときの評価項目"""
+        b = self.schedule[wi][day][ts][bi]
+        return slot_score_terms(s, wi, day, ts, b['teacher'], bi, len(b['slots']),
+                                self.slots_of(wi, s['name']), self.booth_pref)
+
+    def score(self, wi, s, day, ts, bi):
+        """(day, ts, bi) に s を置いたときの点数"""
+        sc = 0
+        for term in self.score_terms(wi, s, day, ts, bi):
+            sc += self.weights[term]
+        return sc
+
+    def candidates(self, wi, s, subj):
+        """置ける (点数, day, ts, bi) の一覧と、1つもないときの未配置理由"""
+        cands, tally = self.scan(wi, s, subj)
+        if not cands:
+            return cands, unplaced_reason(*tally)
+        return cands, None
+
+    def scan(self, wi, s, subj):
+        """置ける (点数, day, ts, bi) の一覧と、却下の集計
+        (希望時間帯があったか, 指導不可, NG講師, NG生徒/ブース制約, 満席)。複数週の理由をまとめる用"""
+        ws = self.schedule[wi]
+        placed_days = self.placed_days_of(wi, s['name'], subj)
+        existing = self.slots_of(wi, s['name'])
+        cands = []
+        checked_avail = False
+        reject_full = 0
+        reject_ng = 0
+        reject_skill = 0
+        reject_other = 0
+        for day in DAYS:
+            if day not in self.valid_days[wi]: continue  # 存在しない曜日をスキップ
+            if day in placed_days: continue  # 同一科目の同曜日配置を防止
+            times = SATURDAY_TIMES if day=='土' else WEEKDAY_TIMES
+            for tl in times:
+                ts = TIME_SHORT[tl]
+                is_primary = s['avail'] is None or (day,ts) in s['avail']
+                is_backup = (not is_primary) and s.get('backup_avail') and (day,ts) in s['backup_avail']
+                if not is_primary and not is_backup: continue
+                checked_avail = True
+                if (day,ts) in existing: continue
+                if ts not in ws.get(day,{}): continue
+                for bi,b in enumerate(ws[day][ts]):
+                    t = b['teacher']
+                    if not t: continue
+                    if len(b['slots'])>=2:
+                        reject_full += 1
+                        continue
+                    if t in s['ng_teachers']:
+                        reject_ng += 1
+                        continue
+                    if not self.can_teach(t, s['grade'], subj):
+                        reject_skill += 1
+                        continue
+                    if not self.check_booth(wi, day, bi, b, s, subj):
+                        reject_other += 1
+                        continue
+                    sc = 0
+                    for term in slot_score_terms(s, wi, day, ts, t, bi, len(b['slots']), existing, self.booth_pref):
+                        sc += self.weights[term]
+                    cands.append((sc, day, ts, bi))
+        return cands, (checked_avail, reject_skill, reject_ng, reject_other, reject_full)
+
+    def best_candidate(self, wi, s, subj):
+        """最高点の候補（同点は走査順で先のもの）→ (day, ts, bi) / None"""
+        cands, _ = self.candidates(wi, s, subj)
+        if not cands:
+            return None
+        best = max(cands, key=lambda c: c[0])
+        return best[1], best[2], best[3]
+
+    def find_slot(self, wi, s, subj):
+        """最高点の候補（同点はランダム）→ ((day, ts, bi), None) / (None, 未配置理由)"""
+        cands, reason = self.candidates(wi, s, subj)
+        if not cands:
+            return None, reason
+        cands.sort(key=lambda x:-x[0])
+        best_sc = cands[0][0]
+        bests = [c for c in cands if c[0]==best_sc]
+        ch = random.choice(bests)
+        return (ch[1], ch[2], ch[3]), None
+
+    def can_place(self, wi, s, subj, day, ts, bi):
+        """(day, ts, bi) に s の subj を置けるか（candidates と同じ条件）"""
+        return self.can_place_time(wi, s, subj, day, ts) and \
+            self.check_booth(wi, day, bi, self.schedule[wi][day][ts][bi], s, subj)
+
+    def can_place_time(self, wi, s, subj, day, ts):
+        """can_place のうちブースによらない条件（曜日・希望時間帯・同じ科目の曜日・同じ時限の配置）"""
+        if day not in self.valid_days[wi] or day in self.placed_days_of(wi, s['name'], subj):
+            return False
+        if not (s['avail'] is None or (day, ts) in s['avail']
+                or (s.get('backup_avail') and (day, ts) in s['backup_avail'])):
+            return False
+        return (day, ts) not in self.slots_of(wi, s['name'])
+
+    # ---- 目的関数（ScheduleScore と同じ lesson_terms の合計） ----
+    def student_week_terms(self, wi, name):
+        s = self.smap.get(name)
+        if s is None:
+            return []
+        ws = self.schedule[wi]
+        lessons = []
+        for day, ts in self.slots_of(wi, name):
+            for bi, b in enumerate(ws[day][ts]):
+                if any(sl[1] == name for sl in b['slots']):
+                    lessons.append((day, ts, bi, b['teacher'], len(b['slots']) - 1))
+                    break
+        return lesson_terms(s, wi, lessons, self.booth_pref)
+
+    def student_week_score(self, wi, name):
+        sc = 0
+        for term in self.student_week_terms(wi, name):
+            sc += self.weights[term]
+        return sc
+
+    def objective(self):
+        return sum(self.student_week_score(wi, name)
+                   for wi in range(self.num_weeks) for name in self.student_slots[wi])
+
+    # ---- 改善 ----
+    def is_primary_slot(self, s, day, ts):
+        return s['avail'] is None or (day, ts) in s['avail']
+
+    def swap_to_primary(self, max_iter=10):
+        """backup スロットにいる生徒を primary スロットの生徒とスワップして遵守率を改善。
+        最大 max_iter 回繰り返し、スワップがゼロになった時点で早期終了。"""
+        for _iter in range(max_iter):
+            total_swaps = 0
+            for wi in range(self.num_weeks):
+                ws = self.schedule[wi]
+                # 配置済みエントリを収集: (day, ts, bi, slot_idx, student, subj)
+                placed = []
+                for day in DAYS:
+                    for ts, booths in ws.get(day, {}).items():
+                        for bi, b in enumerate(booths):
+                            for si, (grade, name, subj) in enumerate(b['slots']):
+                                s = self.smap.get(name)
+                                if s:
+                                    placed.append((day, ts, bi, si, s, subj))
+
+                swapped = set()  # このイテレーションで処理済みのエントリインデックス
+                for i in range(len(placed)):
+                    if i in swapped:
+                        continue
+                    day_a, ts_a, bi_a, si_a, s_a, subj_a = placed[i]
+                    # 固定授業は交換しない
+                    if any((day_a, ts_a) == (fd, ft) for fd, ft, _ in s_a.get('fixed', [])):
+                        continue
+                    # すでに primary なら交換不要
+                    if self.is_primary_slot(s_a, day_a, ts_a):
+                        continue
+
+                    for j in range(len(placed)):
+                        if j == i or j in swapped:
+                            continue
+                        day_b, ts_b, bi_b, si_b, s_b, subj_b = placed[j]
+                        if s_a['name'] == s_b['name']:
+                            continue
+                        # 同一ブース内のエントリは交換しない（同一オブジェクトへの二重pop防止）
+                        if day_a == day_b and ts_a == ts_b and bi_a == bi_b:
+                            continue
+                        # 固定授業は交換しない
+                        if any((day_b, ts_b) == (fd, ft) for fd, ft, _ in s_b.get('fixed', [])):
+                            continue
+
+                        prim_b = self.is_primary_slot(s_b, day_b, ts_b)
+                        new_prim_a = self.is_primary_slot(s_a, day_b, ts_b)
+                        new_prim_b = self.is_primary_slot(s_b, day_a, ts_a)
+                        # prim_a は False（上でチェック済み）
+                        if int(new_prim_a) + int(new_prim_b) <= int(prim_b):
+                            continue  # 合計 primary 数が増えない
+
+                        # 同曜日・同科目重複チェック
+                        if day_b != day_a:
+                            if day_b in self.placed_days_of(wi, s_a['name'], subj_a):
+                                continue
+                            if day_a in self.placed_days_of(wi, s_b['name'], subj_b):
+                                continue
+
+                        # 同一 (day, ts) への重複配置チェック
+                        if (day_b, ts_b) in self.slots_of(wi, s_a['name']):
+                            continue
+                        if (day_a, ts_a) in self.slots_of(wi, s_b['name']):
+                            continue
+
+                        # 一時的に両エントリを取り外してブース制約を確認
+                        slot_a = self._detach(wi, day_a, ts_a, bi_a, si_a)
+                        slot_b = self._detach(wi, day_b, ts_b, bi_b, si_b)
+
+                        ok_a = self.check_booth(wi, day_b, bi_b, ws[day_b][ts_b][bi_b], s_a, subj_a)
+                        ok_b = self.check_booth(wi, day_a, bi_a, ws[day_a][ts_a][bi_a], s_b, subj_b)
+
+                        if ok_a and ok_b:
+                            # スワップ実行
+                            self._attach(wi, day_b, ts_b, bi_b, slot_a, si_b)
+                            self._attach(wi, day_a, ts_a, bi_a, slot_b, si_a)
+                            self._index_remove(wi, s_a['name'], subj_a, day_a, ts_a)
+                            self._index_remove(wi, s_b['name'], subj_b, day_b, ts_b)
+                            self._index_add(wi, s_a['name'], subj_a, day_b, ts_b)
+                            self._index_add(wi, s_b['name'], subj_b, day_a, ts_a)
+                            swapped.add(i)
+                            swapped.add(j)
+                            total_swaps += 1
+                            break
+                        else:
+                            # 元に戻す
+                            self._attach(wi, day_a, ts_a, bi_a, slot_a, si_a)
+                            self._attach(wi, day_b, ts_b, bi_b, slot_b, si_b)
+
+            if total_swaps == 0:
+                break
+
+    # ---- 週ごとの配置 ----
+    def place_week_targets(self, wi, order, dist, mode='greedy', remaining=None):
+        """週 wi に dist[name][subj][wi] コマずつ置く（remaining があればその残り以下）。
+        greedy は order の生徒順に find_slot、それ以外は (生徒, 科目, コマ数) を mode の方式に渡す。
+        → ({(name, subj): 配置数}, {(name, subj): 未配置理由})"""
+        left = lambda s, subj: dist[s['name']][subj][wi] if remaining is None else \
+            min(dist[s['name']][subj][wi], remaining[s['name']].get(subj, 0))
+        if mode != 'greedy':
+            demands = [(s, subj, left(s, subj)) for s in order for subj in s['needs']]
+            place_week = {'heap': self.place_week_heap, 'matching': self.place_week_matching}[mode]
+            return place_week(wi, [d for d in demands if d[2] > 0])
+        placed, reasons = {}, {}
+        for s in order:
+            for subj in s['needs']:
+                key = (s['name'], subj)
+                for _ in range(left(s, subj)):
+                    best, reason = self.find_slot(wi, s, subj)
+                    if not best:
+                        reasons[key] = reason
+                        break
+                    self.place(wi, *best, s, subj)
+                    placed[key] = placed.get(key, 0) + 1
+        return placed, reasons
+
+    # ---- 全体最良優先の配置 ----
+    def place_week_heap(self, wi, demands):
+        """週 wi の (生徒, 科目, コマ数) を、全員の候補を1つの優先度付きキューに入れて配置する。
+        点数の高い候補（同点なら候補の少ない＝制約の強い生徒）から確定し、取り出した候補が古ければ
+        （その曜日か生徒の配置が変わっていれば）その候補だけ評価し直して入れ直す。
+        点数が下がる変化はこの遅延評価で足りるが、連続コマのように上がる変化は取り出し順に反映されない
+        ため、配置した生徒の同じ曜日の候補だけはその場で評価し直して入れる。
+        → ({(name, subj): 配置数}, {(name, subj): 未配置理由})"""
+        seq = itertools.count()
+        heap = []
+        need = {}
+        placed = {}
+        reasons = {}
+        day_ver = {}
+        stu_ver = {}
+        by_student = {}   # name → [(order, 候補数, subj)]
+        for order, (s, subj, n) in enumerate(demands):
+            key = (s['name'], subj)
+            need[key] = need.get(key, 0) + n
+            placed[key] = 0
+            cands, reason = self.candidates(wi, s, subj)
+            if not cands:
+                reasons[key] = reason
+            by_student.setdefault(s['name'], []).append((order, len(cands), subj))
+            for sc, day, ts, bi in cands:
+                heap.append((-sc, len(cands), order, next(seq), day, ts, bi, 0, 0, s, subj))
+        heapq.heapify(heap)
+        ws = self.schedule[wi]
+        while heap:
+            _, n_cands, order, _, day, ts, bi, dv, sv, s, subj = heapq.heappop(heap)
+            key = (s['name'], subj)
+            if placed[key] >= need[key]:
+                continue
+            cur_dv, cur_sv = day_ver.get(day, 0), stu_ver.get(s['name'], 0)
+            if dv != cur_dv or sv != cur_sv:
+                # 古い候補: 置けるままなら点数を付け直して戻す
+                if self.can_place(wi, s, subj, day, ts, bi):
+                    heapq.heappush(heap, (-self.score(wi, s, day, ts, bi), n_cands, order, next(seq),
+                                          day, ts, bi, cur_dv, cur_sv, s, subj))
+                continue
+            self.place(wi, day, ts, bi, s, subj)
+            placed[key] += 1
+            day_ver[day] = cur_dv + 1
+            stu_ver[s['name']] = cur_sv + 1
+            for order2, n2, subj2 in by_student[s['name']]:
+                if placed[(s['name'], subj2)] >= need[(s['name'], subj2)]:
+                    continue
+                for ts2, booths in ws[day].items():
+                    for bi2 in range(len(booths)):
+                        if self.can_place(wi, s, subj2, day, ts2, bi2):
+                            heapq.heappush(heap, (-self.score(wi, s, day, ts2, bi2), n2, order2, next(seq),
+                                                  day, ts2, bi2, cur_dv + 1, cur_sv + 1, s, subj2))
+        for (s, subj, n) in demands:
+            key = (s['name'], subj)
+            if placed[key] < need[key] and key not in reasons:
+                reasons[key] = self.candidates(wi, s, subj)[1]
+        return placed, reasons
+
+    # ---- 時限ごとの最小費用割当による席の詰め直し ----
+    def rematch_timeslot(self, wi, day, ts, extra=()):
+        """(day, ts) の席の割り当てを、コマ × 空席の最小費用割当で解き直す。
+        行はこの時限の固定でないコマ（必ず置く）と extra の (生徒, 科目)（置ければ置く）、
+        列はブースごとに 2 - 固定コマ数の席で、費用は -score。曜日・時限は変えないので連続コマなどの
+        時間の項は変わらず、講師（希望講師・NG講師・指導可否）と同席者だけが入れ替わる。
+        同じブースに NG生徒どうしが当たった分は置ける別のブースへ回し、配置数が増えるか、
+        同数で点数（この時限の生徒の student_week_score の合計）が上がったときだけ採用する。
+        → 新たに置けた (生徒, 科目) のリスト（採用しなければ None）"""
+        own_log = self._log is None
+        if own_log:
+            self._log = []
+        added = self._rematch(wi, day, ts, extra)
+        if own_log:
+            self._log = None
+        return added
+
+    def _rematch(self, wi, day, ts, extra):
+        booths = self.schedule[wi][day][ts]
+        rows = []
+        for bi, b in enumerate(booths):
+            for si in range(len(b['slots']) - 1, -1, -1):
+                g, name, subj = b['slots'][si]
+                s = self.smap.get(name)
+                if s is not None and not self._is_fixed(s, day, ts):
+                    rows.append((s, subj, bi, si))
+        # 空席がなければ元のコマを入れ替えるだけ（差し込むコマは入らない）
+        if not any(b['teacher'] and len(b['slots']) < 2 for b in booths):
+            extra = ()
+        if not rows and not extra:
+            return None
+        names = {b_slot[1] for b in booths for b_slot in b['slots']}
+        before = sum(self.student_week_score(wi, n) for n in names)
+        mark = len(self._log)
+        for s, subj, bi, si in rows:
+            self.unplace(wi, day, ts, bi, si)
+        lessons = [(s, subj, True) for s, subj, _, _ in reversed(rows)]
+        lessons += [(s, subj, False) for s, subj in extra if any(
+            self.can_place(wi, s, subj, day, ts, bi) for bi in range(len(booths)))]
+        seats = [bi for bi, b in enumerate(booths) if b['teacher'] for _ in range(2 - len(b['slots']))]
+        if not seats or len(rows) > len(seats):
+            self._rollback(mark)
+            return None
+        # 行=席, 列=コマ＋「空席のまま」（席ごとに1列）。置けるコマには置く価値を差し引き、
+        # 元からいるコマ（must）はさらに優先する
+        cols = []
+        for s, subj, must in lessons:
+            ok = {bi: -self.score(wi, s, day, ts, bi) - MATCH_PLACE_BONUS * (2 if must else 1)
+                  for bi in set(seats) if self.can_place(wi, s, subj, day, ts, bi)}
+            cols.append(ok)
+        cost = [[c.get(bi, MATCH_FORBIDDEN) for c in cols] + [0] * len(seats) for bi in seats]
+        assign = {}
+        for r, c in enumerate(min_cost_assignment(cost)):
+            if c < len(lessons) and cost[r][c] < MATCH_FORBIDDEN:
+                assign[c] = seats[r]
+        order = sorted(range(len(lessons)), key=lambda c: (not lessons[c][2], c not in assign,
+                                                           cols[c].get(assign.get(c), 0)))
+        added = []
+        for c in order:
+            s, subj, must = lessons[c]
+            if c in assign and self.can_place(wi, s, subj, day, ts, assign[c]):
+                bi = assign[c]
+            else:
+                alt = [(self.score(wi, s, day, ts, bi), -bi) for bi in range(len(booths))
+                       if self.can_place(wi, s, subj, day, ts, bi)]
+                if not alt:
+                    if must:
+                        self._rollback(mark)
+                        return None
+                    continue
+                bi = -max(alt)[1]
+            self.place(wi, day, ts, bi, s, subj)
+            if not must:
+                added.append((s, subj))
+                names.add(s['name'])
+        after = sum(self.student_week_score(wi, n) for n in names)
+        if not added and after <= before:
+            self._rollback(mark)
+            return None
+        return added
+
+    def place_week_matching(self, wi, demands, passes=3):
+        """週 wi の (生徒, 科目, コマ数) を find_slot で順に置いたあと、残ったコマを置ける時限
+        （空席があり、ブースによらない条件で置ける残りコマのある時限）だけ rematch_timeslot で
+        席を詰め直して差し込む（改善がなくなるか passes 回まで）。
+        → ({(name, subj): 配置数}, {(name, subj): 未配置理由})"""
+        need, placed, reasons, smap_ = {}, {}, {}, {}
+        for s, subj, n in demands:
+            key = (s['name'], subj)
+            need[key] = need.get(key, 0) + n
+            placed.setdefault(key, 0)
+            smap_[key] = s
+            for _ in range(n):
+                best, reason = self.find_slot(wi, s, subj)
+                if not best:
+                    if reason:
+                        reasons[key] = reason
+                    break
+                self.place(wi, *best, s, subj)
+                placed[key] += 1
+        ws = self.schedule[wi]
+        slots = sorted(((day, ts) for day in ws for ts in ws[day]), key=lambda k: (_DAY_ORDER[k[0]], k[1]))
+        days = set(ws)
+        for _ in range(passes):
+            # 2回目以降は前回変わった曜日だけ（講師のその日のブースが変わると他の時限の席も変わる）
+            changed = set()
+            pending = [k for k in need if placed[k] < need[k]]
+            for day, ts in slots:
+                if not pending:
+                    break
+                if day not in days:
+                    continue
+                if not any(b['teacher'] and len(b['slots']) < 2 for b in ws[day][ts]):
+                    continue
+                extra = [(smap_[k], k[1]) for k in pending if self.can_place_time(wi, smap_[k], k[1], day, ts)]
+                if not extra:
+                    continue
+                added = self.rematch_timeslot(wi, day, ts, extra)
+                if added is None:
+                    continue
+                changed.add(day)
+                for s, subj in added:
+                    placed[(s['name'], subj)] += 1
+                pending = [k for k in pending if placed[k] < need[k]]
+            if not changed:
+                break
+            days = changed
+        for key in need:
+            if placed[key] >= need[key]:
+                reasons.pop(key, None)
+        return placed, reasons
+
+    # ---- 押し出し連鎖による修復 ----
+    def _eject_targets(self, wi, s, subj):
+        """満席で、空けば s の subj を置ける見込みのあるブース（希望時間帯を先に）"""
+        ws = self.schedule[wi]
+        placed_days = self.placed_days_of(wi, s['name'], subj)
+        existing = self.slots_of(wi, s['name'])
+        out = []
+        for day in DAYS:
+            if day not in self.valid_days[wi] or day in placed_days: continue
+            times = SATURDAY_TIMES if day=='土' else WEEKDAY_TIMES
+            for tl in times:
+                ts = TIME_SHORT[tl]
+                is_primary = s['avail'] is None or (day,ts) in s['avail']
+                if not is_primary and not (s.get('backup_avail') and (day,ts) in s['backup_avail']): continue
+                if (day,ts) in existing or ts not in ws.get(day,{}): continue
+                for bi,b in enumerate(ws[day][ts]):
+                    t = b['teacher']
+                    if not t or len(b['slots']) < 2 or t in s['ng_teachers']: continue
+                    if not self.can_teach(t, s['grade'], subj): continue
+                    out.append((not is_primary, day, ts, bi))
+        out.sort(key=lambda x: x[0])
+        return [x[1:] for x in out]
+
+    def eject_chain(self, wi, s, subj, depth=EJECT_DEPTH, max_nodes=EJECT_MAX_NODES, deadline=None):
+        """満席ブースの生徒を別の空きへ押し出して s の subj を置く。押し出された生徒が置けなければ
+        その生徒についても depth 段まで同じことを繰り返す。置けたら True、だめならスケジュールは元のまま"""
+        # 連鎖の最後は空席に入るので、週に空席がなければ探すまでもない
+        if not any(b['teacher'] and len(b['slots']) < 2
+                   for ds in self.schedule[wi].values() for bs in ds.values() for b in bs):
+            return False
+        own_log = self._log is None
+        if own_log:
+            self._log = []
+        mark = len(self._log)
+        budget = [max_nodes]
+        ok = self._eject(wi, s, subj, depth, {s['name']}, set(), budget, deadline)
+        if not ok:
+            self._rollback(mark)
+        if own_log:
+            self._log = None
+        return ok
+
+    def _eject(self, wi, s, subj, depth, chain, dead, budget, deadline):
+        key = (s['name'], subj, depth)
+        if key in dead:
+            return False
+        ws = self.schedule[wi]
+        for day, ts, bi in self._eject_targets(wi, s, subj):
+            b = ws[day][ts][bi]
+            for si in range(len(b['slots'])):
+                if budget[0] <= 0 or (deadline and time.perf_counter() > deadline):
+                    return False
+                o = self.smap.get(b['slots'][si][1])
+                if o is None or o['name'] in chain or self._is_fixed(o, day, ts):
+                    continue
+                budget[0] -= 1
+                mark = len(self._log)
+                slot = self.unplace(wi, day, ts, bi, si)
+                if self.can_place(wi, s, subj, day, ts, bi):
+                    self.place(wi, day, ts, bi, s, subj)
+                    best = self.best_candidate(wi, o, slot[2])
+                    if best:
+                        self._put(wi, *best, slot)
+                        return True
+                    if depth > 1 and self._eject(wi, o, slot[2], depth - 1, chain | {o['name']}, dead, budget, deadline):
+                        return True
+                self._rollback(mark)
+        # 行き詰まりを記録（同じ連鎖の中で同じ生徒・科目・残り段数を再探索しない）
+        dead.add(key)
+        return False
+
+    def _is_fixed(self, s, day, ts):
+        return any((day, ts) == (fd, ft) for fd, ft, _ in s.get('fixed', []))
+
+    def _try_move(self, wi, booths, rng):
+        """同じ週の別ブースへの移動（移動できなければ None、できれば影響する生徒名）"""
+        src = rng.choice(booths)
+        slots = self.schedule[wi][src[0]][src[1]][src[2]]['slots']
+        if not slots:
+            return None
+        si = rng.randrange(len(slots))
+        s = self.smap.get(slots[si][1])
+        dst = rng.choice(booths)
+        if s is None or dst == src or self._is_fixed(s, src[0], src[1]):
+            return None
+        if len(self.schedule[wi][dst[0]][dst[1]][dst[2]]['slots']) >= 2:
+            return None
+        names = self._names_in(wi, (src, dst))
+        return names, [(src, si, dst, s)]
+
+    def _try_swap(self, wi, booths, rng):
+        """別ブースの2コマの入れ替え"""
+        a, b = rng.choice(booths), rng.choice(booths)
+        sa_slots = self.schedule[wi][a[0]][a[1]][a[2]]['slots']
+        sb_slots = self.schedule[wi][b[0]][b[1]][b[2]]['slots']
+        if a == b or not sa_slots or not sb_slots:
+            return None
+        ia, ib = rng.randrange(len(sa_slots)), rng.randrange(len(sb_slots))
+        s_a, s_b = self.smap.get(sa_slots[ia][1]), self.smap.get(sb_slots[ib][1])
+        if s_a is None or s_b is None or s_a is s_b:
+            return None
+        if self._is_fixed(s_a, a[0], a[1]) or self._is_fixed(s_b, b[0], b[1]):
+            return None
+        return self._names_in(wi, (a, b)), [(a, ia, b, s_a), (b, ib, a, s_b)]
+
+    def _names_in(self, wi, booths):
+        return {sl[1] for day, ts, bi in booths for sl in self.schedule[wi][day][ts][bi]['slots']}
+
+    def _apply_transfers(self, wi, transfers):
+        """(元ブース, si, 先ブース, 生徒) をまとめて適用。1つでも置けなければ False（呼び出し側で巻き戻す）"""
+        slots = []
+        for src, si, dst, s in sorted(transfers, key=lambda t: -t[1]):
+            slots.append((self.unplace(wi, *src, si), dst, s))
+        for slot, dst, s in slots:
+            if not self.can_place(wi, s, slot[2], *dst):
+                return False
+            self._put(wi, *dst, slot)
+        return True
+
+    def anneal(self, seconds, rng=None, t_start=None, t_end=1.0):
+        """焼きなまし法で目的関数を改善する（移動・入れ替えの近傍、制約は candidates と同じ）。
+        seconds 経過で打ち切り、最良解に戻して {'start', 'best', 'iterations', 'accepted', 'curve'} を返す"""
+        rng = rng or random
+        t_start = t_start or max(1.0, max(abs(w) for w in self.weights.values()) / 10)
+        booths = [[(day, ts, bi) for day, ds in ws.items() for ts, bs in ds.items()
+                   for bi, b in enumerate(bs) if b['teacher']] for ws in self.schedule]
+        weeks = [wi for wi in range(self.num_weeks) if len(booths[wi]) >= 2]
+        current = best = start = self.objective()
+        stats = {'start': start, 'best': best, 'iterations': 0, 'accepted': 0, 'curve': [[0.0, start]]}
+        if not weeks or seconds <= 0:
+            return stats
+        self._log = []
+        t0 = time.perf_counter()
+        temp = t_start
+        it = 0
+        while True:
+            it += 1
+            if it % 64 == 0:
+                frac = (time.perf_counter() - t0) / seconds
+                if frac >= 1:
+                    break
+                temp = t_start * (t_end / t_start) ** frac
+            wi = rng.choice(weeks)
+            move = self._try_move(wi, booths[wi], rng) if rng.random() < 0.5 else self._try_swap(wi, booths[wi], rng)
+            if move is None:
+                continue
+            names, transfers = move
+            before = sum(self.student_week_score(wi, n) for n in names)
+            mark = len(self._log)
+            if not self._apply_transfers(wi, transfers):
+                self._rollback(mark)
+                continue
+            delta = sum(self.student_week_score(wi, n) for n in names) - before
+            if delta >= 0 or rng.random() < math.exp(delta / temp):
+                current += delta
+                stats['accepted'] += 1
+                if current > best:
+                    best = current
+                    del self._log[:]
+                    stats['curve'].append([round(time.perf_counter() - t0, 3), best])
+            else:
+                self._rollback(mark)
+        # 最良解まで戻す
+        self._rollback(0)
+        self._log = None
+        stats.update(best=best, iterations=it)
+        return stats
+
+# ========== 配置可能数の事前解析 ==========
+# 他の生徒との取り合いを無視しても置けないコマを、探索の前に見つける。
+# 科目ごとの上限は「その科目を教えられる講師が希望/予備時間帯にいる (週, 曜日) の数」
+# （同じ科目は1日1コマ）。生徒全体の上限は 科目 → (科目, 週, 曜日) → (週, 曜日, 時限) の
+# 最大流（1時限に1コマ）。どちらも満席・NG生徒・講師の1日1ブースは無視した緩和なので、
+# これを超える分は確実に置けない。
+
+def max_flow(cap, source, sink):
+    """cap = {u: {v: 容量}} の最大流（増加路を深さ優先で探す Ford-Fulkerson）。cap は残余容量に書き換わる。
+    ここでの流量は生徒1人の残りコマ数（高々十数）なので、空いた道を最短で見つける深さ優先で足りる"""
+    for u in list(cap):
+        for v in list(cap[u]):
+            cap.setdefault(v, {}).setdefault(u, 0)
+    flow = 0
+    while True:
+        prev = {source: None}
+        stack = [(source, iter(cap[source].items()))]
+        while stack and sink not in prev:
+            u, it = stack[-1]
+            for v, c in it:
+                if c > 0 and v not in prev:
+                    prev[v] = u
+                    stack.append((v, iter(cap[v].items())))
+                    break
+            else:
+                stack.pop()
+        if sink not in prev:
+            return flow
+        path = []
+        v = sink
+        while prev[v] is not None:
+            path.append((prev[v], v))
+            v = prev[v]
+        f = min(cap[u][v] for u, v in path)
+        for u, v in path:
+            cap[u][v] -= f
+            cap[v][u] += f
+        flow += f
+
+def demand_upper_bounds(sch, remaining):
+    """生徒ごとの残りコマの上限。byWeek は科目ごとの週ごとの上限（置ける曜日の数）。
+    → {name: {'bySubject': {subj: 上限}, 'byWeek': {subj: [週ごとの上限]}, 'total': 上限}}"""
+    out = {}
+    for s in sch.smap.values():
+        name = s['name']
+        need = {subj: n for subj, n in remaining.get(name, {}).items() if n > 0}
+        if not need:
+            continue
+        options = {}      # subj → [((wi, day), [(wi, day, ts)])]
+        for subj in need:
+            options[subj] = []
+            for wi, ws in enumerate(sch.schedule):
+                placed_days = sch.placed_days_of(wi, name, subj)
+                existing = sch.slots_of(wi, name)
+                for day in DAYS:
+                    if day not in sch.valid_days[wi] or day in placed_days:
+                        continue
+                    slots = []
+                    for ts, booths in ws.get(day, {}).items():
+                        if not (s['avail'] is None or (day, ts) in s['avail']
+                                or (s.get('backup_avail') and (day, ts) in s['backup_avail'])):
+                            continue
+                        if (day, ts) in existing:
+                            continue
+                        if any(b['teacher'] and b['teacher'] not in s['ng_teachers']
+                               and sch.can_teach(b['teacher'], s['grade'], subj) for b in booths):
+                            slots.append((wi, day, ts))
+                    if slots:
+                        options[subj].append(((wi, day), slots))
+        by_subject = {subj: len(opts) for subj, opts in options.items()}
+        by_week = {subj: [0] * sch.num_weeks for subj in options}
+        for subj, opts in options.items():
+            for (wi, _), _ in opts:
+                by_week[subj][wi] += 1
+        want = {subj: min(need[subj], by_subject[subj]) for subj in need}
+        # まず順に空いた時限へ割り当て、全部入れば上限は科目ごとの上限の和
+        used = set()
+        for subj, opts in options.items():
+            k = 0
+            for _, slots in opts:
+                if k == want[subj]:
+                    break
+                free = next((v for v in slots if v not in used), None)
+                if free is not None:
+                    used.add(free)
+                    k += 1
+            if k < want[subj]:
+                break
+        else:
+            out[name] = {'bySubject': by_subject, 'byWeek': by_week, 'total': sum(want.values())}
+            continue
+        cap = {'src': {subj: n for subj, n in want.items() if n}, 'sink': {}}
+        for subj, opts in options.items():
+            cap[subj] = {}
+            for wd, slots in opts:
+                cap[subj][(subj, wd)] = 1
+                cap[(subj, wd)] = {v: 1 for v in slots}
+                for v in slots:
+                    cap[v] = {'sink': 1}
+        out[name] = {'bySubject': by_subject, 'byWeek': by_week, 'total': max_flow(cap, 'src', 'sink')}
+    return out
+
+def weekly_targets(sch, remaining, bounds, order):
+    """残りコマを週に割り振る。order の順（置き場所の少ない生徒から）に1コマずつ、その科目を置ける曜日が
+    残っている週のうち、その生徒のその科目が少ない週 → その生徒のNG日程が少ない週 → 教室全体の埋まり具合
+    （配置済み / 席数）が低い週の順で選ぶ（同じならランダム）。休塾日・月初月末の部分週で置けない週には
+    割り振らない（NG日程は置けるがペナルティなので、割り振りは避けるだけ）。
+    → {name: {subj: [週ごとのコマ数]}}"""
+    seats = [2 * sum(1 for dd in ws.values() for bs in dd.values() for b in bs if b['teacher'])
+             for ws in sch.schedule]
+    load = [sum(len(b['slots']) for dd in ws.values() for bs in dd.values() for b in bs) for ws in sch.schedule]
+    targets = {}
+    for s in order:
+        name = s['name']
+        targets[name] = {}
+        ng = [sum(1 for day in sch.valid_days[wi] if (wi, day) in s.get('ng_dates', ()))
+              for wi in range(sch.num_weeks)]
+        for subj in s['needs']:
+            t = [0] * sch.num_weeks
+            targets[name][subj] = t
+            caps = bounds.get(name, {}).get('byWeek', {}).get(subj)
+            if not caps:
+                continue
+            tie = [random.random() for _ in t]
+            for _ in range(remaining[name].get(subj, 0)):
+                weeks = [wi for wi in range(len(t)) if t[wi] < caps[wi]]
+                if not weeks:
+                    break
+                wi = min(weeks, key=lambda w: (t[w], ng[w], load[w] / max(seats[w], 1), tie[w]))
+                t[wi] += 1
+                load[wi] += 1
+    return targets
+
+# ========== 厳密解法（任意: ortools） ==========
+# 貪欲法の結果から固定授業以外を CP-SAT のモデルとして解き直す。変数は
+# x[wi, 生徒, 科目, day, ts, bi]（そこに置くか）で、置ける条件（希望/予備時間・NG講師・指導可否・
+# 固定授業の席と NG生徒・講師のその日のブース）を満たす席にだけ作る。制約は find_slot と同じ
+# （必要コマ数・同じ科目は1日1コマ・同じ時限に1コマ・1ブース2人・NG生徒は同席しない・講師は1日1ブース）。
+# 目的は EXACT_PLACE_BONUS×配置数＋lesson_terms の点数の合計（Scheduler.objective と同じ）で、
+# 連続コマ・飛び石は時限の組の AND、同曜日の2コマ目/3コマ目以降と1人ブースは人数の one-hot で表す。
+EXACT_MAX_SECONDS = 60        # 1リクエストで厳密解法に使える上限秒数（gunicorn の timeout 120秒の内側）
+EXACT_PLACE_BONUS = 10 ** 5   # 1コマ置く価値（どの授業の点数の差よりも大きく、配置数を先に最大化する）
+# CP-SAT の探索スレッド数（既定はこのマシンのCPU数）
+EXACT_WORKERS = int(os.environ.get('EXACT_WORKERS', '0') or 0) or (os.cpu_count() or 1)
+
+def _ng_pair(smap, a, b):
+    sa, sb = smap.get(a), smap.get(b)
+    return bool((sa and b in sa.get('ng_students', ())) or (sb and a in sb.get('ng_students', ())))
+
+def solve_exact(sch, remaining, seconds, workers=None):
+    """sch（配置済みの Scheduler）の固定授業以外を CP-SAT で解き直す。貪欲法の配置をヒント（初期解）に
+    与え、seconds 秒で打ち切る。最適、または貪欲法より良い解が見つかったときだけ sch と remaining を
+    書き換え、それ以外（時間切れで改善なし・ortools 未導入）は貪欲法の結果をそのまま残す。
+    → {'status', 'applied', 'objective', 'bound', 'gap', 'greedy', 'variables', 'seconds'}"""
+    if cp_model is None:
+        return {'status': 'unavailable', 'applied': False}
+    t0 = time.perf_counter()
+    W = sch.weights
+    smap = sch.smap
+    model = cp_model.CpModel()
+    coeffs = {}                       # 目的関数の係数 {変数: 係数}
+    const = 0
+    hint = {}                         # 貪欲法の配置での各変数の値（補助変数も含めて初期解として渡す）
+
+    def add(v, w):
+        nonlocal const
+        if isinstance(v, int):
+            const += v * w
+        elif w:
+            coeffs[v] = coeffs.get(v, 0) + w
+
+    def both(a, b):
+        if isinstance(a, int) or isinstance(b, int):
+            return a * b
+        p = model.NewBoolVar('')
+        model.AddBoolOr([a.Not(), b.Not(), p])
+        model.AddImplication(p, a)
+        model.AddImplication(p, b)
+        hint[p] = hint[a] & hint[b]
+        return p
+
+    def count_is(fixed, vs, ks):
+        """fixed + sum(vs) が k のときに1になる変数 {k: 変数}（vs が空なら定数）"""
+        if not vs:
+            return {k: int(fixed == k) for k in ks}
+        onehot = {k: model.NewBoolVar('') for k in range(fixed, fixed + len(vs) + 1)}
+        model.AddExactlyOne(onehot.values())
+        model.Add(sum(k * v for k, v in onehot.items()) == fixed + sum(vs))
+        n = fixed + sum(hint[v] for v in vs)
+        for k, v in onehot.items():
+            hint[v] = int(k == n)
+        return {k: onehot.get(k, 0) for k in ks}
+
+    # 固定授業はそのまま残し、それ以外の授業を解き直す
+    fixed_occ, fixed_at, fixed_days, fixed_booth, current = {}, set(), set(), {}, set()
+    target = {name: dict(r) for name, r in remaining.items()}
+    for wi, ws in enumerate(sch.schedule):
+        for day, dd in ws.items():
+            for ts, booths in dd.items():
+                for bi, b in enumerate(booths):
+                    for g, name, subj in b['slots']:
+                        s = smap.get(name)
+                        if s is None or sch._is_fixed(s, day, ts):
+                            fixed_occ.setdefault((wi, day, ts, bi), []).append(name)
+                            fixed_at.add((wi, name, day, ts))
+                            fixed_days.add((wi, name, subj, day))
+                            fixed_booth[(wi, day, b['teacher'])] = bi
+                            if s is not None:
+                                for term in slot_score_terms(s, wi, day, ts, b['teacher'], bi, 1, (), sch.booth_pref):
+                                    const += W[term]
+                        else:
+                            current.add((wi, name, subj, day, ts, bi))
+                            target.setdefault(name, {})[subj] = target.get(name, {}).get(subj, 0) + 1
+
+    x = {}
+    for s in smap.values():
+        name = s['name']
+        for subj, n in target.get(name, {}).items():
+            if n <= 0:
+                continue
+            for wi, ws in enumerate(sch.schedule):
+                for day in DAYS:
+                    if day not in sch.valid_days[wi] or (wi, name, subj, day) in fixed_days:
+                        continue
+                    for ts, booths in ws.get(day, {}).items():
+                        if not (s['avail'] is None or (day, ts) in s['avail']
+                                or (s.get('backup_avail') and (day, ts) in s['backup_avail'])):
+                            continue
+                        if (wi, name, day, ts) in fixed_at:
+                            continue
+                        for bi, b in enumerate(booths):
+                            t = b['teacher']
+                            if not t or t in s['ng_teachers'] or not sch.can_teach(t, s['grade'], subj):
+                                continue
+                            if fixed_booth.get((wi, day, t), bi) != bi:
+                                continue
+                            occ = fixed_occ.get((wi, day, ts, bi), ())
+                            if len(occ) >= 2 or any(_ng_pair(smap, name, o) for o in occ):
+                                continue
+                            v = model.NewBoolVar('')
+                            x[(wi, name, subj, day, ts, bi)] = v
+                            hint[v] = int((wi, name, subj, day, ts, bi) in current)
+                            add(v, EXACT_PLACE_BONUS + sum(
+                                W[term] for term in slot_score_terms(s, wi, day, ts, t, bi, 1, (), sch.booth_pref)))
+
+    by_key, by_day_subj, by_slot, by_booth, by_teacher = {}, {}, {}, {}, {}
+    for (wi, name, subj, day, ts, bi), v in x.items():
+        by_key.setdefault((name, subj), []).append(v)
+        by_day_subj.setdefault((wi, name, subj, day), []).append(v)
+        by_slot.setdefault((wi, name, day, ts), []).append(v)
+        by_booth.setdefault((wi, day, ts, bi), {}).setdefault(name, []).append(v)
+        t = sch.schedule[wi][day][ts][bi]['teacher']
+        by_teacher.setdefault((wi, day, t), {}).setdefault(bi, []).append(v)
+    for (name, subj), vs in by_key.items():
+        model.Add(sum(vs) <= target[name][subj])
+    for vs in by_day_subj.values():
+        model.AddAtMostOne(vs)
+    for (wi, day, ts, bi), names in by_booth.items():
+        fixed = len(fixed_occ.get((wi, day, ts, bi), ()))
+        model.Add(sum(v for vs in names.values() for v in vs) <= 2 - fixed)
+        ns = list(names)
+        for i, a in enumerate(ns):
+            for b in ns[i + 1:]:
+                if _ng_pair(smap, a, b):
+                    model.Add(sum(names[a]) + sum(names[b]) <= 1)
+        # 1人だけのブース
+        vs = [v for vs in names.values() for v in vs]
+        add(count_is(fixed, vs, (1,))[1], W['empty_booth'])
+    for (wi, day, ts, bi), occ in fixed_occ.items():
+        if (wi, day, ts, bi) not in by_booth and len(occ) == 1 and occ[0] in smap:
+            const += W['empty_booth']
+    for booths in by_teacher.values():
+        if len(booths) > 1:
+            ys = []
+            for vs in booths.values():
+                y = model.NewBoolVar('')
+                for v in vs:
+                    model.AddImplication(v, y)
+                hint[y] = max(hint[v] for v in vs)
+                ys.append(y)
+            model.AddAtMostOne(ys)
+
+    # 生徒ごとの曜日内の項（連続コマ・飛び石・同曜日の2コマ目/3コマ目以降）
+    occupied = {}
+    for (wi, name, day, ts), vs in by_slot.items():
+        model.AddAtMostOne(vs)
+        if len(vs) == 1:
+            o = vs[0]
+        else:
+            o = model.NewBoolVar('')
+            model.Add(o == sum(vs))
+            hint[o] = sum(hint[v] for v in vs)
+        occupied.setdefault((wi, name, day), {})[ts] = o
+    for wi, name, day, ts in fixed_at:
+        if name in smap:
+            occupied.setdefault((wi, name, day), {})[ts] = 1
+    for (wi, name, day), os_ in occupied.items():
+        times = [TIME_SHORT[tl] for tl in (SATURDAY_TIMES if day == '土' else WEEKDAY_TIMES)]
+        tss = sorted(os_, key=times.index)
+        for i, t1 in enumerate(tss):
+            for t2 in tss[i + 1:]:
+                term = 'continuous_block' if times.index(t2) - times.index(t1) == 1 else 'skip_interval'
+                add(both(os_[t1], os_[t2]), 2 * W[term])
+        fixed = sum(1 for o in os_.values() if isinstance(o, int))
+        vs = [o for o in os_.values() if not isinstance(o, int)]
+        ks = range(2, len(tss) + 1)
+        for k, v in count_is(fixed, vs, ks).items():
+            add(v, k * W['same_day_2nd' if k == 2 else 'same_day_3plus'])
+
+    vars_ = list(coeffs)
+    model.Maximize(cp_model.LinearExpr.WeightedSum(vars_, [coeffs[v] for v in vars_]) + const)
+    for v, h in hint.items():
+        model.AddHint(v, h)
+    greedy = EXACT_PLACE_BONUS * len(current) + sch.objective()
+
+    solver = cp_model.CpSolver()
+    solver.parameters.max_time_in_seconds = max(seconds - (time.perf_counter() - t0), 0.1)
+    solver.parameters.num_workers = workers or EXACT_WORKERS
+    status = solver.Solve(model)
+    stats = {'status': solver.StatusName(status), 'applied': False, 'greedy': greedy,
+             'variables': len(x)}
+    if status in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        value = round(solver.ObjectiveValue())
+        bound = round(solver.BestObjectiveBound())
+        stats.update(objective=value, bound=bound, gap=round((bound - value) / max(abs(value), 1), 6))
+        if value > greedy:
+            for wi, ws in enumerate(sch.schedule):
+                for day, dd in ws.items():
+                    for ts, booths in dd.items():
+                        for bi, b in enumerate(booths):
+                            for si in range(len(b['slots']) - 1, -1, -1):
+                                s = smap.get(b['slots'][si][1])
+                                if s is not None and not sch._is_fixed(s, day, ts):
+                                    sch.unplace(wi, day, ts, bi, si)
+            for name, r in target.items():
+                remaining[name] = dict(r)
+            for (wi, name, subj, day, ts, bi), v in x.items():
+                if solver.BooleanValue(v):
+                    sch.place(wi, day, ts, bi, smap[name], subj)
+                    remaining[name][subj] -= 1
+            stats['applied'] = True
+    stats['seconds'] = round(time.perf_counter() - t0, 3)
+    return stats
+
+def _place_week_job(job):
+    """build_schedule(workers > 1) の1週分の Phase2（希望講師あり → なし）と Phase4 を別プロセスで行う。
+    → (その週のスケジュール, {(name, subj): 配置数}, {(name, subj): 未配置理由})"""
+    ws, students, skills, booth_pref, weights, valid_days, orders, dist, mode, seed = job
+    random.seed(seed)
+    sch = Scheduler([ws], students, skills, booth_pref, weights, [valid_days])
+    placed, reasons = {}, {}
+    for names in orders:
+        p, r = sch.place_week_targets(0, [sch.smap[n] for n in names], dist, mode)
+        for key, n in p.items():
+            placed[key] = placed.get(key, 0) + n
+        reasons.update(r)
+    sch.swap_to_primary()
+    return ws, placed, reasons
+
+def build_schedule(students, weekly_teachers, skills, office_rule, booth_pref, holidays=None, weights=None, week_dates=None, manual_teachers=None, improve_seconds=0, report=None, mode='greedy', exact_seconds=0, workers=0, deadline=None):
+    if mode not in PLACEMENT_MODES:
+        raise ValueError(f'unknown placement mode: {mode}')
     if weights is None:
         weights = dict(DEFAULT_WEIGHTS)
     remaining = {s['name']: dict(s['needs']) for s in students}
-    smap = {s['name']: s for s in students}
     schedule = []
     office_teachers = []
     num_weeks = len(weekly_teachers)
@@ -1662,169 +4416,7 @@ def build_schedule(students, weekly_teachers, skills, office_rule, booth_pref, h
             ws[day] = ds
         schedule.append(ws)
 
-    # ---- 配置インデックス: O(1)ルックアップ用 ----
-    # idx_placed_days[wi][name][subj] = set of days
-    # idx_student_slots[wi][name] = set of (day, ts)
-    # idx_any_days[wi][name] = set of days
-    idx_placed_days = [{} for _ in range(num_weeks)]
-    idx_student_slots = [{} for _ in range(num_weeks)]
-    idx_any_days = [{} for _ in range(num_weeks)]
-
-    def _update_index(wi, name, subj, day, ts):
-        """配置成功時にインデックスを更新"""
-        idx_placed_days[wi].setdefault(name, {}).setdefault(subj, set()).add(day)
-        idx_student_slots[wi].setdefault(name, set()).add((day, ts))
-        idx_any_days[wi].setdefault(name, set()).add(day)
-
-    def get_placed_days(ws_unused, name, subj, wi):
-        return idx_placed_days[wi].get(name, {}).get(subj, set())
-
-    def get_student_slots(ws_unused, name, wi):
-        return idx_student_slots[wi].get(name, set())
-
-    def get_any_placed_days(ws_unused, name, wi):
-        return idx_any_days[wi].get(name, set())
-
-    def get_teacher_booth(ws, day, teacher):
-        for ts, booths in ws.get(day,{}).items():
-            for bi,b in enumerate(booths):
-                if b['teacher']==teacher and b['slots']:
-                    return bi
-        return None
-
-    def check_booth(booth, bi, s, day, subj, ws):
-        t = booth['teacher']
-        if not t or len(booth['slots'])>=2: return False
-        if t in s['ng_teachers']: return False
-        if not can_teach(t, s['grade'], subj, skills): return False
-        # 同一ブース内のNG生徒チェック
-        for g2,sn2,sb2 in booth['slots']:
-            if sn2 in s['ng_students']: return False
-            other = smap.get(sn2)
-            if other and s['name'] in other.get('ng_students',[]): return False
-        # 隣接ブースチェックは廃止（同一ブースのみNGとする要望により）
-        
-        eb = get_teacher_booth(ws, day, t)
-        if eb is not None and eb != bi: return False
-        return True
-
-    def place_student(ws, s, day, ts, subj):
-        if day not in ws or ts not in ws[day]: return False
-        booths = list(enumerate(ws[day][ts]))
-        wish = s.get('wish_teachers', [])
-        if wish:
-            # 希望講師のブースを先に試す
-            wish_first = sorted(booths, key=lambda x: (0 if x[1]['teacher'] in wish else 1))
-            booths = wish_first
-        for bi,b in booths:
-            if check_booth(b, bi, s, day, subj, ws):
-                b['slots'].append((s['grade'],s['name'],subj))
-                return True
-        return False
-
-    def find_slot(ws, s, subj, placed_days, existing, wi, any_placed_days):
-        cands = []
-        checked_avail = False
-        reject_full = 0
-        reject_ng = 0
-        reject_skill = 0
-        reject_other = 0
-        for day in DAYS:
-            if day not in valid_days_per_week[wi]: continue  # 存在しない曜日をスキップ
-            if day in placed_days: continue  # 同一科目の同曜日配置を防止
-            # NG日程チェック: 配置自体は許可するがペナルティ
-            is_ng_date = (wi, day) in s.get('ng_dates', set())
-            
-            times = SATURDAY_TIMES if day=='土' else WEEKDAY_TIMES
-            for tl in times:
-                ts = TIME_SHORT[tl]
-                is_primary = s['avail'] is None or (day,ts) in s['avail']
-                is_backup = (not is_primary) and s.get('backup_avail') and (day,ts) in s['backup_avail']
-                if not is_primary and not is_backup: continue
-                checked_avail = True
-                if (day,ts) in existing: continue
-                if ts not in ws.get(day,{}): continue
-                for bi,b in enumerate(ws[day][ts]):
-                    t = b['teacher']
-                    if not t: continue
-                    if len(b['slots'])>=2:
-                        reject_full += 1
-                        continue
-                    if t in s['ng_teachers']:
-                        reject_ng += 1
-                        continue
-                    if not can_teach(t, s['grade'], subj, skills):
-                        reject_skill += 1
-                        continue
-                    if not check_booth(b, bi, s, day, subj, ws):
-                        reject_other += 1
-                        continue
-                    sc = 0
-                    # NG日程は大きくペナルティ（配置は可能）
-                    if is_ng_date: sc += weights['ng_date']
-                    # 予備時間はペナルティ（希望時間を優先）
-                    if is_backup: sc += weights['backup_time']
-                    # 同曜日に既に別科目が配置されている場合
-                    # 連続コマを強く推奨、飛び石は回避
-                    existing_on_day = [t_ for d_, t_ in existing if d_ == day]
-                    if existing_on_day:
-                        # 現在の時刻のインデックスを取得
-                        try:
-                            # timesは '16:00' 等の形式リスト
-                            # tl は現在ループ中の時刻文字列 ('16:00')
-                            curr_idx = times.index(tl)
-
-                            is_continuous = False
-                            for et_short in existing_on_day:
-                                et_long = TIME_SHORT_REV.get(et_short)
-                                if et_long in times:
-                                    ex_idx = times.index(et_long)
-                                    diff = abs(curr_idx - ex_idx)
-                                    if diff == 1:
-                                        sc += weights['continuous_block']
-                                        is_continuous = True
-                                    elif diff > 1:
-                                        sc += weights['skip_interval']
-                        except ValueError:
-                            pass
-
-                    if day in any_placed_days:
-                        day_count = len(existing_on_day)
-                        if day_count < 2:
-                            sc += weights['same_day_2nd']
-                        else:
-                            sc += weights['same_day_3plus']
-                    if b['teacher'] in s['wish_teachers']: sc += weights['wish_teacher']
-                    if t in booth_pref and booth_pref[t]==bi+1: sc += weights['booth_pref']
-                    if len(b['slots'])==0: sc += weights['empty_booth']
-                    cands.append((sc, day, ts, bi))
-        if not cands:
-            if not checked_avail:
-                reason = '希望時間帯なし'
-            elif reject_skill:
-                reason = '指導可能な講師不在'
-            elif reject_ng:
-                reason = 'NG講師'
-            elif reject_other:
-                reason = 'NG生徒/ブース制約'
-            elif reject_full:
-                reason = 'ブース満席'
-            else:
-                reason = '空きコマなし'
-            return None, reason
-        cands.sort(key=lambda x:-x[0])
-        best_sc = cands[0][0]
-        bests = [c for c in cands if c[0]==best_sc]
-        ch = random.choice(bests)
-        return (ch[1], ch[2], ch[3]), None
-
-    def distribute(total, weeks):
-        if weeks <= 0:
-            return []
-        t = [total//weeks]*weeks
-        for i in range(total%weeks): t[i] += 1
-        random.shuffle(t)
-        return t
+    sch = Scheduler(schedule, students, skills, booth_pref, weights, valid_days_per_week)
 
     # Phase1: 固定授業（必要コマ数を超えても配置する — 固定曜日は全有効週に配置）
     for s in students:
@@ -1832,192 +4424,171 @@ def build_schedule(students, weekly_teachers, skills, office_rule, booth_pref, h
             for wi in range(num_weeks):
                 if day not in valid_days_per_week[wi]: continue  # 存在しない曜日をスキップ
                 if (wi, day) in s.get('ng_dates', set()): continue
-                if place_student(schedule[wi], s, day, ts_str, subj):
+                if sch.place_first(wi, s, day, ts_str, subj):
                     if subj in remaining[s['name']]:
                         remaining[s['name']][subj] -= 1
-                    _update_index(wi, s['name'], subj, day, ts_str)
 
-    # viable_slots: 週wiにおいて生徒sの希望時間帯に担当可能講師がいるスロット数
-    # avail=None(制限なし)は999を返す。制約が多い生徒ほど小さい値になる。
+    # Phase1b: 配置可能数の事前解析（確実に置けない分は探索から外し、理由を付けて未配置にする）
+    bounds = demand_upper_bounds(sch, remaining)
+    impossible = {}    # (name, subj) -> 置けないコマ数
+    infeasible = []
+    for s in students:
+        b = bounds.get(s['name'])
+        if b is None:
+            continue
+        for subj, ub in b['bySubject'].items():
+            excess = remaining[s['name']][subj] - ub
+            if excess > 0:
+                impossible[(s['name'], subj)] = excess
+                remaining[s['name']][subj] -= excess
+                infeasible.append({'grade': s['grade'], 'name': s['name'], 'subject': subj,
+                                   'need': ub + excess, 'max': ub})
+        need = sum(n for n in remaining[s['name']].values() if n > 0)
+        if b['total'] < need:
+            infeasible.append({'grade': s['grade'], 'name': s['name'], 'subject': None,
+                               'need': need, 'max': b['total']})
+    if infeasible:
+        print(f"[build_schedule] {len(infeasible)} demands exceed their upper bound "
+              f"({sum(impossible.values())} lessons removed)", flush=True)
+    if report is not None:
+        report['infeasible'] = infeasible
+
+    # viable_slots: 週wiにおいて生徒sがまだ置ける枠（時限）の数。残りコマのある科目のどれかについて、
+    # その曜日に未配置・その時限が空き・席の空いた担当可能講師のブースがある (day, ts) を数える。
+    # 講師ごとの指導可能科目は生徒ごとに1回だけ（Scheduler の can_teach のメモで）求める。
+    # 制約が多い生徒ほど小さい値になる。
+    teach_subjects = {}   # name -> {講師: その生徒に教えられる科目}
+
     def viable_slots(s, wi):
-        if s['avail'] is None:
-            return 999
-        wt = weekly_teachers[wi] if wi < len(weekly_teachers) else {}
+        name = s['name']
+        subjects = [subj for subj in s['needs'] if remaining[name].get(subj, 0) > 0]
+        teach = teach_subjects.setdefault(name, {})
+        existing = sch.slots_of(wi, name)
         count = 0
-        for day, ts in s['avail']:
-            if day not in valid_days_per_week[wi]: continue  # 存在しない曜日をスキップ
-            for b in wt.get(day, {}).get(ts, []):
-                t = b.get('teacher', '') if isinstance(b, dict) else b
-                if t and t not in s.get('ng_teachers', set()):
-                    if any(can_teach(t, s['grade'], subj, skills) for subj in s['needs']):
+        for day in sch.valid_days[wi]:
+            open_subjects = [subj for subj in subjects if day not in sch.placed_days_of(wi, name, subj)]
+            if not open_subjects:
+                continue
+            for ts, booths in sch.schedule[wi].get(day, {}).items():
+                if (day, ts) in existing or not (s['avail'] is None or (day, ts) in s['avail']
+                                                 or (s.get('backup_avail') and (day, ts) in s['backup_avail'])):
+                    continue
+                for b in booths:
+                    t = b['teacher']
+                    if not t or len(b['slots']) >= 2 or t in s['ng_teachers']:
+                        continue
+                    ok = teach.get(t)
+                    if ok is None:
+                        ok = teach[t] = {subj for subj in s['needs'] if sch.can_teach(t, s['grade'], subj)}
+                    if any(subj in ok for subj in open_subjects):
                         count += 1
                         break
         return count
 
     # Phase2: 通常配置（希望講師ありの生徒を先に全て配置してから、その他の生徒を配置）
-    # 週単位でviable_slots数（担当可能講師のある希望スロット数）が少ない順に配置
+    # 週単位でviable_slots数（まだ置ける枠の数）が少ない順に配置
     all_students = sorted(students, key=lambda s: sum(s['needs'].values()))
     wish_order = [s for s in all_students if s['wish_teachers']]
     no_wish_order = [s for s in all_students if not s['wish_teachers']]
     unplaced_reasons = {}  # (name, subj) -> reason
 
-    def _place_phase2(student_list):
-        # 週ごとの配置数を事前に決定（distribute）
-        dist = {}
-        for s in student_list:
-            dist[s['name']] = {}
-            for subj in s['needs']:
-                still = remaining[s['name']].get(subj, 0)
-                dist[s['name']][subj] = distribute(still, num_weeks) if still > 0 else [0] * num_weeks
+    # 週ごとの配置数を事前に決定（週ごとに置ける曜日の数と教室全体の埋まり具合から。
+    # 配置する順＝希望講師ありの生徒が先、その中で置ける曜日の少ない生徒から）
+    capacity = lambda s: sum(sum(c) for c in bounds.get(s['name'], {}).get('byWeek', {}).values())
+    dist = weekly_targets(sch, remaining, bounds,
+                          sorted(wish_order, key=capacity) + sorted(no_wish_order, key=capacity))
 
+    def _place_phase2(student_list):
         for wi in range(num_weeks):
             # この週において担当可能スロット数が少ない順（最制約優先）にソート
             sorted_list = sorted(student_list, key=lambda s: viable_slots(s, wi))
-            for s in sorted_list:
-                for subj in s['needs']:
-                    n = dist[s['name']][subj][wi]
-                    for _ in range(n):
-                        if remaining[s['name']].get(subj, 0) <= 0:
-                            break
-                        pd = get_placed_days(None, s['name'], subj, wi)
-                        ex = get_student_slots(None, s['name'], wi)
-                        apd = get_any_placed_days(None, s['name'], wi)
-                        best, reason = find_slot(schedule[wi], s, subj, pd, ex, wi, apd)
-                        if best:
-                            day, ts, bi = best
-                            schedule[wi][day][ts][bi]['slots'].append((s['grade'], s['name'], subj))
-                            remaining[s['name']][subj] -= 1
-                            _update_index(wi, s['name'], subj, day, ts)
-                        elif reason:
-                            unplaced_reasons[(s['name'], subj)] = reason
-
-    # Phase2a: 希望講師ありの生徒を先に全て配置
-    _place_phase2(wish_order)
-    # Phase2b: 希望講師なしの生徒を配置
-    _place_phase2(no_wish_order)
-
-    # Phase3: 未配置リトライ（distribute で割り当てられなかった週にも配置を試行）
+            placed, reasons = sch.place_week_targets(wi, sorted_list, dist, mode, remaining)
+            for (name, subj), n in placed.items():
+                remaining[name][subj] -= n
+            unplaced_reasons.update(reasons)
+
+    results = None
+    if workers > 1 and num_weeks > 1:
+        # Phase2+4 を週ごとに別プロセスで（週どうしは remaining でしかつながらず、dist が remaining 以下なので独立）
+        # gunicorn のワーカー（スレッド・DB接続あり）を fork しないよう spawn で起動する
+        jobs = [(schedule[wi], students, skills, booth_pref, weights, valid_days_per_week[wi],
+                 [[s['name'] for s in sorted(group, key=lambda s: viable_slots(s, wi))]
+                  for group in (wish_order, no_wish_order)],
+                 {name: {subj: [n[wi]] for subj, n in d.items()} for name, d in dist.items()},
+                 mode, random.getrandbits(32))
+                for wi in range(num_weeks)]
+        try:
+            with ProcessPoolExecutor(max_workers=min(workers, num_weeks),
+                                     mp_context=multiprocessing.get_context('spawn')) as ex:
+                results = list(ex.map(_place_week_job, jobs))
+        except Exception as e:
+            # プロセスを起動できない・途中で落ちた・ジョブが例外（pickle できない等）
+            # → schedule は未変更なので1プロセスでやり直す
+            print(f"[build_schedule] parallel placement failed ({e!r}), falling back to serial", flush=True)
+    if results is not None:
+        for wi, (ws, placed, reasons) in enumerate(results):
+            schedule[wi] = ws
+            for (name, subj), n in placed.items():
+                remaining[name][subj] -= n
+            unplaced_reasons.update(reasons)
+        sch = Scheduler(schedule, students, skills, booth_pref, weights, valid_days_per_week)
+    else:
+        # Phase2a: 希望講師ありの生徒を先に全て配置
+        _place_phase2(wish_order)
+        # Phase2b: 希望講師なしの生徒を配置
+        _place_phase2(no_wish_order)
+
+    # Phase3: 未配置リトライ（weekly_targets で割り当てられなかった週にも配置を試行）
     for s in wish_order + no_wish_order:
         for subj in s['needs']:
             still = remaining[s['name']].get(subj, 0)
             if still <= 0: continue
             for wi in range(num_weeks):
                 if remaining[s['name']].get(subj, 0) <= 0: break
-                pd = get_placed_days(None, s['name'], subj, wi)
-                ex = get_student_slots(None, s['name'], wi)
-                apd = get_any_placed_days(None, s['name'], wi)
-                best, reason = find_slot(schedule[wi], s, subj, pd, ex, wi, apd)
+                best, reason = sch.find_slot(wi, s, subj)
                 if best:
-                    day, ts, bi = best
-                    schedule[wi][day][ts][bi]['slots'].append((s['grade'],s['name'],subj))
+                    sch.place(wi, *best, s, subj)
                     remaining[s['name']][subj] -= 1
-                    _update_index(wi, s['name'], subj, day, ts)
                 elif reason:
                     unplaced_reasons[(s['name'], subj)] = reason
 
-    # Phase4: スワップ最適化（希望時間帯遵守率向上）
-    # backup スロットにいる生徒を primary スロットの生徒とスワップして遵守率を改善。
-    # 最大 MAX_SWAP_ITER 回繰り返し、スワップがゼロになった時点で早期終了。
-    MAX_SWAP_ITER = 10
-
-    def _is_primary_slot(s, day, ts):
-        return s['avail'] is None or (day, ts) in s['avail']
-
-    def _remove_index_entry(wi, name, subj, day, ts):
-        """配置インデックスから1エントリを削除する"""
-        idx_placed_days[wi].setdefault(name, {}).setdefault(subj, set()).discard(day)
-        idx_student_slots[wi].setdefault(name, set()).discard((day, ts))
-        if not any(d == day for d, _ in idx_student_slots[wi].get(name, set())):
-            idx_any_days[wi].setdefault(name, set()).discard(day)
-
-    for _iter in range(MAX_SWAP_ITER):
-        total_swaps = 0
-        for wi in range(num_weeks):
-            ws = schedule[wi]
-            # 配置済みエントリを収集: (day, ts, bi, slot_idx, student, subj)
-            placed = []
-            for day in DAYS:
-                for ts, booths in ws.get(day, {}).items():
-                    for bi, b in enumerate(booths):
-                        for si, (grade, name, subj) in enumerate(b['slots']):
-                            s = smap.get(name)
-                            if s:
-                                placed.append((day, ts, bi, si, s, subj))
-
-            swapped = set()  # このイテレーションで処理済みのエントリインデックス
-            for i in range(len(placed)):
-                if i in swapped:
-                    continue
-                day_a, ts_a, bi_a, si_a, s_a, subj_a = placed[i]
-                # 固定授業は交換しない
-                if any((day_a, ts_a) == (fd, ft) for fd, ft, _ in s_a.get('fixed', [])):
-                    continue
-                # すでに primary なら交換不要
-                if _is_primary_slot(s_a, day_a, ts_a):
-                    continue
-
-                for j in range(len(placed)):
-                    if j == i or j in swapped:
-                        continue
-                    day_b, ts_b, bi_b, si_b, s_b, subj_b = placed[j]
-                    if s_a['name'] == s_b['name']:
-                        continue
-                    # 同一ブース内のエントリは交換しない（同一オブジェクトへの二重pop防止）
-                    if day_a == day_b and ts_a == ts_b and bi_a == bi_b:
-                        continue
-                    # 固定授業は交換しない
-                    if any((day_b, ts_b) == (fd, ft) for fd, ft, _ in s_b.get('fixed', [])):
-                        continue
-
-                    prim_b = _is_primary_slot(s_b, day_b, ts_b)
-                    new_prim_a = _is_primary_slot(s_a, day_b, ts_b)
-                    new_prim_b = _is_primary_slot(s_b, day_a, ts_a)
-                    # prim_a は False（上でチェック済み）
-                    if int(new_prim_a) + int(new_prim_b) <= int(prim_b):
-                        continue  # 合計 primary 数が増えない
-
-                    # 同曜日・同科目重複チェック
-                    if day_b != day_a:
-                        if day_b in idx_placed_days[wi].get(s_a['name'], {}).get(subj_a, set()):
-                            continue
-                        if day_a in idx_placed_days[wi].get(s_b['name'], {}).get(subj_b, set()):
-                            continue
-
-                    # 同一 (day, ts) への重複配置チェック
-                    if (day_b, ts_b) in idx_student_slots[wi].get(s_a['name'], set()):
-                        continue
-                    if (day_a, ts_a) in idx_student_slots[wi].get(s_b['name'], set()):
-                        continue
-
-                    b_a = ws[day_a][ts_a][bi_a]
-                    b_b = ws[day_b][ts_b][bi_b]
-
-                    # 一時的に両エントリを取り外してブース制約を確認
-                    slot_a = b_a['slots'].pop(si_a)
-                    slot_b = b_b['slots'].pop(si_b)
-
-                    ok_a = check_booth(b_b, bi_b, s_a, day_b, subj_a, ws)
-                    ok_b = check_booth(b_a, bi_a, s_b, day_a, subj_b, ws)
-
-                    if ok_a and ok_b:
-                        # スワップ実行
-                        b_b['slots'].insert(si_b, slot_a)
-                        b_a['slots'].insert(si_a, slot_b)
-                        _remove_index_entry(wi, s_a['name'], subj_a, day_a, ts_a)
-                        _remove_index_entry(wi, s_b['name'], subj_b, day_b, ts_b)
-                        _update_index(wi, s_a['name'], subj_a, day_b, ts_b)
-                        _update_index(wi, s_b['name'], subj_b, day_a, ts_a)
-                        swapped.add(i)
-                        swapped.add(j)
-                        total_swaps += 1
-                        break
-                    else:
-                        # 元に戻す
-                        b_a['slots'].insert(si_a, slot_a)
-                        b_b['slots'].insert(si_b, slot_b)
+    # Phase3b: 押し出し連鎖による修復（満席ブースの生徒を別の空きへ移して場所を作る）
+    # deadline（生成リクエスト全体の期限）があれば、Phase3b・4b・5 はその内側に収める
+    left = lambda: float('inf') if deadline is None else deadline - time.perf_counter()
+    eject_deadline = time.perf_counter() + min(EJECT_SECONDS, left())
+    repaired = 0
+    for s in wish_order + no_wish_order:
+        for subj in s['needs']:
+            for wi in range(num_weeks):
+                if remaining[s['name']].get(subj, 0) <= 0 or time.perf_counter() > eject_deadline: break
+                if sch.eject_chain(wi, s, subj, deadline=eject_deadline):
+                    remaining[s['name']][subj] -= 1
+                    repaired += 1
+    if repaired:
+        print(f"[build_schedule] ejection chains placed {repaired} lessons", flush=True)
 
-        if total_swaps == 0:
-            break
+    # Phase4: スワップ最適化（希望時間帯遵守率向上）
+    sch.swap_to_primary()
+
+    # Phase4b: 厳密解法で解き直す（exact_seconds > 0 のときのみ。ortools 未導入・改善なしなら貪欲法の結果のまま）
+    if exact_seconds > 0 and left() > 0:
+        stats = solve_exact(sch, remaining, min(exact_seconds, left()))
+        print(f"[build_schedule] exact {stats['status']} applied={stats['applied']} "
+              f"objective={stats.get('objective')} bound={stats.get('bound')} greedy={stats.get('greedy')}", flush=True)
+        if report is not None:
+            report['exact'] = stats
+
+    # Phase5: 焼きなましによる改善（improve_seconds > 0 のときのみ）
+    if improve_seconds > 0 and left() > 0:
+        stats = sch.anneal(min(improve_seconds, left()))
+        print(f"[build_schedule] anneal {stats['start']} -> {stats['best']} "
+              f"({stats['iterations']} iter, {stats['accepted']} accepted)", flush=True)
+        if report is not None:
+            report['improve'] = stats
+
+    for (name, subj), excess in impossible.items():
+        remaining[name][subj] += excess
+        unplaced_reasons[(name, subj)] = f'配置可能な枠が不足（最大{bounds[name]["bySubject"][subj]}コマ）'
 
     unplaced = []
     for s in students:
@@ -2427,6 +4998,77 @@ def request_entity_too_large(error):
     print(f"[error] 413 Request Entity Too Large", flush=True)
     return jsonify({'error': 'ファイルサイズが上限(10MB)を超えています。ファイルを確認してください。'}), 413
 
+# ========== 静的アセット ==========
+# static/ の app.js・app.css を起動時に内容ハッシュ付きの名前で static/dist/ に書き出し、
+# gzip(brotli導入時は br も)の圧縮済みファイルを並べておく。
+# ファイル名が内容で変わるので、ブラウザには1年間・immutable でキャッシュさせる。
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+STATIC_BUNDLES = ('app.css', 'app.js')
+ASSET_MAX_AGE = 365 * 24 * 3600
+_ASSET_MIMETYPES = {'.css': 'text/css', '.js': 'text/javascript'}
+_assets = {}  # {'app.js': 'app.<hash>.js'}
+
+def build_static_assets(static_dir=None):
+    """ハッシュ付きアセットと .gz/.br を static/dist/ に用意し、論理名→配信名の表を返す"""
+    static_dir = static_dir or STATIC_DIR
+    dist = os.path.join(static_dir, 'dist')
+    os.makedirs(dist, exist_ok=True)
+    manifest = {}
+    for name in STATIC_BUNDLES:
+        with open(os.path.join(static_dir, name), 'rb') as f:
+            data = f.read()
+        stem, ext = os.path.splitext(name)
+        hashed = f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+        variants = {hashed: lambda d: d, hashed + '.gz': lambda d: gzip.compress(d, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants[hashed + '.br'] = lambda d: brotli.compress(d, quality=11)
+        for fname, encode in variants.items():
+            path = os.path.join(dist, fname)
+            if not os.path.exists(path):
+                tmp = f'{path}.{os.getpid()}.tmp'
+                with open(tmp, 'wb') as f:
+                    f.write(encode(data))
+                os.replace(tmp, path)
+        # 古い版は掃除する
+        for old in os.listdir(dist):
+            base = old.removesuffix('.gz').removesuffix('.br')
+            if base != hashed and base.startswith(stem + '.') and base.endswith(ext) and len(base) == len(hashed):
+                os.remove(os.path.join(dist, old))
+        manifest[name] = hashed
+    return manifest
+
+def asset_url(name):
+    """テンプレート用: 論理名からハッシュ付きURLを返す"""
+    return f'/static/dist/{_assets.get(name, name)}'
+
+app.jinja_env.globals['asset_url'] = asset_url
+
+@app.route('/static/dist/<name>')
+@login_required
+def static_asset(name):
+    """ハッシュ付きアセットを圧縮済みファイルから配信する（immutable）"""
+    if name not in _assets.values():
+        return 'Not Found', 404
+    dist = os.path.join(STATIC_DIR, 'dist')
+    accept = request.accept_encodings
+    fname, encoding = name, None
+    if brotli is not None and accept['br'] and os.path.exists(os.path.join(dist, name + '.br')):
+        fname, encoding = name + '.br', 'br'
+    elif accept['gzip'] and os.path.exists(os.path.join(dist, name + '.gz')):
+        fname, encoding = name + '.gz', 'gzip'
+    resp = send_from_directory(dist, fname, mimetype=_ASSET_MIMETYPES[os.path.splitext(name)[1]],
+                               max_age=ASSET_MAX_AGE, etag=True)
+    resp.headers.pop('Content-Disposition', None)
+    if encoding:
+        resp.headers['Content-Encoding'] = encoding
+    resp.vary.add('Accept-Encoding')
+    resp.cache_control.public = False
+    resp.cache_control.private = True  # ログイン後の画面用なので共有キャッシュには置かせない
+    resp.cache_control.immutable = True
+    return resp
+
+_assets.update(build_static_assets())
+
 # ========== API ==========
 @app.route('/')
 @login_required
@@ -2726,6 +5368,7 @@ def consolidate_booth():
 @app.route('/api/generate', methods=['POST'])
 @login_required
 def generate():
+    started = time.perf_counter()
     sd = get_session_data()
     files = sd.get('files',{})
     print(f"[generate] sid={sd.get('_sid','?')}, files_keys={list(files.keys())}", flush=True)
@@ -2743,6 +5386,17 @@ def generate():
     booth_pref_ui = data.get('boothPref', {})
     booth_pref_ui = {k: int(v) for k, v in booth_pref_ui.items() if v}
     manual_teachers = data.get('manualTeachers', [])
+    try:
+        improve_seconds = min(max(float(data.get('improveSeconds') or 0), 0), IMPROVE_MAX_SECONDS)
+    except (TypeError, ValueError):
+        improve_seconds = 0
+    try:
+        exact_seconds = min(max(float(data.get('exactSeconds') or 0), 0), EXACT_MAX_SECONDS)
+    except (TypeError, ValueError):
+        exact_seconds = 0
+    placement_mode = data.get('placementMode') or 'greedy'
+    if placement_mode not in PLACEMENT_MODES:
+        return jsonify({'error': f'配置方式が不正です: {placement_mode}'}), 400
 
     try:
         # メタファイルから講師スキル・ブース希望・生徒データを読み込み
@@ -2816,10 +5470,13 @@ def generate():
         # 学習済み重みをロード
         learned_weights = load_learning_weights()
 
+        build_report = {}
         schedule, unplaced, office_teachers = build_schedule(
             students, wt, skills, office_rule, booth_pref, holidays=holidays,
             weights=learned_weights, week_dates=week_dates,
-            manual_teachers=manual_teachers
+            manual_teachers=manual_teachers, improve_seconds=improve_seconds, report=build_report,
+            mode=placement_mode, exact_seconds=exact_seconds, workers=SCHEDULE_WORKERS,
+            deadline=started + GENERATE_MAX_SECONDS
         )
         placed = sum(len(b['slots']) for w in schedule for d in w.values() for bs in d.values() for b in bs)
 
@@ -2848,14 +5505,18 @@ def generate():
             schedule_json.append(wj)
 
         # 自動生成結果のスナップショットを保存（学習用diff比較のため）
-        original_schedule_json = deepcopy(schedule_json)
-        original_unplaced = deepcopy(unplaced)
+        # deepcopy ではなくコピーオンライト複製（編集された週だけが複製される）
+        compact = CompactSchedule.from_json(schedule_json)
+        compact.source = schedule_json
+        baseline = _make_baseline('generated', compact, unplaced)
 
         sd['result'] = {
-            'schedule': schedule,
+            'schedule': schedule_json,
             'schedule_json': schedule_json,
-            'original_schedule_json': original_schedule_json,
-            'original_unplaced': original_unplaced,
+            '_compact': compact,
+            'original_schedule_json': baseline['schedule'],
+            'original_unplaced': baseline['unplaced'],
+            'baselines': [baseline],
             'unplaced': unplaced,
             'office_teachers': office_teachers,
             'office_rule': office_rule,
@@ -2867,6 +5528,7 @@ def generate():
             'skills': skills,
         }
         save_session_result(sd)
+        score = score_summary(session_score(sd['result']), learned_weights, placed, unplaced)
 
         # 生徒データJSON化（全情報含む）
         students_json = []
@@ -2887,7 +5549,7 @@ def generate():
                 'ng_dates': [list(d) for d in s.get('ng_dates', set())],
             })
 
-        return jsonify({
+        return jsonify(wire_payload({
             'placed': placed,
             'total': total,
             'schedule': schedule_json,
@@ -2898,7 +5560,11 @@ def generate():
             'weekDates': week_dates,
             'weeklyTeachers': _sanitize_weekly_teachers(wt),
             'checkSummary': check_summary,
-        })
+            'score': score,
+            'improve': build_report.get('improve'),
+            'exact': build_report.get('exact'),
+            'infeasible': build_report.get('infeasible', []),
+        }))
     except Exception as e:
         app.logger.error(f'API error: {traceback.format_exc()}')
         return jsonify({'error': '内部エラーが発生しました'}), 500
@@ -2915,9 +5581,7 @@ def _prepare_excel(sd, progress_fn=None):
     _prog(5, 'データを準備中...')
 
     # --- ハッシュキャッシュ: スケジュール未変更ならファイル再生成をスキップ ---
-    sched_hash = hashlib.sha256(
-        json.dumps(res.get('schedule', []), sort_keys=True).encode()
-    ).hexdigest()
+    sched_hash = session_compact(res).digest()
     cached_hash = sd.get('_excel_hash')
     if cached_hash == sched_hash and os.path.exists(output_path):
         _prog(100, '完了')
@@ -2986,7 +5650,7 @@ def download():
                     'unplaced': disk_result.get('unplaced', []),
                     'office_teachers': disk_result.get('office_teachers', []),
                 }
-                save_session_result(sd)
+                save_session_result(sd, keep_history=True)
                 res = sd['result']
     if 'schedule' not in res:
         return jsonify({'error': '先にスケジュールを生成してください'}), 400
@@ -3000,8 +5664,6 @@ def download():
         return jsonify({'error': '内部エラーが発生しました'}), 500
 
 
-import queue as _queue
-
 @app.route('/api/download_stream')
 @login_required
 def download_stream():
@@ -3020,7 +5682,7 @@ def download_stream():
                     'unplaced': disk_result.get('unplaced', []),
                     'office_teachers': disk_result.get('office_teachers', []),
                 }
-                save_session_result(sd)
+                save_session_result(sd, keep_history=True)
                 res = sd['result']
     if 'schedule' not in res:
         def err_gen():
@@ -3241,7 +5903,7 @@ def cloud_save():
             disk_result = _load_result_from_disk(sid)
             if disk_result and 'schedule_json' in disk_result:
                 sd['result'] = disk_result
-                save_session_result(sd)
+                save_session_result(sd, keep_history=True)
                 res = sd['result']
     if 'schedule' not in res and 'schedule_json' not in res:
         return jsonify({'error': 'スケジュールがありません'}), 400
@@ -3303,19 +5965,13 @@ def cloud_save():
 
         print(f"[cloud_save] schedule_only={schedule_only}", flush=True)
 
-        sb_url = f"{SUPABASE_URL}/rest/v1/schedule_snapshots?on_conflict=year,month,label"
-        sb_body = json.dumps(sb_body_dict, ensure_ascii=False).encode('utf-8')
-        sb_hdrs = {
-            'apikey': SUPABASE_SERVICE_KEY,
-            'Authorization': f'Bearer {SUPABASE_SERVICE_KEY}',
-            'Content-Type': 'application/json',
-            'Prefer': 'resolution=merge-duplicates',
-        }
-        sb_req = Request(sb_url, data=sb_body, headers=sb_hdrs, method='POST')
+        if not _storage_enabled():
+            return jsonify({'ok': False, 'error': 'クラウド接続に失敗しました'}), 502
         try:
-            with urlopen(sb_req, timeout=30) as resp:
-                raw = resp.read().decode('utf-8')
-                print(f"[cloud_save] Supabase resp: {resp.status} len={len(raw)}", flush=True)
+            _supabase_request('POST', 'schedule_snapshots', 'on_conflict=year,month,label',
+                              body=sb_body_dict,
+                              headers_extra={'Prefer': 'resolution=merge-duplicates'},
+                              timeout=30, raise_errors=True)
         except HTTPError as he:
             err_body = he.read().decode('utf-8')[:500]
             print(f"[cloud_save] Supabase HTTPError: {he.code} {err_body}", flush=True)
@@ -3357,16 +6013,11 @@ def cloud_load():
 
     try:
         # booth_template は大きいため、専用リクエストで取得 (timeout長め)
-        sb_url = f"{SUPABASE_URL}/rest/v1/schedule_snapshots?id=eq.{snapshot_id}&select=*"
-        sb_hdrs = {
-            'apikey': SUPABASE_SERVICE_KEY,
-            'Authorization': f'Bearer {SUPABASE_SERVICE_KEY}',
-            'Content-Type': 'application/json',
-        }
-        sb_req = Request(sb_url, headers=sb_hdrs, method='GET')
+        if not _storage_enabled():
+            return jsonify({'error': 'クラウド接続に失敗しました'}), 502
         try:
-            with urlopen(sb_req, timeout=30) as resp:
-                rows = json.loads(resp.read().decode('utf-8'))
+            rows = _supabase_request('GET', 'schedule_snapshots', f'id=eq.{snapshot_id}&select=*',
+                                     timeout=30, raise_errors=True)
         except (URLError, HTTPError) as e:
             print(f"[cloud_load] Supabase fetch error: {e}", flush=True)
             return jsonify({'error': 'クラウド接続に失敗しました'}), 502
@@ -3472,7 +6123,7 @@ def cloud_load():
         save_session_files(sd)
 
         # フロントエンドに返却 (generate/restore_json と同じ形式)
-        return jsonify({
+        return jsonify(wire_payload({
             'ok': True,
             'schedule': schedule,
             'unplaced': state.get('unplaced', []),
@@ -3487,7 +6138,7 @@ def cloud_load():
             'total': state.get('total', 0),
             'hasBoothTemplate': has_booth,
             'surveyNameMap': snm,
-        })
+        }))
     except Exception as e:
         app.logger.error(f'API error: {traceback.format_exc()}')
         return jsonify({'error': '内部エラーが発生しました'}), 500
@@ -3735,7 +6386,7 @@ def upload_booth_template():
         month = _sanitize_postgrest_value(month, 'int') if month else 0
     except ValueError:
         year, month = 0, 0
-    if year and month and SUPABASE_URL and SUPABASE_SERVICE_KEY:
+    if year and month and _storage_enabled():
         b64 = _encode_booth_files(sd)
         if b64:
             try:
@@ -4064,7 +6715,7 @@ def load_saved():
     resp = {'ok': True, 'hasBoothTemplate': has_booth_template, **state}
     if weekly_teachers:
         resp['weeklyTeachers'] = _sanitize_weekly_teachers(weekly_teachers)
-    return jsonify(resp)
+    return jsonify(wire_payload(resp))
 
 # ========== メタデータ・講師回答の事後更新 API ==========
 @app.route('/api/update_meta', methods=['POST'])
@@ -4194,30 +6845,209 @@ def update_schedule():
         return jsonify({'error': 'Invalid data'}), 400
 
     sched_json = data['schedule']
-    schedule = []
-    for w in sched_json:
-        wk = {}
-        for day, ds in w.items():
-            dk = {}
-            for ts, booths in ds.items():
-                bk = []
-                for b in booths:
-                    bk.append({'teacher': b['teacher'], 'slots': [tuple(s) for s in b['slots']]})
-                dk[ts] = bk
-            wk[day] = dk
-        schedule.append(wk)
+    unplaced = data.get('unplaced', [])
+    res = sd.get('result', {})
+
+    # 生徒情報が変わらなければセル単位の差分だけをジャーナルに追記
+    students_changed = bool(data.get('students')) and data['students'] != res.get('students')
+    if students_changed or not record_schedule_edit(sd, sched_json, unplaced):
+        res['schedule'] = sched_json
+        res['schedule_json'] = sched_json
+        res['unplaced'] = unplaced
+        if data.get('students'):
+            res['students'] = data['students']
+        sd['result'] = res
+        save_session_result(sd)
+
+    placed = sum(len(b['slots']) for w in res['schedule_json'] for d in w.values() for bs in d.values() for b in bs)
+    return jsonify({'ok': True, 'placed': placed, **journal_status(sd['_sid'])})
+
 
+@app.route('/api/undo', methods=['POST'])
+@login_required
+def undo_schedule():
+    """直前の編集を取り消す"""
+    return _undo_redo_response('undo')
+
+@app.route('/api/redo', methods=['POST'])
+@login_required
+def redo_schedule():
+    """取り消した編集をやり直す"""
+    return _undo_redo_response('redo')
+
+def _undo_redo_response(op):
+    sd = get_session_data()
+    if not undo_redo_session(sd, op):
+        msg = '取り消せる編集がありません' if op == 'undo' else 'やり直せる編集がありません'
+        return jsonify({'error': msg}), 400
+    res = sd['result']
+    placed = sum(len(b['slots']) for w in res['schedule_json'] for d in w.values() for bs in d.values() for b in bs)
+    return jsonify(wire_payload({'ok': True, 'placed': placed, 'schedule': res['schedule_json'],
+                                 'unplaced': res.get('unplaced', []), **journal_status(sd['_sid'])}))
+
+# ========== 週単位スケジュール API ==========
+def _session_schedule_readonly(sd):
+    """表示用にセッションの schedule_json を返す（メモリになければディスクから読むだけ）"""
     res = sd.get('result', {})
-    res['schedule'] = schedule
-    res['schedule_json'] = sched_json
-    res['unplaced'] = data.get('unplaced', [])
-    if data.get('students'):
-        res['students'] = data['students']
-    sd['result'] = res
-    save_session_result(sd)
+    sched = res.get('schedule_json') or res.get('schedule')
+    if sched:
+        return sched, res.get('week_dates')
+    disk_result = _load_result_from_disk(sd['_sid']) or {}
+    return disk_result.get('schedule_json'), disk_result.get('week_dates')
 
-    placed = sum(len(b['slots']) for w in schedule for d in w.values() for bs in d.values() for b in bs)
-    return jsonify({'ok': True, 'placed': placed})
+@app.route('/api/schedule')
+@login_required
+@etag_cached('manifest')
+def schedule_manifest_api():
+    """週ごとの配置数・日付の目録"""
+    sd = get_session_data()
+    sched, week_dates = _session_schedule_readonly(sd)
+    if not sched:
+        return jsonify({'error': 'スケジュールがありません'}), 400
+    return jsonify(schedule_manifest(sched, week_dates))
+
+@app.route('/api/schedule/<int:wi>')
+@login_required
+@etag_cached('week')
+def schedule_week_api(wi):
+    """1週分のスケジュール（schedule は1要素のリスト。X-Schedule-Format: compact 対応）"""
+    sd = get_session_data()
+    sched, _ = _session_schedule_readonly(sd)
+    if not sched:
+        return jsonify({'error': 'スケジュールがありません'}), 400
+    if not 0 <= wi < len(sched):
+        return jsonify({'error': '指定された週はありません'}), 404
+    return jsonify(wire_payload({'wi': wi, 'schedule': [sched[wi]]}))
+
+# ========== 生徒別・講師別 API ==========
+def _session_index_readonly(sd):
+    """表示用の (schedule_json, PlacementIndex)。メモリの結果があれば索引を使い回す"""
+    res = sd.get('result', {})
+    if res.get('schedule_json') or res.get('schedule'):
+        return res.get('schedule_json') or res.get('schedule'), session_index(res)
+    sched, _ = _session_schedule_readonly(sd)
+    return sched, PlacementIndex.from_json(sched) if sched else None
+
+@app.route('/api/student/<path:name>')
+@login_required
+@etag_cached('student')
+def student_calendar_api(name):
+    """生徒1人の全週の配置（週ごとのリスト）と科目別配置数"""
+    sd = get_session_data()
+    sched, idx = _session_index_readonly(sd)
+    if idx is None:
+        return jsonify({'error': 'スケジュールがありません'}), 400
+    known = {s.get('name') for s in sd.get('result', {}).get('students') or []}
+    if name not in idx.students and name not in known:
+        return jsonify({'error': '指定された生徒はいません'}), 404
+    slots = idx.student_placements(name)
+    weeks = [[] for _ in range(idx.num_weeks)]
+    by_subject = {}
+    for p in slots:
+        weeks[p['wi']].append(p)
+        by_subject[p['subj']] = by_subject.get(p['subj'], 0) + 1
+    return jsonify({'name': name, 'weeks': weeks, 'slots': slots,
+                    'placed': len(slots), 'bySubject': by_subject})
+
+@app.route('/api/teacher/<path:name>')
+@login_required
+@etag_cached('teacher')
+def teacher_calendar_api(name):
+    """講師1人の全週の担当ブース（週ごとのリスト）と授業数"""
+    sd = get_session_data()
+    sched, idx = _session_index_readonly(sd)
+    if idx is None:
+        return jsonify({'error': 'スケジュールがありません'}), 400
+    if name not in idx.teachers:
+        return jsonify({'error': '指定された講師の配置はありません'}), 404
+    weeks = [[] for _ in range(idx.num_weeks)]
+    lessons = 0
+    for wi, day, ts, bi in idx.teacher_positions(name):
+        slots = sched[wi][day][ts][bi].get('slots') or []
+        lessons += len(slots)
+        weeks[wi].append({'wi': wi, 'day': day, 'ts': ts, 'bi': bi, 'slots': slots})
+    return jsonify({'name': name, 'weeks': weeks, 'lessons': lessons})
+
+@app.route('/api/suggest', methods=['POST'])
+@login_required
+def suggest_api():
+    """未配置コマ (name, subject) を置ける候補ブースを点数の内訳つきで返す"""
+    sd = get_session_data()
+    data = request.get_json(silent=True) or {}
+    name, subj = data.get('name'), data.get('subject')
+    if not name or not subj:
+        return jsonify({'error': 'name と subject を指定してください'}), 400
+    res = sd.get('result', {})
+    if not (res.get('schedule_json') or res.get('schedule')):
+        res = _load_result_from_disk(sd['_sid']) or {}
+    sched = res.get('schedule_json') or res.get('schedule')
+    if not sched:
+        return jsonify({'error': 'スケジュールがありません'}), 400
+    smap = session_students(res)
+    if name not in smap:
+        return jsonify({'error': '指定された生徒はいません'}), 404
+    try:
+        wi = None if data.get('week') is None else int(data['week'])
+        k = max(1, min(int(data.get('k') or 5), SUGGEST_MAX_K))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'week・k は整数で指定してください'}), 400
+    weeks = None
+    if wi is not None:
+        if not 0 <= wi < len(sched):
+            return jsonify({'error': '指定された週はありません'}), 404
+        weeks = [wi]
+    cands, reason = suggest_slots(session_scheduler(res, load_learning_weights(), weeks), name, subj, weeks=weeks, k=k)
+    return jsonify({'candidates': cands, 'reason': reason})
+
+@app.route('/api/evaluate_move', methods=['POST'])
+@login_required
+def evaluate_move_api():
+    """移動・交換を確定せずに、目的関数の増減と増える/消えるチェック指摘を返す"""
+    sd = get_session_data()
+    data = request.get_json(silent=True) or {}
+    res = sd.get('result', {})
+    if not (res.get('schedule_json') or res.get('schedule')):
+        res = _load_result_from_disk(sd['_sid']) or {}
+    sched = res.get('schedule_json') or res.get('schedule')
+    if not sched:
+        return jsonify({'error': 'スケジュールがありません'}), 400
+    smap = session_students(res)
+    try:
+        changes, placed_delta = move_changes(sched, smap, data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    check_args = (res.get('weekly_teachers') or [], res.get('students') or [],
+                  res.get('skills') or {}, res.get('manual_teachers') or [])
+    result = evaluate_move(sched, smap, changes, res.get('booth_pref') or {}, load_learning_weights(), check_args)
+    result['placedDelta'] = placed_delta
+    return jsonify(result)
+
+@app.route('/api/score')
+@login_required
+def score_api():
+    """現在のスケジュールの目的関数（合計点・項目別の点数と件数）。
+    生成時などのベースラインがあれば ?baseline=番号（既定は0=生成時）との差も返す"""
+    sd = get_session_data()
+    res = sd.get('result', {})
+    if not (res.get('schedule_json') or res.get('schedule')):
+        res = _load_result_from_disk(sd['_sid']) or {}
+    sched = res.get('schedule_json') or res.get('schedule')
+    if not sched:
+        return jsonify({'error': 'スケジュールがありません'}), 400
+    weights = load_learning_weights()
+    placed = sum(len(b['slots']) for w in sched for d in w.values() for bs in d.values() for b in bs)
+    out = score_summary(session_score(res), weights, placed, res.get('unplaced'))
+    history = res.get('baselines') or []
+    bi = request.args.get('baseline', 0, type=int)
+    if 0 <= bi < len(history):
+        b = history[bi]
+        bsched = _as_schedule_json(b['schedule'])
+        bscore = ScheduleScore(PlacementIndex.from_json(bsched), session_students(res), res.get('booth_pref') or {})
+        bplaced = sum(len(x['slots']) for w in bsched for d in w.values() for bs in d.values() for x in bs)
+        base = score_summary(bscore, weights, bplaced, b['unplaced'])
+        out['baseline'] = dict(base, label=b['label'], at=b['at'],
+                               delta=out['score'] - base['score'], placedDelta=placed - bplaced)
+    return jsonify(out)
 
 # ========== スケジュールチェック API ==========
 def _ts_label(ts):
@@ -4437,6 +7267,7 @@ def check_all(schedule, weekly_teachers, office_teachers, students, skills, manu
 
 @app.route('/api/check', methods=['GET'])
 @login_required
+@etag_cached('check')
 def check_schedule():
     """スケジュールの制約違反をチェックする（セッションデータを使用）"""
     sd = get_session_data()
@@ -4697,11 +7528,12 @@ def restore_json():
         'surveyTeacherCount': survey_teacher_count,
         'surveyErrors': survey_errors,
     }
-    return jsonify(resp)
+    return jsonify(wire_payload(resp))
 
 # ========== State persistence API ==========
 @app.route('/api/state')
 @login_required
+@etag_cached('state')
 def get_state():
     """保存済みスケジュール状態を返す（ページリロード時の復元用）"""
     sd = get_session_data()
@@ -4720,14 +7552,14 @@ def get_state():
                 students_raw = load_students_from_wb(meta_wb)
                 meta_wb.close()
                 res['students'] = students_raw
-                save_session_result(sd)
+                save_session_result(sd, keep_history=True)
             except Exception:
                 pass
         # week_dates が空なら週ファイルから補完
         if (not week_dates or not week_dates.get('weeks')) and files.get('week_files'):
             week_dates = extract_week_dates_from_files(files['week_files'])
             res['week_dates'] = week_dates
-            save_session_result(sd)
+            save_session_result(sd, keep_history=True)
 
         students_json = []
         for s in students_raw:
@@ -4749,7 +7581,7 @@ def get_state():
             })
         placed = sum(len(b['slots']) for w in res['schedule_json'] for d in w.values() for bs in d.values() for b in bs)
         total = sum(sum(s.get('needs', {}).values()) for s in students_raw)
-        return jsonify({
+        return jsonify(wire_payload({
             'has_state': True,
             'placed': placed,
             'total': total,
@@ -4759,7 +7591,7 @@ def get_state():
             'boothPref': res.get('booth_pref', {}),
             'students': students_json,
             'weekDates': week_dates or {'year':2026, 'month':3, 'weeks':[]},
-        })
+        }))
 
     # ディスクから復元を試みる
     sid = sd.get('_sid')
@@ -4795,9 +7627,9 @@ def get_state():
                 'weekly_teachers': disk_result.get('weekly_teachers'),
                 'skills': disk_result.get('skills', {}),
             }
-            save_session_result(sd)
+            save_session_result(sd, keep_history=True)
 
-            return jsonify({
+            return jsonify(wire_payload({
                 'has_state': True,
                 'placed': placed,
                 'total': total,
@@ -4807,7 +7639,7 @@ def get_state():
                 'boothPref': disk_result.get('booth_pref', {}),
                 'students': students_json,
                 'weekDates': disk_result.get('week_dates') or {'year':2026, 'month':3, 'weeks':[]},
-            })
+            }))
 
     # Supabaseから復元を試みる（リデプロイ後のフォールバック）
     if sid:
@@ -4846,7 +7678,7 @@ def get_state():
             }
             save_session_result(sd)
 
-            return jsonify({
+            return jsonify(wire_payload({
                 'has_state': True,
                 'placed': placed,
                 'total': total,
@@ -4856,7 +7688,7 @@ def get_state():
                 'boothPref': supa_result.get('booth_pref', {}),
                 'students': students_json,
                 'weekDates': supa_result.get('week_dates') or {'year':2026, 'month':3, 'weeks':[]},
-            })
+            }))
 
     return jsonify({'has_state': False})
 
@@ -4864,18 +7696,31 @@ def get_state():
 @app.route('/api/submit_feedback', methods=['POST'])
 @login_required
 def submit_feedback():
-    """手動編集後のスケジュールと自動生成結果を比較し、学習データを更新"""
+    """手動編集後のスケジュールと自動生成結果を比較し、学習データを更新
+
+    body の baseline にベースライン履歴の番号（0=生成時, -1=直近のフィードバック時）を
+    指定すると、その時点からの編集だけを比較する。
+    """
     sd = get_session_data()
     res = sd.get('result', {})
+    data = request.get_json(silent=True) or {}
     original = res.get('original_schedule_json')
+    orig_unplaced = res.get('original_unplaced', [])
+    history = res.get('baselines') or []
+    if data.get('baseline') is not None and history:
+        try:
+            bl = history[int(data['baseline'])]
+        except (ValueError, TypeError, IndexError):
+            return jsonify({'ok': False, 'error': 'ベースラインが見つかりません', 'changes_count': 0}), 400
+        original, orig_unplaced = bl['schedule'], bl['unplaced']
     edited = res.get('schedule_json')
     if not original or not edited:
         return jsonify({'ok': False, 'error': 'スナップショットがありません', 'changes_count': 0})
 
-    orig_unplaced = res.get('original_unplaced', [])
     edit_unplaced = res.get('unplaced', [])
 
-    changes = compute_schedule_diff(original, edited, orig_unplaced, edit_unplaced)
+    edited_cs = session_compact(res)
+    changes = compute_schedule_diff(original, edited_cs, orig_unplaced, edit_unplaced)
     if not changes:
         return jsonify({'ok': True, 'changes_count': 0, 'summary': {}})
 
@@ -4900,16 +7745,16 @@ def submit_feedback():
         summary[t] = summary.get(t, 0) + 1
 
     # 編集履歴保存
-    placed_before = sum(len(b.get('slots', [])) for w in original for d in w.values()
-                        for bs in d.values() for b in bs)
-    placed_after = sum(len(b.get('slots', [])) for w in edited for d in w.values()
-                       for bs in d.values() for b in bs)
+    placed_before = CompactSchedule.of(original).placed()
+    placed_after = edited_cs.placed()
     save_edit_history({
         'total_changes': len(changes),
         'placed_before': placed_before,
         'placed_after': placed_after,
         'changes': changes,
     })
+    # 次回は今回の状態からの編集だけを比較できるようにベースラインを追加
+    push_baseline(res, 'feedback')
 
     return jsonify({
         'ok': True,
@@ -4917,6 +7762,7 @@ def submit_feedback():
         'summary': summary,
         'weights': new_weights,
         'session_count': stats['session_count'],
+        'baselines': [{'label': b['label'], 'at': b['at']} for b in res['baselines']],
     })
 
 @app.route('/api/learning_stats')
@@ -4938,11 +7784,8 @@ def reset_learning():
     """学習データをリセット"""
     save_learning_weights(dict(DEFAULT_WEIGHTS))
     save_learning_stats({'session_count': 0})
-    # 履歴も全削除
-    rows = _supabase_request('GET', 'schedule_edit_history', 'select=id')
-    if rows:
-        for r in rows:
-            _supabase_request('DELETE', 'schedule_edit_history', f"id=eq.{r['id']}")
+    # 履歴も全削除（1回のDELETEをバックグラウンドで実行）
+    run_in_background(clear_edit_history)
     return jsonify({'ok': True})
 
 # ========== 起動 ==========
@@ -0,0 +1,2340 @@
+function escHtml(s) {
+  if (s == null) return '';
+  return String(s).replace(/&/g,'&amp;').replace(/</g,'&lt;')
+    .replace(/>/g,'&gt;').replace(/"/g,'&quot;').replace(/'/g,'&#39;');
+}
+function toggleHamburger() {
+  const m = document.getElementById('hamburgerMenu');
+  m.classList.toggle('open');
+}
+function toggleStudentBreakdown() {
+  const el = document.getElementById('studentBreakdown');
+  el.style.display = el.style.display === 'none' ? '' : 'none';
+}
+function toggleFileUpdate() {
+  const el = document.getElementById('fileUpdatePanel');
+  el.style.display = el.style.display === 'none' ? '' : 'none';
+}
+document.addEventListener('click', e => {
+  const m = document.getElementById('hamburgerMenu');
+  if (m && m.classList.contains('open') && !e.target.closest('.hamburger-wrap')) m.classList.remove('open');
+});
+const D = ['月', '火', '水', '木', '金', '土'], WT = ['16:00', '17:05', '18:10', '19:15', '20:20'], ST = ['14:55', '16:00', '17:05', '18:10'];
+const TL = ['14:55', '16:00', '17:05', '18:10', '19:15', '20:20'], TS = { '14:55': '14', '16:00': '16', '17:05': '17', '18:10': '18', '19:15': '19', '20:20': '20' }, TSR = { '14': '14:55', '16': '16:00', '17': '17:05', '18': '18:10', '19': '19:15', '20': '20:20' }, BL = ['①', '②', '③', '④', '⑤', '⑥'];
+let OR = { 月: [], 火: [], 水: [], 木: [], 金: [], 土: [] };
+let BP = [], R = null, PW = 0, uploaded = {}, edited = false, dragData = null, calStudent = null, teacherList = [], manualTeachers = [], surveyNameMap = {};
+let ngMap = {}, ngStudentMap = {}, ngDateMap = {};
+function buildNgMap() {
+  ngMap = {}; ngStudentMap = {}; ngDateMap = {};
+  if (!R || !R.students) return;
+  R.students.forEach(s => {
+    ngMap[s.name] = new Set(s.ng_teachers || []);
+    ngStudentMap[s.name] = new Set(s.ng_students || []);
+    const dates = new Set();
+    (s.ng_dates || []).forEach(d => dates.add(d[0] + '_' + d[1]));
+    ngDateMap[s.name] = dates;
+  });
+}
+function isNg(n, t) { return ngMap[n] && ngMap[n].has(t); }
+function isNgDate(n, wi, day) { return ngDateMap[n] && ngDateMap[n].has(wi + '_' + day); }
+function isNgStudent(a, b) { return (ngStudentMap[a] && ngStudentMap[a].has(b)) || (ngStudentMap[b] && ngStudentMap[b].has(a)); }
+function isAdjacentNg(wi, day, ts, bi, sn) { return false; }
+
+// === Compact wire format（X-Schedule-Format: compact の応答を従来形式に展開） ===
+const WIRE = { 'X-Schedule-Format': 'compact' };
+function decodeWireSchedule(p) {
+  const s = p.s, e = p.e;
+  return p.w.map(wk => {
+    if (wk === null) return null;
+    const o = {};
+    for (const day in wk) {
+      const dd = wk[day], od = {};
+      for (const ts in dd) {
+        const c = dd[ts], n = c[0], booths = new Array(n);
+        for (let i = 0; i < n; i++) booths[i] = { teacher: '', slots: [] };
+        for (let j = 1; j < c.length;) {
+          const bi = c[j++], teacher = s[c[j++]], k = c[j++], slots = new Array(k);
+          for (let q = 0; q < k; q++) { const x = c[j++] * 3; slots[q] = [s[e[x]], s[e[x + 1]], s[e[x + 2]]]; }
+          booths[bi] = { teacher, slots };
+        }
+        od[ts] = booths;
+      }
+      o[day] = od;
+    }
+    return o;
+  });
+}
+function decodeWireTeachers(p) {
+  const s = p.s;
+  return p.w.map(wk => { const o = {}; for (const day in wk) { const od = {}; for (const ts in wk[day]) od[ts] = wk[day][ts].map(i => s[i]); o[day] = od; } return o; });
+}
+function decodeWire(d) {
+  if (d && d.schedule && d.schedule.v === 1) d.schedule = decodeWireSchedule(d.schedule);
+  if (d && d.weeklyTeachers && d.weeklyTeachers.v === 1) d.weeklyTeachers = decodeWireTeachers(d.weeklyTeachers);
+  return d;
+}
+
+// === Lazy weeks（X-Schedule-Lazy: 最初の週だけ受け取り、残りは /api/schedule/<wi> で後から取得） ===
+const LAZY = { 'X-Schedule-Lazy': '0' };
+const _weekFetches = {};
+function fillPendingWeeks(d) {
+  d.pendingWeeks = new Set();
+  if (d && Array.isArray(d.schedule)) d.schedule.forEach((w, wi) => { if (w === null) { d.schedule[wi] = {}; d.pendingWeeks.add(wi); } });
+  return d;
+}
+function ensureWeek(wi, target) {
+  const r = target || R;
+  if (!r || !r.pendingWeeks || !r.pendingWeeks.has(wi)) return Promise.resolve();
+  if (!_weekFetches[wi]) {
+    _weekFetches[wi] = fetch('/api/schedule/' + wi, { headers: WIRE })
+      .then(res => res.ok ? res.json() : Promise.reject(new Error('week ' + wi)))
+      .then(d => { decodeWire(d); if (r.pendingWeeks.has(wi)) { r.schedule[wi] = normalizeScheduleKeys(d.schedule)[0]; r.pendingWeeks.delete(wi); } })
+      .finally(() => { delete _weekFetches[wi]; });
+  }
+  return _weekFetches[wi];
+}
+function ensureAllWeeks() {
+  if (!R || !R.pendingWeeks || !R.pendingWeeks.size) return Promise.resolve();
+  return Promise.all([...R.pendingWeeks].map(wi => ensureWeek(wi, R)));
+}
+// 週の読み込み中は生徒カレンダーをサーバーの索引（/api/student/<name>）から表示する
+async function ensureStudentSlots(name) {
+  if (!R || !R.pendingWeeks || !R.pendingWeeks.size || !name) return;
+  R.slotCache = R.slotCache || {};
+  if (R.slotCache[name]) return;
+  const r = R;
+  try {
+    const res = await fetch('/api/student/' + encodeURIComponent(name));
+    if (res.ok) r.slotCache[name] = (await res.json()).slots;
+  } catch (e) { console.warn('Student calendar fetch failed:', e); }
+}
+function startLoadingWeeks() {
+  const r = R;
+  ensureAllWeeks().then(() => { if (R === r && document.getElementById('wTabs')) rR(); }).catch(e => console.warn('Week load failed:', e));
+}
+
+// === Auto-save/restore ===
+function showSaveIndicator(msg) { const el = document.getElementById('saveIndicator'); el.textContent = msg || '保存しました'; el.classList.add('show'); setTimeout(() => el.classList.remove('show'), 2000); }
+async function cloudSave(label, includeTemplate, scheduleOnly) { if (!R || !R.schedule) return; try { const body = { label: label || 'latest' }; if (includeTemplate) body.include_template = true; if (scheduleOnly) body.schedule_only = true; await fetch('/api/cloud_save', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify(body) }); } catch (e) { console.warn('Cloud save failed:', e); } }
+async function autoSave() { if (!R || !edited) return; try { await ensureAllWeeks(); await fetch('/api/update_schedule', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ schedule: R.schedule, unplaced: R.unplaced, students: R.students }) }); showSaveIndicator('自動保存しました'); cloudSave('latest', false, true).catch(() => {}); } catch (e) { } }
+let autoSaveTimer = null;
+function scheduleAutoSave() { if (autoSaveTimer) clearTimeout(autoSaveTimer); autoSaveTimer = setTimeout(autoSave, 3000); }
+// === Undo/Redo（サーバー側の編集ジャーナル） ===
+async function undoRedo(op) { if (!R) return; if (autoSaveTimer) { clearTimeout(autoSaveTimer); autoSaveTimer = null; await autoSave(); } try { const r = await fetch('/api/' + op, { method: 'POST', headers: WIRE }); const d = decodeWire(await r.json()); if (!r.ok) { showSaveIndicator(d.error); return; } R.schedule = d.schedule; R.unplaced = d.unplaced; if (R.pendingWeeks) R.pendingWeeks.clear(); rR(); showSaveIndicator(op === 'undo' ? '元に戻しました' : 'やり直しました'); } catch (e) { } }
+document.addEventListener('keydown', e => {
+  if (!(e.ctrlKey || e.metaKey) || e.target.closest('input,textarea,select,[contenteditable]')) return;
+  const k = e.key.toLowerCase();
+  if (k === 'z' && !e.shiftKey) { e.preventDefault(); undoRedo('undo'); }
+  else if (k === 'y' || (k === 'z' && e.shiftKey)) { e.preventDefault(); undoRedo('redo'); }
+});
+
+// === Cloud save/restore ===
+async function loadCloudList() {
+  const list = document.getElementById('cloudList');
+  list.innerHTML = '<span style="color:var(--ink3);font-size:12px">読み込み中...</span>';
+  try {
+    const res = await fetch('/api/cloud_list');
+    const d = await res.json();
+    if (!d.ok || !d.snapshots || d.snapshots.length === 0) {
+      list.innerHTML = '<span style="color:var(--ink3);font-size:12px">保存済みデータなし</span>';
+      return;
+    }
+    list.innerHTML = '';
+    d.snapshots.forEach(snap => {
+      const div = document.createElement('div');
+      div.style.cssText = 'display:flex;align-items:center;gap:8px;padding:6px 0;border-bottom:1px solid #e0e0e0;font-size:12px;flex-wrap:wrap';
+      const dateStr = new Date(snap.updated_at).toLocaleString('ja-JP');
+      const label = snap.label === 'latest' ? '自動保存' : snap.label;
+      div.innerHTML = '<span style="min-width:80px;font-weight:600">' + snap.year + '年' + snap.month + '月</span>'
+        + '<span style="color:var(--ink3)">' + label + '</span>'
+        + '<span style="color:var(--ink3);font-size:11px">' + dateStr + '</span>'
+        + '<button class="btn btn-s" data-id="' + snap.id + '" onclick="loadCloudSnapshot(this.dataset.id)">再開</button>'
+        + '<button style="background:none;border:none;cursor:pointer;color:var(--red);font-size:14px" data-id="' + snap.id + '" onclick="deleteCloudSnapshot(this.dataset.id,this.closest(\'div\'))">✕</button>';
+      list.appendChild(div);
+    });
+  } catch (e) {
+    list.innerHTML = '<span style="color:var(--red);font-size:12px">エラー: ' + e.message + '</span>';
+  }
+}
+
+async function loadCloudSnapshot(id) {
+  showProgress(20, 'クラウドからスケジュールを再開中...', '再開中');
+  try {
+    const res = await fetch('/api/cloud_load', { method: 'POST', headers: { 'Content-Type': 'application/json', ...WIRE, ...LAZY }, body: JSON.stringify({ id }) });
+    const d = fillPendingWeeks(decodeWire(await res.json()));
+    hideProgress();
+    if (res.ok && d.ok) {
+      R = d; PW = 0; edited = false; calStudent = null; buildNgMap(); startLoadingWeeks();
+      if (d.boothPref) BP = Object.entries(d.boothPref).map(([t, b]) => ({ teacher: t, booth: b }));
+      if (d.officeRule) { OR = {}; for (const day of D) OR[day] = d.officeRule[day] || []; }
+      if (d.manualTeachers) manualTeachers = [...d.manualTeachers];
+      if (d.surveyNameMap) surveyNameMap = d.surveyNameMap;
+      if (d.weeklyTeachers && d.weeklyTeachers.length) {
+        const tSet = new Set(teacherList);
+        for (const wk of d.weeklyTeachers)
+          for (const day of Object.values(wk))
+            for (const ts of Object.values(day))
+              (ts || []).forEach(t => tSet.add(t));
+        teacherList = [...tSet].sort();
+      }
+      go('settings');
+      if (d.hasBoothTemplate) {
+        showSaveIndicator('クラウドから再開しました（テンプレート付）');
+      } else {
+        showSaveIndicator('クラウドから再開（テンプレートなし）');
+      }
+    } else { alert(d.error || '再開に失敗しました'); }
+  } catch (e) { hideProgress(); alert('通信エラー: ' + e.message); }
+}
+
+async function deleteCloudSnapshot(id, el) {
+  if (!confirm('この保存データを削除しますか？')) return;
+  try {
+    await fetch('/api/cloud_delete', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ id }) });
+    if (el) el.remove();
+  } catch (e) { alert('削除に失敗しました'); }
+}
+
+async function dlCloudSave() {
+  const label = prompt('保存名（空欄で「最新」）:') || 'latest';
+  try {
+    const res = await fetch('/api/cloud_save', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ label, include_template: true }) });
+    const d = await res.json();
+    if (d.ok) showSaveIndicator('クラウドに保存しました (' + d.year + '年' + d.month + '月)');
+    else alert(d.error || '保存に失敗しました');
+  } catch (e) { alert('通信エラー: ' + e.message); }
+}
+
+async function onLoadSaved(inp) {
+  const f = inp.files[0]; if (!f) return;
+  const row = inp.closest('.upload-row'); row.querySelector('.desc').textContent = '読み込み中...'; row.querySelector('.icon').textContent = '📄';
+  showProgress(20, '保存済みスケジュールを読み込んでいます...', '読み込み中');
+  const fd = new FormData(); fd.append('file', await preloadFile(f));
+  try {
+    const res = await fetch('/api/load_saved', { method: 'POST', headers: WIRE, body: fd }); const d = decodeWire(await res.json());
+    hideProgress();
+    if (res.ok && d.ok) {
+      row.classList.add('done'); row.querySelector('.icon').textContent = '✅';
+      row.querySelector('.desc').textContent = f.name + ' (' + d.placed + '/' + d.total + 'コマ)';
+      R = d; PW = 0; edited = false; calStudent = null; buildNgMap();
+      if (d.boothPref) BP = Object.entries(d.boothPref).map(([t, b]) => ({ teacher: t, booth: b }));
+      // 結果画面に自動遷移せず、ファイル更新セクションを表示
+      const sec = document.getElementById('postRestoreSection');
+      sec.style.display = 'block';
+      let restoreMsg = '✅ スケジュール再開準備完了 (' + d.placed + '/' + d.total + 'コマ)';
+      if (d.hasBoothTemplate === false) {
+        restoreMsg += '\n⚠️ ブース表エクセルが含まれていません。「ブース表エクセル」からフォルダを選択して再アップロードしてください。';
+      }
+      document.getElementById('postRestoreMsg').textContent = restoreMsg;
+      document.getElementById('postRestoreMsg').style.whiteSpace = 'pre-line';
+      // ステータスをリセット
+      document.getElementById('postRestoreMetaStatus').textContent = '';
+      document.getElementById('postRestoreSurveyStatus').textContent = '';
+      document.getElementById('postRestoreMetaInput').value = '';
+      document.getElementById('postRestoreSurveyInput').value = '';
+      sec.scrollIntoView({ behavior: 'smooth', block: 'nearest' });
+    }
+    else { row.querySelector('.icon').textContent = '❌'; row.querySelector('.desc').textContent = d.error || '読み込み失敗'; }
+  }
+  catch (e) { hideProgress(); row.querySelector('.icon').textContent = '❌'; row.querySelector('.desc').textContent = '通信エラー: ' + e.message; }
+}
+let _jsonFile = null, _jsonMetaFile = null, _jsonWeekFiles = [], _jsonSurveyFiles = [];
+function onJsonSelected(inp) {
+  const f = inp.files[0]; if (!f) return;
+  _jsonFile = f;
+  const row = inp.closest('.upload-row');
+  row.classList.add('done'); row.querySelector('.icon').textContent = '✅';
+  row.querySelector('.desc').textContent = f.name;
+  document.getElementById('jsonBoothSection').style.display = 'block';
+}
+function onJsonMetaFile(inp) {
+  const f = inp.files[0]; if (!f) return;
+  _jsonMetaFile = f;
+  const btn = document.getElementById('jsonMetaBtn');
+  btn.textContent = '✅ ' + f.name;
+  btn.style.border = '2px solid var(--green)';
+  _updateJsonBoothStatus();
+}
+function onJsonWeekFolder(inp) {
+  _jsonWeekFiles = filterXlsx(inp.files);
+  const btn = document.getElementById('jsonWeekBtn');
+  if (_jsonWeekFiles.length) {
+    btn.textContent = '✅ ' + _jsonWeekFiles.length + '件の週別ファイル';
+    btn.style.border = '2px solid var(--green)';
+  }
+  _updateJsonBoothStatus();
+}
+function onJsonSurveyFolder(inp) {
+  _jsonSurveyFiles = filterXlsx(inp.files);
+  const btn = document.getElementById('jsonSurveyBtn');
+  if (_jsonSurveyFiles.length) {
+    btn.textContent = '✅ ' + _jsonSurveyFiles.length + '件の講師回答ファイル';
+    btn.style.border = '2px solid var(--green)';
+  }
+  document.getElementById('jsonSurveyStatus').textContent = _jsonSurveyFiles.length ? _jsonSurveyFiles.length + '件選択済み' : '';
+}
+function _updateJsonBoothStatus() {
+  const parts = [];
+  if (_jsonMetaFile) parts.push('メタ: ' + _jsonMetaFile.name);
+  if (_jsonWeekFiles.length) parts.push('週別: ' + _jsonWeekFiles.length + '件');
+  document.getElementById('jsonBoothStatus').textContent = parts.join(' / ') || '';
+  const ready = _jsonMetaFile && _jsonWeekFiles.length;
+  document.getElementById('jsonRestoreBtn').disabled = !ready;
+}
+async function doJsonRestore() {
+  if (!_jsonFile) return;
+  if (!_jsonMetaFile || !_jsonWeekFiles.length) {
+    alert('メタデータ (.xlsx) と週別ブース表フォルダの両方を選択してください。\n生徒データ・配置率の計算に必要です。');
+    return;
+  }
+  const row = document.getElementById('uJson');
+  showProgress(20, 'JSONバックアップから再開中...', '再開中');
+  const fd = new FormData();
+  // Google ドライブストリーム対応: JSONファイルもプリロード
+  try {
+    const buf = await _jsonFile.arrayBuffer();
+    fd.append('file', new File([buf], _jsonFile.name, { type: 'application/json' }));
+  } catch (e) {
+    fd.append('file', _jsonFile);
+  }
+  // メタ + 週ファイルをまとめて booth_files として送信
+  const boothRaw = [];
+  if (_jsonMetaFile) boothRaw.push(_jsonMetaFile);
+  boothRaw.push(..._jsonWeekFiles);
+  if (boothRaw.length > 0) {
+    const { files: loaded, errors } = await preloadFiles(boothRaw);
+    if (errors.length > 0) {
+      console.warn('[doJsonRestore] preload errors:', errors);
+      showUpErr('一部ファイルの読み込みに失敗: ' + errors.join(', ') + '<br><small>Google ドライブから直接選択できない場合は、ローカルにコピーしてから選択してください。</small>');
+    }
+    if (loaded.length === 0) {
+      hideProgress();
+      showUpErr('ブース表ファイルの読み込みに失敗しました。<br><small>Google ドライブのファイルはローカルにコピーしてから選択してください。</small>');
+      return;
+    }
+    for (const lf of loaded) fd.append('booth_files', lf);
+  }
+  // 講師回答ファイル（任意）
+  if (_jsonSurveyFiles.length > 0) {
+    const { files: surveyLoaded, errors: surveyErrors } = await preloadFiles(_jsonSurveyFiles);
+    if (surveyErrors.length > 0) console.warn('[doJsonRestore] survey preload errors:', surveyErrors);
+    for (const sf of surveyLoaded) fd.append('surveys', sf);
+  }
+  try {
+    const res = await fetch('/api/restore_json', { method: 'POST', headers: WIRE, body: fd });
+    const d = decodeWire(await res.json());
+    hideProgress();
+    if (res.ok && d.ok) {
+      row.querySelector('.desc').textContent = _jsonFile.name + ' (' + d.placed + '/' + d.total + 'コマ)';
+      R = d; PW = 0; edited = false; calStudent = null; buildNgMap();
+      if (d.boothPref) BP = Object.entries(d.boothPref).map(([t, b]) => ({ teacher: t, booth: b }));
+      // 設定画面のデータを再開
+      if (d.officeRule) { OR = {}; for (const day of D) OR[day] = d.officeRule[day] || []; }
+      if (d.manualTeachers) manualTeachers = [...d.manualTeachers];
+      // weeklyTeachersからteacherListを構築
+      if (d.weeklyTeachers && d.weeklyTeachers.length) {
+        const tSet = new Set(teacherList);
+        for (const wk of d.weeklyTeachers) for (const day of Object.values(wk)) for (const ts of Object.values(day)) (ts || []).forEach(t => tSet.add(t));
+        teacherList = [...tSet].sort();
+      }
+      go('settings');
+      let msg = 'JSON再開準備完了（' + d.placed + '/' + d.total + 'コマ）— 設定を確認して結果を表示してください';
+      showSaveIndicator(msg);
+    } else {
+      row.querySelector('.icon').textContent = '❌';
+      row.querySelector('.desc').textContent = d.error || '読み込み失敗';
+    }
+  } catch (e) {
+    hideProgress();
+    row.querySelector('.icon').textContent = '❌';
+    row.querySelector('.desc').textContent = '通信エラー: ' + e.message;
+  }
+}
+async function onLoadJson(inp) { onJsonSelected(inp); }
+
+// === Folder upload helper ===
+function filterXlsx(fileList) { return Array.from(fileList).filter(f => f.name.endsWith('.xlsx') && !f.name.startsWith('~$') && !f.name.includes('出力')); }
+async function preloadFile(f) {
+  // Google ドライブストリーム等の仮想ファイルシステム対応:
+  // ファイル内容を事前にメモリに読み込んでから新しいFileオブジェクトを作成
+  const buf = await f.arrayBuffer();
+  return new File([buf], f.name, { type: f.type || 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet' });
+}
+async function preloadFiles(files) {
+  const results = []; const errors = [];
+  for (const f of files) {
+    try { results.push(await preloadFile(f)); }
+    catch (e) { console.warn('[preload] skip:', f.name, e); errors.push(f.name); }
+  }
+  return { files: results, errors };
+}
+async function onFolderSingle(inp, key) {
+  const files = filterXlsx(inp.files); if (!files.length) { showUpErr('フォルダ内に .xlsx ファイルが見つかりません'); return; }
+  const f = files[0];
+  if (key === 'saved') {
+    const row = document.getElementById('uSaved'); row.querySelector('.desc').textContent = '読み込み中...'; row.querySelector('.icon').textContent = '📄';
+    showProgress(20, '保存済みスケジュールを読み込んでいます...', '読み込み中');
+    const fd = new FormData(); fd.append('file', await preloadFile(f));
+    try {
+      const res = await fetch('/api/load_saved', { method: 'POST', headers: WIRE, body: fd }); const d = decodeWire(await res.json()); hideProgress();
+      if (res.ok && d.ok) {
+        row.classList.add('done'); row.querySelector('.icon').textContent = '✅'; row.querySelector('.desc').textContent = f.name + ' (' + d.placed + '/' + d.total + 'コマ)';
+        R = d; PW = 0; edited = false; calStudent = null; buildNgMap(); if (d.boothPref) BP = Object.entries(d.boothPref).map(([t, b]) => ({ teacher: t, booth: b }));
+        const sec = document.getElementById('postRestoreSection'); sec.style.display = 'block';
+        let rmsg2 = '✅ スケジュール再開準備完了 (' + d.placed + '/' + d.total + 'コマ)';
+        if (d.hasBoothTemplate === false) rmsg2 += '\n⚠️ ブース表エクセルが含まれていません。「ブース表エクセル」からフォルダを選択して再アップロードしてください。';
+        document.getElementById('postRestoreMsg').textContent = rmsg2;
+        document.getElementById('postRestoreMsg').style.whiteSpace = 'pre-line';
+        document.getElementById('postRestoreMetaStatus').textContent = ''; document.getElementById('postRestoreSurveyStatus').textContent = '';
+        sec.scrollIntoView({ behavior: 'smooth', block: 'nearest' });
+      }
+      else { row.querySelector('.icon').textContent = '❌'; row.querySelector('.desc').textContent = d.error || '読み込み失敗'; }
+    }
+    catch (e) { hideProgress(); row.querySelector('.icon').textContent = '❌'; row.querySelector('.desc').textContent = '通信エラー'; }
+    return;
+  }
+}
+async function onFolderSurvey(inp) {
+  const files = filterXlsx(inp.files); if (!files.length) { showUpErr('フォルダ内に .xlsx ファイルが見つかりません'); return; }
+  const zone = document.getElementById('surveyZone'); const desc = document.getElementById('surveyDesc'); const flist = document.getElementById('surveyFileList');
+  desc.textContent = files.length + '件のファイルを読み込み中...'; zone.classList.remove('done');
+  showProgress(10, 'ファイルを読み込んでいます...', '講師回答ファイル集約中');
+  const preloaded = await preloadFiles(files);
+  if (!preloaded.files.length) { desc.textContent = 'ファイルの読み込みに失敗しました'; hideProgress(); return; }
+  desc.textContent = preloaded.files.length + '件のファイルをアップロード中...';
+  const fd = new FormData(); preloaded.files.forEach(f => fd.append('surveys', f));
+  try {
+    const res = await fetch('/api/upload_surveys', { method: 'POST', body: fd }); const d = await res.json();
+    if (res.ok && d.ok) {
+      zone.classList.add('done'); desc.textContent = d.teacherCount + '名の講師データを集約（' + d.weeks + '週分）';
+      flist.innerHTML = d.teachers.map(t => '<span class="sf-item">' + escHtml(t) + '</span>').join(''); uploaded.src = true;
+      if (d.surveyNameMap) surveyNameMap = d.surveyNameMap;
+    }
+    else { console.error('[survey] error:', JSON.stringify(d)); desc.textContent = 'エラー: ' + (d.error || '不明'); uploaded.src = false; }
+  }
+  catch (e) { console.error('[survey] exception:', e); desc.textContent = '通信エラー: ' + e.message; uploaded.src = false; }
+  hideProgress(); document.getElementById('toS').disabled = true;
+  if (uploaded.src && uploaded.booth) {
+    const btn = document.getElementById('toS'); btn.textContent = '読み込み中...'; showProgress(30, '講師データを読み込んでいます...', 'データ読み込み中');
+    try { const r = await fetch('/api/teachers'); const d = await r.json(); if (d.teachers) teacherList = d.teachers; if (d.boothPref) BP = Object.entries(d.boothPref).map(([t, b]) => ({ teacher: t, booth: b })); } catch (e) { }
+    hideProgress(); btn.textContent = '次へ: 設定 →';
+  }
+  document.getElementById('toS').disabled = !(uploaded.src && uploaded.booth);
+}
+function onFolderWeeks(inp) {
+  const files = filterXlsx(inp.files); if (!files.length) { showUpErr('フォルダ内に .xlsx ファイルが見つかりません'); return; }
+  consolWeeks = files;
+  document.getElementById('consolWeekZone').classList.add('done');
+  document.getElementById('consolWeekDesc').textContent = files.length + '件のファイルを選択';
+  const flist = document.getElementById('consolWeekList');
+  flist.innerHTML = files.map(f => '<span class="cf-item">' + escHtml(f.name) + '</span>').join('');
+  // フォルダ選択の場合はメタファイルがなくても（後で自動判定されるので）ボタンを有効化する
+  document.getElementById('consolBtn').disabled = !consolWeeks;
+}
+
+// === Survey upload ===
+function checkReady() { const ready = uploaded.src && uploaded.booth; document.getElementById('toS').disabled = !ready; }
+async function onSurveyFiles(inp) {
+  const files = inp.files; if (!files || !files.length) return;
+  const zone = document.getElementById('surveyZone'); const desc = document.getElementById('surveyDesc'); const flist = document.getElementById('surveyFileList');
+  desc.textContent = files.length + '件のファイルを読み込み中...'; zone.classList.remove('done');
+  document.getElementById('upSt').textContent = ''; document.getElementById('upSt').className = 'status';
+  showProgress(10, 'ファイルを読み込んでいます...', '講師回答ファイル集約中');
+  const preloaded = await preloadFiles(Array.from(files));
+  if (!preloaded.files.length) { desc.textContent = 'ファイルの読み込みに失敗しました'; hideProgress(); return; }
+  desc.textContent = preloaded.files.length + '件のファイルをアップロード中...';
+  const fd = new FormData(); preloaded.files.forEach(f => fd.append('surveys', f));
+  try {
+    const res = await fetch('/api/upload_surveys', { method: 'POST', body: fd }); const d = await res.json();
+    if (res.ok && d.ok) {
+      zone.classList.add('done'); desc.textContent = d.teacherCount + '名の講師データを集約（' + d.weeks + '週分）';
+      flist.innerHTML = d.teachers.map(t => '<span class="sf-item">' + escHtml(t) + '</span>').join('');
+      uploaded.src = true;
+      if (d.surveyNameMap) surveyNameMap = d.surveyNameMap;
+      if (d.errors && d.errors.length) { document.getElementById('upSt').textContent = '一部エラー: ' + d.errors.join(', '); document.getElementById('upSt').className = 'status err'; }
+    } else {
+      desc.textContent = 'エラー: ' + (d.error || '不明'); uploaded.src = false;
+      if (d.details) document.getElementById('upSt').innerHTML = d.details.map(e => '<div>' + escHtml(e) + '</div>').join(''); document.getElementById('upSt').className = 'status err';
+    }
+  } catch (e) { desc.textContent = '通信エラー: ' + e.message; uploaded.src = false; }
+  hideProgress();
+  document.getElementById('toS').disabled = true;
+  if (uploaded.src && uploaded.booth) {
+    const btn = document.getElementById('toS'); btn.textContent = '読み込み中...';
+    showProgress(30, '講師データを読み込んでいます...', 'データ読み込み中');
+    try { const r = await fetch('/api/teachers'); const d = await r.json(); if (d.teachers) teacherList = d.teachers; if (d.boothPref) BP = Object.entries(d.boothPref).map(([t, b]) => ({ teacher: t, booth: b })); } catch (e) { }
+    hideProgress(); btn.textContent = '次へ: 設定 →';
+  }
+  document.getElementById('toS').disabled = !(uploaded.src && uploaded.booth);
+}
+
+// === Booth consolidation ===
+let consolMeta = null, consolWeeks = null;
+function onConsolMeta(inp) {
+  const f = inp.files[0]; if (!f) return; consolMeta = f;
+  document.getElementById('consolMetaZone').classList.add('done');
+  document.getElementById('consolMetaDesc').textContent = f.name;
+  document.getElementById('consolBtn').disabled = !(consolMeta && consolWeeks);
+}
+function onConsolWeeks(inp) {
+  const files = inp.files; if (!files || !files.length) return; consolWeeks = files;
+  document.getElementById('consolWeekZone').classList.add('done');
+  document.getElementById('consolWeekDesc').textContent = files.length + '件のファイルを選択';
+  const flist = document.getElementById('consolWeekList');
+  flist.innerHTML = Array.from(files).map(f => '<span class="cf-item">' + escHtml(f.name) + '</span>').join('');
+  document.getElementById('consolBtn').disabled = !(consolMeta && consolWeeks);
+}
+async function doConsolidate() {
+  if (!consolWeeks) return;
+  const btn = document.getElementById('consolBtn'); btn.disabled = true; btn.textContent = '集約中...';
+  document.getElementById('consolResult').innerHTML = ''; document.getElementById('upSt').textContent = ''; document.getElementById('upSt').className = 'status';
+  showProgress(10, 'ファイルを読み込んでいます...', 'ブース表集約中');
+  const fd = new FormData();
+  if (consolMeta) fd.append('meta', await preloadFile(consolMeta));
+  const preloaded = await preloadFiles(Array.from(consolWeeks));
+  for (const f of preloaded.files) fd.append('weeks', f);
+  showProgress(20, 'ブース表を集約しています...', 'ブース表集約中'); startProgressAnim(20, p => 'ファイルを処理しています...');
+  try {
+    const res = await fetch('/api/consolidate_booth', { method: 'POST', body: fd }); const d = await res.json();
+    if (res.ok && d.ok) {
+      document.getElementById('consolResult').innerHTML = '<div class="consol-result">✅ 統合完了: ' + escHtml(d.weekCount) + '週分のシートを統合<br>メタシート: ' + d.metaSheets.map(s => escHtml(s)).join(', ') + (d.removedSheets.length ? ' / 削除: ' + d.removedSheets.map(s => escHtml(s)).join(', ') : '') + '<br>最終シート構成: ' + d.finalSheets.map(s => escHtml(s)).join(', ') + '</div>';
+      uploaded.booth = true;
+      if (d.errors && d.errors.length) { document.getElementById('upSt').textContent = '一部エラー: ' + d.errors.join(', '); document.getElementById('upSt').className = 'status err'; }
+    } else { document.getElementById('upSt').textContent = 'エラー: ' + (d.error || '不明'); document.getElementById('upSt').className = 'status err'; uploaded.booth = false; }
+  } catch (e) { document.getElementById('upSt').textContent = '通信エラー: ' + e.message; document.getElementById('upSt').className = 'status err'; uploaded.booth = false; }
+  hideProgress();
+  btn.disabled = false; btn.textContent = '集約して統合';
+  document.getElementById('toS').disabled = true;
+  if (uploaded.src && uploaded.booth) {
+    const toS = document.getElementById('toS'); toS.textContent = '読み込み中...';
+    showProgress(30, '講師データを読み込んでいます...', 'データ読み込み中');
+    try { const r = await fetch('/api/teachers'); const d = await r.json(); if (d.teachers) teacherList = d.teachers; if (d.boothPref) BP = Object.entries(d.boothPref).map(([t, b]) => ({ teacher: t, booth: b })); } catch (e) { }
+    hideProgress(); toS.textContent = '次へ: 設定 →';
+  }
+  document.getElementById('toS').disabled = !(uploaded.src && uploaded.booth);
+}
+
+function fmtSize(b) { if (b < 1024) return b + 'B'; if (b < 1048576) return (b / 1024).toFixed(1) + 'KB'; return (b / 1048576).toFixed(1) + 'MB'; }
+function showUpErr(detail) { const st = document.getElementById('upSt'); st.className = 'status err'; st.innerHTML = detail; }
+
+function go(step) {
+  document.getElementById('pUpload').style.display = step === 'upload' ? '' : 'none'; document.getElementById('pSettings').style.display = step === 'settings' ? '' : 'none'; document.getElementById('pResult').style.display = step === 'result' ? '' : 'none';
+  for (const [k, id] of [['upload', 'sb1'], ['settings', 'sb2'], ['result', 'sb3']]) document.getElementById(id).className = 'step-btn' + (step === k ? ' active' : ''); if (step === 'settings') buildSettingsUI();
+}
+function buildSettingsUI() {
+  // 再開済みスケジュールがある場合は「結果を表示」ボタンを表示
+  const goBtn = document.getElementById('goResultBtn');
+  if (goBtn) goBtn.style.display = (R && R.schedule && R.schedule.length) ? '' : 'none';
+  const g = document.getElementById('oGrid'); g.innerHTML = '';
+  const opts = [...teacherList];
+  const optSet = new Set(opts);
+  manualTeachers.forEach(t => { if (!optSet.has(t)) { opts.push(t); optSet.add(t); } });
+  for (const d of D) { (OR[d] || []).forEach(c => { if (c && !optSet.has(c)) { opts.push(c); optSet.add(c); } }); }
+  for (const d of D) {
+    const div = document.createElement('div'); div.className = 'si';
+    if (!Array.isArray(OR[d])) OR[d] = OR[d] ? [OR[d]] : [''];
+    let html = '<label>' + d + '曜</label>';
+    OR[d].forEach((c, i) => {
+      const selHtml = opts.map(t => '<option value="' + escHtml(t) + '"' + (t === c ? ' selected' : '') + '>' + escHtml(t) + '</option>').join('');
+      html += '<div style="display:flex;gap:4px;margin-bottom:4px;align-items:center"><span style="font-size:11px;color:var(--ink3);min-width:16px">' + (i + 1) + '.</span><select style="flex:1" onchange="OR[\'' + d + '\'][' + i + ']=this.value"><option value="">-- 選択 --</option>' + selHtml + '</select>' + (OR[d].length > 1 ? '<button type="button" style="background:none;border:none;cursor:pointer;color:var(--red);font-size:14px" onclick="OR[\'' + d + '\'].splice(' + i + ',1);buildSettingsUI()">✕</button>' : '') + '</div>';
+    });
+    html += '<button type="button" style="background:#7c3aed;color:#fff;font-size:11px;padding:3px 8px;border:none;border-radius:4px;cursor:pointer;margin-top:2px" onclick="OR[\'' + d + '\'].push(\'\');buildSettingsUI()">＋ 追加</button>';
+    div.innerHTML = html; g.appendChild(div);
+  } renderBP(); renderManualTeachers();
+}
+function renderBP() {
+  const g = document.getElementById('bpGrid'); g.innerHTML = ''; BP.forEach((bp, i) => {
+    const div = document.createElement('div'); div.className = 'bp-item';
+    div.innerHTML = '<input style="min-width:80px;max-width:100px;padding:5px 8px;border:1px solid var(--border);border-radius:6px;font-size:13px;font-family:inherit;font-weight:600" value="' + escHtml(bp.teacher) + '" onchange="BP[' + i + '].teacher=this.value">'
+      + '<select onchange="BP[' + i + '].booth=parseInt(this.value)||0"><option value="0">なし</option>' + [1, 2, 3, 4, 5, 6].map(n => '<option value="' + n + '"' + (bp.booth === n ? ' selected' : '') + '>' + BL[n - 1] + '</option>').join('') + '</select>'
+      + '<button style="background:none;border:none;cursor:pointer;font-size:16px;color:var(--red)" onclick="BP.splice(' + i + ',1);renderBP()">✕</button>'; g.appendChild(div);
+  });
+}
+function addBP() { BP.push({ teacher: '', booth: 0 }); renderBP(); }
+async function addManualTeacher() {
+  const inp = document.getElementById('manualTeacherInput'); const name = inp.value.trim(); if (!name) return;
+  if (manualTeachers.includes(name)) { inp.value = ''; return; }
+  // サーベイ講師との名前衝突を即時解消
+  if (surveyNameMap[name]) {
+    try {
+      const res = await fetch('/api/resolve_name_conflict', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ name }) });
+      const d = await res.json();
+      if (d.conflict) {
+        // ローカルの weeklyTeachers をリネーム
+        if (R && R.weeklyTeachers) {
+          for (const wk of R.weeklyTeachers) for (const day of Object.values(wk)) for (const ts of Object.keys(day)) { day[ts] = (day[ts] || []).map(t => t === d.oldName ? d.newName : t); }
+        }
+        // teacherList をリネーム
+        const ti = teacherList.indexOf(d.oldName); if (ti >= 0) teacherList[ti] = d.newName;
+        if (!teacherList.includes(d.newName)) teacherList.push(d.newName);
+        // surveyNameMap 更新
+        surveyNameMap[d.newName] = d.fullName; delete surveyNameMap[d.oldName];
+        // BP のリネーム
+        BP.forEach(bp => { if (bp.teacher === d.oldName) bp.teacher = d.newName; });
+        // OR（教室業務ルール）のリネーム
+        for (const day of D) { if (OR[day]) OR[day] = OR[day].map(t => t === d.oldName ? d.newName : t); }
+        console.log(`[name conflict] サーベイ講師「${d.oldName}」→「${d.newName}」(${d.fullName})`);
+      }
+    } catch (e) { console.error('[resolve_name_conflict]', e); }
+  }
+  manualTeachers.push(name);
+  if (!teacherList.includes(name)) teacherList.push(name);
+  inp.value = ''; renderManualTeachers(); renderBP(); buildSettingsUI();
+}
+function removeManualTeacher(i) {
+  const name = manualTeachers[i]; manualTeachers.splice(i, 1);
+  renderManualTeachers(); buildSettingsUI();
+}
+function renderManualTeachers() {
+  const el = document.getElementById('manualTeacherList'); if (!el) return; el.innerHTML = '';
+  manualTeachers.forEach((t, i) => {
+    const tag = document.createElement('span');
+    tag.style.cssText = 'display:inline-flex;align-items:center;gap:4px;padding:4px 10px;background:#e8f5e9;border-radius:16px;font-size:13px;font-weight:500';
+    tag.innerHTML = escHtml(t) + '<button style="background:none;border:none;cursor:pointer;color:var(--red);font-size:14px;padding:0;line-height:1" onclick="removeManualTeacher(' + i + ')">✕</button>';
+    el.appendChild(tag);
+  });
+}
+
+let progTimer = null;
+function showProgress(pct, msg, title) {
+  const root = document.getElementById('modalRoot');
+  root.innerHTML = '<div class="progress-bg"><div class="progress-box"><div class="progress-spinner"></div><div class="progress-title">' + (title || '処理中') + '</div><div class="progress-pct" id="progPct">' + pct + '%</div><div class="progress-bar-wrap"><div class="progress-bar-fill" id="progBar" style="width:' + pct + '%"></div></div><div class="progress-msg" id="progMsg">' + msg + '</div></div></div>';
+}
+function updateProgress(pct, msg) {
+  const bar = document.getElementById('progBar'); if (bar) bar.style.width = pct + '%';
+  const p = document.getElementById('progPct'); if (p) p.textContent = pct + '%';
+  const el = document.getElementById('progMsg'); if (el) el.innerHTML = msg;
+}
+function hideProgress() { if (progTimer) { clearInterval(progTimer); progTimer = null; } document.getElementById('modalRoot').innerHTML = ''; }
+function startProgressAnim(startPct, msgFn) {
+  let pct = startPct || 10;
+  const defaultMsg = p => p < 30 ? 'データを読み込んでいます' : p < 60 ? '講師配置を計算しています' : p < 85 ? '生徒を配置しています' : '最終調整しています';
+  const getMsg = msgFn || defaultMsg;
+  progTimer = setInterval(() => {
+    if (pct < 30) pct += 2; else if (pct < 60) pct += 1.5; else if (pct < 85) pct += 0.8; else if (pct < 95) pct += 0.2;
+    pct = Math.min(pct, 95);
+    updateProgress(Math.round(pct), getMsg(pct));
+  }, 400);
+}
+
+async function gen() {
+  const st = document.getElementById('stTxt'), btn = document.getElementById('genBtn'); btn.disabled = true; btn.innerHTML = '<span class="spinner"></span>生成中...'; st.textContent = ''; st.className = 'status';
+  showProgress(5, 'データを読み込んでいます', 'スケジュール生成中'); startProgressAnim();
+  const bpObj = {}; BP.forEach(bp => { if (bp.teacher && bp.booth) bpObj[bp.teacher] = bp.booth; });
+  try {
+    const res = await fetch('/api/generate', { method: 'POST', headers: { 'Content-Type': 'application/json', ...WIRE, ...LAZY }, body: JSON.stringify({ officeRule: OR, boothPref: bpObj, manualTeachers: manualTeachers, improveSeconds: +document.getElementById('improveSeconds').value }) }); const d = fillPendingWeeks(decodeWire(await res.json()));
+    if (d.error) {
+      hideProgress(); st.textContent = 'エラー: ' + d.error; st.className = 'status err';
+      if (d.error.includes('アップロード') || d.error.includes('不足') || d.error.includes('見つかりません')) { st.textContent += ' ファイルを再アップロードしてください。'; setTimeout(() => go('upload'), 2000); } return;
+    }
+    // 科目単位の枠不足は未配置タブに出る。生徒単位（合計コマ数超過）は未配置タブに行が無いので名前を出す
+    const infSubj = (d.infeasible || []).filter(i => i.subject), infTotal = (d.infeasible || []).filter(i => !i.subject);
+    updateProgress(100, '完了！ ' + d.placed + '/' + d.total + 'コマ配置' + (d.score ? '（評価 ' + d.score.score + '点' + (d.improve ? '、改善 +' + (d.improve.best - d.improve.start) : '') + '）' : '') + (infSubj.length ? ' ／ 枠不足 ' + infSubj.length + '件（未配置タブ参照）' : '') + (infTotal.length ? ' ／ 合計コマ数が枠を超える生徒: ' + infTotal.map(i => i.name + '（' + i.need + '→最大' + i.max + '）').join('、') : ''));
+    await new Promise(r => setTimeout(r, 600));
+    R = d;
+    if (d.checkSummary) R.checkSummary = d.checkSummary;
+    PW = 0; edited = false; calStudent = null; buildNgMap();
+    if (d.boothPref) BP = Object.entries(d.boothPref).map(([t, b]) => ({ teacher: t, booth: b }));
+    hideProgress(); go('result'); rR(); startLoadingWeeks();
+    if (R.checkSummary) showCheckResults(R.checkSummary);
+    cloudSave('latest', true).catch(() => {});
+  } catch (e) { hideProgress(); st.textContent = 'エラー: ' + e.message; st.className = 'status err'; } finally { btn.disabled = false; btn.innerHTML = '🚀 スケジュール生成'; }
+}
+
+/* ---- Step progress helpers ---- */
+const STEP_PENDING_ICON = '<svg viewBox="0 0 20 20" fill="none"><circle cx="10" cy="10" r="8" stroke="#cbd5e1" stroke-width="2"/></svg>';
+const STEP_DONE_ICON = '<svg viewBox="0 0 20 20" fill="none"><circle cx="10" cy="10" r="8" fill="#16a34a"/><path d="M6.5 10.5l2 2 5-5" stroke="#fff" stroke-width="2" stroke-linecap="round" stroke-linejoin="round"/></svg>';
+const STEP_ERROR_ICON = '<svg viewBox="0 0 20 20" fill="none"><circle cx="10" cy="10" r="8" fill="#dc2626"/><path d="M7 7l6 6M13 7l-6 6" stroke="#fff" stroke-width="2" stroke-linecap="round"/></svg>';
+function showStepProgress(title, steps) {
+  const root = document.getElementById('modalRoot');
+  let h = '<div class="progress-bg"><div class="progress-box"><div class="progress-spinner"></div><div class="progress-title">' + title + '</div><div class="step-list" id="stepList">';
+  steps.forEach((s, i) => { h += '<div class="step-item" id="step' + i + '"><div class="step-icon">' + STEP_PENDING_ICON + '</div><span>' + s + '</span></div>'; });
+  h += '</div></div></div>';
+  root.innerHTML = h;
+}
+function setStep(idx, status, label) {
+  const el = document.getElementById('step' + idx); if (!el) return;
+  el.className = 'step-item ' + status;
+  const iconEl = el.querySelector('.step-icon');
+  if (status === 'active') iconEl.innerHTML = '<div class="step-spinner"></div>';
+  else if (status === 'done') iconEl.innerHTML = STEP_DONE_ICON;
+  else if (status === 'error') iconEl.innerHTML = STEP_ERROR_ICON;
+  if (label) el.querySelector('span').textContent = label;
+}
+function finishStepProgress(ok) {
+  const spinner = document.querySelector('#modalRoot .progress-spinner'); if (spinner) spinner.style.display = 'none';
+  const title = document.querySelector('#modalRoot .progress-title');
+  if (title) { title.textContent = ok ? 'ダウンロード完了' : 'エラーが発生しました'; title.style.color = ok ? '#16a34a' : '#dc2626'; }
+  setTimeout(hideProgress, ok ? 1500 : 3000);
+}
+
+async function dlExcel() {
+  const steps = [];
+  if (edited) { steps.push('スケジュールを保存'); steps.push('学習データを送信'); }
+  steps.push('Excelファイルを生成');
+  steps.push('ダウンロード');
+  showStepProgress('ブース表ダウンロード', steps);
+  let si = 0;
+  try {
+    if (edited) {
+      setStep(si, 'active');
+      await ensureAllWeeks(); await fetch('/api/update_schedule', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ schedule: R.schedule, unplaced: R.unplaced }) });
+      setStep(si, 'done'); si++;
+      setStep(si, 'active');
+      try {
+        const fb = await fetch('/api/submit_feedback', { method: 'POST' }).then(r => r.json());
+        if (fb.changes_count > 0) showSaveIndicator('学習データに' + fb.changes_count + '件の変更を記録');
+      } catch (e) { console.warn('学習フィードバック送信失敗:', e); }
+      setStep(si, 'done'); si++;
+    }
+    setStep(si, 'active', 'Excelファイルを生成 (0%)');
+    await new Promise((resolve, reject) => {
+      const es = new EventSource('/api/download_stream');
+      let lastProgress = 0;
+      es.onmessage = (e) => {
+        try {
+          const d = JSON.parse(e.data);
+          if (d.error) { es.close(); reject(new Error(d.error)); return; }
+          if (d.progress !== undefined) { lastProgress = d.progress; setStep(si, 'active', 'Excelファイルを生成 (' + d.progress + '%)'); }
+          if (d.ready) { es.close(); resolve(); }
+        } catch (_) {}
+      };
+      es.onerror = () => {
+        es.close();
+        if (lastProgress >= 10) {
+          // 生成処理開始後の切断 → バックエンドスレッドは継続中、ポーリングでDLを試行
+          setStep(si, 'active', 'Excelファイルを生成 (' + lastProgress + '% - 再接続中...)');
+          let retries = 0;
+          const maxRetries = 12;  // 5秒 × 12 = 60秒
+          const poll = async () => {
+            retries++;
+            try {
+              const r = await fetch('/api/download');
+              if (r.ok) { resolve(); return; }
+            } catch (_) {}
+            if (retries < maxRetries) {
+              setStep(si, 'active', 'Excelファイルを生成 (バックグラウンド生成中... ' + (retries * 5) + '秒)');
+              setTimeout(poll, 5000);
+            } else {
+              reject(new Error('Excel生成がタイムアウトしました。再度お試しください。'));
+            }
+          };
+          setTimeout(poll, 5000);
+        } else {
+          reject(new Error('Excel生成中に接続が切れました'));
+        }
+      };
+    });
+    setStep(si, 'done', 'Excelファイルを生成'); si++;
+    setStep(si, 'active');
+    const res = await fetch('/api/download');
+    if (!res.ok) { const j = await res.json().catch(() => ({})); throw new Error(j.error || 'ダウンロードに失敗しました'); }
+    const blob = await res.blob();
+    const url = URL.createObjectURL(blob);
+    const a = document.createElement('a'); a.href = url; a.download = '時間割_出力.xlsx'; document.body.appendChild(a); a.click(); a.remove(); URL.revokeObjectURL(url);
+    setStep(si, 'done');
+    finishStepProgress(true);
+  } catch (e) {
+    setStep(si, 'error');
+    const title = document.querySelector('#modalRoot .progress-title');
+    if (title) { title.textContent = e.message; title.style.color = '#dc2626'; }
+    const spinner = document.querySelector('#modalRoot .progress-spinner'); if (spinner) spinner.style.display = 'none';
+    setTimeout(hideProgress, 3000);
+  }
+}
+async function dlJson() {
+  if (edited) {
+    await ensureAllWeeks(); await fetch('/api/update_schedule', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ schedule: R.schedule, unplaced: R.unplaced }) });
+  }
+  window.location.href = '/api/download_json';
+}
+
+async function loadLearningStats() {
+  const el = document.getElementById('learningContent');
+  if (!el) return;
+  try {
+    const d = await fetch('/api/learning_stats').then(r => r.json());
+    const wNames = { ng_date:'NG日程', backup_time:'予備時間', continuous_block:'連続コマ',
+      skip_interval:'飛び石', same_day_2nd:'同日2コマ目', same_day_3plus:'同日3コマ+',
+      wish_teacher:'希望講師', booth_pref:'ブース希望', empty_booth:'空きブース' };
+    let h = '<div style="margin-bottom:4px">学習セッション数: <b>' + d.session_count + '</b>' +
+      (d.last_updated ? ' (最終: ' + d.last_updated.slice(0,10) + ')' : '') + '</div>';
+    if (d.session_count > 0) {
+      h += '<table style="width:100%;font-size:11px;border-collapse:collapse"><tr style="background:#e8e8e8"><th style="text-align:left;padding:2px 4px">項目</th><th style="padding:2px 4px">デフォルト</th><th style="padding:2px 4px">現在</th><th style="padding:2px 4px">変化</th></tr>';
+      for (const [k, name] of Object.entries(wNames)) {
+        const def = d.default_weights[k], cur = d.current_weights[k], diff = cur - def;
+        const color = diff > 0 ? '#2e7d32' : diff < 0 ? '#c62828' : '#888';
+        h += '<tr><td style="padding:2px 4px">' + name + '</td><td style="text-align:center;padding:2px 4px">' + def +
+          '</td><td style="text-align:center;padding:2px 4px;font-weight:600">' + cur +
+          '</td><td style="text-align:center;padding:2px 4px;color:' + color + '">' + (diff > 0 ? '+' : '') + diff + '</td></tr>';
+      }
+      h += '</table>';
+      h += '<button onclick="resetLearning()" style="margin-top:6px;font-size:11px;padding:3px 10px;border:1px solid #ccc;border-radius:4px;cursor:pointer;background:#fff">リセット</button>';
+    } else {
+      h += '<div style="color:#888">まだ学習データがありません（3セッション以上で反映開始）</div>';
+    }
+    el.innerHTML = h;
+  } catch (e) { el.innerHTML = '<span style="color:#888">学習データの取得に失敗</span>'; }
+}
+async function resetLearning() {
+  if (!confirm('学習データをリセットしますか？')) return;
+  await fetch('/api/reset_learning', { method: 'POST' });
+  showSaveIndicator('学習データをリセットしました');
+  loadLearningStats();
+}
+const CHECK_STEPS = [
+  { label: '講師出勤・重複チェック', codes: ['E1','E2','E6','E7'] },
+  { label: 'NG講師・NG生徒チェック', codes: ['E3','E4'] },
+  { label: '希望時間・NG日程チェック', codes: ['W1','W2'] },
+  { label: '同日同科目・スキルチェック', codes: ['W3','W4'] },
+  { label: '1日3コマ以上・1コマ空きチェック', codes: ['W7','W8'] },
+];
+
+function showCheckModal() {
+  let overlay = document.getElementById('checkModalOverlay');
+  if (overlay) overlay.remove();
+  overlay = document.createElement('div');
+  overlay.id = 'checkModalOverlay';
+  overlay.className = 'check-modal-overlay';
+  let stepsHtml = '';
+  CHECK_STEPS.forEach((s, i) => {
+    stepsHtml += '<li id="checkStep' + i + '"><span class="step-icon">○</span>' + escHtml(s.label) + '</li>';
+  });
+  overlay.innerHTML = '<div class="check-modal"><h3>🔍 スケジュールチェック</h3>' +
+    '<div class="check-progress-bar"><div class="check-progress-fill" id="checkProgressFill"></div></div>' +
+    '<ul class="check-step-list">' + stepsHtml + '</ul></div>';
+  document.body.appendChild(overlay);
+}
+
+function updateCheckStep(stepIdx) {
+  const fill = document.getElementById('checkProgressFill');
+  if (fill) fill.style.width = ((stepIdx + 1) / CHECK_STEPS.length * 100) + '%';
+  CHECK_STEPS.forEach((_, i) => {
+    const li = document.getElementById('checkStep' + i);
+    if (!li) return;
+    if (i < stepIdx) {
+      li.className = 'done';
+      li.querySelector('.step-icon').textContent = '✓';
+    } else if (i === stepIdx) {
+      li.className = 'active';
+      li.querySelector('.step-icon').innerHTML = '<span class="check-spinner"></span>';
+    } else {
+      li.className = '';
+      li.querySelector('.step-icon').textContent = '○';
+    }
+  });
+}
+
+function completeCheckStep(stepIdx) {
+  const li = document.getElementById('checkStep' + stepIdx);
+  if (li) { li.className = 'done'; li.querySelector('.step-icon').textContent = '✓'; }
+  const fill = document.getElementById('checkProgressFill');
+  if (fill) fill.style.width = ((stepIdx + 1) / CHECK_STEPS.length * 100) + '%';
+}
+
+function closeCheckModal() {
+  const overlay = document.getElementById('checkModalOverlay');
+  if (!overlay) return;
+  const modal = overlay.querySelector('.check-modal');
+  if (modal) modal.style.animation = 'modalSlideOut .25s ease forwards';
+  overlay.style.animation = 'fadeIn .25s ease reverse forwards';
+  setTimeout(() => overlay.remove(), 260);
+}
+function closeCheckPanel() {
+  const p = document.getElementById('checkPanel');
+  if (p) { p.innerHTML = ''; R.checkSummary = null; }
+}
+function toggleCheckPanel() {
+  const list = document.querySelector('#checkPanel .check-list');
+  const icon = document.querySelector('#checkPanel .check-toggle-icon');
+  if (!list) return;
+  const hidden = list.style.display === 'none';
+  list.style.display = hidden ? '' : 'none';
+  if (icon) icon.classList.toggle('collapsed', !hidden);
+}
+function navigateToCell(wi, day, ts, bi) {
+  if (wi == null || day == null) return;
+  // Switch to the correct week tab
+  if (PW !== wi) { PW = wi; rR(); }
+  // Find the schedule table in the current view
+  requestAnimationFrame(() => {
+    const wrap = document.querySelector('.schedule-wrap');
+    if (!wrap) return;
+    let selector = '.booth-cell[data-day="' + day + '"]';
+    if (ts != null) selector += '[data-ts="' + ts + '"]';
+    if (bi != null) selector += '[data-bi="' + bi + '"]';
+    const cells = wrap.querySelectorAll(selector);
+    if (!cells.length) return;
+    // Scroll first matching cell into view
+    cells[0].scrollIntoView({ behavior: 'smooth', block: 'center', inline: 'center' });
+    // Apply highlight animation
+    cells.forEach(c => {
+      c.classList.remove('cell-highlight');
+      void c.offsetWidth; // force reflow
+      c.classList.add('cell-highlight');
+    });
+    // Remove class after animation
+    setTimeout(() => { cells.forEach(c => c.classList.remove('cell-highlight')); }, 3000);
+  });
+}
+
+async function runCheck() {
+  if (!R || !R.schedule) return;
+  const btn = document.getElementById('checkBtn');
+  btn.disabled = true;
+  showCheckModal();
+  try {
+    // ステップアニメーションを順に表示しながらAPIを呼ぶ
+    const stepDelay = (ms) => new Promise(r => setTimeout(r, ms));
+    updateCheckStep(0);
+    const fetchPromise = fetch('/api/check').then(r => r.json());
+    // 各ステップを順に表示（APIは並行で実行中）
+    for (let i = 1; i < CHECK_STEPS.length; i++) {
+      await stepDelay(200);
+      completeCheckStep(i - 1);
+      updateCheckStep(i);
+    }
+    const d = await fetchPromise;
+    completeCheckStep(CHECK_STEPS.length - 1);
+    await stepDelay(400);
+    closeCheckModal();
+    await stepDelay(300);
+    R.checkSummary = d;
+    showCheckResults(d);
+  } catch (e) {
+    closeCheckModal();
+    showUpErr('チェックエラー: ' + escHtml(e.message));
+  } finally {
+    btn.disabled = false;
+  }
+}
+
+function showCheckResults(d) {
+  let panel = document.getElementById('checkPanel');
+  if (!panel) {
+    panel = document.createElement('div');
+    panel.id = 'checkPanel';
+    const tabs = document.getElementById('wTabs');
+    tabs.parentNode.insertBefore(panel, tabs.nextSibling);
+  }
+  const pc = computePrimaryCompliance();
+  const pcHtml = pc ? ' <span style="font-size:11px;color:#555;margin-left:10px">希望時間帯率: <b>' + pc.primaryRate + '%</b> (' + pc.primary + '/' + pc.total + ')</span>' : '';
+  if (!d.issues || !d.issues.length) {
+    panel.innerHTML = '<div class="check-panel"><div class="check-header all-ok"><span class="check-toggle-icon">▼</span>✅ すべてのチェックに合格しました' + pcHtml + '</div></div>';
+    return;
+  }
+  const errors = d.issues.filter(i => i.level === 'error');
+  const warns = d.issues.filter(i => i.level === 'warn');
+  let html = '<div class="check-panel">';
+  html += '<div class="check-header ' + (errors.length ? 'has-error' : 'has-warn') + '" onclick="toggleCheckPanel()">';
+  html += '<span class="check-toggle-icon">▼</span>';
+  html += (errors.length ? '❌ ' : '⚠️ ');
+  html += escHtml(errors.length + '件のエラー / ' + warns.length + '件の警告');
+  html += pcHtml;
+  html += '</div>';
+  html += '<div class="check-list">';
+  for (const issue of d.issues) {
+    const hasLoc = issue.wi != null && issue.day != null;
+    html += '<div class="check-item' + (hasLoc ? ' clickable' : '') + '"';
+    if (hasLoc) {
+      html += ' onclick="navigateToCell(' + issue.wi + ',\'' + escHtml(issue.day) + '\'';
+      html += ',' + (issue.ts != null ? '\'' + escHtml(issue.ts) + '\'' : 'null');
+      html += ',' + (issue.bi != null ? issue.bi : 'null');
+      html += ')"';
+    }
+    html += '>';
+    html += '<span class="badge ' + (issue.level === 'error' ? 'err' : 'wrn') + '">' + escHtml(issue.code) + '</span>';
+    html += '<span>' + escHtml(issue.message) + '</span>';
+    if (hasLoc) html += '<span style="margin-left:auto;font-size:10px;color:var(--ink3)">→</span>';
+    html += '</div>';
+  }
+  html += '</div></div>';
+  panel.innerHTML = html;
+}
+
+// Navigate to student calendar
+async function goStudent(name) { const idx = R.students.findIndex(s => s.name === name); if (idx < 0) return; await ensureStudentSlots(name); calStudent = idx; PW = -2; rR(); }
+
+// 時間キーを短縮形に正規化（古い保存ファイル対応: '16:00' → '16'）
+const _TIME_NORMALIZE = { '14:55': '14', '16:00': '16', '17:05': '17', '18:10': '18', '19:15': '19', '20:20': '20' };
+function normalizeScheduleKeys(schedule) {
+  if (!schedule) return schedule;
+  return schedule.map(week => {
+    const nw = {};
+    for (const [day, dayData] of Object.entries(week)) {
+      const nd = {};
+      for (const [ts, booths] of Object.entries(dayData)) {
+        nd[_TIME_NORMALIZE[ts] || ts] = booths;
+      }
+      nw[day] = nd;
+    }
+    return nw;
+  });
+}
+// 生徒ごとの配置数カウント
+// 生徒ごとの配置数カウント (引数なし=全体数, 引数あり=科目別オブジェクト)
+function countPlaced(studentName) {
+  if (!R || !R.schedule) return studentName ? {} : 0;
+  if (!studentName) {
+    let c = 0;
+    R.schedule.forEach(w => {
+      Object.values(w).forEach(d => {
+        Object.values(d).forEach(bs => {
+          bs.forEach(b => { c += b.slots.length; });
+        });
+      });
+    });
+    return c;
+  }
+  // 科目別集計
+  const counts = {};
+  R.schedule.forEach(w => {
+    Object.values(w).forEach(d => {
+      Object.values(d).forEach(bs => {
+        bs.forEach(b => {
+          b.slots.forEach(s => {
+            if (s[1] === studentName) {
+              const subj = s[2];
+              counts[subj] = (counts[subj] || 0) + 1;
+            }
+          });
+        });
+      });
+    });
+  });
+  return counts;
+}
+// 生徒ごとの必要コマ数取得
+// 生徒ごとの必要コマ数取得 (引数あり=needsオブジェクト)
+function getStudentNeeds(name) {
+  if (!R || !R.students) return {};
+  const s = R.students.find(st => st.name === name);
+  if (!s || !s.needs) return {};
+  return s.needs;
+}
+
+// 必要コマ数ベースのサマリー計算（1パスで全生徒分を集計）
+function computeStudentSummary() {
+  if (!R || !R.schedule || !R.students) {
+    return { students: [], grandTotalPlaced: 0, grandTotalRequired: 0 };
+  }
+  // 1パスで全生徒の科目別配置数を構築
+  const placedMap = {}; // { studentName: { subj: count } }
+  R.schedule.forEach(w => {
+    Object.values(w).forEach(d => {
+      Object.values(d).forEach(bs => {
+        bs.forEach(b => {
+          b.slots.forEach(s => {
+            const name = s[1], subj = s[2];
+            if (!placedMap[name]) placedMap[name] = {};
+            placedMap[name][subj] = (placedMap[name][subj] || 0) + 1;
+          });
+        });
+      });
+    });
+  });
+  let grandTotalPlaced = 0;
+  let grandTotalRequired = 0;
+  const students = R.students.map(st => {
+    const needs = st.needs || {};
+    const placed = placedMap[st.name] || {};
+    const allSubjs = new Set([...Object.keys(needs), ...Object.keys(placed)]);
+    const subjects = {};
+    let totalPlaced = 0;
+    let totalRequired = 0;
+    allSubjs.forEach(subj => {
+      const p = placed[subj] || 0;
+      const r = needs[subj] || 0;
+      subjects[subj] = { placed: p, required: r };
+      totalPlaced += p;
+      totalRequired += r;
+    });
+    grandTotalPlaced += totalPlaced;
+    grandTotalRequired += totalRequired;
+    return { name: st.name, grade: st.grade, subjects, totalPlaced, totalRequired };
+  });
+  return { students, grandTotalPlaced, grandTotalRequired };
+}
+
+// 希望時間帯遵守率（primary compliance）を計算
+function computePrimaryCompliance() {
+  if (!R || !R.schedule || !R.students) return null;
+  const availMap = {}, backupMap = {};
+  for (const s of R.students) {
+    availMap[s.name] = s.avail ? new Set(s.avail.map(a => a[0] + '|' + a[1])) : null;
+    backupMap[s.name] = s.backup_avail ? new Set(s.backup_avail.map(a => a[0] + '|' + a[1])) : new Set();
+  }
+  let primary = 0, backup = 0, other = 0;
+  for (const week of R.schedule) {
+    for (const [day, dayData] of Object.entries(week)) {
+      for (const [ts, booths] of Object.entries(dayData)) {
+        for (const b of booths) {
+          for (const slot of b.slots) {
+            const sname = slot[1];
+            const key = day + '|' + ts;
+            const avail = availMap[sname];
+            const bkp = backupMap[sname] || new Set();
+            if (avail === null || avail.has(key)) primary++;
+            else if (bkp.has(key)) backup++;
+            else other++;
+          }
+        }
+      }
+    }
+  }
+  const total = primary + backup + other;
+  return { primary, backup, other, total,
+           primaryRate: total > 0 ? (primary / total * 100).toFixed(1) : '0.0' };
+}
+
+// 生徒別内訳テーブルの描画
+function renderStudentBreakdown(summary) {
+  const container = document.getElementById('studentBreakdown');
+  const body = document.getElementById('studentBreakdownBody');
+  if (!container || !body) return;
+  if (!summary.students.length) { container.style.display = 'none'; return; }
+  // 不足生徒を先頭にソート
+  const sorted = [...summary.students].sort((a, b) => {
+    const defA = a.totalRequired - a.totalPlaced;
+    const defB = b.totalRequired - b.totalPlaced;
+    if (defA > 0 && defB <= 0) return -1;
+    if (defA <= 0 && defB > 0) return 1;
+    return defB - defA;
+  });
+  let completeCount = 0, deficitCount = 0;
+  sorted.forEach(s => {
+    if (s.totalPlaced >= s.totalRequired) completeCount++;
+    else deficitCount++;
+  });
+  let html = '<table><thead><tr><th>学年</th><th>生徒</th><th>科目別</th><th>合計</th></tr></thead><tbody>';
+  sorted.forEach(s => {
+    const isOk = s.totalPlaced >= s.totalRequired;
+    html += '<tr>';
+    html += '<td>' + escHtml(s.grade) + '</td>';
+    html += '<td><span class="stu-link" onclick="goStudent(\'' + escHtml(s.name).replace(/'/g, "\\'") + '\')">' + escHtml(s.name) + '</span></td>';
+    html += '<td><div class="subj-tags">';
+    for (const [subj, v] of Object.entries(s.subjects)) {
+      if (v.required === 0 && v.placed === 0) continue;
+      const cls = v.placed >= v.required ? (v.placed > v.required ? 'subj-over' : 'subj-ok') : 'subj-ng';
+      html += '<span class="subj-tag ' + cls + '">' + escHtml(subj) + ':' + v.placed + '/' + v.required + '</span>';
+    }
+    html += '</div></td>';
+    html += '<td class="' + (isOk ? 'total-ok' : 'total-ng') + '">' + s.totalPlaced + '/' + s.totalRequired + '</td>';
+    html += '</tr>';
+  });
+  html += '</tbody></table>';
+  html += '<div class="bd-summary-line">完了: ' + completeCount + '人 / 不足: ' + deficitCount + '人</div>';
+  body.innerHTML = html;
+}
+
+function rR() {
+  const cp = document.getElementById('checkPanel'); if (cp) cp.innerHTML = '';
+  if (R && R.checkSummary) showCheckResults(R.checkSummary);
+  // 時間キーを正規化（古いファイルの '16:00' 形式 → '16' 形式）
+  if (R.schedule && R.schedule.length > 0 && R.schedule[0]) {
+    const firstWeek = R.schedule[0];
+    const firstDay = Object.values(firstWeek)[0] || {};
+    const tsKeys = Object.keys(firstDay);
+    if (tsKeys.length > 0 && tsKeys[0].includes(':')) {
+      R.schedule = normalizeScheduleKeys(R.schedule);
+    }
+  }
+  if (edited) scheduleAutoSave();
+  const summary = computeStudentSummary();
+  const p = summary.grandTotalPlaced;
+  const tot = summary.grandTotalRequired;
+  document.getElementById('pNum').innerHTML = p + '<span>/' + tot + 'コマ</span>';
+  const rate = tot > 0 ? (p / tot * 100).toFixed(1) : (p > 0 ? '100.0' : '0.0');
+  document.getElementById('rTxt').textContent = '配置率 ' + rate + '%';
+  renderStudentBreakdown(summary);
+  const ub = document.getElementById('uBadge'), uT = R.unplaced.reduce((s, u) => s + u.count, 0); if (uT > 0) { ub.style.display = ''; ub.textContent = '⚠️ 未配置: ' + uT + 'コマ'; } else ub.style.display = 'none';
+  const eb = document.getElementById('eBadge'); let extraTotal = 0; summary.students.forEach(s => { for (const v of Object.values(s.subjects)) { if (v.placed > v.required) extraTotal += v.placed - v.required; } }); if (extraTotal > 0) { eb.style.display = ''; eb.textContent = '＋' + extraTotal + 'コマ（5週目対応）'; } else eb.style.display = 'none';
+  const mb = document.getElementById('mBadge'); if (edited) { mb.style.display = ''; mb.textContent = '✏️ 手動編集あり'; } else mb.style.display = 'none';
+  const tabs = document.getElementById('wTabs'); tabs.innerHTML = '';
+  const NW = R.schedule.length; for (let w = 0; w < NW; w++) { const b = document.createElement('button'); b.className = PW === w ? 'active' : ''; const wr = getWeekRange(w); b.textContent = '第' + (w + 1) + '週' + (wr && wr !== 'W' + (w + 1) ? ' ' + wr : ''); b.onclick = async () => { await ensureWeek(w); PW = w; rR(); }; tabs.appendChild(b); }
+  const cb = document.createElement('button'); cb.className = 'cal' + (PW === -2 ? ' active' : ''); cb.textContent = '📅 生徒別'; cb.onclick = async () => { const s = R.students && R.students[calStudent === null ? 0 : calStudent]; if (s) await ensureStudentSlots(s.name); PW = -2; rR(); }; tabs.appendChild(cb);
+  const tb = document.createElement('button'); tb.className = 'cal' + (PW === -3 ? ' active' : ''); tb.textContent = '👨‍🏫 講師出勤'; tb.onclick = async () => { await ensureAllWeeks(); PW = -3; rR(); }; tabs.appendChild(tb);
+  const wrap = document.getElementById('pWrap');
+  const _pm = wrap.querySelector('.schedule-main'), _ps = wrap.querySelector('.unplaced-sidebar');
+  const _ss = { mt: _pm ? _pm.scrollTop : 0, ml: _pm ? _pm.scrollLeft : 0, st: _ps ? _ps.scrollTop : 0 };
+  wrap.innerHTML = ''; const wCard = wrap.parentElement; if (PW >= 0) { wrap.classList.add('result-layout'); wCard.classList.add('result-card'); rW(wrap, PW); const _nm = wrap.querySelector('.schedule-main'), _ns = wrap.querySelector('.unplaced-sidebar'); if (_nm) { _nm.scrollTop = _ss.mt; _nm.scrollLeft = _ss.ml; } if (_ns) _ns.scrollTop = _ss.st; } else if (PW === -3) { wrap.classList.remove('result-layout'); wCard.classList.remove('result-card'); renderTeacherAvail(wrap); } else { wrap.classList.remove('result-layout'); wCard.classList.remove('result-card'); rCal(wrap); }
+}
+
+// === Teacher D&D ===
+function mkTeacher(t, wi, day, ts, bi, isDup = false) {
+  const el = document.createElement('span'); el.className = 'tn';
+  if (isDup) el.classList.add('dup');
+  el.textContent = t; el.draggable = true;
+  el.addEventListener('dragstart', e => { dragData = { type: 'teacher', wi, day, ts, bi, teacher: t }; el.style.opacity = '0.4'; e.dataTransfer.effectAllowed = 'move'; });
+  el.addEventListener('dragend', () => { el.style.opacity = '1'; dragData = null; });
+  el.addEventListener('dragover', e => { if (dragData && dragData.type === 'teacher' && dragData.wi === wi && dragData.day === day && dragData.ts === ts) { e.preventDefault(); el.classList.add('drag-over-t'); } });
+  el.addEventListener('dragleave', () => { el.classList.remove('drag-over-t'); });
+  el.addEventListener('drop', e => { e.preventDefault(); el.classList.remove('drag-over-t'); doTeacherSwap(wi, day, ts, bi); });
+  let wasDragged = false;
+  el.addEventListener('mousedown', () => { wasDragged = false; });
+  el.addEventListener('mousemove', () => { wasDragged = true; });
+  el.addEventListener('click', e => { if (!wasDragged) { e.stopPropagation(); showTeacherPicker(el, wi, day, ts, bi); } });
+  return el;
+}
+function getAvailableTeachers(wi, day, ts) {
+  // weekly_teachers から出勤可能な講師を取得（教室業務担当を除く）
+  const wt = R.weeklyTeachers; if (!wt || !wt[wi] || !wt[wi][day]) return [];
+  const dayData = wt[wi][day];
+  const all = new Set();
+  if (ts && dayData[ts]) {
+    // 特定の時間帯の出勤講師のみ
+    (dayData[ts] || []).forEach(t => all.add(t));
+  } else {
+    // フォールバック: その日の全時間帯
+    for (const k of Object.keys(dayData)) { (dayData[k] || []).forEach(t => all.add(t)); }
+  }
+  const ot = (R.officeTeachers[wi] || {})[day]; if (ot) all.delete(ot);
+  return [...all].sort();
+}
+function getAssignedTeachers(wi, day) {
+  const ws = R.schedule[wi]; if (!ws || !ws[day]) return new Set();
+  const assigned = new Set();
+  for (const ts of Object.keys(ws[day])) { (ws[day][ts] || []).forEach(b => { if (b.teacher) assigned.add(b.teacher); }); }
+  return assigned;
+}
+function showTeacherPicker(anchor, wi, day, ts, bi) {
+  // 既存のピッカーを閉じる
+  document.querySelectorAll('.teacher-picker').forEach(p => p.remove());
+  const assigned = getAssignedTeachers(wi, day);
+  const available = getAvailableTeachers(wi, day, ts);
+  const unassigned = available.filter(t => !assigned.has(t));
+  if (!unassigned.length && available.length <= 1) return;
+  const picker = document.createElement('div'); picker.className = 'teacher-picker';
+  // 未配置の出勤講師
+  if (unassigned.length) {
+    const hdr = document.createElement('div'); hdr.className = 'tp-hdr'; hdr.textContent = '出勤中（未配置）'; picker.appendChild(hdr);
+    unassigned.forEach(t => {
+      const opt = document.createElement('div'); opt.className = 'tp-opt tp-new'; opt.textContent = t;
+      opt.onclick = e => { e.stopPropagation(); replaceTeacher(wi, day, bi, t); picker.remove(); }; picker.appendChild(opt);
+    });
+  }
+  // 配置済み講師との入替（自分自身を除く）
+  const currentT = R.schedule[wi][day][ts][bi].teacher;
+  const others = available.filter(t => assigned.has(t) && t !== currentT);
+  if (others.length) {
+    const hdr2 = document.createElement('div'); hdr2.className = 'tp-hdr'; hdr2.textContent = '配置済み（入替）'; picker.appendChild(hdr2);
+    others.forEach(t => {
+      const opt = document.createElement('div'); opt.className = 'tp-opt tp-swap'; opt.textContent = t;
+      opt.onclick = e => { e.stopPropagation(); swapTeacherFull(wi, day, bi, t); picker.remove(); }; picker.appendChild(opt);
+    });
+  }
+  // 空欄にする
+  const clr = document.createElement('div'); clr.className = 'tp-opt tp-clear'; clr.textContent = '× 講師を外す';
+  clr.onclick = e => { e.stopPropagation(); removeTeacher(wi, day, bi); picker.remove(); }; picker.appendChild(clr);
+  // キャンセル
+  const cancel = document.createElement('div'); cancel.className = 'tp-opt tp-cancel'; cancel.textContent = '× キャンセル';
+  cancel.onclick = e => { e.stopPropagation(); picker.remove(); }; picker.appendChild(cancel);
+  anchor.parentElement.style.position = 'relative'; anchor.parentElement.appendChild(picker);
+  const close = e => { if (!picker.contains(e.target)) { picker.remove(); document.removeEventListener('click', close); } };
+  setTimeout(() => document.addEventListener('click', close), 0);
+}
+function showEmptyBoothPicker(cell, wi, day, ts, bi) {
+  document.querySelectorAll('.teacher-picker').forEach(p => p.remove());
+  const assigned = getAssignedTeachers(wi, day);
+  const available = getAvailableTeachers(wi, day, ts);
+  const unassigned = available.filter(t => !assigned.has(t));
+  const picker = document.createElement('div'); picker.className = 'teacher-picker';
+  if (unassigned.length) {
+    const hdr = document.createElement('div'); hdr.className = 'tp-hdr'; hdr.textContent = '出勤中（未配置）'; picker.appendChild(hdr);
+    unassigned.forEach(t => {
+      const opt = document.createElement('div'); opt.className = 'tp-opt tp-new'; opt.textContent = t;
+      opt.onclick = e => { e.stopPropagation(); replaceTeacher(wi, day, bi, t); picker.remove(); }; picker.appendChild(opt);
+    });
+  }
+  const others = available.filter(t => assigned.has(t));
+  if (others.length) {
+    const hdr2 = document.createElement('div'); hdr2.className = 'tp-hdr'; hdr2.textContent = '配置済み（入替）'; picker.appendChild(hdr2);
+    others.forEach(t => {
+      const opt = document.createElement('div'); opt.className = 'tp-opt tp-swap'; opt.textContent = t;
+      opt.onclick = e => { e.stopPropagation(); swapTeacherFull(wi, day, bi, t); picker.remove(); }; picker.appendChild(opt);
+    });
+  }
+  if (!unassigned.length && !others.length) { picker.remove(); return; }
+  cell.style.position = 'relative'; cell.appendChild(picker);
+  const close = e => { if (!picker.contains(e.target)) { picker.remove(); document.removeEventListener('click', close); } };
+  setTimeout(() => document.addEventListener('click', close), 0);
+}
+function replaceTeacher(wi, day, bi, newT) {
+  const ws = R.schedule[wi], times = day === '土' ? ['14', '16', '17', '18'] : ['16', '17', '18', '19', '20'];
+  const wt = R.weeklyTeachers;
+  // 出勤範囲（最初〜最後の出勤コマ）を計算して補間する
+  let first = 99, last = -1;
+  if (wt && wt[wi] && wt[wi][day]) {
+    const tsOrd = { '14': 0, '16': 1, '17': 2, '18': 3, '19': 4, '20': 5 };
+    for (const t of times) { if ((wt[wi][day][t] || []).includes(newT)) { const o = tsOrd[t]; if (o < first) first = o; if (o > last) last = o; } }
+  }
+  const tsOrd = { '14': 0, '16': 1, '17': 2, '18': 3, '19': 4, '20': 5 };
+  for (const t of times) {
+    const bs = ws[day]?.[t]; if (!bs || !bs[bi]) continue;
+    const o = tsOrd[t]; bs[bi].teacher = (first <= o && o <= last) ? newT : '';
+  }
+  edited = true; rR();
+}
+function swapTeacherFull(wi, day, bi, targetT) {
+  const ws = R.schedule[wi], times = day === '土' ? ['14', '16', '17', '18'] : ['16', '17', '18', '19', '20'];
+  // targetTのブースインデックスを探す
+  let tbi = null; for (const t of times) { const bs = ws[day]?.[t]; if (!bs) continue; for (let i = 0; i < bs.length; i++) { if (bs[i].teacher === targetT) { tbi = i; break; } } if (tbi !== null) break; }
+  if (tbi === null || tbi === bi) return;
+  for (const t of times) { const bs = ws[day]?.[t]; if (!bs) continue; const s = bs[bi], g = bs[tbi]; if (s && g) { const tmp = s.teacher; s.teacher = g.teacher; g.teacher = tmp; } }
+  edited = true; rR();
+}
+function removeTeacher(wi, day, bi) {
+  const ws = R.schedule[wi], times = day === '土' ? ['14', '16', '17', '18'] : ['16', '17', '18', '19', '20'];
+  for (const t of times) {
+    const bs = ws[day]?.[t]; if (!bs || !bs[bi]) continue;
+    // 生徒が配置されている場合は未配置に戻す
+    bs[bi].slots.forEach(sl => {
+      const existing = R.unplaced.find(u => u.name === sl[1] && u.subject === sl[2]);
+      if (existing) existing.count++; else R.unplaced.push({ grade: sl[0], name: sl[1], subject: sl[2], count: 1, reason: '講師削除' });
+    });
+    bs[bi].slots = []; bs[bi].teacher = '';
+  }
+  edited = true; rR();
+}
+function doTeacherSwap(wi, day, ts, tbi) {
+  if (!dragData || dragData.type !== 'teacher' || dragData.wi !== wi || dragData.day !== day || dragData.ts !== ts || dragData.bi === tbi) return;
+  const ws = R.schedule[wi], times = day === '土' ? ['14', '16', '17', '18'] : ['16', '17', '18', '19', '20'];
+  for (const t of times) { const bs = ws[day]?.[t]; if (!bs) continue; const s = bs[dragData.bi], g = bs[tbi]; if (s && g) { const tmp = s.teacher; s.teacher = g.teacher; g.teacher = tmp; } }
+  edited = true; dragData = null; rR();
+}
+
+// === Student slot ===
+function mkChip(slot, wi, day, ts, bi, si, teacher) {
+  const el = document.createElement('div'); const ngT = isNg(slot[1], teacher); const ngS = isAdjacentNg(wi, day, ts, bi, slot[1]); const ngD = isNgDate(slot[1], wi, day);
+  const warn = ngT || ngS || ngD;
+  el.className = 'slot-chip' + (ngT || ngS ? ' ng' : '') + (ngD && !ngT && !ngS ? ' ng-date' : ''); el.draggable = true;
+  let wt = ngT ? 'NG講師:' + teacher : ''; if (ngS) wt += (wt ? ' / ' : '') + 'NG生徒が隣接'; if (ngD) wt += (wt ? ' / ' : '') + 'NG日程';
+  const gSpan = '<span class="g">' + escHtml(slot[0]) + '</span>';
+  const sSpan = '<span class="s">' + escHtml(slot[1]) + '</span>';
+  const jSpan = '<span class="j">' + escHtml(slot[2]) + '</span>';
+  el.innerHTML = gSpan + sSpan + jSpan + (warn ? '<span style="color:' + (ngD && !ngT && !ngS ? 'var(--orange)' : 'var(--red)') + ';font-size:9px">⚠</span>' : '');
+  el.title = wt;
+  let dragged = false;
+  el.addEventListener('dragstart', e => { dragged = true; dragData = { type: 'booth', wi, day, ts, bi, si, slot }; el.style.opacity = '0.4'; e.dataTransfer.effectAllowed = 'move'; });
+  el.addEventListener('dragend', () => { el.style.opacity = '1'; dragData = null; clearMovePreview(); });
+  el.addEventListener('click', e => { if (!dragged) { e.stopPropagation(); goStudent(slot[1]); } dragged = false; }); return el;
+}
+
+function mkUnChip(u, ui) {
+  const el = document.createElement('div'); el.className = 'slot-chip'; el.draggable = true;
+  el.innerHTML = '<span class="g">' + escHtml(u.grade) + '</span><span class="s">' + escHtml(u.name) + '</span><span class="j">' + escHtml(u.subject) + '</span>';
+  let dragged = false;
+  el.addEventListener('dragstart', e => { dragged = true; dragData = { type: 'unplaced', ui, slot: [u.grade, u.name, u.subject] }; el.style.opacity = '0.4'; e.dataTransfer.effectAllowed = 'move'; showSuggestions(u.name, u.subject); });
+  el.addEventListener('dragend', () => { el.style.opacity = '1'; dragData = null; clearSuggestions(); clearMovePreview(); });
+  el.addEventListener('click', e => { if (!dragged) { e.stopPropagation(); goStudent(u.name); } dragged = false; }); return el;
+}
+
+// === 配置候補のハイライト（/api/suggest: 未配置コマのドラッグ中に上位候補のブースを強調） ===
+const SUGGEST_TERM_LABELS = { ng_date: 'NG日程', backup_time: '予備時間', continuous_block: '連続コマ', skip_interval: '飛び石', same_day_2nd: '同日2コマ目', same_day_3plus: '同日3コマ以上', wish_teacher: '希望講師', booth_pref: 'ブース希望', empty_booth: '空きブース' };
+let suggestSeq = 0;
+async function showSuggestions(name, subject) {
+  const seq = ++suggestSeq;
+  if (!R || PW < 0) return;
+  try {
+    if (autoSaveTimer) { clearTimeout(autoSaveTimer); autoSaveTimer = null; await autoSave(); }
+    const res = await fetch('/api/suggest', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ name, subject, week: PW, k: 5 }) });
+    if (!res.ok || seq !== suggestSeq) return;
+    const d = await res.json();
+    d.candidates.forEach((c, i) => {
+      const cell = document.querySelector('.booth-cell[data-day="' + c.day + '"][data-ts="' + c.ts + '"][data-bi="' + c.bi + '"]');
+      if (!cell) return;
+      cell.classList.add('suggested'); cell.dataset.rank = i + 1;
+      cell.title = '候補' + (i + 1) + ': ' + c.score + '点（' + Object.entries(c.breakdown).map(([k, v]) => (SUGGEST_TERM_LABELS[k] || k) + ' ' + (v > 0 ? '+' : '') + v).join(' / ') + '）';
+    });
+  } catch (e) { }
+}
+function clearSuggestions() {
+  suggestSeq++;
+  document.querySelectorAll('.booth-cell.suggested').forEach(c => { c.classList.remove('suggested'); delete c.dataset.rank; c.removeAttribute('title'); });
+}
+
+// === 移動の事前評価（/api/evaluate_move: ドラッグ中のブースに点数の増減と新たなエラーを表示） ===
+let movePreviewKey = null;
+async function previewMove(td, wi, day, ts, bi) {
+  if (!dragData || (dragData.type !== 'booth' && dragData.type !== 'unplaced')) return;
+  const key = [wi, day, ts, bi].join('|');
+  if (key === movePreviewKey) return;
+  movePreviewKey = key;
+  const from = dragData.type === 'booth' ? { wi: dragData.wi, day: dragData.day, ts: dragData.ts, bi: dragData.bi, si: dragData.si } : { unplaced: { name: dragData.slot[1], subject: dragData.slot[2] } };
+  try {
+    if (autoSaveTimer) { clearTimeout(autoSaveTimer); autoSaveTimer = null; await autoSave(); }
+    const res = await fetch('/api/evaluate_move', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ from, to: { wi, day, ts, bi } }) });
+    if (!res.ok || key !== movePreviewKey) return;
+    const d = await res.json();
+    td.classList.toggle('move-bad', !d.feasible); td.classList.add('move-previewed');
+    td.title = '移動すると ' + (d.delta > 0 ? '+' : '') + d.delta + '点' + Object.entries(d.breakdown).map(([k, v]) => '\n' + (SUGGEST_TERM_LABELS[k] || k) + ' ' + (v > 0 ? '+' : '') + v).join('') + d.issues.added.map(i => '\n⚠ ' + i.title).join('');
+  } catch (e) { }
+}
+function clearMovePreview() {
+  movePreviewKey = null;
+  document.querySelectorAll('.booth-cell.move-previewed').forEach(c => { c.classList.remove('move-bad', 'move-previewed'); c.removeAttribute('title'); });
+}
+
+function doBooth(wi, day, ts, bi) {
+  if (!dragData) return; const ws = R.schedule[wi], booth = ws[day][ts][bi];
+  if (booth.slots.length < 2) {
+    // 空きあり: 通常の移動
+    if (dragData.type === 'booth') {
+      if (dragData.wi !== wi) return; if (dragData.day === day && dragData.bi === bi && dragData.ts === ts) return;
+      ws[dragData.day][dragData.ts][dragData.bi].slots.splice(dragData.si, 1); booth.slots.push(dragData.slot);
+    }
+    else if (dragData.type === 'unplaced') { const u = R.unplaced[dragData.ui]; if (!u || u.count <= 0) return; booth.slots.push(dragData.slot); u.count--; if (u.count <= 0) R.unplaced.splice(dragData.ui, 1); }
+    else if (dragData.type === 'calSlot') { const src = R.schedule[dragData.wi][dragData.day][dragData.ts][dragData.bi]; src.slots.splice(dragData.si, 1); booth.slots.push(dragData.slot); }
+    edited = true; dragData = null; rR(); return;
+  }
+  // 満席: スワップモード（booth/calSlotのみ）
+  if (dragData.type === 'booth' || dragData.type === 'calSlot') {
+    if (dragData.type === 'booth' && (dragData.wi !== wi)) return;
+    if (dragData.day === day && dragData.bi === bi && dragData.ts === ts) return;
+    if (booth.slots.length === 1) { doSwapExec(wi, day, ts, bi, 0); }
+    else { showSwapModal(wi, day, ts, bi, booth); }
+  }
+}
+
+function doUnplaced() {
+  if (!dragData || (dragData.type !== 'booth' && dragData.type !== 'calSlot')) return;
+  const wi = dragData.wi, ws = R.schedule[wi], slot = ws[dragData.day][dragData.ts][dragData.bi].slots.splice(dragData.si, 1)[0];
+  const ex = R.unplaced.find(u => u.name === slot[1] && u.subject === slot[2]); if (ex) ex.count++; else R.unplaced.push({ grade: slot[0], name: slot[1], subject: slot[2], count: 1, reason: '' });
+  edited = true; dragData = null; rR();
+}
+
+function showSwapModal(wi, day, ts, bi, booth) {
+  const saved = { ...dragData };
+  const root = document.getElementById('modalRoot');
+  const bg = document.createElement('div'); bg.className = 'modal-bg';
+  const modal = document.createElement('div'); modal.className = 'modal';
+  modal.innerHTML = '<h3>🔄 交換する生徒を選択</h3><p style="font-size:12px;color:var(--ink3);margin-bottom:10px">ドラッグ中の生徒と入れ替えます</p>';
+  const opts = document.createElement('div'); opts.className = 'modal-opts';
+  booth.slots.forEach((sl, si) => {
+    const btn = document.createElement('div'); btn.className = 'modal-opt';
+    btn.innerHTML = '<span class="t-name">' + sl[0] + ' ' + sl[1] + '</span><span class="t-info">' + sl[2] + '</span>';
+    btn.onclick = () => { root.innerHTML = ''; dragData = saved; doSwapExec(wi, day, ts, bi, si); };
+    opts.appendChild(btn);
+  });
+  modal.appendChild(opts);
+  const cancel = document.createElement('div'); cancel.className = 'modal-cancel';
+  cancel.innerHTML = '<button class="btn btn-o" style="padding:6px 16px;font-size:12px">キャンセル</button>';
+  cancel.querySelector('button').onclick = () => { root.innerHTML = ''; dragData = null; };
+  modal.appendChild(cancel); bg.appendChild(modal); root.appendChild(bg);
+  bg.addEventListener('click', e => { if (e.target === bg) { root.innerHTML = ''; dragData = null; } });
+}
+
+function doSwapExec(wi, day, ts, bi, targetSi) {
+  if (!dragData) return;
+  const ws = R.schedule[wi];
+  const targetBooth = ws[day][ts][bi];
+  const swappedOut = targetBooth.slots[targetSi];
+  if (dragData.type === 'booth' || dragData.type === 'calSlot') {
+    const srcBooth = R.schedule[dragData.wi][dragData.day][dragData.ts][dragData.bi];
+    srcBooth.slots.splice(dragData.si, 1);
+    srcBooth.slots.push(swappedOut);
+    targetBooth.slots[targetSi] = dragData.slot;
+  }
+  edited = true; dragData = null; rR();
+}
+
+// === Slot Manual Edit ===
+function showSlotEditModal(wi, day, ts, bi) {
+  if (edited) scheduleAutoSave();
+  const booth = R.schedule[wi][day][ts][bi];
+  const m = document.createElement('div'); m.className = 'modal-overlay';
+  m.onclick = (e) => { if (e.target === m) closeSlotEditModal(); };
+
+  let h = '<div class="modal"><div class="modal-header">ブース編集 (' + day + ' ' + TSR[ts] + ' - ブース' + BL[bi] + ')</div><div class="modal-body"><div style="margin-bottom:12px"><label>講師</label><select id="seTeacher" style="width:100%;padding:4px"><option value="">(なし)</option>';
+  const allT = getAvailableTeachers(wi, day, ts);
+  if (booth.teacher && !allT.includes(booth.teacher)) allT.push(booth.teacher); allT.sort();
+  allT.forEach(t => { h += '<option value="' + t + '"' + (t === booth.teacher ? ' selected' : '') + '>' + t + '</option>'; });
+  h += '</select></div>';
+
+  h += '<div style="margin-bottom:8px;font-weight:bold">生徒スロット</div>';
+  booth.slots.forEach((s, idx) => {
+    let subjOpts = [s[2]];
+    const stData = R.students.find(st => st.name === s[1]);
+    if (stData && stData.needs) { subjOpts = Object.keys(stData.needs); }
+    subjOpts = [...new Set(subjOpts)];
+    let sOpts = '';
+    subjOpts.forEach(sb => { sOpts += '<option value="' + sb + '"' + (sb === s[2] ? ' selected' : '') + '>' + sb + '</option>'; });
+
+    h += '<div class="slot-row" style="display:flex;gap:4px;align-items:center;margin-bottom:4px"><span class="badge ' + getGradeColor(s[0]) + '">' + s[0] + '</span><span style="flex:1;font-weight:bold">' + s[1] + '</span>';
+    h += '<select id="seSubj_' + idx + '" style="width:60px;padding:2px;font-size:12px">' + sOpts + '</select>';
+    h += '<button class="btn btn-o" style="padding:2px 6px;font-size:11px;color:var(--red);border-color:var(--red)" onclick="removeSlot(' + wi + ',\'' + day + '\',\'' + ts + '\',' + bi + ',' + idx + ')">削除</button></div>';
+  });
+
+  if (booth.slots.length < 2) {
+    h += '<div style="margin-top:8px;padding-top:8px;border-top:1px dashed #ddd">';
+    h += '<div style="font-size:12px;margin-bottom:4px;color:var(--ink2)">コマ追加</div>';
+    h += '<div style="display:flex;gap:4px">';
+    h += '<select id="newSlotName" style="flex:1;font-size:12px"><option value="">生徒を選択...</option>';
+    const sortedStudents = [...R.students].sort((a, b) => a.grade.localeCompare(b.grade) || a.name.localeCompare(b.name));
+    sortedStudents.forEach(st => { h += '<option value="' + st.name + '">' + st.grade + ' ' + st.name + '</option>'; });
+    h += '</select>';
+    h += '<input type="text" id="newSlotSubj" placeholder="科目" style="width:50px;font-size:12px">';
+    h += '<button class="btn btn-p" style="padding:2px 8px;font-size:11px" onclick="addSlotManual(' + wi + ',\'' + day + '\',\'' + ts + '\',' + bi + ')">追加</button>';
+    h += '</div></div>';
+  }
+
+  h += '</div><div class="modal-footer"><button class="btn btn-o" onclick="closeSlotEditModal()">閉じる</button><button class="btn btn-p" onclick="saveSlotEdit(' + wi + ',\'' + day + '\',\'' + ts + '\',' + bi + ')">保存</button></div></div>';
+  m.innerHTML = h; document.getElementById('modalRoot').appendChild(m);
+}
+
+function addSlotManual(wi, day, ts, bi) {
+  const name = document.getElementById('newSlotName').value;
+  const subj = document.getElementById('newSlotSubj').value;
+  if (!name || !subj) { showUpErr('生徒と科目を入力してください'); return; }
+  const st = R.students.find(s => s.name === name);
+  const grade = st ? st.grade : '?';
+  R.schedule[wi][day][ts][bi].slots.push([grade, name, subj]);
+  edited = true;
+  const unp = R.unplaced.find(u => u.name === name && u.subject === subj);
+  if (unp) {
+    unp.count--;
+    if (unp.count <= 0) { R.unplaced = R.unplaced.filter(u => u !== unp); }
+  }
+  closeSlotEditModal(); rR();
+}
+function removeSlot(wi, day, ts, bi, idx) {
+  if (!confirm('このコマを削除しますか？')) return;
+  const s = R.schedule[wi][day][ts][bi].slots[idx];
+  let u = R.unplaced.find(x => x.name === s[1] && x.subject === s[2]);
+  if (u) u.count++; else R.unplaced.push({ grade: s[0], name: s[1], subject: s[2], count: 1, reason: '手動削除' });
+  R.schedule[wi][day][ts][bi].slots.splice(idx, 1);
+  edited = true; closeSlotEditModal(); rR();
+}
+function saveSlotEdit(wi, day, ts, bi) {
+  const t = document.getElementById('seTeacher').value;
+  // オブジェクトの参照共有を切るためのディープコピー（安全策）
+  let booth = R.schedule[wi][day][ts][bi];
+  const newBooth = JSON.parse(JSON.stringify(booth));
+
+  // スロット内の科目変更を適用
+  newBooth.slots.forEach((s, idx) => {
+    const sel = document.getElementById('seSubj_' + idx);
+    if (sel) s[2] = sel.value;
+  });
+
+  // 講師を変更
+  newBooth.teacher = t;
+
+  // 更新（参照を置き換え）
+  R.schedule[wi][day][ts][bi] = newBooth;
+
+  edited = true; closeSlotEditModal(); rR();
+}
+function closeSlotEditModal() { const m = document.querySelector('.modal-overlay'); if (m) m.remove(); }
+
+function showOfficeTeacherPicker(anchor, wi, day) {
+  document.querySelectorAll('.teacher-picker').forEach(p => p.remove());
+  const available = getAvailableTeachers(wi, day);
+  const current = (R.officeTeachers[wi] || {})[day] || '';
+  const picker = document.createElement('div'); picker.className = 'teacher-picker';
+  picker.style.cssText = 'position:absolute;z-index:100;background:#fff;border:1px solid var(--border);border-radius:8px;box-shadow:0 4px 16px rgba(0,0,0,.15);padding:6px 0;min-width:120px;max-height:240px;overflow-y:auto';
+  const rect = anchor.getBoundingClientRect();
+  picker.style.left = rect.left + 'px'; picker.style.top = (rect.bottom + 4) + 'px';
+  // 「なし」オプション
+  const noneOpt = document.createElement('div');
+  noneOpt.style.cssText = 'padding:4px 12px;cursor:pointer;font-size:12px;color:var(--ink3)';
+  noneOpt.textContent = '-- なし --';
+  noneOpt.onmouseenter = () => noneOpt.style.background = '#f0f7ff';
+  noneOpt.onmouseleave = () => noneOpt.style.background = '';
+  noneOpt.onclick = () => { R.officeTeachers[wi][day] = ''; picker.remove(); edited = true; rR(); scheduleAutoSave(); };
+  picker.appendChild(noneOpt);
+  // 講師オプション
+  available.forEach(t => {
+    const opt = document.createElement('div');
+    opt.style.cssText = 'padding:4px 12px;cursor:pointer;font-size:12px' + (t === current ? ';font-weight:700;color:var(--accent)' : '');
+    opt.textContent = t;
+    opt.onmouseenter = () => opt.style.background = '#f0f7ff';
+    opt.onmouseleave = () => opt.style.background = '';
+    opt.onclick = () => { if (!R.officeTeachers[wi]) R.officeTeachers[wi] = {}; R.officeTeachers[wi][day] = t; picker.remove(); edited = true; rR(); scheduleAutoSave(); };
+    picker.appendChild(opt);
+  });
+  document.body.appendChild(picker);
+  const close = (e) => { if (!picker.contains(e.target) && e.target !== anchor) { picker.remove(); document.removeEventListener('click', close); } };
+  setTimeout(() => document.addEventListener('click', close), 0);
+}
+
+function rW(wrap, wi) {
+  const ws = R.schedule[wi];
+  const tbl = document.createElement('table'); tbl.className = 'sch';
+  let hd = '<thead><tr><th style="width:50px">時間</th><th style="width:32px">B</th>'; for (const d of D) { const dl = getDateLabel(wi, d); hd += '<th style="width:calc((100% - 82px)/6*0.8)' + (d === '土' ? ';background:#edf2f7' : '') + '">' + d + (dl ? '<br><span style="font-size:10px;font-weight:400;color:var(--ink3)">' + dl + '</span>' : '') + '</th>'; }
+  hd += '</tr><tr class="or"><td colspan="2">教室業務</td>';
+  for (const d of D) {
+    if (!isInMonth(wi, d)) { hd += '<td></td>'; continue; }
+    const ov = (R.officeTeachers[wi] || {})[d] || '';
+    if (ov === '休塾日') hd += '<td><span class="holiday-cell">休塾日</span></td>';
+    else {
+      const assignedInDay = getAssignedTeachers(wi, d);
+      const isDup = assignedInDay.has(ov);
+      hd += '<td data-office-day="' + d + '" style="cursor:pointer" title="クリックで変更"><span class="' + (isDup ? 'tn dup' : '') + '">' + escHtml(ov || '-- なし --') + '</span></td>';
+    }
+  }
+  hd += '</tr></thead>'; tbl.innerHTML = hd;
+  tbl.querySelectorAll('[data-office-day]').forEach(td => {
+    td.addEventListener('click', () => showOfficeTeacherPicker(td, wi, td.dataset.officeDay));
+  });
+  const tbody = document.createElement('tbody');
+  const MX = 6;// 常に6ブース行を表示
+  for (const tl of TL) {
+    const ts = TS[tl];
+    // 重複チェック用のカウント
+    const tCounts = {};
+    for (const d of D) {
+      tCounts[d] = {};
+      // 教室業務
+      const ot = (R.officeTeachers[wi] || {})[d];
+      if (ot && ot !== '休塾日') tCounts[d][ot] = (tCounts[d][ot] || 0) + 1;
+      // 各ブース
+      const bs = ws[d]?.[ts] || [];
+      bs.forEach(b => { if (b.teacher) tCounts[d][b.teacher] = (tCounts[d][b.teacher] || 0) + 1; });
+    }
+
+    for (let bi = 0; bi < MX; bi++) {
+      const tr = document.createElement('tr'); if (!(bi % 2)) tr.className = 'er'; if (!bi) tr.style.borderTop = '2px solid #b8c5d4';
+      if (!bi) { const td = document.createElement('td'); td.className = 'tc'; td.rowSpan = MX; td.textContent = tl; tr.appendChild(td); }
+      const btd = document.createElement('td'); btd.className = 'bc'; btd.textContent = BL[bi] || ''; tr.appendChild(btd);
+      for (const d of D) {
+        const dt = d === '土' ? ST : WT; const td = document.createElement('td');
+        if (!isInMonth(wi, d) || !dt.includes(tl)) { td.className = 'cd'; td.textContent = '-'; tr.appendChild(td); continue; }
+        td.className = 'booth-cell'; td.dataset.day = d; td.dataset.ts = ts; td.dataset.bi = bi; const bs = ws[d]?.[ts] || [], b = bs[bi];
+        if (b && b.teacher) {
+          if (b.slots.length === 0) td.classList.add('empty-booth');
+          const isDup = (tCounts[d][b.teacher] > 1);
+          td.appendChild(mkTeacher(b.teacher, wi, d, ts, bi, isDup));
+          b.slots.forEach((sl, si) => { td.appendChild(mkChip(sl, wi, d, ts, bi, si, b.teacher)); }); if (b.slots.length >= 2) td.classList.add('full');
+        }
+        else {
+          td.classList.add('empty-booth'); td.style.cursor = 'pointer';
+          const dash = document.createElement('span'); dash.className = 'tn'; dash.textContent = '-'; dash.style.opacity = '.4'; dash.style.cursor = 'pointer';
+          td.appendChild(dash);
+          td.addEventListener('click', e => { e.stopPropagation(); showEmptyBoothPicker(td, wi, d, ts, bi); });
+          if (b && b.slots && b.slots.length) { b.slots.forEach((sl, si) => { td.appendChild(mkChip(sl, wi, d, ts, bi, si, b.teacher || '')); }); }
+        }
+        td.addEventListener('dragover', e => {
+          e.preventDefault(); if (!dragData) return; const bth = bs[bi];
+          if (dragData.type === 'teacher') { if (dragData.wi === wi && dragData.day === d && dragData.ts === ts && dragData.bi !== bi) { td.classList.add('drag-over'); } return; }
+          if (!bth || !bth.teacher) return;
+          if (dragData.type === 'booth' && (dragData.wi !== wi)) return;
+          if (dragData.type === 'unplaced' && bth.slots.length >= 2) return;
+          td.classList.add('drag-over');
+          if (bth.slots.length < 2) previewMove(td, wi, d, ts, bi);
+        });
+        td.addEventListener('dragleave', () => { td.classList.remove('drag-over'); });
+        td.addEventListener('drop', e => {
+          e.preventDefault(); td.classList.remove('drag-over');
+          if (dragData && dragData.type === 'teacher') { doTeacherSwap(wi, d, ts, bi); return; }
+          if (dragData && dragData.type !== 'teacher') doBooth(wi, d, ts, bi);
+        });
+        tr.appendChild(td);
+      } tbody.appendChild(tr);
+    }
+  }
+  tbl.appendChild(tbody);
+  const main = document.createElement('div'); main.className = 'schedule-main'; main.appendChild(tbl); wrap.appendChild(main);
+  const sidebar = document.createElement('div'); sidebar.className = 'unplaced-sidebar';
+  const uT = R.unplaced.reduce((s, u) => s + u.count, 0);
+  const lbl = document.createElement('div'); lbl.className = 'unplaced-label'; lbl.textContent = '📦 未配置コマ' + (uT > 0 ? ' (' + uT + ')' : ''); sidebar.appendChild(lbl);
+  const zone = document.createElement('div'); zone.className = 'unplaced-zone';
+  R.unplaced.forEach((u, ui) => { for (let i = 0; i < u.count; i++)zone.appendChild(mkUnChip(u, ui)); });
+  if (!R.unplaced.length) zone.innerHTML = '<span style="color:var(--ink3);font-size:11px">✅ 全コマ配置済み</span>';
+  zone.addEventListener('dragover', e => { e.preventDefault(); if (dragData && (dragData.type === 'booth' || dragData.type === 'calSlot')) zone.classList.add('drag-over'); });
+  zone.addEventListener('dragleave', () => { zone.classList.remove('drag-over'); });
+  zone.addEventListener('drop', e => { e.preventDefault(); zone.classList.remove('drag-over'); doUnplaced(); });
+  sidebar.appendChild(zone);
+  const addBtn = document.createElement('button'); addBtn.className = 'btn btn-o'; addBtn.style.cssText = 'margin-top:8px;font-size:12px;padding:4px 12px';
+  addBtn.textContent = '＋ 未配置コマ追加'; addBtn.onclick = () => showAddUnplacedModal(); sidebar.appendChild(addBtn);
+  wrap.appendChild(sidebar);
+  // チップ最大幅を計測してサイドバー幅を合わせる
+  requestAnimationFrame(() => {
+    const chips = zone.querySelectorAll('.slot-chip');
+    if (!chips.length) return;
+    let maxW = 0;
+    chips.forEach(c => { const w = c.scrollWidth; if (w > maxW) maxW = w; });
+    if (maxW > 0) {
+      const chipW = maxW + 2; // border分
+      chips.forEach(c => { c.style.width = chipW + 'px'; });
+      // サイドバー幅 = チップ幅 + zone padding(20) + sidebar padding(24) + border(2)
+      sidebar.style.width = (chipW + 46) + 'px';
+    }
+  });
+}
+
+// ========== ファイル更新ハンドラ ==========
+// --- 再開直後（Step1）のファイル更新 ---
+async function doPostRestoreMeta(input) {
+  const file = input.files[0];
+  if (!file) return;
+  const status = document.getElementById('postRestoreMetaStatus');
+  status.textContent = '更新中...';
+  status.style.color = '#1565c0';
+  const fd = new FormData();
+  fd.append('file', await preloadFile(file));
+  try {
+    const res = await fetch('/api/update_meta', {method: 'POST', body: fd});
+    const j = await res.json();
+    if (!res.ok || !j.ok) { status.textContent = j.error || 'エラー'; status.style.color = 'red'; return; }
+    R.students = j.students;
+    R.placed = j.placed;
+    R.total = j.total;
+    R.unplaced = j.unplaced;
+    if (j.boothPref) R.boothPref = j.boothPref;
+    buildNgMap();
+    document.getElementById('postRestoreMsg').textContent = '✅ スケジュール再開準備完了 (' + j.placed + '/' + j.total + 'コマ)';
+    status.textContent = `✅ ${j.studentCount}名の生徒データを更新（未配置: ${j.unplaced.length}件）`;
+    status.style.color = 'green';
+  } catch(e) { status.textContent = 'エラー: ' + e.message; status.style.color = 'red'; }
+}
+
+async function doPostRestoreSurvey(input) {
+  const files = input.files;
+  if (!files.length) return;
+  const status = document.getElementById('postRestoreSurveyStatus');
+  status.textContent = 'アップロード中...';
+  status.style.color = '#1565c0';
+  const fd = new FormData();
+  const preloaded = await preloadFiles([...files]);
+  for (const f of preloaded.files) fd.append('surveys', f);
+  try {
+    const res = await fetch('/api/upload_surveys', {method: 'POST', body: fd});
+    const j = await res.json();
+    if (!res.ok || !j.ok) { status.textContent = j.error || 'エラー'; status.style.color = 'red'; return; }
+    if (j.weeklyTeachers) R.weeklyTeachers = j.weeklyTeachers;
+    if (j.surveyNameMap) surveyNameMap = j.surveyNameMap;
+    status.textContent = `✅ ${j.teacherCount}名の講師データ（${j.weeks}週分）を登録 — 結果画面で講師選択が可能になります`;
+    status.style.color = 'green';
+  } catch(e) { status.textContent = 'エラー: ' + e.message; status.style.color = 'red'; }
+}
+
+function finalizeRestore() {
+  go('result'); rR(); showSaveIndicator('スケジュールを再開しました');
+}
+
+// --- 結果画面でのファイル更新 ---
+async function doUpdateMeta(input) {
+  const file = input.files[0];
+  if (!file) return;
+  const status = document.getElementById('updateMetaStatus');
+  status.textContent = '更新中...';
+  status.style.color = '#1565c0';
+  const fd = new FormData();
+  fd.append('file', await preloadFile(file));
+  try {
+    const res = await fetch('/api/update_meta', {method: 'POST', body: fd});
+    const j = await res.json();
+    if (!res.ok || !j.ok) { status.textContent = j.error || 'エラー'; status.style.color = 'red'; return; }
+    // 結果を反映
+    R.students = j.students;
+    R.placed = j.placed;
+    R.total = j.total;
+    R.unplaced = j.unplaced;
+    if (j.boothPref) R.boothPref = j.boothPref;
+    buildNgMap();
+    rR();
+    status.textContent = `${j.studentCount}名の生徒データを更新しました（未配置: ${j.unplaced.length}件）`;
+    status.style.color = 'green';
+  } catch(e) { status.textContent = 'エラー: ' + e.message; status.style.color = 'red'; }
+  input.value = '';
+}
+
+async function doUpdateSurveys(input) {
+  const files = input.files;
+  if (!files.length) return;
+  const status = document.getElementById('updateSurveyStatus');
+  status.textContent = 'アップロード中...';
+  status.style.color = '#1565c0';
+  const fd = new FormData();
+  const preloaded = await preloadFiles([...files]);
+  for (const f of preloaded.files) fd.append('surveys', f);
+  try {
+    const res = await fetch('/api/upload_surveys', {method: 'POST', body: fd});
+    const j = await res.json();
+    if (!res.ok || !j.ok) { status.textContent = j.error || 'エラー'; status.style.color = 'red'; return; }
+    if (j.weeklyTeachers) { R.weeklyTeachers = j.weeklyTeachers; rR(); }
+    status.textContent = `${j.teacherCount}名の講師データ（${j.weeks}週分）を登録しました。講師ピッカーが有効になりました。`;
+    status.style.color = 'green';
+  } catch(e) { status.textContent = 'エラー: ' + e.message; status.style.color = 'red'; }
+  input.value = '';
+}
+
+async function doUpdateBoothTemplate(input) {
+  const files = filterXlsx(input.files);
+  if (!files.length) { showUpErr('フォルダ内に .xlsx ファイルが見つかりません'); return; }
+  const statusEl = input.closest('div').querySelector('[id$="BoothStatus"]');
+  if (statusEl) { statusEl.textContent = files.length + '件アップロード中...'; statusEl.style.color = '#1565c0'; }
+  const fd = new FormData();
+  const preloaded = await preloadFiles(files);
+  for (const f of preloaded.files) fd.append('weeks', f);
+  try {
+    const res = await fetch('/api/upload_booth_template', { method: 'POST', body: fd });
+    const j = await res.json();
+    if (!res.ok || !j.ok) { if (statusEl) { statusEl.textContent = j.error || 'エラー'; statusEl.style.color = 'red'; } return; }
+    let msg = j.weeks + '週' + (j.meta ? '+メタ' : '') + (j.cloudSaved ? ' (クラウド更新済)' : '');
+    if (j.weekDates) R.weekDates = j.weekDates;
+    if (j.hasSchedule && j.schedule) {
+      R.schedule = j.schedule;
+      R.unplaced = j.unplaced || [];
+      // officeTeachers: バックエンドが既存設定を保持するためそのまま適用
+      if (j.officeTeachers) R.officeTeachers = j.officeTeachers;
+      if (j.students) R.students = j.students;
+      if (j.weeklyTeachers) R.weeklyTeachers = j.weeklyTeachers;
+      edited = true; buildNgMap();
+      msg += ' — 配置反映 (' + (j.placed || 0) + '/' + (j.total || 0) + 'コマ)';
+    }
+    rR();
+    if (statusEl) { statusEl.textContent = msg; statusEl.style.color = 'green'; }
+    showSaveIndicator('ブース表エクセル更新');
+  } catch (e) { if (statusEl) { statusEl.textContent = 'エラー: ' + e.message; statusEl.style.color = 'red'; } }
+  input.value = '';
+}
+
+function showAddUnplacedModal(preStudent) {
+  const root = document.getElementById('modalRoot');
+  const bg = document.createElement('div'); bg.className = 'modal-bg';
+  const modal = document.createElement('div'); modal.className = 'modal'; modal.style.cssText = 'min-width:320px;padding:20px';
+  const sorted = [...(R.students || [])].sort((a, b) => (a.grade || '').localeCompare(b.grade || '') || (a.name || '').localeCompare(b.name || ''));
+  let h = '<h3 style="margin:0 0 12px">＋ 未配置コマ追加</h3>';
+  h += '<div style="margin-bottom:10px"><label style="font-size:12px;font-weight:600">生徒</label>';
+  h += '<select id="addUpStudent" style="width:100%;padding:6px;border:1px solid var(--border);border-radius:6px;font-size:13px;margin-top:4px">';
+  h += '<option value="">選択してください...</option>';
+  sorted.forEach(s => { h += '<option value="' + escHtml(s.name) + '" data-grade="' + escHtml(s.grade || '') + '"' + (preStudent === s.name ? ' selected' : '') + '>' + escHtml(s.grade || '') + ' ' + escHtml(s.name) + '</option>'; });
+  h += '</select></div>';
+  h += '<div style="margin-bottom:10px"><label style="font-size:12px;font-weight:600">科目</label>';
+  h += '<select id="addUpSubj" style="width:100%;padding:6px;border:1px solid var(--border);border-radius:6px;font-size:13px;margin-top:4px"><option value="">先に生徒を選択...</option></select></div>';
+  h += '<div style="margin-bottom:14px"><label style="font-size:12px;font-weight:600">コマ数</label>';
+  h += '<input type="number" id="addUpCount" value="1" min="1" max="20" style="width:60px;padding:6px;border:1px solid var(--border);border-radius:6px;font-size:13px;margin-top:4px;margin-left:8px"></div>';
+  h += '<div style="display:flex;gap:8px;justify-content:flex-end">';
+  h += '<button class="btn btn-o" id="addUpCancel">キャンセル</button>';
+  h += '<button class="btn btn-g" id="addUpOk">追加</button></div>';
+  modal.innerHTML = h; bg.appendChild(modal); root.appendChild(bg);
+  const SUBJECTS = ['英','英検','数','算','国','理','社','現','古','物','化','生','日','地','政','世'];
+  function updateSubjects() {
+    const name = document.getElementById('addUpStudent').value;
+    const sel = document.getElementById('addUpSubj'); sel.innerHTML = '';
+    if (!name) { sel.innerHTML = '<option value="">先に生徒を選択...</option>'; return; }
+    const st = R.students.find(s => s.name === name);
+    const subjs = st && st.needs ? Object.keys(st.needs) : [];
+    if (subjs.length) { subjs.forEach(s => { sel.innerHTML += '<option value="' + s + '">' + s + (st.needs[s] ? ' (必要:' + st.needs[s] + ')' : '') + '</option>'; }); }
+    SUBJECTS.filter(s => !subjs.includes(s)).forEach(s => { sel.innerHTML += '<option value="' + s + '">' + s + ' (新規)</option>'; });
+  }
+  document.getElementById('addUpStudent').onchange = updateSubjects;
+  if (preStudent) updateSubjects();
+  document.getElementById('addUpCancel').onclick = () => { root.innerHTML = ''; };
+  document.getElementById('addUpOk').onclick = () => {
+    const name = document.getElementById('addUpStudent').value;
+    const subj = document.getElementById('addUpSubj').value;
+    const count = parseInt(document.getElementById('addUpCount').value) || 1;
+    if (!name || !subj) { alert('生徒と科目を選択してください'); return; }
+    const st = R.students.find(s => s.name === name);
+    const grade = st ? (st.grade || '') : '';
+    const existing = R.unplaced.find(u => u.name === name && u.subject === subj);
+    if (existing) { existing.count += count; } else { R.unplaced.push({ grade: grade, name: name, subject: subj, count: count, reason: '手動追加' }); }
+    R.total = (R.total || 0) + count;
+    edited = true; root.innerHTML = ''; rR();
+  };
+  bg.addEventListener('click', e => { if (e.target === bg) root.innerHTML = ''; });
+}
+
+// === Teacher Availability ===
+function exportTeacherAvail() {
+  const a = document.createElement('a');
+  a.href = '/api/export_teacher_avail'; a.click();
+}
+
+function renderTeacherAvail(wrap) {
+  wrap.innerHTML = '';
+  const wt = R.weeklyTeachers;
+  if (!wt || !wt.length) { wrap.innerHTML = '<p>講師データがありません</p>'; return; }
+
+  const dlBtn = document.createElement('button'); dlBtn.className = 'btn btn-s';
+  dlBtn.style.cssText = 'margin-bottom:8px'; dlBtn.textContent = '📥 Excelエクスポート';
+  dlBtn.onclick = exportTeacherAvail; wrap.appendChild(dlBtn);
+
+  const tbl = document.createElement('table'); tbl.className = 'cal-tbl';
+  let hd = '<thead><tr><th style="width:70px">日程</th>';
+  for (const d of D) hd += '<th>' + d + '</th>';
+  hd += '</tr></thead>';
+  tbl.innerHTML = hd;
+
+  const tbody = document.createElement('tbody');
+  for (let wi = 0; wi < R.schedule.length; wi++) {
+    const tr = document.createElement('tr');
+    const wTd = document.createElement('td');
+    wTd.style.cssText = 'text-align:center;font-weight:700;font-size:11px;line-height:1.4;white-space:nowrap';
+    wTd.innerHTML = getWeekRange(wi);
+    tr.appendChild(wTd);
+
+    for (const day of D) {
+      const td = document.createElement('td'); td.style.verticalAlign = 'top';
+
+      if (!isInMonth(wi, day)) { tr.appendChild(td); continue; }
+
+      const isHoliday = (R.officeTeachers[wi] && R.officeTeachers[wi][day] === '休塾日');
+      const dl = getDateLabel(wi, day);
+
+      if (dl) {
+        const dateEl = document.createElement('div');
+        dateEl.className = 'cal-date';
+        dateEl.textContent = dl + (isHoliday ? ' 🎌休塾日' : '');
+        if (isHoliday) dateEl.style.color = '#c62828';
+        td.appendChild(dateEl);
+      }
+      if (isHoliday) { td.style.background = '#ffebee'; tr.appendChild(td); continue; }
+
+      // 教室業務担当
+      const ot = (R.officeTeachers[wi] || {})[day];
+      if (ot) {
+        const offEl = document.createElement('div');
+        offEl.className = 'avail-office';
+        offEl.textContent = '📋 ' + ot;
+        td.appendChild(offEl);
+      }
+
+      // 出勤可能講師を集計
+      const dayData = (wt[wi] && wt[wi][day]) ? wt[wi][day] : {};
+      const teacherMap = {};
+      for (const [ts, teachers] of Object.entries(dayData)) {
+        for (const t of (teachers || [])) {
+          if (!teacherMap[t]) teacherMap[t] = [];
+          teacherMap[t].push(ts);
+        }
+      }
+      const sorted = Object.keys(teacherMap).sort();
+      for (const t of sorted) {
+        const row = document.createElement('div'); row.className = 'avail-teacher';
+        const nameEl = document.createElement('span'); nameEl.className = 'avail-name';
+        nameEl.textContent = t;
+        const timesEl = document.createElement('span'); timesEl.className = 'avail-times';
+        const tsList = teacherMap[t].sort();
+        const first = tsList[0], last = tsList[tsList.length - 1];
+        timesEl.textContent = first === last ? first : first + '‐' + last;
+        row.appendChild(nameEl);
+        row.appendChild(timesEl);
+        td.appendChild(row);
+      }
+      if (!sorted.length && !ot) {
+        const em = document.createElement('span'); em.className = 'cal-empty'; em.textContent = '-'; td.appendChild(em);
+      }
+      tr.appendChild(td);
+    }
+    tbody.appendChild(tr);
+  }
+  tbl.appendChild(tbody);
+  wrap.appendChild(tbl);
+}
+
+// === Student Calendar ===
+function rCal(wrap) {
+  if (!R.students || !R.students.length) { wrap.innerHTML = '<p>生徒データがありません</p>'; return; }
+
+  const selDiv = document.createElement('div'); selDiv.className = 'cal-sel';
+  const lb = document.createElement('span'); lb.textContent = '生徒:'; lb.style.fontWeight = '600'; selDiv.appendChild(lb);
+
+  const dd = document.createElement('select'); dd.id = 'calSel';
+  R.students.forEach((s, i) => { const o = document.createElement('option'); o.value = i; o.textContent = s.grade + ' ' + s.name; if (calStudent === i) o.selected = true; dd.appendChild(o); });
+  dd.onchange = async () => { calStudent = parseInt(dd.value); await ensureStudentSlots(R.students[calStudent].name); rCal(wrap); };
+  selDiv.appendChild(dd);
+
+  // 配置数表示
+  if (calStudent !== null && R.students[calStudent]) {
+    const sName = R.students[calStudent].name;
+    const cached = R.pendingWeeks && R.pendingWeeks.size && R.slotCache && R.slotCache[sName];
+    const placed = cached ? cached.reduce((o, sl) => { o[sl.subj] = (o[sl.subj] || 0) + 1; return o; }, {}) : countPlaced(sName); // {subj: count}
+    const needs = getStudentNeeds(sName); // {subj: need}
+
+    // 科目の和集合を取得
+    const allSubjs = new Set([...Object.keys(placed), ...Object.keys(needs)]);
+    const details = [];
+    let totalPlaced = 0;
+    let totalNeeds = 0;
+
+    allSubjs.forEach(sb => {
+      const p = placed[sb] || 0;
+      const n = needs[sb] || 0;
+      totalPlaced += p;
+      totalNeeds += n;
+      // 表示: "英:1/2"
+      details.push(sb + ':' + p + '/' + n);
+    });
+
+    const info = document.createElement('span');
+    info.style.marginLeft = '12px';
+    info.style.fontSize = '12px';
+    info.style.fontWeight = 'bold';
+
+    // 色分け
+    info.style.color = (totalPlaced < totalNeeds) ? 'var(--red)' : ((totalPlaced > totalNeeds) ? 'var(--orange)' : 'var(--green)');
+    info.textContent = `(${details.join(', ')})`;
+    selDiv.appendChild(info);
+  }
+
+  wrap.innerHTML = ''; // Clear previous content (important for re-render)
+  wrap.appendChild(selDiv);
+
+  const cw = document.createElement('div'); cw.id = 'calWrap'; wrap.appendChild(cw);
+  if (calStudent === null) calStudent = 0;
+  renderStudentCal();
+}
+
+function getStudentSlots(name) {
+  if (R.pendingWeeks && R.pendingWeeks.size && R.slotCache && R.slotCache[name]) return R.slotCache[name];
+  const slots = [];
+  for (let wi = 0; wi < R.schedule.length; wi++) {
+    for (const day of D) {
+      for (const [ts, booths] of Object.entries(R.schedule[wi][day] || {})) {
+        for (let bi = 0; bi < booths.length; bi++) {
+          const b = booths[bi]; for (let si = 0; si < b.slots.length; si++) {
+            if (b.slots[si][1] === name) slots.push({ wi, day, ts, bi, si, grade: b.slots[si][0], subj: b.slots[si][2], teacher: b.teacher });
+          }
+        }
+      }
+    }
+  }
+  return slots;
+}
+
+function fmtAvail(avail) {
+  if (!avail || !avail.length) return '-';
+  const dayMap = {};
+  avail.forEach(a => { const d = a[0], t = a[1]; if (!dayMap[d]) dayMap[d] = []; dayMap[d].push(t); });
+  return Object.entries(dayMap).map(([d, ts]) => d + ts.sort().join(',')).join(' / ');
+}
+function fmtFixed(fixed) {
+  if (!fixed || !fixed.length) return '-';
+  return fixed.map(f => f[0] + f[1] + ':' + f[2]).join(', ');
+}
+function renderStudentInfo(s, slots) {
+  const panel = document.createElement('div'); panel.className = 'stu-info-panel';
+  const totalNeeds = Object.values(s.needs || {}).reduce((a, b) => a + b, 0);
+  const placedCount = slots.length;
+  const unplacedForStudent = R.unplaced.filter(u => u.name === s.name).reduce((a, u) => a + u.count, 0);
+  let needsHtml = Object.entries(s.needs || {}).map(([subj, cnt]) => '<span class="stu-tag subj">' + subj + ' <b>' + cnt + '</b></span>').join('');
+  if (!needsHtml) needsHtml = '<span style="color:var(--ink3)">-</span>';
+  let availHtml = fmtAvail(s.avail);
+  let backupHtml = fmtAvail(s.backup_avail);
+  let fixedHtml = fmtFixed(s.fixed);
+  let wishHtml = (s.wish_teachers || []).map(t => '<span class="stu-tag wish">' + escHtml(t) + '</span>').join('') || '<span style="color:var(--ink3)">-</span>';
+  let ngTHtml = (s.ng_teachers || []).map(t => '<span class="stu-tag ng">' + escHtml(t) + '</span>').join('') || '<span style="color:var(--ink3)">-</span>';
+  let ngSHtml = (s.ng_students || []).map(t => '<span class="stu-tag ngs">' + escHtml(t) + '</span>').join('') || '<span style="color:var(--ink3)">-</span>';
+
+  let html = '<h4>' + escHtml(s.grade) + ' ' + escHtml(s.name) + ' <span style="font-size:12px;font-weight:400;color:var(--ink3)">配置: ' + placedCount + '/' + totalNeeds + 'コマ';
+  if (unplacedForStudent > 0) html += ' <span style="color:var(--red)">未配置:' + unplacedForStudent + '</span>';
+  html += '</span></h4>';
+  html += '<div class="stu-info-grid">';
+  html += '<div class="stu-info-item"><span class="label">必要コマ数</span><div class="value">' + needsHtml + '</div></div>';
+  html += '<div class="stu-info-item"><span class="label">希望時間</span><div class="value" style="font-size:11px">' + availHtml + '</div></div>';
+  html += '<div class="stu-info-item"><span class="label">通常授業</span><div class="value"><span class="stu-tag fixed" style="font-size:11px">' + fixedHtml + '</span></div></div>';
+  html += '<div class="stu-info-item"><span class="label">予備時間</span><div class="value" style="font-size:11px">' + backupHtml + '</div></div>';
+  html += '<div class="stu-info-item"><span class="label">希望講師</span><div class="value">' + wishHtml + '</div></div>';
+  html += '<div class="stu-info-item"><span class="label">NG講師</span><div class="value">' + ngTHtml + '</div></div>';
+  html += '<div class="stu-info-item"><span class="label">NG生徒</span><div class="value">' + ngSHtml + '</div></div>';
+  if (s.notes) { html += '<div class="stu-info-notes">備考: ' + escHtml(s.notes) + '</div>'; }
+  html += '</div>';
+  panel.innerHTML = html;
+  return panel;
+}
+
+function getDateLabel(wi, day) {
+  const wd = R.weekDates;
+  if (!wd || !wd.weeks || !wd.weeks[wi]) return '';
+  const d = wd.weeks[wi][day];
+  return d ? wd.month + '/' + d : '';
+}
+function isInMonth(wi, day) {
+  const wd = R.weekDates;
+  if (!wd || !wd.weeks || !wd.weeks[wi]) return true;
+  return wd.weeks[wi][day] !== undefined;
+}
+function getWeekRange(wi) {
+  const wd = R.weekDates;
+  if (!wd || !wd.weeks || !wd.weeks[wi]) return 'W' + (wi + 1);
+  const wk = wd.weeks[wi];
+  const days = Object.values(wk).sort((a, b) => a - b);
+  if (!days.length) return 'W' + (wi + 1);
+  return wd.month + '/' + days[0] + '~' + days[days.length - 1];
+}
+
+function renderStudentCal() {
+  try {
+    const s = R.students[calStudent]; if (!s) return;
+    const cw = document.getElementById('calWrap'); if (!cw) return;
+    const slots = getStudentSlots(s.name);
+    const grid = {}; slots.forEach(sl => { const k = sl.wi + '_' + sl.day; if (!grid[k]) grid[k] = []; grid[k].push(sl); });
+
+    // NG日程セット作成 (効率化のため)
+    const ngDateSet = new Set();
+    if (s.ng_dates && Array.isArray(s.ng_dates)) {
+      s.ng_dates.forEach(d => ngDateSet.add(d[0] + '_' + d[1]));
+    }
+
+    cw.innerHTML = '';
+    // Student info panel
+    cw.appendChild(renderStudentInfo(s, slots));
+
+    const tbl = document.createElement('table'); tbl.className = 'cal-tbl';
+    let hd = '<thead><tr><th style="width:70px">日程</th>'; for (const d of D) hd += '<th>' + d + '</th>'; hd += '</tr></thead>';
+    tbl.innerHTML = hd;
+    const tbody = document.createElement('tbody');
+    for (let wi = 0; wi < R.schedule.length; wi++) {
+      const tr = document.createElement('tr');
+      const wTd = document.createElement('td');
+      wTd.style.cssText = 'text-align:center;font-weight:700;font-size:11px;line-height:1.4;cursor:pointer;color:var(--accent)';
+      wTd.title = '全体スケジュールへ移動';
+      wTd.innerHTML = getWeekRange(wi);
+      wTd.onclick = () => { PW = wi; rR(); };
+      tr.appendChild(wTd);
+
+      for (const day of D) {
+        const td = document.createElement('td'); td.className = 'cal-drop';
+
+        // 対象月外の日は何も表示しない
+        const inMonth = isInMonth(wi, day);
+        if (!inMonth) { tr.appendChild(td); continue; }
+
+        // 休塾日チェック
+        const isHoliday = (R.officeTeachers[wi] && R.officeTeachers[wi][day] === '休塾日');
+        if (isHoliday) {
+          td.classList.add('holiday');
+          td.style.background = '#ffebee';
+        }
+        // NG日程チェック
+        const isNgDate = ngDateSet.has(wi + '_' + day);
+        if (isNgDate) {
+          td.style.background = '#fff8e1'; // 薄い黄色
+        }
+
+        // 日付ラベル
+        const dl = getDateLabel(wi, day);
+        if (dl || isHoliday || isNgDate) {
+          const dateEl = document.createElement('div');
+          dateEl.className = 'cal-date';
+          let label = dl || '';
+          if (isHoliday) label = (label ? label + ' ' : '') + '🎌休塾日';
+          else if (isNgDate) label = (label ? label + ' ' : '') + '❌NG';
+
+          dateEl.textContent = label;
+          if (isHoliday) dateEl.style.color = '#c62828';
+          if (isNgDate) dateEl.style.color = '#ef6c00';
+
+          // 日付クリックで全体スケジュールへ移動
+          dateEl.style.cursor = 'pointer';
+          dateEl.onclick = (e) => { e.stopPropagation(); PW = wi; rR(); };
+
+          td.appendChild(dateEl);
+        }
+
+        const items = grid[wi + '_' + day] || [];
+        items.sort((a, b) => (TSR[a.ts] || '').localeCompare(TSR[b.ts] || ''));
+        for (const it of items) {
+          const chip = document.createElement('div');
+          const ng = isNg(s.name, it.teacher);
+          chip.className = 'cal-slot' + (ng ? ' ng' : ''); chip.draggable = true;
+          const tName = it.teacher || '未配置';
+          chip.innerHTML = escHtml((TSR[it.ts] || it.ts).slice(0, 5)) + ' ' + escHtml(it.subj) + ' <span style="font-size:9px;color:' + (ng ? '#c62828' : (it.teacher ? '#666' : '#ea580c')) + '">' + escHtml(tName) + '</span>';
+          if (!it.teacher) chip.classList.add('no-teacher');
+          chip.addEventListener('dragstart', e => { dragData = { type: 'calSlot', wi: it.wi, day: it.day, ts: it.ts, bi: it.bi, si: it.si, slot: [it.grade, s.name, it.subj] }; chip.style.opacity = '0.4'; e.dataTransfer.effectAllowed = 'move'; });
+          chip.addEventListener('dragend', () => { chip.style.opacity = '1'; dragData = null; });
+          ((it_) => { chip.addEventListener('click', e => { e.stopPropagation(); showSlotEditModal(s, it_); }); })(it);
+          td.appendChild(chip);
+        }
+        if (!items.length && !dl && !isHoliday && !isNgDate) { const em = document.createElement('span'); em.className = 'cal-empty'; em.textContent = '-'; td.appendChild(em); }
+        // Drop: move into this day/week with teacher selection
+        td.addEventListener('dragover', e => { e.preventDefault(); if (dragData && (dragData.type === 'calSlot' || dragData.type === 'booth' || dragData.type === 'unplaced')) td.classList.add('drag-over'); });
+        td.addEventListener('dragleave', () => { td.classList.remove('drag-over'); });
+        ((wi_, day_) => {
+          td.addEventListener('drop', e => {
+            e.preventDefault(); td.classList.remove('drag-over');
+            if (!dragData || (dragData.type !== 'calSlot' && dragData.type !== 'booth' && dragData.type !== 'unplaced')) return;
+            if (R.pendingWeeks && R.pendingWeeks.size) { showSaveIndicator('読み込み中です。少し待ってから移動してください'); return; }
+            showTeacherModal(wi_, day_, dragData);
+          });
+        })(wi, day);
+        tr.appendChild(td);
+      }
+      tbody.appendChild(tr);
+    }
+    tbl.appendChild(tbody);
+    cw.appendChild(tbl);
+    const info = document.createElement('div'); info.style.cssText = 'margin-top:8px;font-size:12px;color:var(--ink2)';
+    info.innerHTML = '合計: <b>' + slots.length + 'コマ</b>　<span style="font-size:11px;color:var(--orange)">✋ クリックで講師/時間変更、ドラッグで別の日に移動</span>';
+    cw.appendChild(info);
+
+    // 対象生徒の未配置コマ表示
+    const stuUnplaced = R.unplaced.filter(u => u.name === s.name);
+    if (stuUnplaced.length) {
+      const upLabel = document.createElement('div'); upLabel.className = 'unplaced-label';
+      upLabel.textContent = '📦 未配置コマ（カレンダーにドラッグして配置）';
+      cw.appendChild(upLabel);
+      const upZone = document.createElement('div'); upZone.className = 'unplaced-zone';
+      stuUnplaced.forEach(u => {
+        const gi = R.unplaced.indexOf(u);
+        for (let i = 0; i < u.count; i++) {
+          const chip = document.createElement('div'); chip.className = 'slot-chip'; chip.draggable = true;
+          chip.innerHTML = '<span class="g">' + escHtml(u.grade) + '</span><span class="s">' + escHtml(u.name) + '</span><span class="j">' + escHtml(u.subject) + '</span>';
+          ((gi_) => {
+            chip.addEventListener('dragstart', e => { dragData = { type: 'unplaced', ui: gi_, slot: [u.grade, u.name, u.subject] }; chip.style.opacity = '0.4'; e.dataTransfer.effectAllowed = 'move'; });
+          })(gi);
+          chip.addEventListener('dragend', () => { chip.style.opacity = '1'; dragData = null; });
+          upZone.appendChild(chip);
+        }
+      });
+      cw.appendChild(upZone);
+    }
+  } catch (e) {
+    console.error('Error rendering student calendar:', e);
+    const cw = document.getElementById('calWrap');
+    if (cw) cw.innerHTML = '<div style="color:var(--red);padding:20px;">カレンダー表示エラー: ' + escHtml(e.message) + '</div>';
+  }
+}
+
+// === Teacher selection modal ===
+function showTeacherModal(targetWi, targetDay, dd) {
+  const ws = R.schedule[targetWi];
+  const dayData = ws[targetDay] || {};
+  // Collect available booths with space
+  const times = targetDay === '土' ? ['14', '16', '17', '18'] : ['16', '17', '18', '19', '20'];
+  const options = [];// {ts, bi, teacher, slots_count}
+  for (const ts of times) {
+    const booths = dayData[ts] || [];
+    for (let bi = 0; bi < booths.length; bi++) {
+      if (booths[bi].slots.length < 2) {
+        options.push({ ts, bi, teacher: booths[bi].teacher, cnt: booths[bi].slots.length, time: TSR[ts] || ts });
+      }
+    }
+  }
+  if (!options.length) { showUpErr('この曜日に空きブースがありません'); return; }
+  const root = document.getElementById('modalRoot');
+  const bg = document.createElement('div'); bg.className = 'modal-bg';
+  const modal = document.createElement('div'); modal.className = 'modal';
+  modal.innerHTML = '<h3>📍 W' + (targetWi + 1) + ' ' + targetDay + '曜 - 配置先を選択</h3>';
+  const opts = document.createElement('div'); opts.className = 'modal-opts';
+  // Group by teacher
+  const byTeacher = {}; options.forEach(o => { if (!byTeacher[o.teacher]) byTeacher[o.teacher] = []; byTeacher[o.teacher].push(o); });
+  for (const [teacher, tOpts] of Object.entries(byTeacher)) {
+    const timesList = tOpts.map(o => o.time.slice(0, 5) + '(' + o.cnt + '/2)').join(', ');
+    const btn = document.createElement('div'); btn.className = 'modal-opt';
+    const ngMark = dd.slot ? isNg(dd.slot[1], teacher) : '';
+    btn.innerHTML = '<span class="t-name" style="' + (ngMark ? 'color:var(--red)' : '') + '">' + (ngMark ? '⚠ ' : '') + escHtml(teacher) + '</span><span class="t-info">' + escHtml(timesList) + '</span>';
+    btn.onclick = () => {
+      const pick = tOpts[0];
+      if (dd.type === 'unplaced') { const u = R.unplaced[dd.ui]; if (u) { u.count--; if (u.count <= 0) R.unplaced.splice(dd.ui, 1); } }
+      else { const srcWs = R.schedule[dd.wi]; srcWs[dd.day][dd.ts][dd.bi].slots.splice(dd.si, 1); }
+      ws[targetDay][pick.ts][pick.bi].slots.push(dd.slot);
+      edited = true; dragData = null; root.innerHTML = ''; rR();
+    };
+    opts.appendChild(btn);
+    // Show individual time slots if multiple
+    if (tOpts.length > 1) {
+      for (const o of tOpts) {
+        const sub = document.createElement('div'); sub.className = 'modal-opt'; sub.style.paddingLeft = '28px';
+        sub.innerHTML = '<span class="t-info">└ ' + escHtml(o.time) + ' (' + o.cnt + '/2)</span>';
+        sub.onclick = () => {
+          if (dd.type === 'unplaced') { const u = R.unplaced[dd.ui]; if (u) { u.count--; if (u.count <= 0) R.unplaced.splice(dd.ui, 1); } }
+          else { const srcWs = R.schedule[dd.wi]; srcWs[dd.day][dd.ts][dd.bi].slots.splice(dd.si, 1); }
+          ws[targetDay][o.ts][o.bi].slots.push(dd.slot);
+          edited = true; dragData = null; root.innerHTML = ''; rR();
+        };
+        opts.appendChild(sub);
+      }
+    }
+  }
+  modal.appendChild(opts);
+  const cancel = document.createElement('div'); cancel.className = 'modal-cancel';
+  cancel.innerHTML = '<button class="btn btn-o" style="padding:6px 16px;font-size:12px">キャンセル</button>';
+  cancel.querySelector('button').onclick = () => { root.innerHTML = ''; dragData = null; };
+  modal.appendChild(cancel); bg.appendChild(modal); root.appendChild(bg);
+  bg.addEventListener('click', e => { if (e.target === bg) { root.innerHTML = ''; dragData = null; } });
+}
+
+// === Slot Edit Modal (click on calendar slot) ===
+function showSlotEditModal(student, it) {
+  const root = document.getElementById('modalRoot');
+  const ws = R.schedule[it.wi];
+  const dayData = ws[it.day] || {};
+  const sName = student.name;
+  const curTime = TSR[it.ts] || it.ts;
+  const curTeacher = it.teacher;
+
+  // Collect all available slots for this day (same week)
+  const times = it.day === '土' ? ['14', '16', '17', '18'] : ['16', '17', '18', '19', '20'];
+  const options = [];// {ts,bi,teacher,cnt,time}
+  for (const ts of times) {
+    const booths = dayData[ts] || [];
+    for (let bi = 0; bi < booths.length; bi++) {
+      const b = booths[bi];
+      if (!b || !b.teacher) continue;
+      // Skip current position
+      const isCurrent = (ts === it.ts && bi === it.bi);
+      // Available if: current position OR has space (<2) OR can swap (has 1 student)
+      const hasSpace = b.slots.length < 2 || isCurrent;
+      if (hasSpace) {
+        options.push({ ts, bi, teacher: b.teacher, cnt: b.slots.length, time: TSR[ts] || ts, isCurrent });
+      }
+    }
+  }
+
+  const bg = document.createElement('div'); bg.className = 'modal-bg';
+  const modal = document.createElement('div'); modal.className = 'modal';
+  modal.style.minWidth = '340px';
+  modal.innerHTML = '<h3>✏️ 授業を変更</h3>'
+    + '<p style="font-size:12px;color:var(--ink3);margin-bottom:6px">' + escHtml(student.grade) + ' ' + escHtml(sName) + ' — ' + escHtml(it.subj) + '</p>'
+    + '<p style="font-size:11px;color:var(--ink3);margin-bottom:12px">現在: ' + escHtml(curTime.slice(0, 5)) + ' / ' + escHtml(curTeacher) + '</p>';
+
+  const opts = document.createElement('div'); opts.className = 'modal-opts';
+
+  // Group by time slot
+  for (const ts of times) {
+    const tsOpts = options.filter(o => o.ts === ts);
+    if (!tsOpts.length) continue;
+    for (const o of tsOpts) {
+      const btn = document.createElement('div'); btn.className = 'modal-opt';
+      const ng = isNg(sName, o.teacher);
+      const isCur = o.isCurrent;
+      btn.style.cssText = isCur ? 'background:#f0f5ff;border-color:var(--accent)' : '';
+      btn.innerHTML = '<div><span class="t-name" style="' + (ng ? 'color:var(--red)' : '') + '">'
+        + (ng ? '⚠ ' : '') + escHtml(o.teacher) + '</span>'
+        + '<span style="font-size:10px;color:var(--ink3);margin-left:6px">' + escHtml(o.time.slice(0, 5)) + '</span></div>'
+        + '<span class="t-info">' + (isCur ? '📍 現在' : '空き ' + o.cnt + '/2') + '</span>';
+      if (!isCur) {
+        ((o_) => {
+          btn.onclick = () => {
+            // Move student from current booth to new booth
+            const srcBooth = ws[it.day][it.ts][it.bi];
+            const si = srcBooth.slots.findIndex(sl => sl[1] === sName && sl[2] === it.subj);
+            if (si < 0) { root.innerHTML = ''; return; }
+            const slot = srcBooth.slots.splice(si, 1)[0];
+            const tgtBooth = ws[it.day][o_.ts][o_.bi];
+            tgtBooth.slots.push(slot);
+            edited = true; root.innerHTML = ''; rR();
+          };
+        })(o);
+      }
+      opts.appendChild(btn);
+    }
+  }
+
+  // Option to remove (send to unplaced)
+  const rmBtn = document.createElement('div'); rmBtn.className = 'modal-opt';
+  rmBtn.style.cssText = 'border-color:#fca5a5;color:var(--red)';
+  rmBtn.innerHTML = '<span class="t-name" style="color:var(--red)">🗑 未配置に戻す</span><span class="t-info">ブースから外す</span>';
+  rmBtn.onclick = () => {
+    const srcBooth = ws[it.day][it.ts][it.bi];
+    const si = srcBooth.slots.findIndex(sl => sl[1] === sName && sl[2] === it.subj);
+    if (si < 0) { root.innerHTML = ''; return; }
+    const slot = srcBooth.slots.splice(si, 1)[0];
+    const ex = R.unplaced.find(u => u.name === slot[1] && u.subject === slot[2]);
+    if (ex) ex.count++; else R.unplaced.push({ grade: slot[0], name: slot[1], subject: slot[2], count: 1, reason: '' });
+    edited = true; root.innerHTML = ''; rR();
+  };
+  opts.appendChild(rmBtn);
+
+  modal.appendChild(opts);
+  const cancel = document.createElement('div'); cancel.className = 'modal-cancel';
+  cancel.innerHTML = '<button class="btn btn-o" style="padding:6px 16px;font-size:12px">キャンセル</button>';
+  cancel.querySelector('button').onclick = () => { root.innerHTML = ''; };
+  modal.appendChild(cancel); bg.appendChild(modal); root.appendChild(bg);
+  bg.addEventListener('click', e => { if (e.target === bg) root.innerHTML = ''; });
+}
@@ -0,0 +1,77 @@
+"""Latency benchmark for Supabase-dependent flows against FakePostgREST.
+
+各フローを注入遅延ごとに実行し、所要時間とHTTP往復回数を表示する。
+
+    python tests/bench_cloud_latency.py [latency_ms ...]
+"""
+import sys
+import os
+import shutil
+import tempfile
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import app as app_module
+from tests.fake_postgrest import FakePostgREST, SERVICE_KEY
+from tests.schedule_builders import one_teacher_schedule
+
+SCHEDULE = one_teacher_schedule([['C1', 'S1', '数']])
+
+
+def _flows(client):
+    def seed():
+        client.post('/api/update_schedule', json={'schedule': SCHEDULE, 'unplaced': []})
+
+    def feedback():
+        with client.session_transaction() as s:
+            sid = s['sid']
+        res = app_module.get_session_data._cache[sid]['result']
+        res['original_schedule_json'] = [{'月': {'16': [{'teacher': 'T1', 'slots': []}]}}]
+        client.post('/api/submit_feedback')
+
+    def load_latest():
+        snaps = client.get('/api/cloud_list').get_json()['snapshots']
+        if snaps:
+            client.post('/api/cloud_load', json={'id': snaps[0]['id']})
+
+    return [
+        ('update_schedule', seed),
+        ('cloud_save', lambda: client.post('/api/cloud_save',
+                                           json={'label': 'latest', 'year': 2026, 'month': 3})),
+        ('cloud_list', lambda: client.get('/api/cloud_list')),
+        ('cloud_list+load', load_latest),
+        ('load_learning_weights', app_module.load_learning_weights),
+        ('learning_stats', lambda: client.get('/api/learning_stats')),
+        ('submit_feedback', feedback),
+        ('reset_learning', lambda: client.post('/api/reset_learning')),
+    ]
+
+
+def run(latency):
+    tmp = tempfile.mkdtemp(prefix='bench_sessions_')
+    srv = FakePostgREST(latency=latency).start()
+    app_module.SUPABASE_URL = srv.url
+    app_module.SUPABASE_SERVICE_KEY = SERVICE_KEY
+    app_module._storage_backend = app_module._SupabaseBackend()
+    app_module.UPLOAD_BASE = tmp
+    client = app_module.app.test_client()
+    with client.session_transaction() as s:
+        s['authenticated'] = True
+    print(f'\n--- latency {latency * 1000:.0f} ms ---')
+    print(f'{"flow":<24}{"ms":>10}{"requests":>10}')
+    try:
+        for name, fn in _flows(client):
+            srv.reset_log()
+            t0 = time.perf_counter()
+            fn()
+            ms = (time.perf_counter() - t0) * 1000
+            print(f'{name:<24}{ms:>10.1f}{len(srv.log):>10}')
+    finally:
+        srv.stop()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    latencies = [float(a) / 1000 for a in sys.argv[1:]] or [0.0, 0.05, 0.2]
+    for lat in latencies:
+        run(lat)
@@ -0,0 +1,134 @@
+"""In-process PostgREST stand-in for integration tests and latency benchmarks.
+
+app._SQLiteBackend が解釈する PostgREST サブセット（eq/lt/in 等のフィルタ、
+on_conflict + Prefer ヘッダーによる upsert、order/offset/limit）をそのまま
+HTTP で公開する。遅延(latency)と失敗率(failure_rate)を注入でき、
+全リクエストを log に記録するので往復回数の計測にも使える。
+
+使い方:
+    with FakePostgREST(latency=0.2) as srv:
+        app.SUPABASE_URL = srv.url
+        ...
+"""
+import json
+import random
+import threading
+import time
+import sys
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from app import _SQLiteBackend
+
+SERVICE_KEY = 'test-service-key'
+
+
+class FakePostgREST:
+    """ThreadingHTTPServer 上で動くフェイク Supabase REST API"""
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=0, service_key=SERVICE_KEY):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.service_key = service_key
+        self.backend = _SQLiteBackend(':memory:')
+        self.log = []  # [(method, table, query)]
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    # ---- lifecycle ----
+    def start(self):
+        handler = _make_handler(self)
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    # ---- helpers ----
+    def count(self, method=None, table=None):
+        """記録済みリクエスト数（method/table で絞り込み可）"""
+        return sum(1 for m, t, _ in self.log
+                   if (method is None or m == method) and (table is None or t == table))
+
+    def reset_log(self):
+        self.log.clear()
+
+    def _should_fail(self):
+        if self.failure_rate <= 0:
+            return False
+        with self._rng_lock:
+            return self._rng.random() < self.failure_rate
+
+
+def _make_handler(fake):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def _send(self, status, payload=None):
+            raw = b'' if payload is None else json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(raw)))
+            self.end_headers()
+            if raw:
+                self.wfile.write(raw)
+
+        def _handle(self):
+            parts = urlsplit(self.path)
+            prefix = '/rest/v1/'
+            length = int(self.headers.get('Content-Length') or 0)
+            raw_body = self.rfile.read(length) if length else b''
+            if not parts.path.startswith(prefix):
+                return self._send(404, {'message': 'not found'})
+            table = parts.path[len(prefix):]
+            fake.log.append((self.command, table, parts.query))
+            if fake.latency:
+                time.sleep(fake.latency)
+            if self.headers.get('apikey') != fake.service_key:
+                return self._send(401, {'message': 'Invalid API key'})
+            if fake._should_fail():
+                return self._send(503, {'message': 'injected failure'})
+            body = json.loads(raw_body.decode('utf-8')) if raw_body else None
+            prefer = self.headers.get('Prefer', '')
+            try:
+                result = fake.backend.request(self.command, table, parts.query, body,
+                                              {'Prefer': prefer} if prefer else None)
+            except ValueError as e:
+                return self._send(400, {'message': str(e)})
+            except Exception as e:  # 制約違反など
+                return self._send(409, {'message': str(e)})
+            if self.command == 'GET':
+                return self._send(200, result)
+            if result is not None:
+                return self._send(201 if self.command == 'POST' else 200, result)
+            return self._send(201 if self.command == 'POST' else 204)
+
+        do_GET = do_POST = do_PATCH = do_DELETE = _handle
+
+    return Handler
@@ -0,0 +1,21 @@
+"""Minimal schedule_json builders shared by the session and cloud tests.
+
+第1週の月曜に講師T1だけがいる最小スケジュールを組み立てる。
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import app as app_module
+
+
+def booths(teacher='T1', slots=None):
+    """講師 teacher のブース1つ（slots 入り）と空きブースで MAX_BOOTHS 個"""
+    bs = [{'teacher': teacher, 'slots': slots or []}]
+    bs += [{'teacher': '', 'slots': []} for _ in range(app_module.MAX_BOOTHS - 1)]
+    return bs
+
+
+def one_teacher_schedule(slots, times=('16',)):
+    """第1週 月曜の times の各時限に講師T1がいる最小スケジュール。slots は最初の時限に入れる"""
+    return [{'月': {ts: booths('T1', slots if i == 0 else None) for i, ts in enumerate(times)}}]
@@ -206,3 +206,21 @@ class TestViableSlotsSort:
         # B should NOT be at Mon 16 (taken by A)
         assert not (day_b == '月' and ts_b == '16'), \
             "B should have yielded Mon 16 to A"
+
+    def test_full_booths_do_not_count(self, monkeypatch):
+        """月16 の T2 は固定授業で満席 → B の置ける枠は火16 だけで、A（火16・水16）より先に配置する"""
+        import app as app_module
+        wt = [week({'月': {'16': ['T2']}, '火': {'16': ['T1']}, '水': {'16': ['T3']}})]
+        c = student('C', needs={'英': 1}, avail=set(), fixed=[('月', '16', '英')])
+        d = student('D', needs={'英': 1}, avail=set(), fixed=[('月', '16', '英')])
+        a = student('A', avail={('火', '16'), ('水', '16')})
+        b = student('B', avail={('月', '16'), ('火', '16')})
+        orders = []
+        place = app_module.Scheduler.place_week_targets
+
+        def spy(self, wi, order, *args):
+            orders.append([s['name'] for s in order if s['name'] in 'AB'])
+            return place(self, wi, order, *args)
+        monkeypatch.setattr(app_module.Scheduler, 'place_week_targets', spy)
+        build_schedule([c, d, a, b], wt, {}, {}, {})
+        assert [o for o in orders if o][0] == ['B', 'A']
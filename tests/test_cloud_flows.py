@@ -0,0 +1,194 @@
+"""Integration tests for Supabase-dependent flows against FakePostgREST.
+
+cloud_save / cloud_list / cloud_load / cloud_delete、セッション復元、
+学習フィードバック、編集履歴の剪定を実際のHTTP経由で検証する。
+"""
+import sys
+import os
+import threading
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import pytest
+import app as app_module
+from tests.fake_postgrest import FakePostgREST, SERVICE_KEY
+from tests.schedule_builders import one_teacher_schedule
+
+
+@pytest.fixture
+def fake(monkeypatch, tmp_path):
+    srv = FakePostgREST().start()
+    monkeypatch.setattr(app_module, 'SUPABASE_URL', srv.url)
+    monkeypatch.setattr(app_module, 'SUPABASE_SERVICE_KEY', SERVICE_KEY)
+    monkeypatch.setattr(app_module, '_storage_backend', app_module._SupabaseBackend())
+    monkeypatch.setattr(app_module, 'UPLOAD_BASE', str(tmp_path))
+    app_module.invalidate_learning_cache()
+    yield srv
+    srv.stop()
+
+
+@pytest.fixture
+def client(fake):
+    app_module.app.config['TESTING'] = True
+    c = app_module.app.test_client()
+    with c.session_transaction() as s:
+        s['authenticated'] = True
+    return c
+
+
+def _seed_schedule(client, slots=None):
+    r = client.post('/api/update_schedule', json={
+        'schedule': one_teacher_schedule(slots or [['C1', 'S1', '数']]),
+        'unplaced': [],
+        'students': [{'grade': 'C1', 'name': 'S1', 'needs': {'数': 1}}],
+    })
+    assert r.status_code == 200
+    with client.session_transaction() as s:
+        return s['sid']
+
+
+class TestCloudSnapshots:
+
+    def test_save_list_load_delete_roundtrip(self, client, fake):
+        _seed_schedule(client)
+        r = client.post('/api/cloud_save', json={'label': 'latest', 'year': 2026, 'month': 3})
+        assert r.get_json()['ok'] is True
+
+        snaps = client.get('/api/cloud_list').get_json()['snapshots']
+        assert [(s['year'], s['month'], s['label']) for s in snaps] == [(2026, 3, 'latest')]
+
+        # 同一 year/month/label は上書き (on_conflict upsert)
+        client.post('/api/cloud_save', json={'label': 'latest', 'year': 2026, 'month': 3})
+        assert len(client.get('/api/cloud_list').get_json()['snapshots']) == 1
+
+        d = client.post('/api/cloud_load', json={'id': snaps[0]['id']}).get_json()
+        assert d['ok'] is True
+        assert d['schedule'][0]['月']['16'][0]['slots'] == [['C1', 'S1', '数']]
+
+        assert client.post('/api/cloud_delete', json={'id': snaps[0]['id']}).get_json()['ok']
+        assert client.get('/api/cloud_list').get_json()['snapshots'] == []
+
+    def test_save_reports_502_when_backend_fails(self, client, fake):
+        _seed_schedule(client)
+        fake.failure_rate = 1.0
+        r = client.post('/api/cloud_save', json={'label': 'latest', 'year': 2026, 'month': 3})
+        assert r.status_code == 502
+
+
+class TestSessionRestore:
+
+    def test_state_restored_from_supabase_after_disk_loss(self, client, fake, tmp_path):
+        sid = _seed_schedule(client)
+        # サーバー再起動相当: インメモリキャッシュとディスクを消す
+        app_module.get_session_data._cache.pop(sid, None)
+        os.remove(app_module._result_json_path(sid))
+        d = client.get('/api/state').get_json()
+        assert d['has_state'] is True
+        assert d['placed'] == 1
+
+
+class TestLearningFlows:
+
+    def test_feedback_updates_stats_and_history(self, client, fake):
+        sid = _seed_schedule(client, [['C1', 'S1', '数']])
+        res = app_module.get_session_data._cache[sid]['result']
+        res['original_schedule_json'] = one_teacher_schedule([])
+        res['original_unplaced'] = [{'name': 'S1', 'subject': '数', 'count': 1}]
+        d = client.post('/api/submit_feedback').get_json()
+        assert d['ok'] is True and d['changes_count'] == 1
+        assert d['session_count'] == 1
+        app_module.wait_background_jobs()
+        assert fake.count('POST', 'schedule_edit_history') == 1
+
+        stats = client.get('/api/learning_stats').get_json()
+        assert stats['session_count'] == 1
+
+        assert client.post('/api/reset_learning').get_json()['ok']
+        assert client.get('/api/learning_stats').get_json()['session_count'] == 0
+        app_module.wait_background_jobs()
+        assert fake.count('DELETE', 'schedule_edit_history') == 1
+        assert fake.backend.request('GET', 'schedule_edit_history', 'select=id') == []
+
+    def test_feedback_against_latest_baseline(self, client, fake):
+        sid = _seed_schedule(client, [['C1', 'S1', '数']])
+        res = app_module.get_session_data._cache[sid]['result']
+        res['original_schedule_json'] = one_teacher_schedule([])
+        res['baselines'] = [app_module._make_baseline(
+            'generated', app_module.CompactSchedule.from_json(one_teacher_schedule([])), [])]
+        assert client.post('/api/submit_feedback').get_json()['changes_count'] == 1
+        # 直近のフィードバック以降は未編集
+        d = client.post('/api/submit_feedback', json={'baseline': -1}).get_json()
+        assert d['changes_count'] == 0
+        # 生成時との比較は従来どおり
+        d = client.post('/api/submit_feedback', json={'baseline': 0}).get_json()
+        assert d['changes_count'] == 1
+        assert [b['label'] for b in d['baselines']] == ['generated', 'feedback', 'feedback']
+        assert client.post('/api/submit_feedback', json={'baseline': 9}).status_code == 400
+
+    def test_edit_history_pruned_to_latest_20(self, fake):
+        for i in range(23):
+            app_module.save_edit_history({'total_changes': i, 'placed_before': 0,
+                                          'placed_after': 0, 'changes': []})
+        app_module.wait_background_jobs()
+        rows = fake.backend.request('GET', 'schedule_edit_history',
+                                    'select=total_changes&order=id.desc')
+        assert len(rows) == 20
+        assert rows[0]['total_changes'] == 22
+
+    def test_prune_issues_single_bulk_delete(self, fake):
+        for i in range(25):
+            fake.backend.request('POST', 'schedule_edit_history', '',
+                                 body={'total_changes': i, 'changes': []})
+        fake.reset_log()
+        app_module.prune_edit_history()
+        assert fake.count('DELETE', 'schedule_edit_history') == 1
+        assert len(fake.backend.request('GET', 'schedule_edit_history', 'select=id')) == 20
+
+    def test_clear_history_ignores_clock_skew(self, fake):
+        # DBの時計がアプリサーバーより進んでいても（created_at が未来でも）全件消える
+        fake.backend.request('POST', 'schedule_edit_history', '',
+                             body={'total_changes': 1, 'changes': []})
+        fake.backend.request('POST', 'schedule_edit_history', '',
+                             body={'total_changes': 2, 'changes': [], 'created_at': '2999-01-01T00:00:00Z'})
+        fake.reset_log()
+        app_module.clear_edit_history()
+        assert fake.count('DELETE', 'schedule_edit_history') == 1
+        assert fake.backend.request('GET', 'schedule_edit_history', 'select=id') == []
+
+    def test_feedback_response_does_not_wait_for_history(self, client, fake):
+        sid = _seed_schedule(client, [['C1', 'S1', '数']])
+        app_module.get_session_data._cache[sid]['result']['original_schedule_json'] = one_teacher_schedule([])
+        fake.reset_log()
+        gate = threading.Event()
+        app_module.run_in_background(gate.wait, 5)  # ワーカーを塞いでおく
+        assert client.post('/api/submit_feedback').get_json()['ok']
+        # 履歴の POST/GET/DELETE はレスポンス後にバックグラウンドで走る
+        assert fake.count('POST', 'schedule_edit_history') == 0
+        gate.set()
+        app_module.wait_background_jobs()
+        assert fake.count('POST', 'schedule_edit_history') == 1
+
+
+class TestLatencyBudget:
+    """200ms遅延下での往復回数（generate 経路が遠隔往復に依存しないこと）"""
+
+    def test_learning_weights_single_fetch_then_cached(self, fake):
+        app_module.save_learning_weights(dict(app_module.DEFAULT_WEIGHTS, wish_teacher=900))
+        app_module.save_learning_stats({'session_count': 5})
+        fake.reset_log()
+        fake.latency = 0.2
+        assert app_module.load_learning_weights()['wish_teacher'] == 900
+        assert fake.count('GET', 'schedule_learning_data') == 1
+        app_module.load_learning_weights()
+        app_module.load_learning_stats()
+        assert fake.count('GET', 'schedule_learning_data') == 1
+
+    def test_weights_ignored_below_three_sessions(self, fake):
+        app_module.save_learning_weights(dict(app_module.DEFAULT_WEIGHTS, wish_teacher=900))
+        app_module.save_learning_stats({'session_count': 2})
+        assert app_module.load_learning_weights() == app_module.DEFAULT_WEIGHTS
+
+    def test_save_invalidates_cache(self, fake):
+        app_module.save_learning_stats({'session_count': 1})
+        assert app_module.load_learning_stats()['session_count'] == 1
+        app_module.save_learning_stats({'session_count': 4})
+        assert app_module.load_learning_stats()['session_count'] == 4
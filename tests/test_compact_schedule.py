@@ -0,0 +1,166 @@
+"""Unit tests for the array-backed CompactSchedule representation.
+
+入れ子dict形式との往復、ブース書き換え、ハッシュ、差分、
+学習用 diff の結果が従来の入れ子dict版と一致することを確認する。
+"""
+import sys
+import os
+import random
+import tracemalloc
+from copy import deepcopy
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import pytest
+import app as app_module
+from app import CompactSchedule, BoothRecord, compute_schedule_diff
+
+
+def _random_schedule(seed=0, weeks=4):
+    rng = random.Random(seed)
+    teachers = [f'T{i}' for i in range(12)]
+    students = [(f'C{rng.randint(1, 3)}', f'S{i}', rng.choice(['数', '英', '国'])) for i in range(60)]
+    sched = []
+    for _ in range(weeks):
+        w = {}
+        for day in app_module.DAYS:
+            times = app_module.SATURDAY_TIMES if day == '土' else app_module.WEEKDAY_TIMES
+            w[day] = {}
+            for t in times:
+                booths = []
+                for _ in range(app_module.MAX_BOOTHS):
+                    if rng.random() < 0.7:
+                        booths.append({'teacher': rng.choice(teachers),
+                                       'slots': [list(s) for s in rng.sample(students, rng.randint(0, 2))]})
+                    else:
+                        booths.append({'teacher': '', 'slots': []})
+                w[day][app_module.TIME_SHORT[t]] = booths
+        sched.append(w)
+    return sched
+
+
+@pytest.fixture
+def sched():
+    return _random_schedule()
+
+
+class TestRoundTrip:
+
+    def test_to_json_roundtrip(self, sched):
+        assert CompactSchedule.from_json(sched).to_json() == sched
+
+    def test_tuple_slots_accepted(self, sched):
+        tup = [{d: {ts: [{'teacher': b['teacher'], 'slots': [tuple(s) for s in b['slots']]} for b in bs]
+                    for ts, bs in dd.items()} for d, dd in w.items()} for w in sched]
+        assert CompactSchedule.from_json(tup).to_json() == sched
+
+    def test_placed_counts_slots(self, sched):
+        expect = sum(len(b['slots']) for w in sched for d in w.values() for bs in d.values() for b in bs)
+        assert CompactSchedule.from_json(sched).placed() == expect
+
+
+class TestBoothEdit:
+
+    def test_set_booth_shifts_following_slots(self, sched):
+        cs = CompactSchedule.from_json(sched)
+        cs.set_booth(0, '月', '16', 0, {'teacher': 'TX', 'slots': [['C1', 'A', '数'], ['C1', 'B', '英'], ['C2', 'C', '国']]})
+        sched[0]['月']['16'][0] = {'teacher': 'TX', 'slots': [['C1', 'A', '数'], ['C1', 'B', '英'], ['C2', 'C', '国']]}
+        assert cs.to_json() == sched
+        assert cs.booth(0, '月', '16', 0) == BoothRecord('TX', [('C1', 'A', '数'), ('C1', 'B', '英'), ('C2', 'C', '国')])
+
+    def test_copy_is_independent(self, sched):
+        cs = CompactSchedule.from_json(sched)
+        cp = cs.copy()
+        cp.set_booth(1, '火', '17', 2, BoothRecord('', []))
+        assert cs.to_json() == sched
+        assert cp.booth(1, '火', '17', 2) == BoothRecord('', [])
+
+    def test_out_of_range_booth(self, sched):
+        with pytest.raises(IndexError):
+            CompactSchedule.from_json(sched).booth(0, '月', '16', app_module.MAX_BOOTHS)
+
+
+class TestCopyOnWrite:
+
+    def test_copy_shares_untouched_weeks(self, sched):
+        cs = CompactSchedule.from_json(sched)
+        cp = cs.copy()
+        assert all(a is b for a, b in zip(cs.weeks, cp.weeks))
+        cp.set_booth(1, '月', '16', 0, {'teacher': 'TX', 'slots': []})
+        assert cp.weeks[1] is not cs.weeks[1]
+        assert all(cs.weeks[i] is cp.weeks[i] for i in (0, 2, 3))
+        # 元側への書き込みもスナップショットに影響しない
+        cs.set_booth(0, '月', '16', 0, {'teacher': 'TY', 'slots': []})
+        assert cp.booth(0, '月', '16', 0).teacher == sched[0]['月']['16'][0]['teacher']
+        assert sorted(cs.diff(cp)) == [(0, '月', '16', 0), (1, '月', '16', 0)]
+
+    def test_many_snapshots_cost_no_week_copies(self, sched):
+        cs = CompactSchedule.from_json(sched)
+        snaps = [cs.copy() for _ in range(10)]
+        assert len({id(w) for s in snaps for w in s.weeks}) == len(cs.weeks)
+
+    def test_baseline_history_keeps_generated(self, sched, monkeypatch):
+        monkeypatch.setattr(app_module, 'BASELINE_HISTORY_LIMIT', 3)
+        res = {'schedule_json': sched, 'unplaced': []}
+        res['baselines'] = [app_module._make_baseline('generated', app_module.session_compact(res), [])]
+        for _ in range(4):
+            app_module.push_baseline(res, 'feedback')
+        assert [b['label'] for b in res['baselines']] == ['generated', 'feedback', 'feedback']
+
+
+class TestDigestAndDiff:
+
+    def test_digest_tracks_content(self, sched):
+        cs = CompactSchedule.from_json(sched)
+        cp = cs.copy()
+        assert cs.digest() == cp.digest() == CompactSchedule.from_json(sched).digest()
+        cp.set_booth(0, '月', '16', 0, {'teacher': 'TX', 'slots': []})
+        assert cp.digest() != cs.digest()
+
+    def test_diff_lists_changed_booths(self, sched):
+        cs = CompactSchedule.from_json(sched)
+        cp = cs.copy()
+        cp.set_booth(2, '土', '14', 1, {'teacher': 'TX', 'slots': []})
+        cp.set_booth(0, '水', '19', 5, {'teacher': 'TY', 'slots': [['C3', 'Z', '数']]})
+        assert sorted(cs.diff(cp)) == [(0, '水', '19', 5), (2, '土', '14', 1)]
+        # 名前テーブルが別々でも内容で比較する
+        assert sorted(cs.diff(CompactSchedule.from_json(cp.to_json()))) == sorted(cs.diff(cp))
+
+    def test_diff_none_on_layout_change(self, sched):
+        other = deepcopy(sched)
+        del other[0]['土']
+        assert CompactSchedule.from_json(sched).diff(CompactSchedule.from_json(other)) is None
+
+
+def _canon(changes):
+    return sorted(repr(sorted(c.items())) for c in changes)
+
+
+class TestLearningDiff:
+
+    def test_compact_diff_matches_nested_diff(self, sched):
+        edited = deepcopy(sched)
+        rng = random.Random(1)
+        for _ in range(15):
+            w, d = rng.randrange(len(edited)), rng.choice(app_module.DAYS)
+            ts = rng.choice(list(edited[w][d]))
+            b = edited[w][d][ts][rng.randrange(app_module.MAX_BOOTHS)]
+            if b['slots'] and rng.random() < 0.5:
+                b['slots'].pop()
+            else:
+                b['teacher'] = 'TZ'
+        expect = compute_schedule_diff(sched, edited, [], [])
+        got = compute_schedule_diff(CompactSchedule.from_json(sched), CompactSchedule.from_json(edited), [], [])
+        assert expect and _canon(got) == _canon(expect)
+
+    def test_baseline_copy_is_much_smaller_than_deepcopy(self, sched):
+        cs = CompactSchedule.from_json(sched)
+        tracemalloc.start()
+        snap = deepcopy(sched)
+        nested = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        tracemalloc.start()
+        cp = cs.copy()
+        compact = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        assert snap and cp
+        assert compact * 5 < nested
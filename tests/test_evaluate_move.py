@@ -0,0 +1,137 @@
+"""Tests for what-if evaluation of manual moves (/api/evaluate_move).
+
+移動・交換を確定せずに目的関数の増減と check_all 指摘の増減を返すこと、
+セッションのスケジュールを書き換えないことを確認する。
+"""
+import sys
+import os
+import copy
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import pytest
+import app as app_module
+from app import evaluate_move, move_changes, normalize_student, Scheduler, DEFAULT_WEIGHTS
+from tests.test_build_schedule import student
+from tests.test_suggest import _empty_week
+
+
+def _evaluate(sched, students, data, weekly_teachers=None):
+    smap = {s['name']: normalize_student(s) for s in students}
+    changes, placed_delta = move_changes(sched, smap, data)
+    wt = weekly_teachers or [{}] * len(sched)
+    r = evaluate_move(sched, smap, changes, {}, dict(DEFAULT_WEIGHTS), (wt, students, {}, []))
+    return r, placed_delta
+
+
+def _apply(sched, data, students):
+    """変更を実際に適用したスケジュール（全体再計算との比較用）"""
+    smap = {s['name']: normalize_student(s) for s in students}
+    changes, _ = move_changes(sched, smap, data)
+    out = copy.deepcopy(sched)
+    for (wi, day, ts, bi), b in changes.items():
+        out[wi][day][ts][bi] = b
+    return out
+
+
+def _total(sched, students):
+    sch = Scheduler(sched, [normalize_student(s) for s in students], {}, {})
+    return sch.objective()
+
+
+POS = lambda wi, day, ts, bi, si=0: {'wi': wi, 'day': day, 'ts': ts, 'bi': bi, 'si': si}
+
+
+@pytest.fixture
+def sched():
+    s = [_empty_week({('月', '16'): ['T1', 'T2'], ('月', '17'): ['T1'], ('火', '18'): ['T3']})]
+    s[0]['月']['16'][0]['slots'] = [['C', 'A', '数']]
+    s[0]['月']['17'][0]['slots'] = [['C', 'A', '英']]
+    s[0]['火']['18'][0]['slots'] = [['C', 'B', '数']]
+    return s
+
+
+STUDENTS = [student('A', needs={'数': 1, '英': 1}, wish_teachers=['T2']),
+            student('B', ng_teachers={'T1'})]
+
+
+class TestDelta:
+
+    def test_delta_equals_full_recompute(self, sched):
+        for data in ({'from': POS(0, '月', '16', 0), 'to': POS(0, '月', '16', 1)},
+                     {'from': POS(0, '月', '17', 0), 'to': POS(0, '火', '18', 0)},
+                     {'swap': [POS(0, '月', '16', 0), POS(0, '火', '18', 0)]},
+                     {'from': POS(0, '月', '16', 0), 'to': None}):
+            r, _ = _evaluate(sched, STUDENTS, data)
+            after = _apply(sched, data, STUDENTS)
+            assert r['delta'] == _total(after, STUDENTS) - _total(sched, STUDENTS)
+            assert r['delta'] == sum(r['breakdown'].values())
+
+    def test_wish_teacher_and_block_terms(self, sched):
+        r, placed = _evaluate(sched, STUDENTS, {'from': POS(0, '月', '16', 0), 'to': POS(0, '月', '16', 1)})
+        assert placed == 0
+        assert r['breakdown'] == {'wish_teacher': DEFAULT_WEIGHTS['wish_teacher']}
+        r, _ = _evaluate(sched, STUDENTS, {'from': POS(0, '月', '17', 0), 'to': POS(0, '火', '18', 0)})
+        # 月の連続コマがなくなる
+        assert r['breakdown']['continuous_block'] == -2 * DEFAULT_WEIGHTS['continuous_block']
+
+    def test_unplaced_to_booth(self, sched):
+        r, placed = _evaluate(sched, STUDENTS, {'from': {'unplaced': {'name': 'B', 'subject': '英'}},
+                                                'to': POS(0, '月', '16', 1)})
+        assert placed == 1
+        assert r['breakdown'] == {'empty_booth': DEFAULT_WEIGHTS['empty_booth']}
+
+
+class TestIssues:
+
+    def test_added_and_removed_errors(self, sched):
+        r, _ = _evaluate(sched, STUDENTS, {'swap': [POS(0, '月', '17', 0), POS(0, '火', '18', 0)]})
+        # B を NG講師 T1 へ
+        assert [i['code'] for i in r['issues']['added']] == ['E3']
+        assert r['feasible'] is False
+        sched[0]['火']['18'][0]['teacher'] = 'T1'
+        r, _ = _evaluate(sched, STUDENTS, {'from': POS(0, '火', '18', 0), 'to': POS(0, '月', '16', 1)})
+        assert [i['code'] for i in r['issues']['removed']] == ['E3']
+        assert r['feasible'] is True
+
+    def test_invalid_moves(self, sched):
+        with pytest.raises(ValueError):
+            _evaluate(sched, STUDENTS, {'from': POS(0, '月', '16', 0, si=1), 'to': None})
+        sched[0]['月']['16'][1]['slots'] = [['C', 'X', '数'], ['C', 'Y', '数']]
+        with pytest.raises(ValueError):
+            _evaluate(sched, STUDENTS, {'from': POS(0, '月', '17', 0), 'to': POS(0, '月', '16', 1)})
+        with pytest.raises(ValueError):
+            _evaluate(sched, STUDENTS, {'from': POS(3, '月', '16', 0), 'to': None})
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path, sched):
+    monkeypatch.setattr(app_module, 'SUPABASE_URL', '')
+    monkeypatch.setattr(app_module, '_storage_backend', app_module._SupabaseBackend())
+    monkeypatch.setattr(app_module, 'UPLOAD_BASE', str(tmp_path))
+    app_module.app.config['TESTING'] = True
+    c = app_module.app.test_client()
+    with c.session_transaction() as s:
+        s['authenticated'] = True
+    students = [{'grade': 'C', 'name': 'A', 'needs': {'数': 1, '英': 1}, 'avail': None, 'backup_avail': [],
+                 'fixed': [], 'ng_teachers': [], 'wish_teachers': ['T2'], 'ng_students': [], 'ng_dates': []}]
+    r = c.post('/api/update_schedule', json={'schedule': sched, 'unplaced': [], 'students': students})
+    assert r.status_code == 200
+    return c
+
+
+class TestEvaluateMoveApi:
+
+    def test_does_not_modify_session(self, client, sched):
+        before = client.get('/api/state').get_json()['schedule']
+        d = client.post('/api/evaluate_move', json={'from': POS(0, '月', '16', 0),
+                                                    'to': POS(0, '月', '16', 1)}).get_json()
+        assert d['placedDelta'] == 0
+        assert d['breakdown']['wish_teacher'] == app_module.load_learning_weights()['wish_teacher']
+        assert client.get('/api/state').get_json()['schedule'] == before == sched
+
+    def test_bad_request(self, client):
+        assert client.post('/api/evaluate_move', json={}).status_code == 400
+        assert client.post('/api/evaluate_move', json={'from': {'wi': 'x'}}).status_code == 400
+        for body in ([1], {'swap': 5}, {'swap': [1, 2]}, {'from': 'x'}, {'from': {'unplaced': 'A'}},
+                     {'from': POS(0, '月', '16', 0), 'to': 3}, {'from': dict(POS(0, '月', '16', 0), si=[0])}):
+            assert client.post('/api/evaluate_move', json=body).status_code == 400
@@ -0,0 +1,95 @@
+"""Tests for the optional exact (CP-SAT) backend behind build_schedule.
+
+solve_exact のモデルが貪欲法の結果を初期解として受け取り、Scheduler.objective と同じ目的関数で
+解き直すこと、ortools がなければ貪欲法の結果のまま返ることを確認する。
+"""
+import sys
+import os
+import time
+import random
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import pytest
+import app as app_module
+from app import Scheduler, build_schedule, solve_exact, EXACT_PLACE_BONUS, DAYS
+from tests.test_build_schedule import student, week
+
+
+def _problem():
+    rng = random.Random(2)
+    teachers = ['T1', 'T2', 'T3']
+    wt = [week({d: {ts: rng.sample(teachers, 2) for ts in ('16', '17', '18')} for d in DAYS[:3]})]
+    students = [student(f'S{i}', needs={'数': 1, '英': 1},
+                        avail={(d, ts) for d in rng.sample(DAYS[:3], 2) for ts in ('16', '17', '18')},
+                        wish_teachers=[rng.choice(teachers)], ng_students=['S0'] if i == 1 else None)
+                for i in range(5)]
+    students[2]['fixed'] = [('月', '16', '数')]
+    return students, wt
+
+
+def _placed(schedule):
+    return [(wi, d, ts, bi, tuple(x)) for wi, w in enumerate(schedule) for d, dd in w.items()
+            for ts, bs in dd.items() for bi, b in enumerate(bs) for x in b['slots']]
+
+
+class TestUnavailable:
+
+    def test_falls_back_to_greedy(self, monkeypatch):
+        monkeypatch.setattr(app_module, 'cp_model', None)
+        students, wt = _problem()
+        random.seed(0)
+        greedy, _, _ = build_schedule(students, wt, {}, {d: [] for d in DAYS}, {})
+        random.seed(0)
+        report = {}
+        exact, _, _ = build_schedule(students, wt, {}, {d: [] for d in DAYS}, {}, exact_seconds=5, report=report)
+        assert report['exact'] == {'status': 'unavailable', 'applied': False}
+        assert _placed(exact) == _placed(greedy)
+
+
+class TestBudget:
+
+    def test_optional_phases_stop_at_request_deadline(self):
+        students, wt = _problem()
+        random.seed(0)
+        report = {}
+        build_schedule(students, wt, {}, {d: [] for d in DAYS}, {}, improve_seconds=5, exact_seconds=5,
+                       report=report, deadline=time.perf_counter())
+        assert 'exact' not in report and 'improve' not in report
+
+
+class TestModel:
+
+    @pytest.fixture(autouse=True)
+    def _ortools(self):
+        pytest.importorskip('ortools')
+
+    def test_optimal_and_consistent_with_objective(self):
+        students, wt = _problem()
+        random.seed(0)
+        report = {}
+        schedule, unplaced, ot = build_schedule(students, wt, {}, {d: [] for d in DAYS}, {},
+                                                exact_seconds=20, report=report)
+        stats = report['exact']
+        assert stats['status'] == 'OPTIMAL' and stats['gap'] == 0
+        assert stats['objective'] >= stats['greedy']
+        # 目的関数は 配置数×ボーナス + Scheduler.objective（固定授業は数えない）
+        sch = Scheduler(schedule, students, {}, {})
+        movable = sum(1 for *_, x in _placed(schedule) if x[1] != 'S2' or x[2] != '数')
+        assert stats['objective'] == EXACT_PLACE_BONUS * movable + sch.objective()
+        errors = [i for i in app_module.check_all(schedule, wt, ot, students, {}, []) if i['level'] == 'error']
+        assert errors == []
+        # 固定授業はそのまま
+        assert any(x[1:] == ('S2', '数') and (d, ts) == ('月', '16') for _, d, ts, _, x in _placed(schedule))
+
+    def test_greedy_hint_kept_when_not_better(self):
+        # 1人・1枠だけなら貪欲法の結果が最適で、書き換えない
+        wt = [week({'月': {'16': ['T1']}})]
+        a = student('A', avail={('月', '16')})
+        random.seed(0)
+        schedule, unplaced, _ = build_schedule([a], wt, {}, {d: [] for d in DAYS}, {})
+        sch = Scheduler(schedule, [a], {}, {})
+        remaining = {'A': {'数': 0}}
+        stats = solve_exact(sch, remaining, 5)
+        assert stats['status'] == 'OPTIMAL' and not stats['applied']
+        assert stats['objective'] == stats['greedy'] == EXACT_PLACE_BONUS + sch.objective()
+        assert remaining == {'A': {'数': 0}}
@@ -0,0 +1,121 @@
+"""Tests for the per-student upper bounds computed before placement.
+
+demand_upper_bounds が希望時間帯・指導可能講師・1日1科目から置けるコマ数の上限を求め、
+build_schedule が確実に置けない分を探索から外して理由付きで未配置にすること、
+weekly_targets が置ける曜日のある週に、空いている週から割り振ることを確認する。
+"""
+import sys
+import os
+import random
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import app as app_module
+from app import Scheduler, build_schedule, demand_upper_bounds, max_flow, DAYS
+from tests.test_build_schedule import student, week
+from tests.test_suggest import _empty_week
+
+
+def _build(students, wt, skills=None):
+    random.seed(0)
+    report = {}
+    schedule, unplaced, _ = build_schedule(students, wt, skills or {}, {d: [] for d in DAYS}, {}, report=report)
+    return schedule, unplaced, report
+
+
+class TestMaxFlow:
+
+    def test_bipartite(self):
+        cap = {'s': {'a': 1, 'b': 1, 'c': 1}, 'a': {'x': 1}, 'b': {'x': 1, 'y': 1}, 'c': {'x': 1},
+               'x': {'t': 1}, 'y': {'t': 1}}
+        assert max_flow(cap, 's', 't') == 2
+
+    def test_capacities(self):
+        cap = {'s': {'a': 3, 'b': 2}, 'a': {'b': 1, 't': 2}, 'b': {'t': 3}}
+        assert max_flow(cap, 's', 't') == 5
+
+
+class TestBounds:
+
+    def test_subject_and_total(self):
+        sched = [_empty_week({('月', '16'): ['T1'], ('月', '17'): ['T2'], ('火', '16'): ['T2']})]
+        skills = {'T1': {'中数', '中英'}, 'T2': {'中数'}}
+        a = student('A', needs={'数': 3, '英': 2}, avail={('月', '16'), ('月', '17'), ('火', '16')})
+        b = student('B', needs={'数': 1, '英': 1}, avail={('月', '16')})
+        bounds = demand_upper_bounds(Scheduler(sched, [a, b], skills, {}), {'A': a['needs'], 'B': b['needs']})
+        # 数は月・火の2日、英は T1 のいる月だけ
+        assert bounds['A'] == {'bySubject': {'数': 2, '英': 1}, 'byWeek': {'数': [2], '英': [1]}, 'total': 3}
+        # 1時限しかないので2科目で1コマ
+        assert bounds['B']['total'] == 1
+
+    def test_bound_covers_greedy(self):
+        rng = random.Random(4)
+        teachers = [f'T{i}' for i in range(5)]
+        wt = [week({d: {ts: rng.sample(teachers, 3) for ts in ('16', '17', '18')} for d in DAYS[:4]})
+              for _ in range(2)]
+        students = [student(f'S{i}', needs={'数': 3, '英': 2},
+                            avail={(d, ts) for d in rng.sample(DAYS[:4], 2) for ts in rng.sample(['16', '17', '18'], 2)})
+                    for i in range(12)]
+        schedule, unplaced, _ = _build(students, wt)
+        empty = [{d: {ts: [{'teacher': b['teacher'], 'slots': []} for b in bs] for ts, bs in dd.items()}
+                  for d, dd in w.items()} for w in schedule]
+        bounds = demand_upper_bounds(Scheduler(empty, students, {}, {}), {s['name']: s['needs'] for s in students})
+        left = {}
+        for u in unplaced:
+            left[u['name']] = left.get(u['name'], 0) + u['count']
+        for s in students:
+            assert sum(s['needs'].values()) - left.get(s['name'], 0) <= bounds[s['name']]['total']
+
+
+class TestBuildSchedule:
+
+    def test_impossible_lessons_reported_up_front(self):
+        wt = [week({'月': {'16': ['T1'], '17': ['T1']}})]
+        a = student('A', needs={'数': 2}, avail={('月', '16'), ('月', '17')})
+        schedule, unplaced, report = _build([a], wt)
+        assert report['infeasible'] == [{'grade': 'C', 'name': 'A', 'subject': '数', 'need': 2, 'max': 1}]
+        assert unplaced == [{'grade': 'C', 'name': 'A', 'subject': '数', 'count': 1,
+                             'reason': '配置可能な枠が不足（最大1コマ）'}]
+
+    def test_joint_shortage_is_reported_not_removed(self):
+        wt = [week({'月': {'16': ['T1']}})]
+        a = student('A', needs={'数': 1, '英': 1}, avail={('月', '16')})
+        schedule, unplaced, report = _build([a], wt)
+        assert report['infeasible'] == [{'grade': 'C', 'name': 'A', 'subject': None, 'need': 2, 'max': 1}]
+        assert sum(u['count'] for u in unplaced) == 1
+        assert not any(u['reason'].startswith('配置可能な枠が不足') for u in unplaced)
+
+
+class TestWeeklyTargets:
+
+    def test_skips_weeks_without_capacity(self):
+        # 第2週は休塾日で置けない → 3コマを第1・第3週へ
+        wt = [week({'月': {'16': ['T1']}, '火': {'16': ['T1']}}) for _ in range(3)]
+        a = student('A', needs={'数': 3}, avail={('月', '16'), ('火', '16')})
+        random.seed(0)
+        schedule, unplaced, _ = build_schedule([a], wt, {}, {d: [] for d in DAYS}, {},
+                                               holidays=[{}, {'月': True, '火': True}, {}])
+        assert unplaced == []
+        counts = [sum(len(b['slots']) for dd in w.values() for bs in dd.values() for b in bs) for w in schedule]
+        assert counts[1] == 0 and sorted(counts) == [0, 1, 2]
+
+    def test_even_then_least_loaded(self):
+        sched = [_empty_week({('月', '16'): ['T1', 'T2']}), _empty_week({('月', '16'): ['T1', 'T2']})]
+        sched[0]['月']['16'][0]['slots'] = [['C', 'X', '数'], ['C', 'Y', '数']]
+        a = student('A', needs={'数': 1})
+        b = student('B', needs={'数': 2})
+        sch = Scheduler(sched, [a, b], {}, {})
+        remaining = {'A': {'数': 1}, 'B': {'数': 2}}
+        targets = app_module.weekly_targets(sch, remaining, demand_upper_bounds(sch, remaining), [a, b])
+        # 第1週は既に半分埋まっているので A は第2週、B は両週に1コマずつ
+        assert targets == {'A': {'数': [0, 1]}, 'B': {'数': [1, 1]}}
+
+    def test_avoids_weeks_with_ng_dates(self):
+        # 第1週の方が空いているが、A は第1週の月曜がNG日程 → 第2週へ
+        sched = [_empty_week({('月', '16'): ['T1', 'T2']}), _empty_week({('月', '16'): ['T1', 'T2']})]
+        sched[1]['月']['16'][0]['slots'] = [['C', 'X', '数'], ['C', 'Y', '数']]
+        a = student('A', needs={'数': 1})
+        a['ng_dates'] = {(0, '月')}
+        sch = Scheduler(sched, [a], {}, {})
+        remaining = {'A': {'数': 1}}
+        targets = app_module.weekly_targets(sch, remaining, demand_upper_bounds(sch, remaining), [a])
+        assert targets == {'A': {'数': [0, 1]}}
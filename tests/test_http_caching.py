@@ -0,0 +1,88 @@
+"""Tests for JSON response compression and ETag-based conditional GET.
+
+/api/state・/api/check がセッション結果の版から強いETagを返し、未変更なら 304、
+大きなJSON応答が Accept-Encoding に応じて圧縮されることを確認する。
+"""
+import sys
+import os
+import gzip
+import json
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import pytest
+import app as app_module
+
+
+def _schedule(weeks=4):
+    booths = [{'teacher': f'T{i}', 'slots': [['C1', f'S{i}', '数']]} for i in range(app_module.MAX_BOOTHS)]
+    return [{d: {ts: [dict(b) for b in booths] for ts in ('16', '17', '18', '19', '20')}
+             for d in app_module.DAYS} for _ in range(weeks)]
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(app_module, 'SUPABASE_URL', '')
+    monkeypatch.setattr(app_module, '_storage_backend', app_module._SupabaseBackend())
+    monkeypatch.setattr(app_module, 'UPLOAD_BASE', str(tmp_path))
+    app_module.app.config['TESTING'] = True
+    c = app_module.app.test_client()
+    with c.session_transaction() as s:
+        s['authenticated'] = True
+    r = c.post('/api/update_schedule', json={'schedule': _schedule(), 'unplaced': []})
+    assert r.status_code == 200
+    return c
+
+
+class TestConditionalGet:
+
+    def test_state_not_modified(self, client):
+        r = client.get('/api/state')
+        assert r.status_code == 200 and r.headers['ETag']
+        r2 = client.get('/api/state', headers={'If-None-Match': r.headers['ETag']})
+        assert r2.status_code == 304
+        assert r2.data == b''
+
+    def test_edit_changes_etag(self, client):
+        etag = client.get('/api/state').headers['ETag']
+        sched = _schedule()
+        sched[0]['月']['16'][0]['slots'] = []
+        client.post('/api/update_schedule', json={'schedule': sched, 'unplaced': []})
+        r = client.get('/api/state', headers={'If-None-Match': etag})
+        assert r.status_code == 200
+        assert r.get_json()['schedule'][0]['月']['16'][0]['slots'] == []
+        assert r.headers['ETag'] != etag
+
+    def test_check_skips_recompute(self, client, monkeypatch):
+        calls = []
+        real = app_module.check_all
+        monkeypatch.setattr(app_module, 'check_all', lambda *a: calls.append(1) or real(*a))
+        etag = client.get('/api/check').headers['ETag']
+        assert client.get('/api/check', headers={'If-None-Match': etag}).status_code == 304
+        assert len(calls) == 1
+        # state と check のETagは別物
+        assert client.get('/api/state', headers={'If-None-Match': etag}).status_code == 200
+
+
+class TestCompression:
+
+    def test_large_json_gzipped(self, client):
+        r = client.get('/api/state', headers={'Accept-Encoding': 'gzip'})
+        assert r.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in r.headers['Vary']
+        body = json.loads(gzip.decompress(r.data))
+        assert body['placed'] == 4 * 6 * 5 * app_module.MAX_BOOTHS
+        assert int(r.headers['Content-Length']) == len(r.data)
+        # 圧縮版のETagでも 304
+        r2 = client.get('/api/state', headers={'Accept-Encoding': 'gzip', 'If-None-Match': r.headers['ETag']})
+        assert r2.status_code == 304
+
+    def test_uncompressed_without_accept_encoding(self, client):
+        r = client.get('/api/state')
+        assert 'Content-Encoding' not in r.headers
+        assert r.get_json()['has_state'] is True
+
+    def test_small_response_left_alone(self, client):
+        r = client.post('/api/update_schedule', json={'schedule': _schedule(), 'unplaced': []},
+                        headers={'Accept-Encoding': 'gzip'})
+        assert 'Content-Encoding' not in r.headers
+        assert r.get_json()['ok'] is True
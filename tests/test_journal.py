@@ -0,0 +1,168 @@
+"""Tests for the append-only session edit journal.
+
+update_schedule がセル単位の差分を _journal.jsonl に追記すること、
+get_state で再起動後に再生されること、コンパクションとアンドゥ/リドゥを検証する。
+"""
+import sys
+import os
+import json
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import pytest
+import app as app_module
+from tests.schedule_builders import one_teacher_schedule
+
+
+def _schedule(slots):
+    return one_teacher_schedule(slots, times=('16', '17'))
+
+
+STUDENTS = [{'grade': 'C1', 'name': 'S1', 'needs': {'数': 2}}]
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(app_module, 'SUPABASE_URL', '')
+    monkeypatch.setattr(app_module, '_storage_backend', app_module._SupabaseBackend())
+    monkeypatch.setattr(app_module, 'UPLOAD_BASE', str(tmp_path))
+    app_module.app.config['TESTING'] = True
+    c = app_module.app.test_client()
+    with c.session_transaction() as s:
+        s['authenticated'] = True
+    return c
+
+
+def _put(client, slots, unplaced=None):
+    r = client.post('/api/update_schedule', json={
+        'schedule': _schedule(slots), 'unplaced': unplaced or [], 'students': STUDENTS})
+    assert r.status_code == 200
+    return r.get_json()
+
+
+def _sid(client):
+    with client.session_transaction() as s:
+        return s['sid']
+
+
+def _restart(sid):
+    """サーバー再起動相当: インメモリ状態だけを消す"""
+    app_module.get_session_data._cache.pop(sid, None)
+    app_module._journals.pop(sid, None)
+
+
+def _journal_lines(sid):
+    with open(app_module._journal_path(sid), encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+class TestJournalAppend:
+
+    def test_edit_appends_cells_without_rewriting_checkpoint(self, client):
+        _put(client, [])
+        sid = _sid(client)
+        rp = app_module._result_json_path(sid)
+        with open(rp, encoding='utf-8') as f:
+            checkpoint = f.read()
+        d = _put(client, [['C1', 'S1', '数']])
+        assert d['placed'] == 1 and d['can_undo'] is True
+        with open(rp, encoding='utf-8') as f:
+            assert f.read() == checkpoint
+        lines = _journal_lines(sid)
+        assert len(lines) == 1
+        assert [c[:4] for c in lines[0]['cells']] == [[0, '月', '16', 0]]
+
+    def test_state_replays_journal_after_restart(self, client):
+        _put(client, [])
+        _put(client, [['C1', 'S1', '数']], unplaced=[{'name': 'S2'}])
+        sid = _sid(client)
+        _restart(sid)
+        d = client.get('/api/state').get_json()
+        assert d['placed'] == 1
+        assert d['schedule'][0]['月']['16'][0]['slots'] == [['C1', 'S1', '数']]
+        assert d['unplaced'] == [{'name': 'S2'}]
+
+    def test_truncated_tail_is_ignored(self, client):
+        _put(client, [])
+        _put(client, [['C1', 'S1', '数']])
+        sid = _sid(client)
+        with open(app_module._journal_path(sid), 'a', encoding='utf-8') as f:
+            f.write('{"op": "edit", "cel')
+        _restart(sid)
+        assert client.get('/api/state').get_json()['placed'] == 1
+
+    def test_structure_change_falls_back_to_checkpoint(self, client):
+        _put(client, [])
+        sid = _sid(client)
+        client.post('/api/update_schedule', json={
+            'schedule': _schedule([]) * 2, 'unplaced': [], 'students': STUDENTS})
+        assert not os.path.exists(app_module._journal_path(sid))
+        with open(app_module._result_json_path(sid), encoding='utf-8') as f:
+            assert len(json.load(f)['schedule_json']) == 2
+
+
+class TestCompaction:
+
+    def test_compacts_every_n_edits(self, client, monkeypatch):
+        monkeypatch.setattr(app_module, 'JOURNAL_COMPACT_EVERY', 3)
+        _put(client, [])
+        sid = _sid(client)
+        _put(client, [['C1', 'S1', '数']])
+        _put(client, [['C1', 'S1', '数'], ['C1', 'S1', '英']])
+        _put(client, [['C1', 'S1', '英']])
+        lines = _journal_lines(sid)
+        assert [l['op'] for l in lines] == ['stacks']
+        assert len(lines[0]['undo']) == 3
+        with open(app_module._result_json_path(sid), encoding='utf-8') as f:
+            assert json.load(f)['schedule_json'][0]['月']['16'][0]['slots'] == [['C1', 'S1', '英']]
+        # コンパクション後もアンドゥできる
+        _restart(sid)
+        d = client.post('/api/undo').get_json()
+        assert d['schedule'][0]['月']['16'][0]['slots'] == [['C1', 'S1', '数'], ['C1', 'S1', '英']]
+
+
+class TestUndoRedo:
+
+    def test_undo_redo_roundtrip(self, client):
+        _put(client, [])
+        _put(client, [['C1', 'S1', '数']], unplaced=[])
+        d = client.post('/api/undo').get_json()
+        assert d['placed'] == 0 and d['can_undo'] is False and d['can_redo'] is True
+        d = client.post('/api/redo').get_json()
+        assert d['placed'] == 1 and d['can_redo'] is False
+        assert client.get('/api/state').get_json()['placed'] == 1
+
+    def test_nothing_to_undo(self, client):
+        _put(client, [])
+        r = client.post('/api/undo')
+        assert r.status_code == 400
+
+    def test_new_edit_clears_redo_and_undo_survives_restart(self, client):
+        _put(client, [])
+        _put(client, [['C1', 'S1', '数']])
+        client.post('/api/undo')
+        d = _put(client, [['C1', 'S1', '英']])
+        assert d['can_redo'] is False
+        sid = _sid(client)
+        _restart(sid)
+        d = client.post('/api/undo').get_json()
+        assert d['placed'] == 0
+        assert client.post('/api/undo').status_code == 400
+
+
+class TestSupabaseSync:
+
+    def test_queued_sync_is_a_snapshot(self, client, monkeypatch):
+        # バックグラウンド同期は積んだ時点の内容を送り、その後の編集に影響されない
+        jobs, saved = [], []
+        monkeypatch.setattr(app_module, 'run_in_background', lambda fn, *args: jobs.append((fn, args)))
+        monkeypatch.setattr(app_module, '_save_result_to_supabase', lambda sid, saveable: saved.append(saveable))
+        _put(client, [])
+        _put(client, [['C1', 'S1', '数']])
+        sid = _sid(client)
+        live = app_module.get_session_data._cache[sid]['result']
+        live['schedule_json'][0]['月']['16'][0]['slots'].append(['C1', 'S2', '英'])
+        live['unplaced'].append({'name': 'S3'})
+        for fn, args in jobs:
+            fn(*args)
+        assert saved[-1]['schedule_json'][0]['月']['16'][0]['slots'] == [['C1', 'S1', '数']]
+        assert saved[-1]['unplaced'] == []
@@ -0,0 +1,94 @@
+"""Tests for the per-week lazy schedule API.
+
+X-Schedule-Lazy を付けた応答が指定週だけを含み manifest を添えること、
+/api/schedule と /api/schedule/<wi> で目録と1週分を取得できることを確認する。
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import pytest
+import app as app_module
+from tests.test_compact_schedule import _random_schedule
+from tests.test_wire_format import _decode_schedule
+
+COMPACT = {'X-Schedule-Format': 'compact'}
+
+
+@pytest.fixture
+def sched():
+    return _random_schedule(weeks=4)
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path, sched):
+    monkeypatch.setattr(app_module, 'SUPABASE_URL', '')
+    monkeypatch.setattr(app_module, '_storage_backend', app_module._SupabaseBackend())
+    monkeypatch.setattr(app_module, 'UPLOAD_BASE', str(tmp_path))
+    app_module.app.config['TESTING'] = True
+    c = app_module.app.test_client()
+    with c.session_transaction() as s:
+        s['authenticated'] = True
+    r = c.post('/api/update_schedule', json={'schedule': sched, 'unplaced': []})
+    assert r.status_code == 200
+    return c
+
+
+def _placed(week):
+    return sum(len(b['slots']) for dd in week.values() for bs in dd.values() for b in bs)
+
+
+class TestWeekEndpoints:
+
+    def test_manifest(self, client, sched):
+        m = client.get('/api/schedule').get_json()
+        assert [w['wi'] for w in m['weeks']] == [0, 1, 2, 3]
+        assert [w['placed'] for w in m['weeks']] == [_placed(w) for w in sched]
+        assert m['placed'] == sum(_placed(w) for w in sched)
+
+    def test_single_week(self, client, sched):
+        d = client.get('/api/schedule/2').get_json()
+        assert d['wi'] == 2 and d['schedule'] == [sched[2]]
+        d = client.get('/api/schedule/2', headers=COMPACT).get_json()
+        assert _decode_schedule(d['schedule']) == [sched[2]]
+
+    def test_out_of_range(self, client):
+        assert client.get('/api/schedule/4').status_code == 404
+
+    def test_week_not_modified_until_edit(self, client, sched):
+        etag = client.get('/api/schedule/1').headers['ETag']
+        assert client.get('/api/schedule/1', headers={'If-None-Match': etag}).status_code == 304
+        sched[1]['月']['16'][0] = {'teacher': 'TZ', 'slots': []}
+        client.post('/api/update_schedule', json={'schedule': sched, 'unplaced': []})
+        r = client.get('/api/schedule/1', headers={'If-None-Match': etag})
+        assert r.status_code == 200 and r.get_json()['schedule'][0]['月']['16'][0]['teacher'] == 'TZ'
+
+    def test_week_served_after_restart(self, client, sched):
+        with client.session_transaction() as s:
+            sid = s['sid']
+        app_module.get_session_data._cache.pop(sid, None)
+        assert client.get('/api/schedule/3').get_json()['schedule'] == [sched[3]]
+
+
+class TestLazyPayload:
+
+    def test_state_keeps_only_requested_week(self, client, sched):
+        d = client.get('/api/state', headers={'X-Schedule-Lazy': '1'}).get_json()
+        assert d['schedule'] == [None, sched[1], None, None]
+        assert d['manifest']['placed'] == d['placed']
+        # 省略形は別のETag
+        full = client.get('/api/state')
+        assert full.headers['ETag'] != client.get('/api/state', headers={'X-Schedule-Lazy': '1'}).headers['ETag']
+        assert full.get_json()['schedule'] == sched
+
+    def test_lazy_with_compact_wire(self, client, sched):
+        d = client.get('/api/state', headers={'X-Schedule-Lazy': '0', **COMPACT}).get_json()
+        assert _decode_schedule_nullable(d['schedule']) == [sched[0], None, None, None]
+
+
+def _decode_schedule_nullable(p):
+    """decodeWireSchedule と同じく null 週はそのまま"""
+    weeks = p['w']
+    dense = _decode_schedule(dict(p, w=[w for w in weeks if w is not None]))
+    it = iter(dense)
+    return [None if w is None else next(it) for w in weeks]
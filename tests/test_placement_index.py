@@ -0,0 +1,107 @@
+"""Tests for the maintained placement index and the per-student / per-teacher APIs.
+
+PlacementIndex が全走査と同じ結果を返し、ジャーナル編集で差分更新されること、
+/api/student/<name>・/api/teacher/<name> が週ごとのカレンダーを返すことを確認する。
+"""
+import sys
+import os
+import json
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import pytest
+import app as app_module
+from app import PlacementIndex
+from tests.test_compact_schedule import _random_schedule
+
+
+def _scan_student(sched, name):
+    """index.html の getStudentSlots と同じ全走査"""
+    out = []
+    for wi, w in enumerate(sched):
+        for day in app_module.DAYS:
+            for ts in sorted(w.get(day, {})):
+                for bi, b in enumerate(w[day][ts]):
+                    for si, s in enumerate(b['slots']):
+                        if s[1] == name:
+                            out.append({'wi': wi, 'day': day, 'ts': ts, 'bi': bi, 'si': si,
+                                        'grade': s[0], 'subj': s[2], 'teacher': b['teacher']})
+    return out
+
+
+def _snapshot(idx):
+    return ({n: sorted(p.items(), key=repr) for n, p in idx.students.items()},
+            {t: sorted(p, key=repr) for t, p in idx.teachers.items()},
+            idx.occupancy)
+
+
+@pytest.fixture
+def sched():
+    return _random_schedule(seed=3, weeks=5)
+
+
+class TestPlacementIndex:
+
+    def test_matches_full_scan(self, sched):
+        idx = PlacementIndex.from_json(sched)
+        for name in ('S0', 'S17', 'S59'):
+            assert idx.student_placements(name) == _scan_student(sched, name)
+        positions = idx.teacher_positions('T4')
+        assert positions and all(sched[wi][d][ts][bi]['teacher'] == 'T4' for wi, d, ts, bi in positions)
+        assert idx.occupancy[(0, '月')]['16'] == [len(b['slots']) for b in sched[0]['月']['16']]
+
+    def test_update_booth_equals_rebuild(self, sched):
+        idx = PlacementIndex.from_json(sched)
+        new = {'teacher': 'TZ', 'slots': [['C1', 'S0', '数'], ['C2', 'NEW', '英']]}
+        idx.update_booth((2, '水', '18', 3), sched[2]['水']['18'][3], new)
+        sched[2]['水']['18'][3] = new
+        assert _snapshot(idx) == _snapshot(PlacementIndex.from_json(sched))
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path, sched):
+    monkeypatch.setattr(app_module, 'SUPABASE_URL', '')
+    monkeypatch.setattr(app_module, '_storage_backend', app_module._SupabaseBackend())
+    monkeypatch.setattr(app_module, 'UPLOAD_BASE', str(tmp_path))
+    app_module.app.config['TESTING'] = True
+    c = app_module.app.test_client()
+    with c.session_transaction() as s:
+        s['authenticated'] = True
+    assert c.post('/api/update_schedule', json={'schedule': sched, 'unplaced': []}).status_code == 200
+    return c
+
+
+class TestCalendarApi:
+
+    def test_student_calendar(self, client, sched):
+        d = client.get('/api/student/S5').get_json()
+        assert d['slots'] == _scan_student(sched, 'S5')
+        assert len(d['weeks']) == 5
+        assert [p for w in d['weeks'] for p in w] == d['slots']
+        assert sum(d['bySubject'].values()) == d['placed'] == len(d['slots'])
+
+    def test_unknown_names(self, client):
+        assert client.get('/api/student/nobody').status_code == 404
+        assert client.get('/api/teacher/nobody').status_code == 404
+
+    def test_teacher_calendar(self, client, sched):
+        d = client.get('/api/teacher/T1').get_json()
+        got = [(p['wi'], p['day'], p['ts'], p['bi']) for w in d['weeks'] for p in w]
+        assert got and all(sched[wi][day][ts][bi]['teacher'] == 'T1' for wi, day, ts, bi in got)
+        expect = sum(1 for w in sched for dd in w.values() for bs in dd.values() for b in bs if b['teacher'] == 'T1')
+        assert len(got) == expect
+
+    def test_journal_edit_updates_index_in_place(self, client, sched):
+        with client.session_transaction() as s:
+            sid = s['sid']
+        res = app_module.get_session_data._cache[sid]['result']
+        idx = app_module.session_index(res)
+        edited = json.loads(json.dumps(sched))
+        edited[1]['火']['17'][0] = {'teacher': 'TZ', 'slots': [['C1', 'S5', '数']]}
+        client.post('/api/update_schedule', json={'schedule': edited, 'unplaced': []})
+        assert app_module.session_index(res) is idx
+        assert client.get('/api/student/S5').get_json()['slots'] == _scan_student(edited, 'S5')
+        assert client.get('/api/teacher/TZ').get_json()['lessons'] == 1
+
+    def test_not_modified(self, client):
+        etag = client.get('/api/student/S5').headers['ETag']
+        assert client.get('/api/student/S5', headers={'If-None-Match': etag}).status_code == 304
@@ -0,0 +1,347 @@
+"""Tests for the stateful Scheduler engine behind build_schedule.
+
+Scheduler の配置・取り外し・移動がインデックスを差分更新し、作り直したものと一致すること、
+候補列挙が find_slot と同じ判定になることを確認する。
+"""
+import sys
+import os
+import random
+import itertools
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import pytest
+import app as app_module
+from app import Scheduler, build_schedule, DEFAULT_WEIGHTS, DAYS
+from tests.test_build_schedule import student, week
+from tests.test_suggest import _empty_week
+
+
+def _state(sch):
+    norm = lambda per_week: [{k: v for k, v in w.items() if v} for w in per_week]
+    return (norm([{n: {s: d for s, d in subj.items() if d} for n, subj in w.items()} for w in sch.placed_days]),
+            norm(sch.student_slots), norm(sch.any_days), norm(sch.teacher_booths))
+
+
+def _rebuilt(sch, students):
+    return Scheduler(sch.schedule, students, sch.skills, sch.booth_pref, sch.weights, sch.valid_days)
+
+
+@pytest.fixture
+def built():
+    rng = random.Random(0)
+    teachers = [f'T{i}' for i in range(6)]
+    wt = [week({d: {ts: rng.sample(teachers, 4) for ts in ('16', '17', '18', '19')} for d in DAYS[:5]})
+          for _ in range(2)]
+    students = [student(f'S{i}', needs={'数': 2, '英': 1}) for i in range(25)]
+    random.seed(0)
+    schedule, unplaced, _ = build_schedule(students, wt, {}, {d: [] for d in DAYS}, {})
+    return schedule, students
+
+
+class TestIndexes:
+
+    def test_initial_index_matches_schedule(self, built):
+        schedule, students = built
+        sch = Scheduler(schedule, students, {}, {})
+        for wi, w in enumerate(schedule):
+            for day, dd in w.items():
+                for ts, bs in dd.items():
+                    for bi, b in enumerate(bs):
+                        for g, name, subj in b['slots']:
+                            assert (day, ts) in sch.slots_of(wi, name)
+                            assert day in sch.placed_days_of(wi, name, subj)
+                        if b['slots']:
+                            assert sch.teacher_booth(wi, day, b['teacher']) == bi
+
+    def test_place_unplace_move_equal_rebuild(self, built):
+        schedule, students = built
+        sch = Scheduler(schedule, students, {}, {})
+        smap = {s['name']: s for s in students}
+        rng = random.Random(1)
+        for _ in range(100):
+            wi = rng.randrange(2)
+            occupied = [(d, ts, bi, si) for d, dd in schedule[wi].items() for ts, bs in dd.items()
+                        for bi, b in enumerate(bs) for si in range(len(b['slots']))]
+            src = rng.choice(occupied)
+            free = [(d, ts, bi) for d, dd in schedule[wi].items() for ts, bs in dd.items()
+                    for bi, b in enumerate(bs) if b['teacher'] and len(b['slots']) < 2 and (d, ts, bi) != src[:3]]
+            op = rng.randrange(3)
+            if op == 0 and free:
+                sch.move(wi, src, rng.choice(free))
+            else:
+                g, name, subj = sch.unplace(wi, *src)
+                if op == 1 and free:
+                    sch.place(wi, *rng.choice(free), smap[name], subj)
+        assert _state(sch) == _state(_rebuilt(sch, students))
+
+
+class TestCandidates:
+
+    def test_candidates_respect_booth_rules(self):
+        sched = [_empty_week({('月', '16'): ['T1', 'T2', 'T3'], ('月', '17'): ['T1', 'T2']})]
+        a, b = student('A', ng_teachers={'T2'}), student('B', ng_students=['A'])
+        sch = Scheduler(sched, [a, b], {}, {})
+        sch.place(0, '月', '16', 2, b, '数')
+        cands, reason = sch.candidates(0, a, '数')
+        assert reason is None
+        # T2 はNG講師、T3 のブースには A をNGにしている B がいる
+        assert sorted((c[1], c[2], c[3]) for c in cands) == [('月', '16', 0), ('月', '17', 0)]
+        # 講師は1日1ブース: T1 が 16時に別ブースで授業を持つと 17時の別ブースには置けない
+        sch.unplace(0, '月', '16', 2, 0)
+        sch.place(0, '月', '16', 0, b, '英')
+        assert sch.teacher_booth(0, '月', 'T1') == 0
+        assert not sch.check_booth(0, '月', 1, {'teacher': 'T1', 'slots': []}, a, '数')
+
+    def test_score_matches_candidate_score(self):
+        sched = [_empty_week({('月', '16'): ['T1'], ('月', '17'): ['T2']})]
+        a = student('A', needs={'数': 1, '英': 1}, wish_teachers=['T2'])
+        sch = Scheduler(sched, [a], {}, {})
+        sch.place(0, '月', '16', 0, a, '英')
+        cands, _ = sch.candidates(0, a, '数')
+        assert [(c[0], c[2]) for c in cands] == [(sch.score(0, a, '月', '17', 0), '17')]
+        assert cands[0][0] == sum(DEFAULT_WEIGHTS[t] for t in ('continuous_block', 'same_day_2nd',
+                                                               'wish_teacher', 'empty_booth'))
+
+
+class TestAnneal:
+
+    def _problem(self):
+        rng = random.Random(3)
+        teachers = [f'T{i}' for i in range(5)]
+        wt = [week({d: {ts: rng.sample(teachers, 3) for ts in ('16', '17', '18', '19', '20')} for d in DAYS[:5]})]
+        students = [student(f'S{i}', needs={'数': 2, '英': 2},
+                            avail={(d, ts) for d in rng.sample(DAYS[:5], 3) for ts in ('16', '17', '18', '19', '20')},
+                            wish_teachers=rng.sample(teachers, 1) if i % 3 == 0 else None,
+                            ng_students=[f'S{(i + 1) % 20}'] if i % 5 == 0 else None)
+                    for i in range(20)]
+        random.seed(3)
+        schedule, _, _ = build_schedule(students, wt, {}, {d: [] for d in DAYS}, {})
+        return schedule, students
+
+    def test_improves_and_keeps_constraints(self):
+        schedule, students = self._problem()
+        sch = Scheduler(schedule, students, {}, {})
+        placed = sorted(sl for w in schedule for dd in w.values() for bs in dd.values() for b in bs for sl in b['slots'])
+        stats = sch.anneal(0.3, rng=random.Random(0))
+        assert stats['best'] >= stats['start'] and stats['iterations'] > 0
+        assert sch.objective() == stats['best']
+        assert [p[1] for p in stats['curve']] == sorted(p[1] for p in stats['curve'])
+        # コマの増減はなく、すべて配置条件を満たしたまま
+        assert sorted(sl for w in schedule for dd in w.values() for bs in dd.values() for b in bs for sl in b['slots']) == placed
+        smap = {s['name']: s for s in students}
+        for day, dd in schedule[0].items():
+            for ts, bs in dd.items():
+                for bi, b in enumerate(bs):
+                    for si in reversed(range(len(b['slots']))):
+                        slot = sch.unplace(0, day, ts, bi, si)
+                        assert sch.can_place(0, smap[slot[1]], slot[2], day, ts, bi)
+                        sch._put(0, day, ts, bi, slot, si)
+        assert _state(sch) == _state(_rebuilt(sch, students))
+
+    def test_objective_matches_schedule_score(self):
+        schedule, students = self._problem()
+        sch = Scheduler(schedule, students, {}, {'T1': 2})
+        sch.anneal(0.1, rng=random.Random(1))
+        sj = [{d: {ts: [{'teacher': b['teacher'], 'slots': [list(x) for x in b['slots']]} for b in bs]
+                   for ts, bs in dd.items()} for d, dd in w.items()} for w in schedule]
+        smap = {s['name']: app_module.normalize_student(s) for s in students}
+        total = app_module.ScheduleScore(app_module.PlacementIndex.from_json(sj), smap, {'T1': 2}).total(DEFAULT_WEIGHTS)
+        assert total[0] == sch.objective()
+
+    def test_zero_budget_is_noop(self):
+        schedule, students = self._problem()
+        sch = Scheduler(schedule, students, {}, {})
+        before = repr(schedule)
+        assert sch.anneal(0)['iterations'] == 0
+        assert repr(schedule) == before
+
+
+class TestEjectionChain:
+
+    def test_one_step_chain(self):
+        # A は月16だけ。そこは B・C で満席だが、B は火16の空きへ移れる
+        sched = [_empty_week({('月', '16'): ['T1'], ('火', '16'): ['T2']})]
+        a = student('A', avail={('月', '16')})
+        b = student('B', avail={('月', '16'), ('火', '16')})
+        c = student('C', avail={('月', '16')})
+        sch = Scheduler(sched, [a, b, c], {}, {})
+        sch.place(0, '月', '16', 0, b, '数')
+        sch.place(0, '月', '16', 0, c, '数')
+        assert sch.find_slot(0, a, '数') == (None, 'ブース満席')
+        assert sch.eject_chain(0, a, '数')
+        assert sorted(sl[1] for sl in sched[0]['月']['16'][0]['slots']) == ['A', 'C']
+        assert [sl[1] for sl in sched[0]['火']['16'][0]['slots']] == ['B']
+        assert _state(sch) == _state(_rebuilt(sch, [a, b, c]))
+
+    def test_depth_limit_and_rollback(self):
+        # A → 月16(B,C) / B → 水16(D,E) / D → 火16 の空き: 2段の連鎖が必要
+        sched = [_empty_week({('月', '16'): ['T1'], ('水', '16'): ['T2'], ('火', '16'): ['T3']})]
+        a = student('A', avail={('月', '16')})
+        b = student('B', avail={('月', '16'), ('水', '16')})
+        c = student('C', avail={('月', '16')})
+        d = student('D', avail={('水', '16'), ('火', '16')})
+        e = student('E', avail={('水', '16')})
+        people = [a, b, c, d, e]
+        sch = Scheduler(sched, people, {}, {})
+        for s, day in ((b, '月'), (c, '月'), (d, '水'), (e, '水')):
+            sch.place(0, day, '16', 0, s, '数')
+        before = repr(sched)
+        assert not sch.eject_chain(0, a, '数', depth=1)
+        assert repr(sched) == before
+        assert sch.eject_chain(0, a, '数', depth=2)
+        assert [sl[1] for sl in sched[0]['火']['16'][0]['slots']] == ['D']
+        assert _state(sch) == _state(_rebuilt(sch, people))
+
+    def test_build_schedule_places_more(self):
+        # 希望講師ありの B が先に月16を取り、A が入れなくなる配置を押し出しで解消する
+        wt = [week({'月': {'16': ['T1']}, '火': {'16': ['T2']}})]
+        a = student('A', avail={('月', '16')}, needs={'数': 1})
+        b = student('B', avail={('月', '16'), ('火', '16')}, wish_teachers=['T1'])
+        c = student('C', avail={('月', '16'), ('火', '16')}, wish_teachers=['T1'])
+        random.seed(0)
+        schedule, unplaced, _ = build_schedule([a, b, c], wt, {}, {d: [] for d in DAYS}, {})
+        assert unplaced == []
+
+
+class TestHeapMode:
+
+    def _problem(self, n=30):
+        rng = random.Random(5)
+        teachers = [f'T{i}' for i in range(6)]
+        wt = [week({d: {ts: rng.sample(teachers, 4) for ts in ('16', '17', '18', '19')} for d in DAYS[:5]})
+              for _ in range(2)]
+        students = [student(f'S{i}', needs={'数': 2, '英': 2},
+                            avail={(d, ts) for d in rng.sample(DAYS[:5], 3) for ts in ('16', '17', '18', '19')},
+                            wish_teachers=rng.sample(teachers, 1) if i % 4 == 0 else None)
+                    for i in range(n)]
+        return students, wt
+
+    def _run(self, mode, students, wt):
+        random.seed(0)
+        return build_schedule(students, wt, {}, {d: [] for d in DAYS}, {}, mode=mode)
+
+    def test_places_everything_without_errors(self):
+        students, wt = self._problem()
+        h_sched, h_unplaced, ot = self._run('heap', students, wt)
+        assert h_unplaced == []
+        errors = [i for i in app_module.check_all(h_sched, wt, ot, students, {}, []) if i['level'] == 'error']
+        assert errors == []
+
+    def test_continuity_after_first_lesson(self):
+        # 初期点は同じでも、1コマ目を置いた後は隣の時限が連続コマで上がる
+        sched = [_empty_week({('月', '16'): ['T1'], ('月', '17'): ['T1'], ('木', '19'): ['T1']})]
+        a = student('A', needs={'数': 1, '英': 1}, wish_teachers=['T1'])
+        sch = Scheduler(sched, [a], {}, {})
+        placed, reasons = sch.place_week_heap(0, [(a, '数', 1), (a, '英', 1)])
+        assert placed == {('A', '数'): 1, ('A', '英'): 1} and reasons == {}
+        assert sorted(sch.slots_of(0, 'A')) == [('月', '16'), ('月', '17')]
+
+    def test_unknown_mode(self):
+        with pytest.raises(ValueError):
+            build_schedule([], [], {}, {}, {}, mode='nope')
+
+
+class TestMatchingMode:
+
+    def test_assignment_matches_brute_force(self):
+        rng = random.Random(1)
+        for _ in range(30):
+            n, m = rng.randint(1, 5), rng.randint(5, 7)
+            cost = [[rng.randint(-50, 50) for _ in range(m)] for _ in range(n)]
+            got = app_module.min_cost_assignment(cost)
+            assert len(set(got)) == n
+            best = min(sum(cost[i][p[i]] for i in range(n)) for p in itertools.permutations(range(m), n))
+            assert sum(cost[i][got[i]] for i in range(n)) == best
+
+    def test_rematch_makes_room(self):
+        # T1 の席を数学の2人が埋めていて、T1 しか教えられない英語の B が入らない
+        sched = [_empty_week({('月', '16'): ['T1', 'T2']})]
+        sched[0]['月']['16'][0]['slots'] = [['C', 'A1', '数'], ['C', 'A2', '数']]
+        skills = {'T1': {'中数', '中英'}, 'T2': {'中数'}}
+        a1, a2, b = student('A1'), student('A2'), student('B', needs={'英': 1})
+        sch = Scheduler(sched, [a1, a2, b], skills, {})
+        assert not sch.candidates(0, b, '英')[0]
+        assert sch.rematch_timeslot(0, '月', '16', [(b, '英')]) == [(b, '英')]
+        names = lambda bi: sorted(x[1] for x in sch.schedule[0]['月']['16'][bi]['slots'])
+        assert len(names(0)) == 2 and 'B' in names(0) and len(names(1)) == 1
+
+    def test_rematch_moves_to_wish_teacher_or_keeps(self):
+        sched = [_empty_week({('月', '16'): ['T1', 'T2']})]
+        sched[0]['月']['16'][0]['slots'] = [['C', 'A', '数']]
+        a = student('A', wish_teachers=['T2'])
+        sch = Scheduler(sched, [a], {}, {})
+        before = sch.objective()
+        assert sch.rematch_timeslot(0, '月', '16') == []
+        assert sch.slots_of(0, 'A') and sch.schedule[0]['月']['16'][1]['slots'][0][1] == 'A'
+        assert sch.objective() > before
+        # もう改善がなければ元のまま
+        assert sch.rematch_timeslot(0, '月', '16') is None
+        assert sch.schedule[0]['月']['16'][1]['slots'][0][1] == 'A'
+
+    def test_only_timeslots_with_leftovers_are_rematched(self, monkeypatch):
+        # 全部置ければ詰め直しは走らず greedy と同じ結果
+        students, wt = TestHeapMode()._problem()
+        calls = []
+        monkeypatch.setattr(Scheduler, 'rematch_timeslot', lambda self, *a: calls.append(a))
+        results = []
+        for mode in ('greedy', 'matching'):
+            random.seed(0)
+            results.append(build_schedule(students, wt, {}, {d: [] for d in DAYS}, {}, mode=mode)[0])
+        assert calls == [] and results[0] == results[1]
+
+    def test_places_everything_without_errors(self):
+        students, wt = TestHeapMode()._problem()
+        random.seed(0)
+        sched, unplaced, ot = build_schedule(students, wt, {}, {d: [] for d in DAYS}, {}, mode='matching')
+        assert unplaced == []
+        errors = [i for i in app_module.check_all(sched, wt, ot, students, {}, []) if i['level'] == 'error']
+        assert errors == []
+
+
+class TestParallelWeeks:
+
+    def _run(self, students, wt, workers):
+        random.seed(3)
+        return build_schedule(students, wt, {}, {d: [] for d in DAYS}, {}, workers=workers)
+
+    def test_parallel_places_everything_and_is_reproducible(self):
+        students, wt = TestHeapMode()._problem()
+        sched, unplaced, ot = self._run(students, wt, 2)
+        assert unplaced == []
+        errors = [i for i in app_module.check_all(sched, wt, ot, students, {}, []) if i['level'] == 'error']
+        assert errors == []
+        assert self._run(students, wt, 2)[0] == sched
+
+    def test_job_runs_one_week(self):
+        sched = _empty_week({('月', '16'): ['T1'], ('火', '17'): ['T2']})
+        a = student('A', needs={'数': 1, '英': 1})
+        dist = {'A': {'数': [1], '英': [1]}}
+        ws, placed, reasons = app_module._place_week_job(
+            (sched, [a], {}, {}, dict(DEFAULT_WEIGHTS), set(DAYS), [['A'], []], dist, 'greedy', 0))
+        assert placed == {('A', '数'): 1, ('A', '英'): 1} and reasons == {}
+        assert sum(len(b['slots']) for dd in ws.values() for bs in dd.values() for b in bs) == 2
+
+    @pytest.mark.parametrize('fail_in, error', [('start', OSError('no processes')),
+                                                 ('map', ValueError('cannot pickle')),
+                                                 ('map', KeyError('job failed'))])
+    def test_falls_back_to_serial_when_pool_fails(self, monkeypatch, fail_in, error):
+        students, wt = TestHeapMode()._problem()
+
+        class BrokenPool:
+            def __init__(self, *a, **kw):
+                if fail_in == 'start':
+                    raise error
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def map(self, fn, jobs):
+                raise error
+        monkeypatch.setattr(app_module, 'ProcessPoolExecutor', BrokenPool)
+        sched, unplaced, ot = self._run(students, wt, 2)
+        assert unplaced == []
+        errors = [i for i in app_module.check_all(sched, wt, ot, students, {}, []) if i['level'] == 'error']
+        assert errors == []
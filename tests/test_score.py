@@ -0,0 +1,134 @@
+"""Tests for the whole-schedule objective evaluator (/api/score).
+
+ScheduleScore が全体の評価項目を一度に数え、ブース変更・ジャーナル編集で
+差分更新した結果が作り直しと一致することを確認する。
+"""
+import sys
+import os
+import json
+import random
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import pytest
+import app as app_module
+from app import ScheduleScore, PlacementIndex, normalize_student, DEFAULT_WEIGHTS
+from tests.test_build_schedule import student
+from tests.test_suggest import _empty_week
+from tests.test_compact_schedule import _random_schedule
+
+
+def _score(sched, smap, booth_pref=None):
+    return ScheduleScore(PlacementIndex.from_json(sched), smap, booth_pref or {})
+
+
+def _random_students(sched, seed=0):
+    rng = random.Random(seed)
+    names = {sl[1] for w in sched for dd in w.values() for bs in dd.values() for b in bs for sl in b['slots']}
+    teachers = sorted({b['teacher'] for w in sched for dd in w.values() for bs in dd.values() for b in bs if b['teacher']})
+    return {n: normalize_student(student(n, wish_teachers=rng.sample(teachers, 1),
+                                         ng_dates={(rng.randrange(len(sched)), rng.choice(app_module.DAYS))}))
+            for n in sorted(names)}
+
+
+class TestScheduleScore:
+
+    def test_counts_match_manual(self):
+        sched = [_empty_week({('月', '16'): ['T1'], ('月', '17'): ['T2'], ('月', '19'): ['T3']})]
+        sched[0]['月']['16'][0]['slots'] = [['C', 'A', '数']]
+        sched[0]['月']['17'][0]['slots'] = [['C', 'A', '英'], ['C', 'B', '英']]
+        sched[0]['月']['19'][0]['slots'] = [['C', 'A', '国']]
+        smap = {n: normalize_student(student(n, wish_teachers=['T2'])) for n in 'AB'}
+        score, breakdown, counts = _score(sched, smap).total(DEFAULT_WEIGHTS)
+        # A: 16-17 と 17-16 が連続、16-19 / 17-19 / 19-16 / 19-17 が飛び石、3コマ目以降が2件
+        assert counts == {'continuous_block': 2, 'skip_interval': 4, 'same_day_3plus': 3,
+                          'wish_teacher': 2, 'empty_booth': 2}
+        assert score == sum(breakdown.values())
+
+    def test_incremental_equals_rebuild(self):
+        sched = _random_schedule(seed=5, weeks=3)
+        smap = _random_students(sched)
+        idx = PlacementIndex.from_json(sched)
+        sc = ScheduleScore(idx, smap, {'T1': 1})
+        rng = random.Random(1)
+        positions = [(wi, d, ts, bi) for wi, w in enumerate(sched) for d, dd in w.items()
+                     for ts, bs in dd.items() for bi in range(len(bs))]
+        for _ in range(200):
+            a, b = rng.sample(positions, 2)
+            old_a, old_b = sched[a[0]][a[1]][a[2]][a[3]], sched[b[0]][b[1]][b[2]][b[3]]
+            if not old_a['slots']:
+                continue
+            new_a = {'teacher': old_a['teacher'], 'slots': old_a['slots'][1:]}
+            new_b = {'teacher': old_b['teacher'], 'slots': (old_b['slots'] + old_a['slots'][:1])[-2:]}
+            for pos, old, new in ((a, old_a, new_a), (b, old_b, new_b)):
+                idx.update_booth(pos, old, new)
+                sched[pos[0]][pos[1]][pos[2]][pos[3]] = new
+                sc.update_booth(pos, old, new)
+        assert sc.total(DEFAULT_WEIGHTS) == _score(sched, smap, {'T1': 1}).total(DEFAULT_WEIGHTS)
+
+    def test_weights_applied_at_read(self):
+        sched = _random_schedule(seed=2, weeks=1)
+        sc = _score(sched, _random_students(sched))
+        doubled = {t: w * 2 for t, w in DEFAULT_WEIGHTS.items()}
+        assert sc.total(doubled)[0] == 2 * sc.total(DEFAULT_WEIGHTS)[0]
+
+
+@pytest.fixture
+def sched():
+    return _random_schedule(seed=4, weeks=2)
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path, sched):
+    monkeypatch.setattr(app_module, 'SUPABASE_URL', '')
+    monkeypatch.setattr(app_module, '_storage_backend', app_module._SupabaseBackend())
+    monkeypatch.setattr(app_module, 'UPLOAD_BASE', str(tmp_path))
+    app_module.app.config['TESTING'] = True
+    c = app_module.app.test_client()
+    with c.session_transaction() as s:
+        s['authenticated'] = True
+    names = sorted({sl[1] for w in sched for dd in w.values() for bs in dd.values() for b in bs for sl in b['slots']})
+    students = [{'grade': 'C', 'name': n, 'needs': {'数': 2}, 'avail': None, 'backup_avail': [], 'fixed': [],
+                 'ng_teachers': [], 'wish_teachers': ['T1'], 'ng_students': [], 'ng_dates': []} for n in names]
+    r = c.post('/api/update_schedule', json={'schedule': sched, 'unplaced': [], 'students': students})
+    assert r.status_code == 200
+    return c
+
+
+class TestScoreApi:
+
+    def test_score_follows_edits(self, client, sched):
+        with client.session_transaction() as s:
+            sid = s['sid']
+        res = app_module.get_session_data._cache[sid]['result']
+        first = client.get('/api/score').get_json()
+        sc = app_module.session_score(res)
+        edited = json.loads(json.dumps(sched))
+        edited[0]['月']['16'][0] = {'teacher': 'T1', 'slots': [['C1', 'S1', '数']]}
+        client.post('/api/update_schedule', json={'schedule': edited, 'unplaced': []})
+        assert app_module.session_score(res) is sc
+        d = client.get('/api/score').get_json()
+        rebuilt = ScheduleScore(PlacementIndex.from_json(edited), app_module.session_students(res), {})
+        assert d['score'] == rebuilt.total(app_module.load_learning_weights())[0]
+        assert d['placed'] == sum(len(b['slots']) for w in edited for dd in w.values() for bs in dd.values() for b in bs)
+        assert first['score'] != d['score'] or first['breakdown'] != d['breakdown']
+
+    def test_no_schedule(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(app_module, 'UPLOAD_BASE', str(tmp_path))
+        c = app_module.app.test_client()
+        with c.session_transaction() as s:
+            s['authenticated'] = True
+        assert c.get('/api/score').status_code == 400
+
+    def test_baseline_delta(self, client, sched):
+        with client.session_transaction() as s:
+            sid = s['sid']
+        res = app_module.get_session_data._cache[sid]['result']
+        app_module.push_baseline(res, 'test')
+        edited = json.loads(json.dumps(sched))
+        edited[1]['火']['17'][0] = {'teacher': 'T1', 'slots': []}
+        client.post('/api/update_schedule', json={'schedule': edited, 'unplaced': []})
+        n = len(res['baselines']) - 1
+        d = client.get(f'/api/score?baseline={n}').get_json()
+        assert d['baseline']['label'] == 'test'
+        assert d['baseline']['delta'] == d['score'] - d['baseline']['score']
+        assert d['baseline']['placedDelta'] == -len(sched[1]['火']['17'][0]['slots'])
@@ -0,0 +1,75 @@
+"""Tests for the hashed, pre-compressed static assets behind the index shell.
+
+index.html がハッシュ付きの app.js / app.css を参照する小さなシェルになり、
+アセットが圧縮済みファイルから immutable で配信されることを確認する。
+"""
+import sys
+import os
+import gzip
+import re
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import pytest
+import app as app_module
+
+STATIC = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static')
+
+
+@pytest.fixture
+def client():
+    app_module.app.config['TESTING'] = True
+    c = app_module.app.test_client()
+    with c.session_transaction() as s:
+        s['authenticated'] = True
+    return c
+
+
+def _source(name):
+    with open(os.path.join(STATIC, name), 'rb') as f:
+        return f.read()
+
+
+class TestShell:
+
+    def test_index_references_hashed_assets(self, client):
+        html = client.get('/').get_data(as_text=True)
+        urls = re.findall(r'/static/dist/app\.[0-9a-f]{12}\.(?:js|css)', html)
+        assert sorted(u.rsplit('.', 1)[1] for u in urls) == ['css', 'js']
+        assert '<style>' not in html and 'function rR' not in html
+
+    def test_assets_require_login(self):
+        c = app_module.app.test_client()
+        assert c.get(app_module.asset_url('app.js')).status_code == 302
+
+
+class TestAssets:
+
+    def test_gzip_variant_served_immutable(self, client):
+        r = client.get(app_module.asset_url('app.js'), headers={'Accept-Encoding': 'gzip'})
+        assert r.status_code == 200
+        assert r.headers['Content-Encoding'] == 'gzip'
+        assert r.mimetype == 'text/javascript'
+        assert 'immutable' in r.headers['Cache-Control'] and 'max-age=31536000' in r.headers['Cache-Control']
+        assert 'Accept-Encoding' in r.headers['Vary']
+        assert gzip.decompress(r.data) == _source('app.js')
+
+    def test_identity_without_accept_encoding(self, client):
+        r = client.get(app_module.asset_url('app.css'))
+        assert 'Content-Encoding' not in r.headers
+        assert r.data == _source('app.css')
+
+    def test_unknown_hash_is_404(self, client):
+        assert client.get('/static/dist/app.000000000000.js').status_code == 404
+
+    def test_rebuild_renames_on_change(self, tmp_path):
+        for name in app_module.STATIC_BUNDLES:
+            (tmp_path / name).write_bytes(_source(name))
+        first = app_module.build_static_assets(str(tmp_path))
+        (tmp_path / 'app.js').write_bytes(_source('app.js') + b'\n// changed\n')
+        second = app_module.build_static_assets(str(tmp_path))
+        assert first['app.css'] == second['app.css']
+        assert first['app.js'] != second['app.js']
+        # 古い版は消え、新しい版と圧縮版だけが残る
+        js = {f for f in os.listdir(tmp_path / 'dist') if '.js' in f}
+        assert {f.removesuffix('.gz').removesuffix('.br') for f in js} == {second['app.js']}
+        assert gzip.decompress((tmp_path / 'dist' / (second['app.js'] + '.gz')).read_bytes()).endswith(b'// changed\n')
@@ -0,0 +1,122 @@
+"""Unit tests for the storage layer (SQLite backend / cached backend).
+
+_SQLiteBackend が app の使う PostgREST サブセットを正しく解釈すること、
+_CachedBackend が read-through / write-through として動作することを確認する。
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import pytest
+from urllib.error import URLError
+from app import _SQLiteBackend, _CachedBackend
+
+MERGE = {'Prefer': 'resolution=merge-duplicates'}
+
+
+@pytest.fixture
+def local():
+    return _SQLiteBackend(':memory:')
+
+
+class _RecordingRemote:
+    """呼び出しを記録し、中身はもう一つのSQLiteに委譲するリモート代替"""
+
+    def __init__(self):
+        self.inner = _SQLiteBackend(':memory:')
+        self.calls = []
+        self.down = False
+
+    def enabled(self):
+        return True
+
+    def request(self, method, table, params='', body=None, headers_extra=None,
+                timeout=10, raise_errors=False):
+        self.calls.append((method, table, params))
+        if self.down:
+            raise URLError('connection refused')
+        return self.inner.request(method, table, params, body, headers_extra)
+
+
+# ---------------------------------------------------------------------------
+# SQLite バックエンド
+# ---------------------------------------------------------------------------
+
+class TestSQLiteBackend:
+
+    def test_upsert_merges_on_primary_key(self, local):
+        local.request('POST', 'schedule_learning_data', '',
+                      body={'key': 'weights', 'data': {'wish_teacher': 500}}, headers_extra=MERGE)
+        local.request('POST', 'schedule_learning_data', '',
+                      body={'key': 'weights', 'data': {'wish_teacher': 600}}, headers_extra=MERGE)
+        rows = local.request('GET', 'schedule_learning_data', 'key=eq.weights&select=data')
+        assert rows == [{'data': {'wish_teacher': 600}}]
+
+    def test_on_conflict_keeps_generated_id(self, local):
+        body = {'year': 2026, 'month': 3, 'label': 'latest', 'schedule_data': {'v': 1}}
+        local.request('POST', 'schedule_snapshots', 'on_conflict=year,month,label',
+                      body=body, headers_extra=MERGE)
+        first = local.request('GET', 'schedule_snapshots', 'select=id')
+        local.request('POST', 'schedule_snapshots', 'on_conflict=year,month,label',
+                      body={**body, 'schedule_data': {'v': 2}}, headers_extra=MERGE)
+        rows = local.request('GET', 'schedule_snapshots', 'select=id,schedule_data')
+        assert len(rows) == 1
+        assert rows[0]['id'] == first[0]['id']
+        assert rows[0]['schedule_data'] == {'v': 2}
+
+    def test_filters_order_offset_and_bulk_delete(self, local):
+        for i in range(5):
+            local.request('POST', 'schedule_edit_history', '', body={'total_changes': i, 'changes': []})
+        rows = local.request('GET', 'schedule_edit_history', 'select=id&order=id.desc&offset=2')
+        assert [r['id'] for r in rows] == [3, 2, 1]
+        ids = ','.join(str(r['id']) for r in rows)
+        local.request('DELETE', 'schedule_edit_history', f'id=in.({ids})')
+        left = local.request('GET', 'schedule_edit_history', 'select=total_changes&order=id.asc')
+        assert [r['total_changes'] for r in left] == [3, 4]
+        assert local.request('GET', 'schedule_edit_history', 'total_changes=lt.4&select=id') == [{'id': 4}]
+        assert local.request('GET', 'schedule_edit_history', 'total_changes=not.lt.4&select=id') == [{'id': 5}]
+        local.request('DELETE', 'schedule_edit_history', 'id=not.is.null')
+        assert local.request('GET', 'schedule_edit_history', 'select=id') == []
+
+    def test_unknown_column_rejected(self, local):
+        with pytest.raises(ValueError):
+            local.request('GET', 'schedule_sessions', 'nope=eq.1')
+
+
+# ---------------------------------------------------------------------------
+# キャッシュ付きバックエンド
+# ---------------------------------------------------------------------------
+
+class TestCachedBackend:
+
+    def test_repeated_reads_served_from_cache(self, local):
+        remote = _RecordingRemote()
+        cached = _CachedBackend(remote, local, ttl=60)
+        cached.request('POST', 'schedule_learning_data', '',
+                       body={'key': 'stats', 'data': {'session_count': 1}}, headers_extra=MERGE)
+        for _ in range(3):
+            rows = cached.request('GET', 'schedule_learning_data', 'key=eq.stats&select=data')
+        assert rows == [{'data': {'session_count': 1}}]
+        assert [c[0] for c in remote.calls] == ['POST', 'GET']
+
+    def test_write_invalidates_table_cache(self, local):
+        remote = _RecordingRemote()
+        cached = _CachedBackend(remote, local, ttl=60)
+        q = 'key=eq.stats&select=data'
+        cached.request('POST', 'schedule_learning_data', '',
+                       body={'key': 'stats', 'data': {'session_count': 1}}, headers_extra=MERGE)
+        cached.request('GET', 'schedule_learning_data', q)
+        cached.request('POST', 'schedule_learning_data', '',
+                       body={'key': 'stats', 'data': {'session_count': 2}}, headers_extra=MERGE)
+        assert cached.request('GET', 'schedule_learning_data', q) == [{'data': {'session_count': 2}}]
+
+    def test_remote_outage_served_from_local_mirror(self, local):
+        remote = _RecordingRemote()
+        cached = _CachedBackend(remote, local, ttl=0)
+        cached.request('POST', 'schedule_sessions', '',
+                       body={'sid': 'abcdef1234', 'result_data': {'schedule_json': []}}, headers_extra=MERGE)
+        remote.down = True
+        rows = cached.request('GET', 'schedule_sessions', 'sid=eq.abcdef1234&select=result_data')
+        assert rows == [{'result_data': {'schedule_json': []}}]
+        with pytest.raises(URLError):
+            cached.request('DELETE', 'schedule_sessions', 'sid=eq.abcdef1234', raise_errors=True)
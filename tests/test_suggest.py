@@ -0,0 +1,140 @@
+"""Tests for slot suggestions for unplaced lessons (/api/suggest).
+
+suggest_slots が生成時と同じ Scheduler.candidates で候補を絞り、同じ評価項目で順位付けすること、
+内訳の合計が点数になることを確認する。
+"""
+import sys
+import os
+import random
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import pytest
+import app as app_module
+from app import (build_schedule, suggest_slots, normalize_student, Scheduler,
+                 DEFAULT_WEIGHTS, MAX_BOOTHS)
+from tests.test_build_schedule import student, week
+
+
+def _empty_week(cells):
+    """cells: {(day, ts): [teacher, ...]} → schedule_json の1週分"""
+    w = {}
+    for day in app_module.DAYS:
+        times = app_module.SATURDAY_TIMES if day == '土' else app_module.WEEKDAY_TIMES
+        w[day] = {}
+        for tl in times:
+            ts = app_module.TIME_SHORT[tl]
+            teachers = cells.get((day, ts), [])
+            w[day][ts] = [{'teacher': t, 'slots': []} for t in teachers]
+            w[day][ts] += [{'teacher': '', 'slots': []} for _ in range(MAX_BOOTHS - len(teachers))]
+    return w
+
+
+def _suggest(sched, students, name, subj, **kw):
+    sch = Scheduler(sched, [normalize_student(s) for s in students], kw.pop('skills', {}),
+                    kw.pop('booth_pref', {}), dict(DEFAULT_WEIGHTS))
+    return suggest_slots(sch, name, subj, **kw)
+
+
+class TestRanking:
+
+    def test_wish_teacher_first_and_breakdown_sums(self):
+        sched = [_empty_week({('月', '16'): ['T1', 'T2'], ('月', '17'): ['T3']})]
+        a = student('A', avail={('月', '16')}, backup_avail={('月', '17')}, wish_teachers=['T2'])
+        cands, reason = _suggest(sched, [a], 'A', '数')
+        assert reason is None
+        assert [(c['ts'], c['teacher']) for c in cands] == [('16', 'T2'), ('16', 'T1'), ('17', 'T3')]
+        assert cands[0]['breakdown'] == {'wish_teacher': 500, 'empty_booth': 20}
+        assert cands[2]['breakdown']['backup_time'] == DEFAULT_WEIGHTS['backup_time']
+        assert all(c['score'] == sum(c['breakdown'].values()) for c in cands)
+
+    def test_continuous_block_after_existing_lesson(self):
+        sched = [_empty_week({('火', '16'): ['T1'], ('火', '17'): ['T2'], ('火', '19'): ['T3']})]
+        sched[0]['火']['16'][0]['slots'] = [['C', 'A', '英']]
+        a = student('A', needs={'英': 1, '数': 1})
+        cands, _ = _suggest(sched, [a], 'A', '数')
+        assert cands[0]['teacher'] == 'T2'
+        assert cands[0]['breakdown']['continuous_block'] == DEFAULT_WEIGHTS['continuous_block']
+        assert cands[-1]['teacher'] == 'T3' and 'skip_interval' in cands[-1]['breakdown']
+
+    def test_top_k_and_week_filter(self):
+        sched = [_empty_week({('水', '18'): ['T1', 'T2', 'T3']}) for _ in range(3)]
+        a = student('A')
+        assert len(_suggest(sched, [a], 'A', '数', k=2)[0]) == 2
+        assert {c['wi'] for c in _suggest(sched, [a], 'A', '数', weeks=[1], k=10)[0]} == {1}
+
+
+class TestFeasibility:
+
+    def test_constraints_exclude_booths(self):
+        sched = [_empty_week({('月', '16'): ['T1', 'T2', 'T3', 'T4', 'T5']})]
+        booths = sched[0]['月']['16']
+        booths[0]['slots'] = [['C', 'X', '数'], ['C', 'Y', '数']]   # 満席
+        booths[2]['slots'] = [['C', 'B', '数']]                      # NG生徒
+        a = student('A', ng_teachers={'T2'}, ng_students=['B'])
+        skills = {t: {'中数'} for t in ('T1', 'T2', 'T3', 'T4')}
+        cands, _ = _suggest(sched, [a, student('B')], 'A', '数', skills=skills)
+        assert [c['teacher'] for c in cands] == ['T4']              # T5 は指導不可
+
+    def test_same_subject_same_day_excluded(self):
+        sched = [_empty_week({('月', '16'): ['T1'], ('月', '18'): ['T2'], ('木', '16'): ['T3']})]
+        sched[0]['月']['16'][0]['slots'] = [['C', 'A', '数']]
+        cands, _ = _suggest(sched, [student('A', needs={'数': 2})], 'A', '数')
+        assert [c['day'] for c in cands] == ['木']
+
+    def test_reason_when_no_candidate(self):
+        sched = [_empty_week({('月', '16'): ['T1']})]
+        cands, reason = _suggest(sched, [student('A', avail={('火', '16')})], 'A', '数')
+        assert cands == [] and reason == '空きコマなし'
+        cands, reason = _suggest(sched, [student('A', ng_teachers={'T1'})], 'A', '数')
+        assert reason == 'NG講師'
+
+
+class TestMatchesFindSlot:
+
+    def test_top_candidate_is_where_generate_placed(self):
+        wt = [week({'月': {'16': ['T1', 'T2'], '17': ['T1']}, '水': {'18': ['T3']}})]
+        a = student('A', avail={('月', '16'), ('水', '18')}, wish_teachers=['T3'])
+        random.seed(0)
+        schedule, unplaced, _ = build_schedule([a], wt, {}, {d: [] for d in app_module.DAYS}, {})
+        assert unplaced == []
+        sched = [{d: {ts: [{'teacher': b['teacher'], 'slots': [list(x) for x in b['slots']]} for b in bs]
+                      for ts, bs in dd.items()} for d, dd in w.items()} for w in schedule]
+        placed = [(d, ts, bi) for d, dd in sched[0].items() for ts, bs in dd.items()
+                  for bi, b in enumerate(bs) if b['slots']]
+        for d, ts, bi in placed:
+            sched[0][d][ts][bi]['slots'] = []
+        top = _suggest(sched, [a], 'A', '数')[0][0]
+        assert [(top['day'], top['ts'], top['bi'])] == placed
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(app_module, 'SUPABASE_URL', '')
+    monkeypatch.setattr(app_module, '_storage_backend', app_module._SupabaseBackend())
+    monkeypatch.setattr(app_module, 'UPLOAD_BASE', str(tmp_path))
+    app_module.app.config['TESTING'] = True
+    c = app_module.app.test_client()
+    with c.session_transaction() as s:
+        s['authenticated'] = True
+    sched = [_empty_week({('月', '16'): ['T1', 'T2']}), _empty_week({('火', '17'): ['T1']})]
+    students = [{'grade': 'C', 'name': 'A', 'needs': {'数': 2}, 'avail': None, 'backup_avail': [],
+                 'fixed': [], 'ng_teachers': [], 'wish_teachers': ['T2'], 'ng_students': [], 'ng_dates': [[1, '火']]}]
+    assert c.post('/api/update_schedule', json={'schedule': sched, 'unplaced': [], 'students': students}).status_code == 200
+    return c
+
+
+class TestSuggestApi:
+
+    def test_returns_ranked_candidates(self, client):
+        d = client.post('/api/suggest', json={'name': 'A', 'subject': '数'}).get_json()
+        assert [(c['wi'], c['teacher']) for c in d['candidates']] == [(0, 'T2'), (0, 'T1'), (1, 'T1')]
+        assert d['candidates'][2]['breakdown']['ng_date'] == DEFAULT_WEIGHTS['ng_date']
+
+    def test_week_and_errors(self, client):
+        d = client.post('/api/suggest', json={'name': 'A', 'subject': '数', 'week': 1}).get_json()
+        assert [c['wi'] for c in d['candidates']] == [1]
+        assert client.post('/api/suggest', json={'name': 'Z', 'subject': '数'}).status_code == 404
+        assert client.post('/api/suggest', json={'name': 'A'}).status_code == 400
+        assert client.post('/api/suggest', json={'name': 'A', 'subject': '数', 'week': 5}).status_code == 404
+        assert client.post('/api/suggest', json={'name': 'A', 'subject': '数', 'week': 'x'}).status_code == 400
+        assert client.post('/api/suggest', json={'name': 'A', 'subject': '数', 'k': 'abc'}).status_code == 400
@@ -0,0 +1,94 @@
+"""Tests for the dictionary-encoded compact wire format.
+
+X-Schedule-Format: compact を送ったときだけ schedule / weeklyTeachers が
+文字列テーブル形式になり、index.html の decodeWire と同じ手順で元に戻ることを確認する。
+"""
+import sys
+import os
+import json
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import pytest
+import app as app_module
+from tests.test_compact_schedule import _random_schedule
+
+COMPACT = {'X-Schedule-Format': 'compact'}
+
+
+def _decode_schedule(p):
+    """templates/index.html の decodeWireSchedule と同じ展開"""
+    s, e = p['s'], p['e']
+    out = []
+    for wk in p['w']:
+        o = {}
+        for day, dd in wk.items():
+            od = {}
+            for ts, c in dd.items():
+                booths = [{'teacher': '', 'slots': []} for _ in range(c[0])]
+                j = 1
+                while j < len(c):
+                    bi, teacher, k = c[j], s[c[j + 1]], c[j + 2]
+                    j += 3
+                    slots = [[s[e[x * 3]], s[e[x * 3 + 1]], s[e[x * 3 + 2]]] for x in c[j:j + k]]
+                    j += k
+                    booths[bi] = {'teacher': teacher, 'slots': slots}
+                od[ts] = booths
+            o[day] = od
+        out.append(o)
+    return out
+
+
+class TestEncoding:
+
+    def test_schedule_roundtrip_and_size(self):
+        sched = _random_schedule(weeks=6)
+        enc = app_module.encode_schedule_wire(sched)
+        assert _decode_schedule(enc) == sched
+        raw = len(json.dumps(sched, ensure_ascii=False).encode())
+        assert len(json.dumps(enc, ensure_ascii=False).encode()) * 3 < raw
+
+    def test_irregular_slots_not_encoded(self):
+        sched = [{'月': {'16': [{'teacher': 'T1', 'slots': [['C1', 'S1']]}]}}]
+        assert app_module.encode_schedule_wire(sched) is None
+
+    def test_weekly_teachers(self):
+        wt = [{'月': {'16': ['A', 'B'], '17': []}}, {'火': {'16': ['B']}}]
+        enc = app_module.encode_weekly_teachers_wire(wt)
+        assert [{d: {ts: [enc['s'][i] for i in ids] for ts, ids in dd.items()} for d, dd in w.items()}
+                for w in enc['w']] == wt
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(app_module, 'SUPABASE_URL', '')
+    monkeypatch.setattr(app_module, '_storage_backend', app_module._SupabaseBackend())
+    monkeypatch.setattr(app_module, 'UPLOAD_BASE', str(tmp_path))
+    app_module.app.config['TESTING'] = True
+    c = app_module.app.test_client()
+    with c.session_transaction() as s:
+        s['authenticated'] = True
+    return c
+
+
+class TestNegotiation:
+
+    def test_state_compact_only_when_requested(self, client):
+        sched = _random_schedule(weeks=2)
+        client.post('/api/update_schedule', json={'schedule': sched, 'unplaced': []})
+        plain = client.get('/api/state')
+        assert plain.get_json()['schedule'] == sched
+        compact = client.get('/api/state', headers=COMPACT)
+        assert _decode_schedule(compact.get_json()['schedule']) == sched
+        assert 'X-Schedule-Format' in compact.headers['Vary']
+        # 形式ごとに別のETag
+        assert plain.headers['ETag'] != compact.headers['ETag']
+        assert client.get('/api/state', headers={**COMPACT, 'If-None-Match': plain.headers['ETag']}).status_code == 200
+
+    def test_undo_response_compact(self, client):
+        sched = _random_schedule(weeks=1)
+        client.post('/api/update_schedule', json={'schedule': sched, 'unplaced': []})
+        edited = json.loads(json.dumps(sched))
+        edited[0]['月']['16'][0] = {'teacher': 'TZ', 'slots': []}
+        client.post('/api/update_schedule', json={'schedule': edited, 'unplaced': []})
+        d = client.post('/api/undo', headers=COMPACT).get_json()
+        assert _decode_schedule(d['schedule']) == sched